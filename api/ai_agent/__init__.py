@@ -7,11 +7,13 @@ AI Agent Package
 from .stock_agents import stock_analyzer, StockAnalysisOrchestrator
 from .prompt_manager import prompt_manager
 from .base_agent import BaseAIAgent
+from .client_pool import llm_client_pool
 
 __version__ = "1.0.0"
 __all__ = [
     "stock_analyzer",
     "StockAnalysisOrchestrator", 
     "prompt_manager",
-    "BaseAIAgent"
+    "BaseAIAgent",
+    "llm_client_pool"
 ]
\ No newline at end of file
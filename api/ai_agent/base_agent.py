@@ -8,29 +8,23 @@ import json
 import hashlib
 from typing import Dict, Any, Optional, List
 from datetime import datetime, timedelta
-import asyncio
 import logging
 from abc import ABC, abstractmethod
 
 # AI相关库
 try:
     import anthropic
-    from anthropic import Anthropic
     HAS_ANTHROPIC = True
 except ImportError:
     HAS_ANTHROPIC = False
     logging.warning("anthropic library not installed. Install with: pip install anthropic")
 
-# Redis缓存（可选）
-try:
-    import redis.asyncio as redis
-    HAS_REDIS = True
-except ImportError:
-    HAS_REDIS = False
-    logging.warning("redis library not installed. Install with: pip install redis")
-
+from .client_pool import HAS_REDIS, llm_client_pool
 from .prompt_manager import prompt_manager
 
+if not HAS_REDIS:
+    logging.warning("redis library not installed. Install with: pip install redis")
+
 logger = logging.getLogger(__name__)
 
 class BaseAIAgent(ABC):
@@ -53,26 +47,31 @@ class BaseAIAgent(ABC):
         if not HAS_ANTHROPIC:
             raise ImportError("anthropic library is required. Install with: pip install anthropic")
         
-        # 初始化Anthropic客户端
-        self.client = Anthropic(api_key=self.api_key)
+        # 进程内共享的异步Anthropic客户端（连接池和并发上限由 llm_client_pool 管理）
+        self.client = llm_client_pool.get_client(self.api_key)
         
-        # 初始化Redis客户端（可选）
+        # 共享的Redis客户端（可选）
         self.redis_client = None
-        if HAS_REDIS:
-            try:
-                redis_url = os.getenv("REDIS_URL", "redis://localhost:6379")
-                self.redis_client = redis.from_url(redis_url, decode_responses=True)
-                logger.info(f"Redis client initialized for {agent_name}")
-            except Exception as e:
-                logger.warning(f"Failed to initialize Redis client: {e}")
-        
-        # 加载Agent配置
-        self.config = prompt_manager.load_prompt_config(agent_name)
-        self.model_params = prompt_manager.get_model_parameters(agent_name)
-        self.cache_config = prompt_manager.get_cache_config(agent_name)
+        try:
+            self.redis_client = llm_client_pool.get_redis_client(os.getenv("REDIS_URL", "redis://localhost:6379"))
+        except Exception as e:
+            logger.warning(f"Failed to initialize Redis client: {e}")
         
         logger.info(f"BaseAIAgent initialized: {agent_name}")
     
+    # Agent配置从提示词管理器的内存注册表读取，提示词文件修改后自动使用新配置
+    @property
+    def config(self) -> Dict[str, Any]:
+        return prompt_manager.load_prompt_config(self.agent_name)
+    
+    @property
+    def model_params(self) -> Dict[str, Any]:
+        return prompt_manager.get_model_parameters(self.agent_name)
+    
+    @property
+    def cache_config(self) -> Dict[str, Any]:
+        return prompt_manager.get_cache_config(self.agent_name)
+    
     def generate_cache_key(self, **kwargs) -> str:
         """生成缓存键"""
         # 创建包含agent名称和参数的字符串
@@ -85,6 +84,24 @@ class BaseAIAgent(ABC):
         # 使用MD5生成短的缓存键
         return f"agent:{hashlib.md5(key_string.encode()).hexdigest()}"
     
+    def generate_content_key(self, processed_data: Dict[str, Any]) -> str:
+        """
+        生成内容缓存键：提示词版本 + 模型参数 + 填充模板的输入数据
+        
+        不包含分析时间等默认模板变量，输入数据不变时键也不变，
+        参数缓存过期后仍可复用上次的模型输出
+        """
+        key_data = {
+            'agent': self.agent_name,
+            'version': self.config.get('version', 'unknown'),
+            'model_params': self.model_params,
+            'system_prompt': self.config.get('system_prompt', ''),
+            'user_prompt_template': self.config.get('user_prompt_template', ''),
+            'data': processed_data
+        }
+        key_string = json.dumps(key_data, sort_keys=True, ensure_ascii=False, default=str)
+        return f"agent:content:{hashlib.sha256(key_string.encode('utf-8')).hexdigest()}"
+    
     async def get_cached_result(self, cache_key: str) -> Optional[Dict[str, Any]]:
         """从缓存获取结果"""
         if not self.redis_client or not self.cache_config.get('enabled'):
@@ -101,13 +118,13 @@ class BaseAIAgent(ABC):
         
         return None
     
-    async def set_cached_result(self, cache_key: str, result: Dict[str, Any]):
+    async def set_cached_result(self, cache_key: str, result: Dict[str, Any], ttl: Optional[int] = None):
         """设置缓存结果"""
         if not self.redis_client or not self.cache_config.get('enabled'):
             return
         
         try:
-            ttl = self.cache_config.get('ttl', 1800)  # 默认30分钟
+            ttl = ttl or self.cache_config.get('ttl', 1800)  # 默认30分钟
             cached_data = json.dumps(result)
             await self.redis_client.setex(cache_key, ttl, cached_data)
             logger.info(f"Cached result for {self.agent_name}: {cache_key} (TTL: {ttl}s)")
@@ -145,11 +162,8 @@ class BaseAIAgent(ABC):
             
             logger.info(f"Calling AI model for {self.agent_name} with model: {params['model']}")
             
-            # 调用API
-            response = await asyncio.to_thread(
-                self.client.messages.create,
-                **params
-            )
+            # 调用API（共享异步客户端，超过并发上限时排队）
+            response = await llm_client_pool.create_message(self.api_key, **params)
             
             # 提取响应内容
             if response.content and len(response.content) > 0:
@@ -211,6 +225,14 @@ class BaseAIAgent(ABC):
             # 处理输入数据
             processed_data = await self.process_input_data(**kwargs)
             
+            # 输入数据与上次相同时复用上次的模型输出
+            content_key = self.generate_content_key(processed_data)
+            cached_result = await self.get_cached_result(content_key)
+            if cached_result:
+                cached_result['cached'] = True
+                await self.set_cached_result(cache_key, cached_result)
+                return cached_result
+            
             # 获取提示词
             system_prompt = prompt_manager.get_system_prompt(self.agent_name)
             user_prompt = prompt_manager.get_user_prompt(self.agent_name, **processed_data)
@@ -231,8 +253,9 @@ class BaseAIAgent(ABC):
                 'raw_response': ai_response  # 可选：保留原始响应用于调试
             }
             
-            # 缓存结果
+            # 缓存结果（内容缓存保留更久，默认7天）
             await self.set_cached_result(cache_key, result)
+            await self.set_cached_result(content_key, result, ttl=self.cache_config.get('content_ttl', 7 * 86400))
             
             logger.info(f"Analysis completed for {self.agent_name}")
             return result
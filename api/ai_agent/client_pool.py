@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+"""
+进程级共享的模型客户端和Redis连接
+Process-wide shared LLM client and Redis connection
+
+- 所有Agent共用一个异步Anthropic客户端（按API Key区分），HTTP连接池大小固定，
+  调用直接在事件循环中等待，不再占用线程池线程
+- 同时进行的模型调用数有上限，超出的调用排队等待
+- 所有Agent共用同一个Redis客户端（按URL区分），不再每个Agent单独建立连接
+应用关闭时调用 close() 释放连接。
+"""
+import asyncio
+import logging
+from typing import Any, Dict
+
+try:
+    import httpx
+    from anthropic import AsyncAnthropic, DefaultAsyncHttpxClient
+    HAS_ANTHROPIC = True
+except ImportError:
+    HAS_ANTHROPIC = False
+
+try:
+    import redis.asyncio as redis
+    HAS_REDIS = True
+except ImportError:
+    HAS_REDIS = False
+
+try:
+    from config import Config
+    MAX_CONCURRENT_CALLS = Config.AI_AGENT_MAX_CONCURRENT_CALLS
+    MAX_CONNECTIONS = Config.AI_AGENT_MAX_CONNECTIONS
+    REQUEST_TIMEOUT = Config.AI_AGENT_REQUEST_TIMEOUT
+except (ImportError, AttributeError):
+    MAX_CONCURRENT_CALLS = 8
+    MAX_CONNECTIONS = 20
+    REQUEST_TIMEOUT = 120
+
+logger = logging.getLogger(__name__)
+
+
+class LLMClientPool:
+    """共享的异步模型客户端，带连接池和并发上限"""
+
+    def __init__(self, max_concurrent_calls: int = MAX_CONCURRENT_CALLS,
+                 max_connections: int = MAX_CONNECTIONS, request_timeout: float = REQUEST_TIMEOUT):
+        self.max_concurrent_calls = max_concurrent_calls
+        self.max_connections = max_connections
+        self.request_timeout = request_timeout
+        self._clients: Dict[str, Any] = {}
+        self._redis_clients: Dict[str, Any] = {}
+        self._semaphore = asyncio.Semaphore(max_concurrent_calls)
+        self.stats = {"calls": 0, "errors": 0, "in_flight": 0, "waiting": 0, "max_in_flight": 0}
+
+    def get_client(self, api_key: str):
+        """获取API Key对应的共享客户端，首次使用时创建"""
+        if not HAS_ANTHROPIC:
+            raise ImportError("anthropic library is required. Install with: pip install anthropic")
+        client = self._clients.get(api_key)
+        if client is None:
+            client = AsyncAnthropic(
+                api_key=api_key,
+                timeout=self.request_timeout,
+                http_client=DefaultAsyncHttpxClient(limits=httpx.Limits(
+                    max_connections=self.max_connections,
+                    max_keepalive_connections=self.max_connections
+                ))
+            )
+            self._clients[api_key] = client
+            logger.info(f"Shared Anthropic client created (max_connections={self.max_connections})")
+        return client
+
+    def get_redis_client(self, redis_url: str):
+        """获取URL对应的共享Redis客户端（自带连接池），redis库未安装时返回None"""
+        if not HAS_REDIS:
+            return None
+        client = self._redis_clients.get(redis_url)
+        if client is None:
+            client = redis.from_url(redis_url, decode_responses=True)
+            self._redis_clients[redis_url] = client
+            logger.info(f"Shared Redis client created for {redis_url}")
+        return client
+
+    async def create_message(self, api_key: str, **params) -> Any:
+        """
+        调用 messages.create，同时进行的调用超过上限时排队
+
+        Args:
+            api_key: Anthropic API Key
+            **params: messages.create 的参数
+        """
+        client = self.get_client(api_key)
+        self.stats["waiting"] += 1
+        async with self._semaphore:
+            self.stats["waiting"] -= 1
+            self.stats["calls"] += 1
+            self.stats["in_flight"] += 1
+            self.stats["max_in_flight"] = max(self.stats["max_in_flight"], self.stats["in_flight"])
+            try:
+                return await client.messages.create(**params)
+            except Exception:
+                self.stats["errors"] += 1
+                raise
+            finally:
+                self.stats["in_flight"] -= 1
+
+    async def close(self):
+        """关闭所有共享客户端"""
+        for client in self._clients.values():
+            await client.close()
+        for client in self._redis_clients.values():
+            # redis-py 5.0.1 起为 aclose()，旧版本为 close()
+            await (getattr(client, "aclose", None) or client.close)()
+        self._clients.clear()
+        self._redis_clients.clear()
+        logger.info("Shared LLM and Redis clients closed")
+
+    def info(self) -> Dict[str, Any]:
+        """连接池配置和调用统计"""
+        return {
+            "clients": len(self._clients),
+            "redis_clients": len(self._redis_clients),
+            "max_concurrent_calls": self.max_concurrent_calls,
+            "max_connections": self.max_connections,
+            "request_timeout": self.request_timeout,
+            **self.stats
+        }
+
+
+# 全局共享客户端池
+llm_client_pool = LLMClientPool()
@@ -2,16 +2,58 @@
 """
 AI Agent提示词管理器
 Prompt Manager for AI Agents
+
+提示词配置在首次使用时加载一次，用户提示词模板同时预解析出所需变量，之后的查询只读内存，
+不再每次检查文件修改时间。start_watching() 启动后台监听，提示词文件修改后自动重新加载：
+安装了 watchfiles 时使用文件系统事件，否则按固定间隔扫描一次目录。
+新配置解析或校验失败时保留旧配置。
 """
 import os
+import asyncio
+import string
 import yaml
 from pathlib import Path
-from typing import Dict, Any, Optional
+from typing import Dict, Any, FrozenSet, Optional
 from datetime import datetime
 import logging
 
+# 文件监听（可选）
+try:
+    from watchfiles import awatch
+    HAS_WATCHFILES = True
+except ImportError:
+    HAS_WATCHFILES = False
+
+try:
+    from config import Config
+    PROMPT_WATCH_INTERVAL = Config.PROMPT_WATCH_INTERVAL_SECONDS
+except (ImportError, AttributeError):
+    PROMPT_WATCH_INTERVAL = 2.0
+
 logger = logging.getLogger(__name__)
 
+# 提示词配置必需的字段
+REQUIRED_FIELDS = ['agent_name', 'system_prompt', 'user_prompt_template']
+
+
+class PromptTemplate:
+    """预解析的用户提示词模板（str.format 语法）"""
+    
+    def __init__(self, template: str):
+        self.template = template
+        # 模板中引用的顶层变量名，如 {stock_code}、{data[key]} -> stock_code、data
+        self.fields: FrozenSet[str] = frozenset(
+            field_name.split('.', 1)[0].split('[', 1)[0]
+            for _, field_name, _, _ in string.Formatter().parse(template)
+            if field_name
+        )
+    
+    def render(self, variables: Dict[str, Any]) -> str:
+        missing = sorted(self.fields - variables.keys())
+        if missing:
+            raise KeyError(missing[0])
+        return self.template.format_map(variables)
+
 class PromptManager:
     """提示词管理器 - 负责加载和管理AI Agent的提示词配置"""
     
@@ -27,62 +69,39 @@ class PromptManager:
         else:
             self.prompts_dir = Path(prompts_dir)
         
-        self.prompts_cache = {}  # 提示词缓存
-        self.file_mtimes = {}    # 文件修改时间缓存
+        self.prompts_cache: Dict[str, Dict[str, Any]] = {}  # Agent名称 -> 提示词配置
+        self.templates: Dict[str, PromptTemplate] = {}       # Agent名称 -> 预解析的用户提示词模板
+        self.file_mtimes: Dict[str, float] = {}              # Agent名称 -> 加载时的文件修改时间
+        self.reload_count = 0
+        self._watch_task: Optional[asyncio.Task] = None
+        self._stop_event: Optional[asyncio.Event] = None
         
         # 确保prompts目录存在
         self.prompts_dir.mkdir(exist_ok=True)
         
         logger.info(f"PromptManager initialized with prompts_dir: {self.prompts_dir}")
     
-    def load_prompt_config(self, agent_name: str, force_reload: bool = False) -> Dict[str, Any]:
-        """
-        加载指定Agent的提示词配置
-        
-        Args:
-            agent_name: Agent名称（对应yaml文件名）
-            force_reload: 是否强制重新加载
-            
-        Returns:
-            Dict: 提示词配置字典
-            
-        Raises:
-            FileNotFoundError: 配置文件不存在
-            yaml.YAMLError: YAML解析错误
-        """
-        config_file = self.prompts_dir / f"{agent_name}.yaml"
+    def _config_file(self, agent_name: str) -> Path:
+        return self.prompts_dir / f"{agent_name}.yaml"
+    
+    def _read_config(self, agent_name: str):
+        """读取并校验配置文件，返回 (配置, 模板, 文件修改时间)"""
+        config_file = self._config_file(agent_name)
         
         if not config_file.exists():
             raise FileNotFoundError(f"Prompt config file not found: {config_file}")
         
-        # 检查文件是否需要重新加载
-        current_mtime = config_file.stat().st_mtime
-        cache_key = str(config_file)
-        
-        if (not force_reload and 
-            cache_key in self.prompts_cache and 
-            self.file_mtimes.get(cache_key) == current_mtime):
-            logger.debug(f"Using cached prompt config for {agent_name}")
-            return self.prompts_cache[cache_key]
-        
-        # 读取并解析YAML配置文件
+        mtime = config_file.stat().st_mtime
         try:
             with open(config_file, 'r', encoding='utf-8') as f:
                 config = yaml.safe_load(f)
             
             # 验证必需的字段
-            required_fields = ['agent_name', 'system_prompt', 'user_prompt_template']
-            missing_fields = [field for field in required_fields if field not in config]
-            
+            missing_fields = [field for field in REQUIRED_FIELDS if field not in (config or {})]
             if missing_fields:
                 raise ValueError(f"Missing required fields in {config_file}: {missing_fields}")
             
-            # 缓存配置和文件修改时间
-            self.prompts_cache[cache_key] = config
-            self.file_mtimes[cache_key] = current_mtime
-            
-            logger.info(f"Loaded prompt config for {agent_name} from {config_file}")
-            return config
+            return config, PromptTemplate(config['user_prompt_template']), mtime
             
         except yaml.YAMLError as e:
             logger.error(f"Error parsing YAML config {config_file}: {e}")
@@ -91,6 +110,36 @@ class PromptManager:
             logger.error(f"Error loading prompt config {config_file}: {e}")
             raise
     
+    def _store(self, agent_name: str, config: Dict[str, Any], template: PromptTemplate, mtime: float):
+        self.prompts_cache[agent_name] = config
+        self.templates[agent_name] = template
+        self.file_mtimes[agent_name] = mtime
+    
+    def load_prompt_config(self, agent_name: str, force_reload: bool = False) -> Dict[str, Any]:
+        """
+        加载指定Agent的提示词配置
+        
+        已加载的配置直接从内存返回；文件修改由 start_watching() 的后台监听负责重新加载
+        
+        Args:
+            agent_name: Agent名称（对应yaml文件名）
+            force_reload: 是否强制重新加载
+            
+        Returns:
+            Dict: 提示词配置字典
+            
+        Raises:
+            FileNotFoundError: 配置文件不存在
+            yaml.YAMLError: YAML解析错误
+        """
+        if not force_reload and agent_name in self.prompts_cache:
+            return self.prompts_cache[agent_name]
+        
+        config, template, mtime = self._read_config(agent_name)
+        self._store(agent_name, config, template, mtime)
+        logger.info(f"Loaded prompt config for {agent_name} from {self._config_file(agent_name)}")
+        return config
+    
     def get_system_prompt(self, agent_name: str) -> str:
         """获取系统提示词"""
         config = self.load_prompt_config(agent_name)
@@ -107,21 +156,22 @@ class PromptManager:
         Returns:
             str: 格式化后的用户提示词
         """
-        config = self.load_prompt_config(agent_name)
-        template = config['user_prompt_template']
+        self.load_prompt_config(agent_name)
+        template = self.templates[agent_name]
         
         try:
             # 添加默认变量
+            now = datetime.now()
             default_vars = {
-                'analysis_time': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-                'timestamp': datetime.now().isoformat()
+                'analysis_time': now.strftime('%Y-%m-%d %H:%M:%S'),
+                'timestamp': now.isoformat()
             }
             
             # 合并用户变量和默认变量
             variables = {**default_vars, **kwargs}
             
-            # 使用format方法进行模板替换
-            formatted_prompt = template.format(**variables)
+            # 使用预解析的模板进行替换
+            formatted_prompt = template.render(variables)
             
             logger.debug(f"Formatted user prompt for {agent_name} with variables: {list(variables.keys())}")
             return formatted_prompt
@@ -181,8 +231,75 @@ class PromptManager:
     def reload_all_configs(self):
         """重新加载所有配置文件"""
         self.prompts_cache.clear()
+        self.templates.clear()
         self.file_mtimes.clear()
         logger.info("All prompt configs reloaded")
+    
+    async def _reload_changed(self):
+        """重新加载修改过的配置，只处理已加载过的Agent，失败时保留旧配置"""
+        for agent_name in list(self.prompts_cache):
+            config_file = self._config_file(agent_name)
+            try:
+                mtime = config_file.stat().st_mtime
+            except FileNotFoundError:
+                logger.warning(f"Prompt config file removed, keeping loaded config: {config_file}")
+                continue
+            if mtime == self.file_mtimes.get(agent_name):
+                continue
+            try:
+                config, template, mtime = await asyncio.to_thread(self._read_config, agent_name)
+            except Exception as e:
+                logger.error(f"Prompt config reload failed for {agent_name}, keeping previous version: {e}")
+                # 记录修改时间，文件再次修改前不重复尝试
+                self.file_mtimes[agent_name] = mtime
+                continue
+            previous_version = self.prompts_cache[agent_name].get('version', 'unknown')
+            self._store(agent_name, config, template, mtime)
+            self.reload_count += 1
+            logger.info(f"Prompt config reloaded for {agent_name}: "
+                        f"version {previous_version} -> {config.get('version', 'unknown')}")
+    
+    async def _watch(self, interval: float):
+        if HAS_WATCHFILES:
+            async for _ in awatch(self.prompts_dir, stop_event=self._stop_event,
+                                  watch_filter=lambda _, path: path.endswith('.yaml')):
+                await self._reload_changed()
+            return
+        # 没有 watchfiles 时按间隔扫描目录（每个间隔一次，与查询次数无关）
+        while not self._stop_event.is_set():
+            try:
+                await asyncio.wait_for(self._stop_event.wait(), interval)
+            except asyncio.TimeoutError:
+                await self._reload_changed()
+    
+    async def start_watching(self, interval: float = PROMPT_WATCH_INTERVAL):
+        """启动后台监听，提示词文件修改后自动重新加载"""
+        if self._watch_task and not self._watch_task.done():
+            return
+        self._stop_event = asyncio.Event()
+        self._watch_task = asyncio.create_task(self._watch(interval))
+        logger.info(f"Watching prompt configs in {self.prompts_dir} "
+                    f"({'watchfiles' if HAS_WATCHFILES else f'polling every {interval}s'})")
+    
+    async def stop_watching(self):
+        """停止后台监听"""
+        if not self._watch_task:
+            return
+        self._stop_event.set()
+        try:
+            await asyncio.wait_for(self._watch_task, 5)
+        except asyncio.TimeoutError:
+            self._watch_task.cancel()
+        self._watch_task = None
+    
+    def info(self) -> Dict[str, Any]:
+        """已加载的配置和监听状态"""
+        return {
+            'loaded_agents': {name: config.get('version', 'unknown') for name, config in self.prompts_cache.items()},
+            'watching': bool(self._watch_task and not self._watch_task.done()),
+            'watch_mode': 'watchfiles' if HAS_WATCHFILES else 'polling',
+            'reload_count': self.reload_count
+        }
 
 # 全局提示词管理器实例
 prompt_manager = PromptManager()
\ No newline at end of file
@@ -4,17 +4,26 @@ AI Agent基础类
 Base AI Agent Class
 """
 import os
+import hashlib
+import json
 import logging
 from typing import Dict, Any, Optional
 from datetime import datetime
 import asyncio
 from anthropic import AsyncAnthropic
 
+from ..services.analysis_stream import emit_progress, streaming_active
+from ..services.prompt_encoder import estimate_tokens
+from ..services.rate_limiter import model_rate_limiter
+
 logger = logging.getLogger(__name__)
 
 class BaseAIAgent:
     """AI Agent基础类"""
     
+    # 提示词版本，修改提示词时递增，使按输入内容缓存的旧结果失效
+    PROMPT_VERSION = "1"
+    
     def __init__(self, agent_name: str, api_key: Optional[str] = None):
         self.agent_name = agent_name
         self.api_key = api_key or os.getenv('ANTHROPIC_API_KEY')
@@ -38,7 +47,7 @@ class BaseAIAgent:
             try:
                 logger.info(f"调用Claude API (尝试 {attempt + 1}/{self.max_retries})")
                 
-                response = await self.client.messages.create(
+                request_params = dict(
                     model=self.model,
                     max_tokens=self.max_tokens,
                     temperature=self.temperature,
@@ -48,6 +57,26 @@ class BaseAIAgent:
                         "content": user_prompt
                     }]
                 )
+                # 按每分钟token预算排队，输出按 max_tokens 预占，调用结束后按实际用量结算
+                reservation = await model_rate_limiter.acquire(
+                    estimate_tokens(system_prompt) + estimate_tokens(user_prompt), self.max_tokens,
+                    on_wait=lambda seconds: emit_progress("phase", {"phase": "rate_limited",
+                                                                    "wait_seconds": round(seconds, 1)})
+                )
+                try:
+                    if streaming_active():
+                        # 流式分析：边生成边推送文本片段
+                        emit_progress("phase", {"phase": "model_call", "model": self.model, "attempt": attempt + 1})
+                        async with self.client.messages.stream(**request_params) as stream:
+                            async for text in stream.text_stream:
+                                emit_progress("token", {"text": text})
+                            response = await stream.get_final_message()
+                    else:
+                        response = await self.client.messages.create(**request_params)
+                except BaseException:
+                    model_rate_limiter.settle(reservation)
+                    raise
+                model_rate_limiter.settle(reservation, response.usage.input_tokens, response.usage.output_tokens)
                 
                 # 提取响应内容
                 content = ""
@@ -71,7 +100,8 @@ class BaseAIAgent:
                 logger.error(f"Claude API调用失败 (尝试 {attempt + 1}): {e}")
                 
                 if attempt < self.max_retries - 1:
-                    # 如果不是最后一次尝试，等待后重试
+                    # 如果不是最后一次尝试，等待后重试；流式客户端需丢弃已收到的文本片段
+                    emit_progress("retry", {"attempt": attempt + 2, "error": str(e)})
                     await asyncio.sleep(self.retry_delay * (attempt + 1))
                     continue
                 else:
@@ -83,6 +113,20 @@ class BaseAIAgent:
                         "timestamp": datetime.now().isoformat()
                     }
     
+    def input_fingerprint(self, normalized_data: str) -> str:
+        """
+        输入内容指纹：规范化后的输入数据 + 提示词版本 + 模型参数
+        指纹相同说明送给模型的内容没有变化，可以直接复用上次的分析结果
+        """
+        key_data = json.dumps({
+            "agent": self.agent_name,
+            "prompt_version": self.PROMPT_VERSION,
+            "model": self.model,
+            "max_tokens": self.max_tokens,
+            "temperature": self.temperature
+        }, sort_keys=True)
+        return hashlib.sha256(f"{key_data}\n{normalized_data}".encode("utf-8")).hexdigest()
+    
     def validate_input_data(self, **kwargs) -> Dict[str, Any]:
         """验证输入数据 - 子类可重写"""
         stock_code = kwargs.get('stock_code')
@@ -154,5 +198,6 @@ class BaseAIAgent:
             "max_tokens": self.max_tokens,
             "temperature": self.temperature,
             "max_retries": self.max_retries,
+            "prompt_version": self.PROMPT_VERSION,
             "api_key_configured": bool(self.api_key)
         }
\ No newline at end of file
@@ -6,7 +6,7 @@ AI Analysis API Endpoints
 from fastapi import FastAPI, HTTPException, BackgroundTasks
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, List
 import logging
 from datetime import datetime
 import os
@@ -14,6 +14,10 @@ import os
 # 导入服务模块
 from .services.cache_manager import analysis_cache
 from .services.data_aggregator import stock_data_aggregator
+from .services.analysis_stream import emit_progress, stream_analysis
+from .services.job_queue import JobQueueFull, analysis_job_queue
+from .services.batch_analysis import batch_analyzer
+from .services.rate_limiter import model_rate_limiter
 from .agents.technical_agent import TechnicalAnalysisAgent
 from .agents.comprehensive_agent import ComprehensiveAnalysisAgent
 
@@ -64,6 +68,16 @@ class TradingSignalRequest(BaseModel):
 class ComprehensiveEvalRequest(BaseModel):
     force_refresh: Optional[bool] = False
 
+class AnalysisJobRequest(BaseModel):
+    job_type: str
+    stock_code: str
+    force_refresh: Optional[bool] = False
+
+class BatchAnalysisRequest(BaseModel):
+    stock_codes: List[str]
+    analysis_type: str = "trading_signal"
+    force_refresh: Optional[bool] = False
+
 class CacheStatusResponse(BaseModel):
     stock_code: str
     trading_signal: Dict[str, Any]
@@ -78,12 +92,31 @@ async def startup_event():
     if not initialize_agents():
         logger.error("AI Agents初始化失败，某些功能可能不可用")
     
-    # 测试Redis连接
-    try:
-        await analysis_cache.connect()
+    # 连接缓存（Redis不可用时使用进程内存储，后台自动重连）
+    if await analysis_cache.connect():
         logger.info("Redis连接测试成功")
-    except Exception as e:
-        logger.error(f"Redis连接失败: {e}")
+    else:
+        logger.warning("Redis不可用，AI分析缓存暂时使用进程内存储")
+    
+    # 异步任务队列和批量分析执行与同步接口相同的分析流程
+    runners = {
+        "trading_signal": lambda stock_code, force_refresh: get_trading_signal(
+            stock_code, TradingSignalRequest(force_refresh=force_refresh)
+        ),
+        "comprehensive_eval": lambda stock_code, force_refresh: get_comprehensive_evaluation(
+            stock_code, ComprehensiveEvalRequest(force_refresh=force_refresh)
+        ),
+    }
+    for analysis_type, runner in runners.items():
+        analysis_job_queue.register(analysis_type, runner)
+        batch_analyzer.register(analysis_type, runner)
+    await analysis_job_queue.start()
+
+@ai_analysis_app.on_event("shutdown")
+async def shutdown_event():
+    """应用关闭事件：停止任务队列，关闭缓存连接，保存进程内缓存"""
+    await analysis_job_queue.stop()
+    await analysis_cache.disconnect()
 
 @ai_analysis_app.get("/")
 async def root():
@@ -124,6 +157,9 @@ async def health_check():
         "comprehensive_agent": bool(comprehensive_agent),
         "anthropic_api_key": bool(os.getenv('ANTHROPIC_API_KEY'))
     }
+    health_status["components"]["job_queue"] = analysis_job_queue.info()
+    health_status["components"]["batch_analysis"] = batch_analyzer.info()
+    health_status["components"]["model_rate_limiter"] = model_rate_limiter.info()
     
     # 计算整体状态
     all_healthy = all(
@@ -157,69 +193,84 @@ async def get_trading_signal(
                 detail="股票代码必须是6位数字"
             )
         
-        # 检查缓存（除非强制刷新）
-        cached_result = None
-        if not request.force_refresh:
-            cached_result = await analysis_cache.get_trading_signal_cache(stock_code)
-            if cached_result:
-                logger.info(f"返回技术面交易信号缓存: {stock_code}")
-                return {
-                    "analysis_type": "daily_technical_trading",
-                    "stock_code": stock_code,
-                    **cached_result
-                }
+        # 缓存未命中时执行的分析（同一时间只有一个请求真正执行）
+        async def run_analysis():
+            # 检查AI Agent是否可用
+            if not technical_agent:
+                raise HTTPException(
+                    status_code=503,
+                    detail="技术面分析AI Agent未初始化"
+                )
+        
+            # 收集技术面数据
+            emit_progress("phase", {"phase": "collecting_data"})
+            logger.info(f"收集技术面数据: {stock_code}")
+            technical_data = await stock_data_aggregator.collect_technical_data(stock_code)
         
-        # 检查AI Agent是否可用
-        if not technical_agent:
-            raise HTTPException(
-                status_code=503,
-                detail="技术面分析AI Agent未初始化"
-            )
+            if not technical_data or technical_data.get("success_count", 0) == 0:
+                raise HTTPException(
+                    status_code=503,
+                    detail="无法获取技术分析所需的数据"
+                )
         
-        # 收集技术面数据
-        logger.info(f"收集技术面数据: {stock_code}")
-        technical_data = await stock_data_aggregator.collect_technical_data(stock_code)
+            emit_progress("phase", {
+                "phase": "data_collected",
+                "success_count": technical_data.get("success_count", 0),
+                "data_completeness": technical_data.get("data_completeness", 0),
+                "partial": technical_data.get("partial", False),
+                "sections": technical_data.get("sections", {})
+            })
+            
+            # 格式化数据为AI可读格式
+            formatted_data = stock_data_aggregator.format_data_for_ai(technical_data)
         
-        if not technical_data or technical_data.get("success_count", 0) == 0:
-            raise HTTPException(
-                status_code=503,
-                detail="无法获取技术分析所需的数据"
+            # 执行AI分析
+            logger.info(f"执行技术面AI分析: {stock_code}")
+            # 输入数据与上次相同（收盘后、周末）时复用上次的AI结果，不再调用模型
+            fingerprint = technical_agent.input_fingerprint(
+                stock_data_aggregator.format_data_for_ai(technical_data, normalize=True)
+            )
+            ai_result = await analysis_cache.get_or_analyze_content(
+                "trading_signal", stock_code, fingerprint,
+                lambda: technical_agent.analyze_trading_signal(formatted_data, stock_code),
+                force_refresh=request.force_refresh
             )
         
-        # 格式化数据为AI可读格式
-        formatted_data = stock_data_aggregator.format_data_for_ai(technical_data)
-        
-        # 执行AI分析
-        logger.info(f"执行技术面AI分析: {stock_code}")
-        ai_result = await technical_agent.analyze_trading_signal(formatted_data, stock_code)
+            if not ai_result.get("success"):
+                raise HTTPException(
+                    status_code=500,
+                    detail=f"AI技术分析失败: {ai_result.get('error', 'Unknown error')}"
+                )
         
-        if not ai_result.get("success"):
-            raise HTTPException(
-                status_code=500,
-                detail=f"AI技术分析失败: {ai_result.get('error', 'Unknown error')}"
-            )
+            # 构建响应
+            response_data = {
+                "analysis_type": "daily_technical_trading",
+                "stock_code": stock_code,
+                "cached": False,
+                "cache_expires_at": None,
+                "immediate_trading_signal": ai_result["analysis"].get("immediate_trading_signal", {}),
+                "technical_summary": ai_result["analysis"].get("technical_summary", {}),
+                "risk_warning": ai_result["analysis"].get("risk_warning", "请注意投资风险"),
+                "ai_analysis": ai_result["analysis"].get("raw_content", ""),
+                "data_completeness": technical_data.get("data_completeness", 0),
+                "api_usage": ai_result.get("api_usage", {}),
+                "content_reused": ai_result.get("content_reused", False),
+                "timestamp": datetime.now().isoformat()
+            }
+            
+            logger.info(f"技术面交易信号分析完成: {stock_code}")
+            return response_data
         
-        # 构建响应
-        response_data = {
+        # 读取缓存；未命中时单飞执行分析，临近过期时后台提前刷新（除非强制刷新）
+        result = await analysis_cache.get_or_compute(
+            "trading_signal", stock_code, run_analysis, force_refresh=request.force_refresh
+        )
+        return {
             "analysis_type": "daily_technical_trading",
             "stock_code": stock_code,
-            "cached": False,
-            "cache_expires_at": None,
-            "immediate_trading_signal": ai_result["analysis"].get("immediate_trading_signal", {}),
-            "technical_summary": ai_result["analysis"].get("technical_summary", {}),
-            "risk_warning": ai_result["analysis"].get("risk_warning", "请注意投资风险"),
-            "ai_analysis": ai_result["analysis"].get("raw_content", ""),
-            "data_completeness": technical_data.get("data_completeness", 0),
-            "api_usage": ai_result.get("api_usage", {}),
-            "timestamp": datetime.now().isoformat()
+            **result
         }
         
-        # 保存到缓存
-        await analysis_cache.set_trading_signal_cache(stock_code, response_data)
-        
-        logger.info(f"技术面交易信号分析完成: {stock_code}")
-        return response_data
-        
     except HTTPException:
         raise
     except Exception as e:
@@ -229,6 +280,22 @@ async def get_trading_signal(
             detail=f"处理技术面交易信号时发生错误: {str(e)}"
         )
 
+@ai_analysis_app.get("/ai/trading-signal/{stock_code}/stream")
+async def stream_trading_signal(stock_code: str, force_refresh: bool = False):
+    """
+    流式获取技术面交易信号（Server-Sent Events）
+    
+    - 依次推送 phase（数据收集阶段）、token（模型输出片段）事件，最后推送 result（与 POST /ai/trading-signal 的响应相同）
+    - 缓存命中时直接推送 result；失败时推送 error
+    - 与普通接口共享缓存和单飞，客户端中途断开时分析继续执行并写入缓存
+    """
+    if not stock_code or len(stock_code) != 6 or not stock_code.isdigit():
+        raise HTTPException(status_code=400, detail="股票代码必须是6位数字")
+    return stream_analysis(
+        lambda: get_trading_signal(stock_code, TradingSignalRequest(force_refresh=force_refresh)),
+        stock_code=stock_code, analysis_type="daily_technical_trading"
+    )
+
 @ai_analysis_app.post("/ai/comprehensive-evaluation/{stock_code}")
 async def get_comprehensive_evaluation(
     stock_code: str,
@@ -251,88 +318,103 @@ async def get_comprehensive_evaluation(
                 detail="股票代码必须是6位数字"
             )
         
-        # 检查缓存（除非强制刷新）
-        cached_result = None
-        if not request.force_refresh:
-            cached_result = await analysis_cache.get_comprehensive_cache(stock_code)
-            if cached_result:
-                logger.info(f"返回综合评估缓存: {stock_code}")
-                return {
-                    "analysis_type": "comprehensive_stock_evaluation",
-                    "stock_code": stock_code,
-                    **cached_result
-                }
-        
-        # 检查AI Agent是否可用
-        if not comprehensive_agent:
-            raise HTTPException(
-                status_code=503,
-                detail="综合评估AI Agent未初始化"
-            )
-        
-        # 收集综合数据
-        logger.info(f"收集综合数据: {stock_code}")
-        comprehensive_data = await stock_data_aggregator.collect_comprehensive_data(stock_code)
+        # 缓存未命中时执行的分析（同一时间只有一个请求真正执行）
+        async def run_analysis():
+            # 检查AI Agent是否可用
+            if not comprehensive_agent:
+                raise HTTPException(
+                    status_code=503,
+                    detail="综合评估AI Agent未初始化"
+                )
         
-        if not comprehensive_data or comprehensive_data.get("success_count", 0) < 3:  # 至少需要3个数据源
-            raise HTTPException(
-                status_code=503,
-                detail=f"数据不足，无法进行综合评估。成功获取: {comprehensive_data.get('success_count', 0)}/8"
-            )
+            # 收集综合数据
+            emit_progress("phase", {"phase": "collecting_data"})
+            logger.info(f"收集综合数据: {stock_code}")
+            comprehensive_data = await stock_data_aggregator.collect_comprehensive_data(stock_code)
         
-        # 格式化数据为AI可读格式
-        formatted_data = stock_data_aggregator.format_data_for_ai(comprehensive_data)
+            if not comprehensive_data or comprehensive_data.get("success_count", 0) < 3:  # 至少需要3个数据源
+                raise HTTPException(
+                    status_code=503,
+                    detail=f"数据不足，无法进行综合评估。成功获取: {comprehensive_data.get('success_count', 0)}/8"
+                )
         
-        # 执行AI分析
-        logger.info(f"执行综合评估AI分析: {stock_code}")
-        ai_result = await comprehensive_agent.analyze_comprehensive_evaluation(formatted_data, stock_code)
+            emit_progress("phase", {
+                "phase": "data_collected",
+                "success_count": comprehensive_data.get("success_count", 0),
+                "data_completeness": comprehensive_data.get("data_completeness", 0),
+                "partial": comprehensive_data.get("partial", False),
+                "sections": comprehensive_data.get("sections", {})
+            })
+            
+            # 格式化数据为AI可读格式
+            formatted_data = stock_data_aggregator.format_data_for_ai(comprehensive_data)
         
-        if not ai_result.get("success"):
-            raise HTTPException(
-                status_code=500,
-                detail=f"AI综合评估失败: {ai_result.get('error', 'Unknown error')}"
+            # 执行AI分析
+            logger.info(f"执行综合评估AI分析: {stock_code}")
+            # 输入数据与上次相同（收盘后、周末）时复用上次的AI结果，不再调用模型
+            fingerprint = comprehensive_agent.input_fingerprint(
+                stock_data_aggregator.format_data_for_ai(comprehensive_data, normalize=True)
+            )
+            ai_result = await analysis_cache.get_or_analyze_content(
+                "comprehensive_eval", stock_code, fingerprint,
+                lambda: comprehensive_agent.analyze_comprehensive_evaluation(formatted_data, stock_code),
+                force_refresh=request.force_refresh
             )
         
-        # 构建响应
-        response_data = {
-            "analysis_type": "comprehensive_stock_evaluation",
-            "stock_code": stock_code,
-            "cached": False,
-            "cache_expires_at": None,
-            "comprehensive_evaluation": ai_result["analysis"].get("comprehensive_evaluation", {}),
-            "evidence_and_reasoning": ai_result["analysis"].get("evidence_and_reasoning", {}),
-            "detailed_analysis": ai_result["analysis"].get("detailed_analysis", {}),
-            "sector_comparison": ai_result["analysis"].get("sector_comparison", {}),
-            "raw_data_sources": {
-                "fundamental_data": stock_data_aggregator._trim_large_datasets(
-                    comprehensive_data.get("data_sources", {}).get("fundamental_analysis", {}), max_items=8
-                ),
-                "technical_data": stock_data_aggregator._trim_large_datasets(
-                    comprehensive_data.get("data_sources", {}).get("technical_analysis", {}), max_items=8
-                ),
-                "news_data": {
-                    "announcements": stock_data_aggregator._trim_large_datasets(
-                        comprehensive_data.get("data_sources", {}).get("announcements", {}), max_items=8
+            if not ai_result.get("success"):
+                raise HTTPException(
+                    status_code=500,
+                    detail=f"AI综合评估失败: {ai_result.get('error', 'Unknown error')}"
+                )
+        
+            # 构建响应
+            response_data = {
+                "analysis_type": "comprehensive_stock_evaluation",
+                "stock_code": stock_code,
+                "cached": False,
+                "cache_expires_at": None,
+                "comprehensive_evaluation": ai_result["analysis"].get("comprehensive_evaluation", {}),
+                "evidence_and_reasoning": ai_result["analysis"].get("evidence_and_reasoning", {}),
+                "detailed_analysis": ai_result["analysis"].get("detailed_analysis", {}),
+                "sector_comparison": ai_result["analysis"].get("sector_comparison", {}),
+                "raw_data_sources": {
+                    "fundamental_data": stock_data_aggregator._trim_large_datasets(
+                        comprehensive_data.get("data_sources", {}).get("fundamental_analysis", {}), max_items=8
+                    ),
+                    "technical_data": stock_data_aggregator._trim_large_datasets(
+                        comprehensive_data.get("data_sources", {}).get("technical_analysis", {}), max_items=8
                     ),
-                    "dragon_tiger": stock_data_aggregator._trim_large_datasets(
-                        comprehensive_data.get("data_sources", {}).get("dragon_tiger", {}), max_items=8
+                    "news_data": {
+                        "announcements": stock_data_aggregator._trim_large_datasets(
+                            comprehensive_data.get("data_sources", {}).get("announcements", {}), max_items=8
+                        ),
+                        "dragon_tiger": stock_data_aggregator._trim_large_datasets(
+                            comprehensive_data.get("data_sources", {}).get("dragon_tiger", {}), max_items=8
+                        )
+                    },
+                    "financial_history": stock_data_aggregator._trim_large_datasets(
+                        comprehensive_data.get("data_sources", {}).get("financial_history", {}), max_items=8
                     )
                 },
-                "financial_history": stock_data_aggregator._trim_large_datasets(
-                    comprehensive_data.get("data_sources", {}).get("financial_history", {}), max_items=8
-                )
-            },
-            "ai_analysis": ai_result["analysis"].get("raw_content", ""),
-            "data_completeness": comprehensive_data.get("data_completeness", 0),
-            "api_usage": ai_result.get("api_usage", {}),
-            "timestamp": datetime.now().isoformat()
-        }
+                "ai_analysis": ai_result["analysis"].get("raw_content", ""),
+                "data_completeness": comprehensive_data.get("data_completeness", 0),
+                "api_usage": ai_result.get("api_usage", {}),
+                "content_reused": ai_result.get("content_reused", False),
+                "timestamp": datetime.now().isoformat()
+            }
+            
+            logger.info(f"综合评估分析完成: {stock_code}")
+            return response_data
         
-        # 保存到缓存
-        await analysis_cache.set_comprehensive_cache(stock_code, response_data)
-        
-        logger.info(f"综合评估分析完成: {stock_code}")
-        return response_data
+        # 读取缓存；未命中时单飞执行分析，临近过期时后台提前刷新（除非强制刷新）
+        result = await analysis_cache.get_or_compute(
+            "comprehensive_eval", stock_code, run_analysis, force_refresh=request.force_refresh
+        )
+        return {
+            "analysis_type": "comprehensive_stock_evaluation",
+            "stock_code": stock_code,
+            **result
+        }
         
     except HTTPException:
         raise
@@ -343,6 +425,98 @@ async def get_comprehensive_evaluation(
             detail=f"处理综合评估时发生错误: {str(e)}"
         )
 
+@ai_analysis_app.get("/ai/comprehensive-evaluation/{stock_code}/stream")
+async def stream_comprehensive_evaluation(stock_code: str, force_refresh: bool = False):
+    """
+    流式获取综合评估报告（Server-Sent Events）
+    
+    - 依次推送 phase（数据收集阶段）、token（模型输出片段）事件，最后推送 result（与 POST /ai/comprehensive-evaluation 的响应相同）
+    - 缓存命中时直接推送 result；失败时推送 error
+    - 与普通接口共享缓存和单飞，客户端中途断开时分析继续执行并写入缓存
+    """
+    if not stock_code or len(stock_code) != 6 or not stock_code.isdigit():
+        raise HTTPException(status_code=400, detail="股票代码必须是6位数字")
+    return stream_analysis(
+        lambda: get_comprehensive_evaluation(stock_code, ComprehensiveEvalRequest(force_refresh=force_refresh)),
+        stock_code=stock_code, analysis_type="comprehensive_stock_evaluation"
+    )
+
+@ai_analysis_app.post("/ai/jobs", status_code=202)
+async def submit_analysis_job(request: AnalysisJobRequest):
+    """
+    提交异步分析任务，立即返回任务ID
+    
+    - **job_type**: trading_signal（技术面交易信号）或 comprehensive_eval（综合评估）
+    - 同一股票、同一类型已有排队或执行中的任务时返回该任务（deduplicated=true）
+    - 通过 GET /ai/jobs/{job_id}?wait=秒数 查询或长轮询结果
+    """
+    if not request.stock_code or len(request.stock_code) != 6 or not request.stock_code.isdigit():
+        raise HTTPException(status_code=400, detail="股票代码必须是6位数字")
+    if request.job_type not in analysis_job_queue.runners:
+        raise HTTPException(
+            status_code=400,
+            detail=f"job_type必须是: {', '.join(sorted(analysis_job_queue.runners)) or '(任务队列未启动)'}"
+        )
+    try:
+        job, created = await analysis_job_queue.submit(request.job_type, request.stock_code, request.force_refresh)
+    except JobQueueFull as e:
+        raise HTTPException(status_code=429, detail=str(e))
+    except RuntimeError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    return {**job, "deduplicated": not created}
+
+@ai_analysis_app.get("/ai/jobs/{job_id}")
+async def get_analysis_job(job_id: str, wait: float = 0):
+    """
+    查询分析任务状态和结果
+    
+    - **wait**: 长轮询秒数（最长60），任务在此期间完成时立即返回；0 表示立即返回当前状态
+    - status: queued / running / succeeded / failed；succeeded 时 result 与同步接口的响应相同
+    """
+    job = await (analysis_job_queue.wait(job_id, wait) if wait > 0 else analysis_job_queue.get(job_id))
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"任务不存在或已过期: {job_id}")
+    return job
+
+@ai_analysis_app.post("/ai/batch")
+async def batch_analysis(request: BatchAnalysisRequest):
+    """
+    自选股批量AI分析（Server-Sent Events）
+    
+    - **stock_codes**: 股票代码列表，最多100只（ANALYSIS_BATCH_MAX_CODES）
+    - **analysis_type**: trading_signal（技术面交易信号，默认）或 comprehensive_eval（综合评估）
+    - 数据收集并发有上限，模型调用按每分钟token预算排队；每只股票的结果与单只接口相同并写入缓存
+    - 按完成顺序推送 stock 事件，全部完成后推送 result（批次汇总）
+    """
+    stock_codes, invalid_codes = batch_analyzer.validate(request.analysis_type, request.stock_codes)
+    return batch_analyzer.stream(request.analysis_type, stock_codes, request.force_refresh, invalid_codes)
+
+@ai_analysis_app.get("/ai/cache/status")
+async def get_cache_status_batch(codes: str):
+    """
+    批量获取多只股票的缓存状态（所有TTL查询在一个Redis pipeline中完成）
+    
+    - **codes**: 逗号分隔的股票代码，如 600519,000001
+    """
+    stock_codes = list(dict.fromkeys(code.strip() for code in codes.split(",") if code.strip()))
+    if not stock_codes:
+        raise HTTPException(status_code=400, detail="请提供股票代码，如 codes=600519,000001")
+    if len(stock_codes) > analysis_cache.MAX_BATCH_CODES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"单次最多查询 {analysis_cache.MAX_BATCH_CODES} 只股票，当前 {len(stock_codes)} 只"
+        )
+    
+    statuses = await analysis_cache.get_cache_status_many(stock_codes)
+    if "error" in statuses:
+        raise HTTPException(status_code=500, detail=statuses["error"])
+    
+    return {
+        "count": len(stock_codes),
+        "statuses": [CacheStatusResponse(**statuses[code]) for code in stock_codes],
+        "timestamp": datetime.now().isoformat()
+    }
+
 @ai_analysis_app.get("/ai/cache/status/{stock_code}")
 async def get_cache_status(stock_code: str) -> CacheStatusResponse:
     """获取指定股票的缓存状态"""
@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+"""
+AI分析流式进度（Server-Sent Events）
+AI analysis progress streaming over Server-Sent Events
+
+一次完整的AI分析需要20~60秒。流式接口在后台任务中执行与普通接口相同的分析流程，
+分析过程中通过 emit_progress() 上报的事件（数据收集阶段、模型输出的文本片段）实时以SSE推送：
+- phase:  阶段变化，如 started / collecting_data / data_collected / model_call
+- token:  模型输出的文本片段
+- retry:  模型调用失败后重试，客户端应丢弃之前收到的文本片段
+- result: 最终解析后的完整结果（与普通接口的响应相同）
+- error:  分析失败，含 status_code 和 detail
+result 或 error 之后流结束。长时间没有事件时发送SSE注释行保活，避免代理超时断开。
+进度通过 ContextVar 传递，未在流式任务中调用时 emit_progress() 不做任何事；
+任务队列通过 progress_listener() 接收同样的事件，记录到任务状态中。
+客户端中途断开时分析任务继续执行，结果照常写入缓存。
+"""
+import asyncio
+import json
+import logging
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Iterator, Optional, Set
+
+from fastapi import HTTPException
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import StreamingResponse
+
+logger = logging.getLogger(__name__)
+
+# 无事件时发送保活注释的间隔（秒）
+HEARTBEAT_SECONDS = 15.0
+
+SSE_HEADERS = {
+    "Cache-Control": "no-cache",
+    "Connection": "keep-alive",
+    "X-Accel-Buffering": "no",  # 关闭nginx响应缓冲
+}
+
+
+def sse_event(event: str, data: Any, event_id: Optional[int] = None) -> str:
+    """格式化一条SSE事件"""
+    payload = json.dumps(jsonable_encoder(data), ensure_ascii=False, separators=(",", ":"))
+    lines = [f"event: {event}"]
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    lines.extend(f"data: {line}" for line in payload.splitlines() or [""])
+    return "\n".join(lines) + "\n\n"
+
+
+class AnalysisEventStream:
+    """一次流式分析的事件队列"""
+
+    def __init__(self, heartbeat_seconds: float = HEARTBEAT_SECONDS):
+        self.heartbeat_seconds = heartbeat_seconds
+        self.closed = False
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._next_id = 0
+
+    def emit(self, event: str, data: Optional[Dict[str, Any]] = None):
+        """加入一条事件；客户端已断开时丢弃"""
+        if self.closed:
+            return
+        self._next_id += 1
+        self._queue.put_nowait(sse_event(event, data or {}, self._next_id))
+
+    async def _run(self, run: Callable[[], Awaitable[Dict[str, Any]]]):
+        # 任务有自己的上下文副本，只有本任务及其调用链中的 emit_progress() 写入本队列
+        _active_stream.set(self)
+        try:
+            self.emit("result", await run())
+        except HTTPException as e:
+            self.emit("error", {"status_code": e.status_code, "detail": e.detail})
+        except Exception as e:
+            logger.error(f"流式分析失败: {e}")
+            self.emit("error", {"status_code": 500, "detail": str(e)})
+        finally:
+            self._queue.put_nowait(None)
+
+    async def events(self, run: Callable[[], Awaitable[Dict[str, Any]]]) -> AsyncIterator[str]:
+        """在后台任务中执行 run，依次产出SSE文本，直到 result 或 error"""
+        task = asyncio.create_task(self._run(run))
+        _running_tasks.add(task)
+        task.add_done_callback(_running_tasks.discard)
+        try:
+            while True:
+                try:
+                    chunk = await asyncio.wait_for(self._queue.get(), self.heartbeat_seconds)
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+                    continue
+                if chunk is None:
+                    return
+                yield chunk
+        finally:
+            # 客户端断开时不取消分析任务：模型调用已产生费用，结果仍写入缓存
+            self.closed = True
+
+
+_active_stream: ContextVar[Optional[AnalysisEventStream]] = ContextVar("active_analysis_stream", default=None)
+# 持有运行中的分析任务引用，避免客户端断开后任务被回收
+_running_tasks: Set[asyncio.Task] = set()
+
+
+def emit_progress(event: str, data: Optional[Dict[str, Any]] = None) -> bool:
+    """上报进度事件；当前不在流式分析中时忽略，返回是否已上报"""
+    stream = _active_stream.get()
+    if stream is None:
+        return False
+    stream.emit(event, data)
+    return True
+
+
+@contextmanager
+def progress_listener(listener: Any) -> Iterator[None]:
+    """
+    在当前上下文中把进度事件交给 listener，用于任务队列等非SSE调用方
+    listener 需提供 emit(event, data) 方法和 closed 属性
+    """
+    token = _active_stream.set(listener)
+    try:
+        yield
+    finally:
+        _active_stream.reset(token)
+
+
+def streaming_active() -> bool:
+    """当前调用是否处于流式分析中（模型调用据此决定是否使用流式接口）"""
+    stream = _active_stream.get()
+    return stream is not None and not stream.closed
+
+
+def stream_analysis(run: Callable[[], Awaitable[Dict[str, Any]]], **started: Any) -> StreamingResponse:
+    """
+    构建SSE流式响应
+
+    Args:
+        run: 执行分析并返回最终结果的协程函数，抛出 HTTPException 时输出 error 事件
+        started: 首个 phase=started 事件附带的信息（如股票代码、分析类型）
+    """
+    stream = AnalysisEventStream()
+    stream.emit("phase", {"phase": "started", **started})
+    return StreamingResponse(
+        (chunk.encode("utf-8") async for chunk in stream.events(run)),
+        media_type="text/event-stream",
+        headers=SSE_HEADERS
+    )
@@ -0,0 +1,228 @@
+# -*- coding: utf-8 -*-
+"""
+AI批量分析（自选股）
+AI batch analysis for a watchlist
+
+逐只调用 /ai/trading-signal 分析一个自选股列表时，每只股票都重新获取全市场快照等重叠数据，
+模型调用同时发起还会触发账户的每分钟token限流。批量分析一次提交多只股票：
+- 共享数据只收集一次: use_shared_data() 注册的加载函数（如全市场快照、行业板块统计）在批次开始时执行一次，
+  按股票拆分后作为数据段附加到每只股票的聚合数据中
+- 数据收集并发有上限: 最多 collect_concurrency 只股票同时收集数据，收集完成即让出名额
+- 模型调用按每分钟token预算调度（rate_limiter.model_rate_limiter）
+- 每只股票执行与普通接口相同的分析流程（缓存、单飞、按输入内容复用结果），结果写入分析缓存
+结果按完成顺序以SSE推送：
+- phase:    批次阶段，started / shared_data_collected
+- progress: 某只股票的分析阶段（collecting_data / data_collected / rate_limited / ...），含 stock_code
+- stock:    一只股票的分析结果（成功时 result 与普通接口的响应相同，失败时含 status_code 和 detail）
+- result:   全部完成后的批次汇总
+客户端中途断开时剩余股票继续分析，结果照常写入缓存。
+"""
+import asyncio
+import logging
+import time
+from collections import Counter
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Tuple
+
+from fastapi import HTTPException
+from fastapi.responses import StreamingResponse
+
+from .analysis_stream import HEARTBEAT_SECONDS, SSE_HEADERS, AnalysisEventStream, progress_listener
+from .data_aggregator import StockDataAggregator, stock_data_aggregator
+from .rate_limiter import model_rate_limiter
+
+try:
+    from config import Config
+    BATCH_MAX_CODES = Config.ANALYSIS_BATCH_MAX_CODES
+    BATCH_COLLECT_CONCURRENCY = Config.ANALYSIS_BATCH_COLLECT_CONCURRENCY
+except (ImportError, AttributeError):
+    BATCH_MAX_CODES = 100
+    BATCH_COLLECT_CONCURRENCY = 4
+
+logger = logging.getLogger(__name__)
+
+# 单只股票的分析函数：(股票代码, 是否强制刷新) -> 与普通接口相同的响应
+BatchRunner = Callable[[str, bool], Awaitable[Dict[str, Any]]]
+# 共享数据加载函数：股票代码列表 -> {股票代码: {数据段名称: 数据}}
+SharedDataLoader = Callable[[List[str]], Awaitable[Dict[str, Dict[str, Any]]]]
+
+
+def _elapsed_ms(since: float) -> float:
+    return round((time.perf_counter() - since) * 1000, 2)
+
+
+class _StockProgress:
+    """把单只股票的阶段事件转发到批量流（附加股票代码），丢弃模型输出的文本片段"""
+
+    # closed 为 True 时模型调用不使用流式接口
+    closed = True
+
+    def __init__(self, stream: AnalysisEventStream, stock_code: str):
+        self.stream = stream
+        self.stock_code = stock_code
+
+    def emit(self, event: str, data: Optional[Dict[str, Any]] = None):
+        if event == "phase":
+            self.stream.emit("progress", {"stock_code": self.stock_code, **(data or {})})
+
+
+class BatchAnalyzer:
+    """自选股批量AI分析"""
+
+    def __init__(self, aggregator: StockDataAggregator = stock_data_aggregator,
+                 max_codes: int = BATCH_MAX_CODES, collect_concurrency: int = BATCH_COLLECT_CONCURRENCY,
+                 heartbeat_seconds: float = HEARTBEAT_SECONDS):
+        self.aggregator = aggregator
+        self.max_codes = max_codes
+        self.collect_concurrency = collect_concurrency
+        self.heartbeat_seconds = heartbeat_seconds
+        self.runners: Dict[str, BatchRunner] = {}
+        self.shared_loader: Optional[SharedDataLoader] = None
+        self.stats = Counter()
+
+    def register(self, analysis_type: str, runner: BatchRunner):
+        """注册分析类型对应的单只股票分析函数"""
+        self.runners[analysis_type] = runner
+
+    def use_shared_data(self, loader: SharedDataLoader):
+        """注册批次共享数据的加载函数，每个批次开始时调用一次"""
+        self.shared_loader = loader
+
+    def validate(self, analysis_type: str, stock_codes: Iterable[str]) -> Tuple[List[str], List[str]]:
+        """
+        校验请求，返回去重后的 (有效代码, 无效代码)，无效代码不分析但在 started 事件中列出
+        分析类型未知、没有有效代码或超过数量上限时抛出 HTTPException(400)
+        """
+        if analysis_type not in self.runners:
+            raise HTTPException(
+                status_code=400,
+                detail=f"analysis_type必须是: {', '.join(sorted(self.runners)) or '(批量分析未启用)'}"
+            )
+        valid, invalid = [], []
+        for code in stock_codes:
+            code = (code or "").strip()
+            if not code or code in valid or code in invalid:
+                continue
+            (valid if len(code) == 6 and code.isdigit() else invalid).append(code)
+        if not valid:
+            raise HTTPException(status_code=400, detail="请提供有效的6位股票代码")
+        if len(valid) > self.max_codes:
+            raise HTTPException(
+                status_code=400, detail=f"单次最多分析 {self.max_codes} 只股票，当前 {len(valid)} 只"
+            )
+        return valid, invalid
+
+    async def _load_shared(self, stock_codes: List[str]) -> Tuple[Dict[str, Dict[str, Any]], Dict[str, Any]]:
+        if self.shared_loader is None:
+            return {}, {"loaded": False}
+        started = time.perf_counter()
+        try:
+            shared = await self.shared_loader(stock_codes)
+        except Exception as e:
+            # 共享数据只是补充信息，失败时各股票照常分析
+            logger.warning(f"批量分析共享数据收集失败: {e}")
+            return {}, {"loaded": False, "error": str(e), "elapsed_ms": _elapsed_ms(started)}
+        sections = sorted({name for item in shared.values() for name in item})
+        return shared, {"loaded": True, "stocks": len(shared), "sections": sections,
+                        "elapsed_ms": _elapsed_ms(started)}
+
+    async def _analyze_one(self, stream: AnalysisEventStream, runner: BatchRunner, stock_code: str,
+                           force_refresh: bool) -> Dict[str, Any]:
+        started = time.perf_counter()
+        record: Dict[str, Any] = {"stock_code": stock_code}
+        try:
+            with progress_listener(_StockProgress(stream, stock_code)):
+                result = await runner(stock_code, force_refresh)
+            record.update(success=True, cached=bool(result.get("cached")), result=result)
+        except HTTPException as e:
+            record.update(success=False, status_code=e.status_code, detail=e.detail)
+        except Exception as e:
+            logger.error(f"批量分析失败 {stock_code}: {e}")
+            record.update(success=False, status_code=500, detail=str(e))
+        record["elapsed_ms"] = _elapsed_ms(started)
+        return record
+
+    async def _run(self, stream: AnalysisEventStream, analysis_type: str, stock_codes: List[str],
+                   force_refresh: bool) -> Dict[str, Any]:
+        started = time.perf_counter()
+        runner = self.runners[analysis_type]
+        self.stats["batches"] += 1
+
+        shared, shared_info = await self._load_shared(stock_codes)
+        stream.emit("phase", {"phase": "shared_data_collected", **shared_info})
+
+        # 任务在 batch_scope 内创建，数据收集共享同一组并发名额和共享数据
+        with self.aggregator.batch_scope(shared, self.collect_concurrency):
+            tasks = [
+                asyncio.create_task(self._analyze_one(stream, runner, code, force_refresh))
+                for code in stock_codes
+            ]
+
+        counts = Counter()
+        usage = Counter()
+        for next_done in asyncio.as_completed(tasks):
+            record = await next_done
+            stream.emit("stock", record)
+            counts["succeeded" if record["success"] else "failed"] += 1
+            result = record.get("result") or {}
+            if result.get("cached"):
+                counts["cached"] += 1
+            elif result.get("content_reused"):
+                counts["content_reused"] += 1
+            elif record["success"]:
+                # 只统计本批次实际调用模型产生的用量
+                usage.update(result.get("api_usage") or {})
+        self.stats["stocks"] += len(stock_codes)
+        self.stats["failed"] += counts["failed"]
+
+        return {
+            "analysis_type": analysis_type,
+            "requested": len(stock_codes),
+            "succeeded": counts["succeeded"],
+            "failed": counts["failed"],
+            "cached": counts["cached"],
+            "content_reused": counts["content_reused"],
+            "api_usage": dict(usage),
+            "shared_data": shared_info,
+            "elapsed_ms": _elapsed_ms(started),
+            "rate_limiter": model_rate_limiter.info()
+        }
+
+    def stream(self, analysis_type: str, stock_codes: List[str], force_refresh: bool = False,
+               invalid_codes: Iterable[str] = ()) -> StreamingResponse:
+        """
+        构建批量分析的SSE流式响应（调用前先用 validate() 校验）
+
+        Args:
+            analysis_type: 已注册的分析类型，如 trading_signal
+            stock_codes: 有效的股票代码
+            invalid_codes: 无效的股票代码，只在 started 事件中列出
+        """
+        stream = AnalysisEventStream(self.heartbeat_seconds)
+        stream.emit("phase", {
+            "phase": "started",
+            "analysis_type": analysis_type,
+            "stock_codes": stock_codes,
+            "invalid_codes": list(invalid_codes),
+            "collect_concurrency": self.collect_concurrency
+        })
+        return StreamingResponse(
+            (chunk.encode("utf-8") async for chunk in stream.events(
+                lambda: self._run(stream, analysis_type, stock_codes, force_refresh)
+            )),
+            media_type="text/event-stream",
+            headers=SSE_HEADERS
+        )
+
+    def info(self) -> Dict[str, Any]:
+        """批量分析配置和累计统计"""
+        return {
+            "analysis_types": sorted(self.runners),
+            "shared_data": self.shared_loader is not None,
+            "max_codes": self.max_codes,
+            "collect_concurrency": self.collect_concurrency,
+            **self.stats
+        }
+
+
+# 全局批量分析实例
+batch_analyzer = BatchAnalyzer()
@@ -0,0 +1,510 @@
+# -*- coding: utf-8 -*-
+"""
+AI分析缓存存储后端
+Analysis Cache Backends
+
+- RedisCacheBackend: Redis存储，多进程/多实例共享
+- MemoryCacheBackend: 进程内有界LRU + TTL存储，可选定期持久化到磁盘文件
+- FailoverCacheBackend: 优先使用Redis，Redis不可用时自动切换到进程内存储，
+  后台定时重连，恢复后切回Redis；按后端分别统计命中率
+所有后端的值都是编码后的字节串（见 cache_codec）。
+"""
+import asyncio
+import logging
+import os
+import struct
+import time
+from abc import ABC, abstractmethod
+from collections import Counter, OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+import redis.asyncio as redis
+
+logger = logging.getLogger(__name__)
+
+# 仅当锁的值等于自己的token时才删除，避免误删其他进程重新获得的锁
+_DELETE_IF_EQUALS_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+REDIS_TIMEOUT_SECONDS = 2.0
+
+# 持久化文件格式：MAGIC + 若干条 [键长度(2字节) 过期时间(8字节浮点) 值长度(4字节) 键 值]
+PERSIST_MAGIC = b"\x89ACM1"
+_RECORD_HEADER = struct.Struct(">HdI")
+
+
+class CacheBackend(ABC):
+    """缓存存储后端接口"""
+
+    name = "base"
+
+    @abstractmethod
+    async def get(self, key: str) -> Optional[bytes]:
+        """读取单个键，不存在时返回None"""
+
+    @abstractmethod
+    async def mget(self, keys: List[str]) -> List[Optional[bytes]]:
+        """批量读取，顺序与 keys 一致"""
+
+    @abstractmethod
+    async def set(self, key: str, value: bytes, ttl: int) -> bool:
+        """写入并设置过期时间（秒）"""
+
+    @abstractmethod
+    async def set_if_absent(self, key: str, value: bytes, ttl: int) -> bool:
+        """键不存在时写入（用于锁），返回是否写入"""
+
+    @abstractmethod
+    async def delete(self, *keys: str) -> int:
+        """删除键，返回删除数量"""
+
+    @abstractmethod
+    async def delete_if_equals(self, key: str, value: bytes) -> bool:
+        """键的值等于 value 时删除（用于释放锁）"""
+
+    @abstractmethod
+    async def exists(self, key: str) -> bool:
+        """键是否存在"""
+
+    @abstractmethod
+    async def ttls(self, keys: List[str]) -> List[int]:
+        """批量查询剩余秒数：-2 表示不存在，-1 表示永不过期"""
+
+    @abstractmethod
+    async def scan_keys(self, prefix: str) -> List[str]:
+        """列出以 prefix 开头的未过期键（用于任务恢复等低频操作）"""
+
+    @abstractmethod
+    async def ping(self) -> bool:
+        """连通性检查"""
+
+    async def info(self) -> Dict[str, Any]:
+        """后端状态"""
+        return {"backend": self.name}
+
+    async def close(self):
+        """释放资源"""
+
+
+class RedisCacheBackend(CacheBackend):
+    """Redis存储后端"""
+
+    name = "redis"
+
+    def __init__(self, redis_url: str):
+        self.redis_url = redis_url
+        self.client = None
+
+    async def connect(self):
+        """建立连接并ping；失败时抛出异常且不保留客户端"""
+        client = redis.from_url(
+            self.redis_url, decode_responses=False,
+            socket_timeout=REDIS_TIMEOUT_SECONDS, socket_connect_timeout=REDIS_TIMEOUT_SECONDS
+        )
+        try:
+            await client.ping()
+        except Exception:
+            await client.aclose()
+            raise
+        await self.close()
+        self.client = client
+
+    async def get(self, key: str) -> Optional[bytes]:
+        return await self.client.get(key)
+
+    async def mget(self, keys: List[str]) -> List[Optional[bytes]]:
+        return await self.client.mget(keys)
+
+    async def set(self, key: str, value: bytes, ttl: int) -> bool:
+        return bool(await self.client.setex(key, ttl, value))
+
+    async def set_if_absent(self, key: str, value: bytes, ttl: int) -> bool:
+        return bool(await self.client.set(key, value, nx=True, ex=ttl))
+
+    async def delete(self, *keys: str) -> int:
+        return await self.client.delete(*keys) if keys else 0
+
+    async def delete_if_equals(self, key: str, value: bytes) -> bool:
+        return bool(await self.client.eval(_DELETE_IF_EQUALS_SCRIPT, 1, key, value))
+
+    async def exists(self, key: str) -> bool:
+        return bool(await self.client.exists(key))
+
+    async def ttls(self, keys: List[str]) -> List[int]:
+        # 所有TTL查询放在一个pipeline中，一次往返
+        pipeline = self.client.pipeline(transaction=False)
+        for key in keys:
+            pipeline.ttl(key)
+        return await pipeline.execute()
+
+    async def scan_keys(self, prefix: str) -> List[str]:
+        # SCAN 增量遍历，不像 KEYS 那样阻塞Redis
+        return [key.decode() async for key in self.client.scan_iter(match=f"{prefix}*", count=500)]
+
+    async def ping(self) -> bool:
+        return bool(await self.client.ping())
+
+    async def info(self) -> Dict[str, Any]:
+        info = await self.client.info()
+        return {
+            "backend": self.name,
+            "redis_version": info.get("redis_version", "unknown"),
+            "connected_clients": info.get("connected_clients", 0),
+            "used_memory": info.get("used_memory_human", "unknown"),
+            "total_connections_received": info.get("total_connections_received", 0)
+        }
+
+    async def close(self):
+        if self.client is not None:
+            await self.client.aclose()
+            self.client = None
+
+
+class MemoryCacheBackend(CacheBackend):
+    """
+    进程内有界LRU + TTL存储
+
+    超过 max_entries 时淘汰最久未使用的条目；过期条目在读取时删除。
+    设置 persist_path 后定期（以及关闭时）把未过期条目写入文件，启动时读回，
+    重启后仍能命中。过期时间使用墙钟时间，以便跨进程重启保持有效。
+    """
+
+    name = "memory"
+
+    def __init__(self, max_entries: int = 2000, persist_path: str = "", persist_seconds: int = 60):
+        self.max_entries = max_entries
+        self.persist_path = persist_path
+        self.persist_seconds = persist_seconds
+        self._entries: "OrderedDict[str, Tuple[bytes, Optional[float]]]" = OrderedDict()
+        self._dirty = False
+        self._persist_task: Optional[asyncio.Task] = None
+        if persist_path:
+            self._load()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _lookup(self, key: str) -> Optional[Tuple[bytes, Optional[float]]]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry[1] is not None and entry[1] <= time.time():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    def _store(self, key: str, value: bytes, ttl: Optional[int]):
+        self._entries[key] = (value, time.time() + ttl if ttl else None)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        self._dirty = True
+
+    async def get(self, key: str) -> Optional[bytes]:
+        entry = self._lookup(key)
+        return entry[0] if entry else None
+
+    async def mget(self, keys: List[str]) -> List[Optional[bytes]]:
+        return [await self.get(key) for key in keys]
+
+    async def set(self, key: str, value: bytes, ttl: int) -> bool:
+        self._store(key, value, ttl)
+        return True
+
+    async def set_if_absent(self, key: str, value: bytes, ttl: int) -> bool:
+        if self._lookup(key) is not None:
+            return False
+        self._store(key, value, ttl)
+        return True
+
+    async def delete(self, *keys: str) -> int:
+        deleted = 0
+        for key in keys:
+            if self._lookup(key) is not None:
+                del self._entries[key]
+                deleted += 1
+        if deleted:
+            self._dirty = True
+        return deleted
+
+    async def delete_if_equals(self, key: str, value: bytes) -> bool:
+        entry = self._lookup(key)
+        if entry is None or entry[0] != value:
+            return False
+        del self._entries[key]
+        return True
+
+    async def exists(self, key: str) -> bool:
+        return self._lookup(key) is not None
+
+    async def ttls(self, keys: List[str]) -> List[int]:
+        results = []
+        for key in keys:
+            entry = self._lookup(key)
+            if entry is None:
+                results.append(-2)
+            elif entry[1] is None:
+                results.append(-1)
+            else:
+                results.append(max(int(entry[1] - time.time()), 0))
+        return results
+
+    async def scan_keys(self, prefix: str) -> List[str]:
+        # 不经过 _lookup，避免遍历打乱LRU顺序
+        now = time.time()
+        return [key for key, (_, expires_at) in list(self._entries.items())
+                if key.startswith(prefix) and (expires_at is None or expires_at > now)]
+
+    async def ping(self) -> bool:
+        return True
+
+    async def info(self) -> Dict[str, Any]:
+        return {
+            "backend": self.name,
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "persist_path": self.persist_path or None
+        }
+
+    # ---------- 持久化 ----------
+
+    def _load(self):
+        """从持久化文件读回未过期的条目；文件损坏时忽略"""
+        if not os.path.exists(self.persist_path):
+            return
+        try:
+            with open(self.persist_path, "rb") as f:
+                raw = f.read()
+            if not raw.startswith(PERSIST_MAGIC):
+                logger.warning(f"进程内缓存持久化文件格式不正确，忽略: {self.persist_path}")
+                return
+            offset, now = len(PERSIST_MAGIC), time.time()
+            while offset < len(raw):
+                key_length, expires_at, value_length = _RECORD_HEADER.unpack_from(raw, offset)
+                offset += _RECORD_HEADER.size
+                key = raw[offset:offset + key_length].decode("utf-8")
+                offset += key_length
+                value = raw[offset:offset + value_length]
+                offset += value_length
+                # 过期时间 0 表示永不过期
+                if not expires_at or expires_at > now:
+                    self._entries[key] = (value, expires_at or None)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            logger.info(f"从持久化文件恢复进程内缓存 {len(self._entries)} 条: {self.persist_path}")
+        except Exception as e:
+            logger.warning(f"读取进程内缓存持久化文件失败 {self.persist_path}: {e}")
+
+    def _snapshot(self) -> bytes:
+        now = time.time()
+        chunks = [PERSIST_MAGIC]
+        for key, (value, expires_at) in self._entries.items():
+            if expires_at is not None and expires_at <= now:
+                continue
+            key_bytes = key.encode("utf-8")
+            chunks.append(_RECORD_HEADER.pack(len(key_bytes), expires_at or 0.0, len(value)))
+            chunks.append(key_bytes)
+            chunks.append(value)
+        return b"".join(chunks)
+
+    def _write_file(self, data: bytes):
+        # 先写临时文件再替换，进程中途退出也不会留下半个文件
+        temp_path = f"{self.persist_path}.tmp"
+        with open(temp_path, "wb") as f:
+            f.write(data)
+        os.replace(temp_path, self.persist_path)
+
+    async def persist(self):
+        """把当前条目写入持久化文件（有变化时）"""
+        if not self.persist_path or not self._dirty:
+            return
+        self._dirty = False
+        try:
+            await asyncio.to_thread(self._write_file, self._snapshot())
+        except Exception as e:
+            self._dirty = True
+            logger.warning(f"写入进程内缓存持久化文件失败 {self.persist_path}: {e}")
+
+    async def _persist_loop(self):
+        while True:
+            await asyncio.sleep(self.persist_seconds)
+            await self.persist()
+
+    def start(self):
+        """启动定期持久化"""
+        if self.persist_path and (self._persist_task is None or self._persist_task.done()):
+            self._persist_task = asyncio.create_task(self._persist_loop())
+
+    async def close(self):
+        if self._persist_task is not None:
+            self._persist_task.cancel()
+            try:
+                await self._persist_task
+            except asyncio.CancelledError:
+                pass
+            self._persist_task = None
+        await self.persist()
+
+
+class FailoverCacheBackend(CacheBackend):
+    """
+    Redis优先、进程内存储兜底的缓存后端
+
+    - Redis可用时读写Redis，写入同时保存一份到进程内存储，切换后仍有热数据
+    - Redis连接失败或操作出错时立即改用进程内存储，并启动后台任务定时重连
+    - 锁只在当前使用的后端上获取：Redis不可用时退化为进程内互斥
+    """
+
+    name = "failover"
+
+    def __init__(self, primary: RedisCacheBackend, fallback: MemoryCacheBackend, reconnect_seconds: int = 30):
+        self.primary = primary
+        self.fallback = fallback
+        self.reconnect_seconds = reconnect_seconds
+        self.primary_available = False
+        self.last_error: Optional[str] = None
+        self.stats: Dict[str, Counter] = {primary.name: Counter(), fallback.name: Counter()}
+        self._reconnect_task: Optional[asyncio.Task] = None
+        self._connect_lock = asyncio.Lock()
+
+    @property
+    def active(self) -> CacheBackend:
+        """当前使用的后端"""
+        return self.primary if self.primary_available else self.fallback
+
+    async def connect(self) -> bool:
+        """连接Redis；失败时使用进程内存储并在后台重连，不抛出异常"""
+        async with self._connect_lock:
+            self.fallback.start()
+            if self.primary_available:
+                return True
+            try:
+                await self.primary.connect()
+                self.primary_available = True
+                self.last_error = None
+                logger.info("Redis连接成功，AI分析缓存使用Redis")
+            except Exception as e:
+                self._mark_unavailable(e)
+            return self.primary_available
+
+    def _mark_unavailable(self, error: Exception):
+        if self.primary_available or self.last_error is None:
+            logger.error(f"Redis不可用，AI分析缓存切换到进程内存储: {error}")
+        self.primary_available = False
+        self.last_error = str(error)
+        self.stats[self.primary.name]["errors"] += 1
+        if self._reconnect_task is None or self._reconnect_task.done():
+            self._reconnect_task = asyncio.create_task(self._reconnect_loop())
+
+    async def _reconnect_loop(self):
+        while not self.primary_available:
+            await asyncio.sleep(self.reconnect_seconds)
+            try:
+                await self.primary.connect()
+                self.primary_available = True
+                self.last_error = None
+                self.stats[self.primary.name]["reconnects"] += 1
+                logger.info("Redis已恢复，AI分析缓存切回Redis")
+            except Exception as e:
+                self.last_error = str(e)
+                logger.debug(f"Redis重连失败: {e}")
+
+    async def _call(self, method: str, *args):
+        """在当前后端上执行操作；Redis出错时切换到进程内存储重试一次"""
+        if self.primary_available:
+            try:
+                return self.primary, await getattr(self.primary, method)(*args)
+            except Exception as e:
+                self._mark_unavailable(e)
+        return self.fallback, await getattr(self.fallback, method)(*args)
+
+    def _count_reads(self, backend: CacheBackend, values: List[Optional[bytes]]):
+        hits = sum(1 for value in values if value)
+        self.stats[backend.name]["hits"] += hits
+        self.stats[backend.name]["misses"] += len(values) - hits
+
+    async def get(self, key: str) -> Optional[bytes]:
+        backend, value = await self._call("get", key)
+        self._count_reads(backend, [value])
+        return value
+
+    async def mget(self, keys: List[str]) -> List[Optional[bytes]]:
+        backend, values = await self._call("mget", keys)
+        self._count_reads(backend, values)
+        return values
+
+    async def set(self, key: str, value: bytes, ttl: int) -> bool:
+        backend, result = await self._call("set", key, value, ttl)
+        self.stats[backend.name]["sets"] += 1
+        if backend is not self.fallback:
+            await self.fallback.set(key, value, ttl)
+        return result
+
+    async def set_if_absent(self, key: str, value: bytes, ttl: int) -> bool:
+        return (await self._call("set_if_absent", key, value, ttl))[1]
+
+    async def delete(self, *keys: str) -> int:
+        # 两个后端都删除，避免Redis故障时读到已清除的旧数据
+        local_deleted = await self.fallback.delete(*keys)
+        backend, deleted = await self._call("delete", *keys)
+        return deleted if backend is not self.fallback else local_deleted
+
+    async def delete_if_equals(self, key: str, value: bytes) -> bool:
+        return (await self._call("delete_if_equals", key, value))[1]
+
+    async def exists(self, key: str) -> bool:
+        return (await self._call("exists", key))[1]
+
+    async def ttls(self, keys: List[str]) -> List[int]:
+        return (await self._call("ttls", keys))[1]
+
+    async def scan_keys(self, prefix: str) -> List[str]:
+        return (await self._call("scan_keys", prefix))[1]
+
+    async def ping(self) -> bool:
+        return (await self._call("ping"))[1]
+
+    def hit_rates(self) -> Dict[str, Dict[str, Any]]:
+        """按后端统计的命中率"""
+        rates = {}
+        for name, counter in self.stats.items():
+            reads = counter["hits"] + counter["misses"]
+            rates[name] = {
+                **counter,
+                "hit_rate": round(counter["hits"] / reads, 4) if reads else None
+            }
+        return rates
+
+    async def info(self) -> Dict[str, Any]:
+        active = self.active
+        try:
+            active_info = await active.info()
+        except Exception as e:
+            self._mark_unavailable(e)
+            active = self.fallback
+            active_info = await active.info()
+        return {
+            **active_info,
+            "backend": active.name,
+            "redis_available": self.primary_available,
+            "last_redis_error": self.last_error,
+            "memory": await self.fallback.info(),
+            "stats": self.hit_rates()
+        }
+
+    async def close(self):
+        if self._reconnect_task is not None:
+            self._reconnect_task.cancel()
+            try:
+                await self._reconnect_task
+            except asyncio.CancelledError:
+                pass
+            self._reconnect_task = None
+        await self.primary.close()
+        await self.fallback.close()
+        self.primary_available = False
@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+"""
+AI分析缓存编解码
+AI Analysis Cache Codec
+
+缓存条目格式（二进制）:
+    MAGIC(3字节 b"\\x89AC") + 格式(1字节) + 标志(1字节) + 数据
+- 格式 1: 紧凑JSON（UTF-8，无多余空格）
+- 格式 2: MessagePack（安装了 msgpack 时默认使用）
+- 标志位 0x01: 数据经过 zlib 压缩（超过 COMPRESS_MIN_BYTES 才压缩）
+不以 MAGIC 开头的条目按旧版 json.dumps 文本解析，升级前写入的缓存仍可读取。
+"""
+import json
+import zlib
+from typing import Any, Dict, Union
+
+try:
+    import msgpack
+    MSGPACK_AVAILABLE = True
+except ImportError:
+    MSGPACK_AVAILABLE = False
+
+MAGIC = b"\x89AC"
+FORMAT_JSON = 1
+FORMAT_MSGPACK = 2
+FLAG_ZLIB = 0x01
+
+# 小于该字节数的条目不压缩
+COMPRESS_MIN_BYTES = 256
+ZLIB_LEVEL = 6
+
+FORMAT_NAMES = {FORMAT_JSON: "json", FORMAT_MSGPACK: "msgpack"}
+
+
+class CacheCodecError(ValueError):
+    """缓存条目无法解码"""
+
+
+def _serialize(data: Dict[str, Any], fmt: int) -> bytes:
+    if fmt == FORMAT_MSGPACK:
+        return msgpack.packb(data, use_bin_type=True, default=str)
+    return json.dumps(data, ensure_ascii=False, separators=(",", ":"), default=str).encode("utf-8")
+
+
+def _deserialize(body: bytes, fmt: int) -> Dict[str, Any]:
+    if fmt == FORMAT_MSGPACK:
+        if not MSGPACK_AVAILABLE:
+            raise CacheCodecError("缓存条目为msgpack格式，但未安装msgpack")
+        return msgpack.unpackb(body, raw=False, strict_map_key=False)
+    if fmt == FORMAT_JSON:
+        return json.loads(body.decode("utf-8"))
+    raise CacheCodecError(f"未知的缓存格式版本: {fmt}")
+
+
+class CacheCodec:
+    """缓存条目编解码器"""
+
+    def __init__(self, fmt: int = None, compress: bool = True):
+        if fmt is None:
+            fmt = FORMAT_MSGPACK if MSGPACK_AVAILABLE else FORMAT_JSON
+        if fmt == FORMAT_MSGPACK and not MSGPACK_AVAILABLE:
+            raise CacheCodecError("未安装msgpack，无法使用msgpack格式")
+        self.format = fmt
+        self.compress = compress
+
+    @property
+    def name(self) -> str:
+        return FORMAT_NAMES[self.format] + ("+zlib" if self.compress else "")
+
+    def encode(self, data: Dict[str, Any]) -> bytes:
+        """编码缓存条目"""
+        body = _serialize(data, self.format)
+        flags = 0
+        if self.compress and len(body) >= COMPRESS_MIN_BYTES:
+            body = zlib.compress(body, ZLIB_LEVEL)
+            flags |= FLAG_ZLIB
+        return MAGIC + bytes((self.format, flags)) + body
+
+    @staticmethod
+    def decode(raw: Union[bytes, str]) -> Dict[str, Any]:
+        """解码缓存条目，兼容旧版JSON文本"""
+        if isinstance(raw, str):
+            return json.loads(raw)
+        if not raw.startswith(MAGIC):
+            # 旧版条目: json.dumps(data, ensure_ascii=False)
+            return json.loads(raw.decode("utf-8"))
+        if len(raw) < len(MAGIC) + 2:
+            raise CacheCodecError("缓存条目头部不完整")
+        fmt, flags = raw[len(MAGIC)], raw[len(MAGIC) + 1]
+        body = raw[len(MAGIC) + 2:]
+        if flags & FLAG_ZLIB:
+            try:
+                body = zlib.decompress(body)
+            except zlib.error as e:
+                raise CacheCodecError(f"缓存条目解压失败: {e}")
+        return _deserialize(body, fmt)
+
+
+# 默认编解码器
+default_codec = CacheCodec()
@@ -3,40 +3,87 @@
 缓存管理服务
 Cache Management Service
 """
-import json
+import asyncio
 import logging
-import redis.asyncio as redis
-from typing import Optional, Dict, Any
+import math
+import random
+import time
+import uuid
+from typing import Optional, Dict, Any, List, Callable, Awaitable
 from datetime import datetime, timedelta
 
+from .cache_backends import CacheBackend, FailoverCacheBackend, MemoryCacheBackend, RedisCacheBackend
+from .cache_codec import CacheCodec, default_codec
+
+try:
+    from config import Config
+    REDIS_URL = Config.REDIS_URL
+    MEMORY_MAX_ENTRIES = Config.ANALYSIS_CACHE_MEMORY_MAX_ENTRIES
+    PERSIST_PATH = Config.ANALYSIS_CACHE_PERSIST_PATH
+    PERSIST_SECONDS = Config.ANALYSIS_CACHE_PERSIST_SECONDS
+    RECONNECT_SECONDS = Config.ANALYSIS_CACHE_RECONNECT_SECONDS
+except (ImportError, AttributeError):
+    REDIS_URL = "redis://localhost:6379"
+    MEMORY_MAX_ENTRIES = 2000
+    PERSIST_PATH = ""
+    PERSIST_SECONDS = 60
+    RECONNECT_SECONDS = 30
+
 logger = logging.getLogger(__name__)
 
+# 缓存后端出错时的锁标记：只依赖进程内单飞
+LOCAL_LOCK_TOKEN = "local"
+
 class AnalysisCache:
     """AI分析缓存管理器"""
     
-    def __init__(self, redis_url: str = "redis://localhost:6379"):
+    # 缓存类型
+    CACHE_TYPES = ("trading_signal", "comprehensive_eval")
+    # 批量接口单次最多股票数
+    MAX_BATCH_CODES = 500
+    
+    # 单飞锁与提前刷新设置
+    LOCK_TIMEOUT = 300  # 分布式锁过期时间（秒），需大于一次完整AI分析的耗时
+    LOCK_POLL_INTERVAL = 0.5  # 等待者轮询缓存的间隔（秒）
+    EARLY_REFRESH_BETA = 1.0  # 提前刷新系数，越大越早刷新
+    
+    def __init__(self, redis_url: str = REDIS_URL, codec: CacheCodec = default_codec,
+                 backend: Optional[CacheBackend] = None):
         self.redis_url = redis_url
-        self.redis_client = None
+        # 存储后端：默认Redis优先，Redis不可用时自动使用进程内LRU存储并在后台重连
+        self.backend = backend if backend is not None else FailoverCacheBackend(
+            RedisCacheBackend(redis_url),
+            MemoryCacheBackend(MEMORY_MAX_ENTRIES, PERSIST_PATH, PERSIST_SECONDS),
+            reconnect_seconds=RECONNECT_SECONDS
+        )
+        self._connected = False
+        # 缓存条目编解码器（压缩二进制格式，兼容读取旧版JSON）
+        self.codec = codec
         
         # 缓存TTL设置（秒）
         self.TRADING_SIGNAL_TTL = 1800  # 30分钟
         self.COMPREHENSIVE_EVAL_TTL = 86400  # 24小时
+        # 按输入内容复用AI结果的保留时间：覆盖周末和长假期间数据不变的情况
+        self.CONTENT_RESULT_TTL = 7 * 86400  # 7天
+        
+        # 进程内进行中的分析（单飞）和后台提前刷新任务
+        self._local_flights: Dict[str, asyncio.Future] = {}
+        self._background_refreshes: Dict[str, asyncio.Task] = {}
     
-    async def connect(self):
-        """建立Redis连接"""
-        try:
-            self.redis_client = redis.from_url(self.redis_url, decode_responses=True)
-            # 测试连接
-            await self.redis_client.ping()
-            logger.info("Redis连接成功")
-        except Exception as e:
-            logger.error(f"Redis连接失败: {e}")
-            raise
+    async def connect(self) -> bool:
+        """
+        连接缓存后端，返回Redis是否可用
+        Redis不可用时不抛出异常：缓存继续使用进程内存储，并在后台重连
+        """
+        self._connected = True
+        if isinstance(self.backend, FailoverCacheBackend):
+            return await self.backend.connect()
+        return await self.backend.ping()
     
     async def disconnect(self):
-        """断开Redis连接"""
-        if self.redis_client:
-            await self.redis_client.aclose()
+        """断开缓存后端（有持久化文件时写入磁盘）"""
+        await self.backend.close()
+        self._connected = False
     
     def _generate_cache_key(self, cache_type: str, stock_code: str) -> str:
         """生成缓存键"""
@@ -45,14 +92,14 @@ class AnalysisCache:
     async def get_trading_signal_cache(self, stock_code: str) -> Optional[Dict[str, Any]]:
         """获取技术面交易信号缓存"""
         try:
-            if not self.redis_client:
+            if not self._connected:
                 await self.connect()
             
             cache_key = self._generate_cache_key("trading_signal", stock_code)
-            cached_data = await self.redis_client.get(cache_key)
+            cached_data = await self.backend.get(cache_key)
             
             if cached_data:
-                data = json.loads(cached_data)
+                data = self.codec.decode(cached_data)
                 logger.info(f"技术面交易信号缓存命中: {stock_code}")
                 return data
             
@@ -64,7 +111,7 @@ class AnalysisCache:
     async def set_trading_signal_cache(self, stock_code: str, data: Dict[str, Any]) -> bool:
         """设置技术面交易信号缓存（30分钟TTL）"""
         try:
-            if not self.redis_client:
+            if not self._connected:
                 await self.connect()
             
             cache_key = self._generate_cache_key("trading_signal", stock_code)
@@ -74,11 +121,11 @@ class AnalysisCache:
             data['cache_created_at'] = datetime.now().isoformat()
             data['cache_expires_at'] = (datetime.now() + timedelta(seconds=self.TRADING_SIGNAL_TTL)).isoformat()
             
-            cached_data = json.dumps(data, ensure_ascii=False)
-            result = await self.redis_client.setex(
+            cached_data = self.codec.encode(data)
+            result = await self.backend.set(
                 cache_key, 
-                self.TRADING_SIGNAL_TTL, 
-                cached_data
+                cached_data,
+                self.TRADING_SIGNAL_TTL
             )
             
             if result:
@@ -92,14 +139,14 @@ class AnalysisCache:
     async def get_comprehensive_cache(self, stock_code: str) -> Optional[Dict[str, Any]]:
         """获取综合评估缓存"""
         try:
-            if not self.redis_client:
+            if not self._connected:
                 await self.connect()
             
             cache_key = self._generate_cache_key("comprehensive_eval", stock_code)
-            cached_data = await self.redis_client.get(cache_key)
+            cached_data = await self.backend.get(cache_key)
             
             if cached_data:
-                data = json.loads(cached_data)
+                data = self.codec.decode(cached_data)
                 logger.info(f"综合评估缓存命中: {stock_code}")
                 return data
             
@@ -111,7 +158,7 @@ class AnalysisCache:
     async def set_comprehensive_cache(self, stock_code: str, data: Dict[str, Any]) -> bool:
         """设置综合评估缓存（24小时TTL）"""
         try:
-            if not self.redis_client:
+            if not self._connected:
                 await self.connect()
             
             cache_key = self._generate_cache_key("comprehensive_eval", stock_code)
@@ -121,11 +168,11 @@ class AnalysisCache:
             data['cache_created_at'] = datetime.now().isoformat()
             data['cache_expires_at'] = (datetime.now() + timedelta(seconds=self.COMPREHENSIVE_EVAL_TTL)).isoformat()
             
-            cached_data = json.dumps(data, ensure_ascii=False)
-            result = await self.redis_client.setex(
+            cached_data = self.codec.encode(data)
+            result = await self.backend.set(
                 cache_key,
-                self.COMPREHENSIVE_EVAL_TTL,
-                cached_data
+                cached_data,
+                self.COMPREHENSIVE_EVAL_TTL
             )
             
             if result:
@@ -136,96 +183,315 @@ class AnalysisCache:
             logger.error(f"设置综合评估缓存失败 {stock_code}: {e}")
             return False
     
-    async def clear_cache(self, stock_code: str, cache_type: str = "all") -> bool:
-        """清除指定股票的缓存"""
+    def _cache_types(self, cache_type: str) -> List[str]:
+        """缓存类型参数展开为具体类型列表（"all" 表示全部）"""
+        if cache_type == "all":
+            return list(self.CACHE_TYPES)
+        return [cache_type] if cache_type in self.CACHE_TYPES else []
+    
+    @staticmethod
+    def _ttl_status(ttl: int) -> Dict[str, Any]:
+        """由TTL构建单个缓存的状态"""
+        status = {"exists": False, "ttl": -1, "expires_at": None}
+        if ttl > -2:  # -2表示键不存在
+            status["exists"] = ttl > -1
+            status["ttl"] = ttl
+            if ttl > 0:
+                status["expires_at"] = (datetime.now() + timedelta(seconds=ttl)).isoformat()
+        return status
+    
+    async def get_many(self, stock_codes: List[str], cache_type: str) -> Dict[str, Optional[Dict[str, Any]]]:
+        """批量获取缓存（一次MGET），未命中或无法解码的股票为None"""
         try:
-            if not self.redis_client:
+            if not self._connected:
                 await self.connect()
             
-            keys_to_delete = []
+            if cache_type not in self.CACHE_TYPES or not stock_codes:
+                return {}
             
-            if cache_type in ["all", "trading_signal"]:
-                keys_to_delete.append(self._generate_cache_key("trading_signal", stock_code))
+            keys = [self._generate_cache_key(cache_type, code) for code in stock_codes]
+            values = await self.backend.mget(keys)
             
-            if cache_type in ["all", "comprehensive_eval"]:
-                keys_to_delete.append(self._generate_cache_key("comprehensive_eval", stock_code))
+            results = {}
+            for stock_code, cached_data in zip(stock_codes, values):
+                try:
+                    results[stock_code] = self.codec.decode(cached_data) if cached_data else None
+                except Exception as e:
+                    logger.error(f"缓存解码失败 {cache_type}:{stock_code}: {e}")
+                    results[stock_code] = None
             
-            if keys_to_delete:
-                deleted_count = await self.redis_client.delete(*keys_to_delete)
-                logger.info(f"清除缓存成功: {stock_code}, 删除 {deleted_count} 个键")
-                return deleted_count > 0
+            logger.info(f"批量获取缓存 {cache_type}: {len(stock_codes)} 只, 命中 {sum(1 for v in results.values() if v)} 只")
+            return results
+        except Exception as e:
+            logger.error(f"批量获取缓存失败 {cache_type}: {e}")
+            return {}
+    
+    async def clear_cache_many(self, stock_codes: List[str], cache_type: str = "all") -> int:
+        """批量清除缓存（一次DELETE），返回删除的键数量"""
+        try:
+            if not self._connected:
+                await self.connect()
             
-            return True
+            keys_to_delete = [
+                self._generate_cache_key(type_name, code)
+                for code in stock_codes
+                for type_name in self._cache_types(cache_type)
+            ]
+            if not keys_to_delete:
+                return 0
+            
+            deleted_count = await self.backend.delete(*keys_to_delete)
+            logger.info(f"批量清除缓存成功: {len(stock_codes)} 只股票, 删除 {deleted_count} 个键")
+            return deleted_count
         except Exception as e:
-            logger.error(f"清除缓存失败 {stock_code}: {e}")
-            return False
+            logger.error(f"批量清除缓存失败: {e}")
+            return 0
     
-    async def get_cache_status(self, stock_code: str) -> Dict[str, Any]:
-        """获取指定股票的缓存状态"""
+    async def clear_cache(self, stock_code: str, cache_type: str = "all") -> bool:
+        """清除指定股票的缓存"""
+        if not self._cache_types(cache_type):
+            return True
+        return await self.clear_cache_many([stock_code], cache_type) > 0
+    
+    async def get_cache_status_many(self, stock_codes: List[str]) -> Dict[str, Any]:
+        """批量获取缓存状态：所有TTL查询一次完成（Redis为一个pipeline）"""
         try:
-            if not self.redis_client:
+            if not self._connected:
                 await self.connect()
             
-            status = {
-                "stock_code": stock_code,
-                "trading_signal": {
-                    "exists": False,
-                    "ttl": -1,
-                    "expires_at": None
-                },
-                "comprehensive_eval": {
-                    "exists": False,
-                    "ttl": -1,
-                    "expires_at": None
+            ttls = iter(await self.backend.ttls([
+                self._generate_cache_key(type_name, stock_code)
+                for stock_code in stock_codes
+                for type_name in self.CACHE_TYPES
+            ]))
+            
+            return {
+                stock_code: {
+                    "stock_code": stock_code,
+                    **{type_name: self._ttl_status(next(ttls)) for type_name in self.CACHE_TYPES}
                 }
+                for stock_code in stock_codes
             }
-            
-            # 检查技术面交易信号缓存
-            trading_key = self._generate_cache_key("trading_signal", stock_code)
-            trading_ttl = await self.redis_client.ttl(trading_key)
-            if trading_ttl > -2:  # -2表示键不存在
-                status["trading_signal"]["exists"] = trading_ttl > -1
-                status["trading_signal"]["ttl"] = trading_ttl
-                if trading_ttl > 0:
-                    status["trading_signal"]["expires_at"] = (
-                        datetime.now() + timedelta(seconds=trading_ttl)
-                    ).isoformat()
-            
-            # 检查综合评估缓存
-            comprehensive_key = self._generate_cache_key("comprehensive_eval", stock_code)
-            comprehensive_ttl = await self.redis_client.ttl(comprehensive_key)
-            if comprehensive_ttl > -2:
-                status["comprehensive_eval"]["exists"] = comprehensive_ttl > -1
-                status["comprehensive_eval"]["ttl"] = comprehensive_ttl
-                if comprehensive_ttl > 0:
-                    status["comprehensive_eval"]["expires_at"] = (
-                        datetime.now() + timedelta(seconds=comprehensive_ttl)
-                    ).isoformat()
-            
-            return status
         except Exception as e:
-            logger.error(f"获取缓存状态失败 {stock_code}: {e}")
+            logger.error(f"批量获取缓存状态失败: {e}")
             return {"error": str(e)}
     
+    async def get_cache_status(self, stock_code: str) -> Dict[str, Any]:
+        """获取指定股票的缓存状态"""
+        statuses = await self.get_cache_status_many([stock_code])
+        return statuses.get(stock_code, statuses)
+    
+    # ---------- 单飞与提前刷新 ----------
+    
+    async def _get_entry(self, cache_type: str, stock_code: str) -> Optional[Dict[str, Any]]:
+        if cache_type == "trading_signal":
+            return await self.get_trading_signal_cache(stock_code)
+        return await self.get_comprehensive_cache(stock_code)
+    
+    async def _set_entry(self, cache_type: str, stock_code: str, data: Dict[str, Any]) -> bool:
+        if cache_type == "trading_signal":
+            return await self.set_trading_signal_cache(stock_code, data)
+        return await self.set_comprehensive_cache(stock_code, data)
+    
+    def _should_refresh_early(self, entry: Dict[str, Any]) -> bool:
+        """
+        概率提前刷新：剩余有效期越短、分析耗时越长，刷新概率越高
+        条件: -耗时 * beta * ln(rand) >= 剩余秒数
+        """
+        expires_at = entry.get("cache_expires_at")
+        compute_seconds = entry.get("compute_seconds")
+        if not expires_at or not compute_seconds:
+            return False
+        try:
+            remaining = (datetime.fromisoformat(expires_at) - datetime.now()).total_seconds()
+        except ValueError:
+            return False
+        return -compute_seconds * self.EARLY_REFRESH_BETA * math.log(random.random() or 1e-12) >= remaining
+    
+    async def _try_lock(self, lock_key: str) -> Optional[str]:
+        """尝试获取分布式锁，返回token；Redis不可用时返回本地锁标记"""
+        token = uuid.uuid4().hex
+        try:
+            if not self._connected:
+                await self.connect()
+            acquired = await self.backend.set_if_absent(lock_key, token.encode(), self.LOCK_TIMEOUT)
+            return token if acquired else None
+        except Exception as e:
+            logger.warning(f"分布式锁不可用，使用进程内单飞 {lock_key}: {e}")
+            return LOCAL_LOCK_TOKEN
+    
+    async def _release_lock(self, lock_key: str, token: str):
+        if token == LOCAL_LOCK_TOKEN:
+            return
+        try:
+            await self.backend.delete_if_equals(lock_key, token.encode())
+        except Exception as e:
+            logger.warning(f"释放分布式锁失败 {lock_key}: {e}")
+    
+    async def _lock_exists(self, lock_key: str) -> bool:
+        try:
+            return await self.backend.exists(lock_key)
+        except Exception:
+            return False
+    
+    async def _compute_and_store(self, cache_type: str, stock_code: str,
+                                 compute: Callable[[], Awaitable[Dict[str, Any]]]) -> Dict[str, Any]:
+        """执行分析并写入缓存，记录耗时供提前刷新使用"""
+        started = time.monotonic()
+        data = await compute()
+        data["compute_seconds"] = round(time.monotonic() - started, 2)
+        await self._set_entry(cache_type, stock_code, data)
+        return data
+    
+    async def _lead_or_wait(self, cache_type: str, stock_code: str,
+                            compute: Callable[[], Awaitable[Dict[str, Any]]]) -> Dict[str, Any]:
+        """分布式单飞：获得锁的请求执行分析，其他请求等待其写入的缓存结果"""
+        lock_key = self._generate_cache_key(f"lock:{cache_type}", stock_code)
+        waiting_since = datetime.now()
+        deadline = time.monotonic() + self.LOCK_TIMEOUT
+        while True:
+            token = await self._try_lock(lock_key)
+            if token:
+                try:
+                    return await self._compute_and_store(cache_type, stock_code, compute)
+                finally:
+                    await self._release_lock(lock_key, token)
+            
+            # 其他进程正在分析：等待新结果；锁释放后仍无结果（对方失败）则重新竞争
+            logger.info(f"等待其他进程的分析结果: {cache_type}:{stock_code}")
+            while True:
+                if time.monotonic() >= deadline:
+                    raise TimeoutError(f"等待 {cache_type}:{stock_code} 分析结果超时")
+                await asyncio.sleep(self.LOCK_POLL_INTERVAL)
+                entry = await self._get_entry(cache_type, stock_code)
+                if entry and datetime.fromisoformat(entry.get("cache_created_at", "1970-01-01")) >= waiting_since:
+                    return entry
+                if not await self._lock_exists(lock_key):
+                    break
+    
+    def _refresh_in_background(self, cache_type: str, stock_code: str,
+                               compute: Callable[[], Awaitable[Dict[str, Any]]]):
+        """后台提前刷新；已有进程在刷新（持有锁）时跳过"""
+        cache_key = self._generate_cache_key(cache_type, stock_code)
+        if cache_key in self._local_flights or cache_key in self._background_refreshes:
+            return
+        
+        async def run():
+            lock_key = self._generate_cache_key(f"lock:{cache_type}", stock_code)
+            try:
+                token = await self._try_lock(lock_key)
+                if not token:
+                    return
+                try:
+                    logger.info(f"提前刷新缓存: {cache_type}:{stock_code}")
+                    await self._compute_and_store(cache_type, stock_code, compute)
+                finally:
+                    await self._release_lock(lock_key, token)
+            except Exception as e:
+                logger.error(f"提前刷新缓存失败 {cache_type}:{stock_code}: {e}")
+            finally:
+                self._background_refreshes.pop(cache_key, None)
+        
+        self._background_refreshes[cache_key] = asyncio.create_task(run())
+    
+    async def get_or_compute(self, cache_type: str, stock_code: str,
+                             compute: Callable[[], Awaitable[Dict[str, Any]]],
+                             force_refresh: bool = False) -> Dict[str, Any]:
+        """
+        读取缓存，未命中时单飞执行分析
+        
+        - 命中: 直接返回；临近过期时按概率在后台提前刷新
+        - 未命中: 同一进程内的并发请求共享一次分析；跨进程通过Redis锁只让一个请求执行，
+          其他请求等待其写入缓存的结果。Redis不可用时退化为进程内单飞
+        - compute 抛出的异常会传给所有等待的请求
+        """
+        if not force_refresh:
+            entry = await self._get_entry(cache_type, stock_code)
+            if entry:
+                if self._should_refresh_early(entry):
+                    self._refresh_in_background(cache_type, stock_code, compute)
+                return entry
+        
+        cache_key = self._generate_cache_key(cache_type, stock_code)
+        flight = self._local_flights.get(cache_key)
+        if flight is not None:
+            return await asyncio.shield(flight)
+        
+        flight = asyncio.get_running_loop().create_future()
+        self._local_flights[cache_key] = flight
+        try:
+            result = await self._lead_or_wait(cache_type, stock_code, compute)
+            flight.set_result(result)
+            return result
+        except asyncio.CancelledError:
+            flight.cancel()
+            raise
+        except Exception as e:
+            flight.set_exception(e)
+            flight.exception()  # 没有等待者时避免 "exception was never retrieved" 警告
+            raise
+        finally:
+            self._local_flights.pop(cache_key, None)
+    
+    def _content_key(self, cache_type: str, stock_code: str, fingerprint: str) -> str:
+        return f"content:{cache_type}:{stock_code}:{fingerprint}"
+    
+    async def get_or_analyze_content(self, cache_type: str, stock_code: str, fingerprint: str,
+                                     analyze: Callable[[], Awaitable[Dict[str, Any]]],
+                                     force_refresh: bool = False) -> Dict[str, Any]:
+        """
+        按输入内容指纹复用AI结果
+        
+        输入数据与上次逐字节相同（收盘后、周末）时，即使分析缓存已过期也直接返回上次的模型输出，
+        不再调用模型。只保存成功的结果；返回结果中 content_reused 表示是否复用。
+        """
+        content_key = self._content_key(cache_type, stock_code, fingerprint)
+        if not force_refresh:
+            try:
+                if not self._connected:
+                    await self.connect()
+                cached_data = await self.backend.get(content_key)
+                if cached_data:
+                    result = self.codec.decode(cached_data)
+                    result["content_reused"] = True
+                    logger.info(f"输入数据未变化，复用AI分析结果: {cache_type}:{stock_code}")
+                    return result
+            except Exception as e:
+                logger.warning(f"读取内容缓存失败 {cache_type}:{stock_code}: {e}")
+        
+        result = await analyze()
+        if result.get("success"):
+            try:
+                if not self._connected:
+                    await self.connect()
+                await self.backend.set(content_key, self.codec.encode(result), self.CONTENT_RESULT_TTL)
+            except Exception as e:
+                logger.warning(f"写入内容缓存失败 {cache_type}:{stock_code}: {e}")
+        result["content_reused"] = False
+        return result
+    
     async def health_check(self) -> Dict[str, Any]:
         """缓存健康检查"""
         try:
-            if not self.redis_client:
+            if not self._connected:
                 await self.connect()
             
             # 执行ping测试
-            ping_result = await self.redis_client.ping()
+            ping_result = await self.backend.ping()
+            
+            # 获取后端信息（Redis版本、内存，进程内存储条目数，各后端命中率）
+            info = await self.backend.info()
             
-            # 获取Redis信息
-            info = await self.redis_client.info()
+            # Redis不可用、使用进程内存储时为 degraded
+            status = "healthy" if ping_result else "unhealthy"
+            if ping_result and isinstance(self.backend, FailoverCacheBackend) and not self.backend.primary_available:
+                status = "degraded"
             
             return {
-                "status": "healthy" if ping_result else "unhealthy",
+                "status": status,
                 "ping": ping_result,
-                "redis_version": info.get("redis_version", "unknown"),
-                "connected_clients": info.get("connected_clients", 0),
-                "used_memory": info.get("used_memory_human", "unknown"),
-                "total_connections_received": info.get("total_connections_received", 0),
+                **info,
+                "codec": self.codec.name,
                 "timestamp": datetime.now().isoformat()
             }
         except Exception as e:
@@ -5,20 +5,132 @@ Data Aggregation Service
 """
 import asyncio
 import aiohttp
+import contextlib
 import logging
-from typing import Dict, Any, List, Optional
+import time
+from contextvars import ContextVar
+from typing import Dict, Any, Iterator, List, NamedTuple, Optional, Callable, Awaitable, Tuple
 from datetime import datetime
 import json
 
+from fastapi import HTTPException
+from fastapi.encoders import jsonable_encoder
+
+from .prompt_encoder import PromptDataEncoder
+
 logger = logging.getLogger(__name__)
 
+# 每次请求都会变化的字段（生成时间、缓存信息等），计算输入指纹时剔除
+VOLATILE_FIELDS = {"update_time", "timestamp", "response_time", "collected_at", "cache_time", "cache_info"}
+
+
+def _strip_volatile_fields(value: Any) -> Any:
+    """递归剔除易变字段"""
+    if isinstance(value, dict):
+        return {k: _strip_volatile_fields(v) for k, v in value.items() if k not in VOLATILE_FIELDS}
+    if isinstance(value, list):
+        return [_strip_volatile_fields(item) for item in value]
+    return value
+
+
+class DataSection(NamedTuple):
+    """聚合的一个数据段：对应一个接口"""
+    name: str
+    path: str  # 接口路径，{code} 为股票代码
+    description: str
+    priority: int = 1  # 越小越先发起；0 为关键数据段
+    timeout: float = 10.0  # 单个数据段的截止时间（秒）
+
+
+def _elapsed_ms(since: float) -> float:
+    return round((time.perf_counter() - since) * 1000, 2)
+
+
+class BatchScope:
+    """一次批量分析的共享状态：批次内收集一次的共享数据段、数据收集并发名额"""
+    
+    def __init__(self, shared_sections: Dict[str, Dict[str, Any]], max_concurrent_collections: int):
+        # 股票代码 -> {数据段名称: 数据}
+        self.shared_sections = shared_sections
+        self.collect_slots = asyncio.Semaphore(max(1, max_concurrent_collections))
+
+
+# 由 StockDataAggregator.batch_scope() 设置，批量分析中创建的任务继承同一个 BatchScope
+_batch_scope: ContextVar[Optional[BatchScope]] = ContextVar("aggregator_batch_scope", default=None)
+
 class StockDataAggregator:
-    """股票数据聚合器 - 整合现有的8个API接口"""
+    """
+    股票数据聚合器 - 整合现有的8个API接口
+    
+    两种收集方式：
+    - 进程内（local）：与接口服务运行在同一进程时，直接调用注册的接口处理函数，
+      一次聚合共享同一个抓取上下文（相同的akshare调用只执行一次），没有HTTP往返
+    - HTTP（http）：独立部署时通过 base_url 调用远端接口
+    调用 use_local_sources() 注册处理函数后自动使用进程内方式。
+    """
+    
+    # 技术面分析所需接口
+    TECHNICAL_ENDPOINTS = [
+        DataSection("live_quote", "/stocks/{code}/live/quote", "实时报价", priority=0),
+        DataSection("technical_analysis", "/stocks/{code}/analysis/technical", "技术分析", priority=0),
+        DataSection("historical_prices", "/stocks/{code}/historical/prices?days=30", "30天K线数据"),
+    ]
+    
+    # 综合评估所需接口：核心数据和技术面优先，公告、龙虎榜等消息面最后
+    COMPREHENSIVE_ENDPOINTS = [
+        DataSection("core_data", "/stocks/{code}", "统一核心数据", priority=0),
+        DataSection("technical_analysis", "/stocks/{code}/analysis/technical", "技术面分析", priority=0),
+        DataSection("fundamental_analysis", "/stocks/{code}/analysis/fundamental", "基本面分析"),
+        DataSection("historical_prices", "/stocks/{code}/historical/prices", "历史价格"),
+        DataSection("money_flow", "/stocks/{code}/live/flow", "资金流向"),
+        DataSection("financial_history", "/stocks/{code}/historical/financial", "历史财务数据", priority=2),
+        DataSection("announcements", "/stocks/{code}/news/announcements", "公司公告", priority=2, timeout=8.0),
+        DataSection("dragon_tiger", "/stocks/{code}/news/dragon-tiger", "龙虎榜数据", priority=2, timeout=8.0),
+    ]
     
     def __init__(self, base_url: str = "http://35.77.54.203:3003"):
         self.base_url = base_url
         self.timeout = 10  # 减少超时时间到10秒
         self.max_concurrent = 3  # 限制并发请求数量
+        self.total_budget = 20.0  # 一次聚合的总时间预算（秒），用尽后返回已完成的部分结果
+        # 进程内数据源：名称 -> async (stock_code) -> 接口响应
+        self.local_sources: Dict[str, Callable[[str], Awaitable[Any]]] = {}
+        self.local_context_factory: Optional[Callable[[], Any]] = None
+        # 提示词数据编码器：按各数据段token预算输出紧凑表格文本
+        self.prompt_encoder = PromptDataEncoder()
+    
+    @property
+    def mode(self) -> str:
+        """当前收集方式：local 或 http"""
+        return "local" if self.local_sources else "http"
+    
+    def use_local_sources(self, sources: Dict[str, Callable[[str], Awaitable[Any]]],
+                          context_factory: Optional[Callable[[], Any]] = None):
+        """
+        注册进程内数据源，之后的数据收集直接调用处理函数
+        
+        Args:
+            sources: 接口名称 -> 接收股票代码的异步处理函数，需覆盖全部接口名称
+            context_factory: 每次聚合开启的请求级上下文（如 fetch_context），所有数据源在其中执行
+        """
+        self.local_sources = dict(sources)
+        self.local_context_factory = context_factory
+        logger.info(f"数据聚合使用进程内数据源: {sorted(self.local_sources)}")
+    
+    @contextlib.contextmanager
+    def batch_scope(self, shared_sections: Dict[str, Dict[str, Any]],
+                    max_concurrent_collections: int) -> Iterator[BatchScope]:
+        """
+        批量分析范围：其中创建的任务收集数据时
+        - 最多 max_concurrent_collections 只股票同时收集，其余排队
+        - 聚合结果附加该股票在 shared_sections 中的共享数据段（如市场概况、行业统计）
+        """
+        scope = BatchScope(shared_sections, max_concurrent_collections)
+        token = _batch_scope.set(scope)
+        try:
+            yield scope
+        finally:
+            _batch_scope.reset(token)
     
     async def _make_request(self, session: aiohttp.ClientSession, url: str, endpoint_name: str) -> Dict[str, Any]:
         """发起HTTP请求"""
@@ -41,7 +153,165 @@ class StockDataAggregator:
             logger.error(error_msg)
             return {"success": False, "error": error_msg, "endpoint": endpoint_name}
     
-    async def collect_technical_data(self, stock_code: str) -> Dict[str, Any]:
+    async def _call_local(self, stock_code: str, endpoint_name: str) -> Dict[str, Any]:
+        """直接调用进程内处理函数，结果按接口响应的JSON形式返回"""
+        try:
+            data = jsonable_encoder(await self.local_sources[endpoint_name](stock_code))
+            logger.info(f"成功获取 {endpoint_name} 数据（进程内）")
+            return {"success": True, "data": data, "endpoint": endpoint_name}
+        except HTTPException as e:
+            error_msg = f"{endpoint_name} 接口返回错误状态码: {e.status_code}"
+            logger.warning(error_msg)
+            return {"success": False, "error": error_msg, "endpoint": endpoint_name}
+        except Exception as e:
+            error_msg = f"{endpoint_name} 数据获取失败: {str(e)}"
+            logger.error(error_msg)
+            return {"success": False, "error": error_msg, "endpoint": endpoint_name}
+    
+    async def _fan_out(self, sections: List[DataSection],
+                       fetch: Callable[[DataSection], Awaitable[Dict[str, Any]]],
+                       budget: float) -> Tuple[Dict[str, Dict[str, Any]], Dict[str, Dict[str, Any]]]:
+        """
+        按优先级并发获取各数据段
+        
+        - 最多 max_concurrent 个同时进行，一个完成立即开始下一个（不再整批等待最慢的）
+        - 按 priority 从小到大发起，关键数据段先拿到并发名额
+        - 单个数据段超过自己的 timeout 记为 timeout；总耗时超过 budget 时取消未完成的数据段
+        返回 (各数据段结果, 各数据段状态与耗时)
+        """
+        semaphore = asyncio.Semaphore(self.max_concurrent)
+        started = time.perf_counter()
+        report = {
+            section.name: {"priority": section.priority, "status": "skipped", "elapsed_ms": None}
+            for section in sections
+        }
+        
+        async def run(section: DataSection) -> Dict[str, Any]:
+            async with semaphore:
+                section_started = time.perf_counter()
+                report[section.name].update(status="running", started_at_ms=_elapsed_ms(started))
+                try:
+                    result = await asyncio.wait_for(fetch(section), section.timeout)
+                    report[section.name]["status"] = "ok" if result.get("success") else "error"
+                except asyncio.TimeoutError:
+                    result = {"success": False, "error": f"{section.name} 超过截止时间 {section.timeout}s",
+                              "endpoint": section.name}
+                    report[section.name]["status"] = "timeout"
+                report[section.name]["elapsed_ms"] = _elapsed_ms(section_started)
+                return result
+        
+        # 排序稳定：同一优先级内保持声明顺序
+        tasks = {
+            section.name: asyncio.create_task(run(section))
+            for section in sorted(sections, key=lambda section: section.priority)
+        }
+        done, pending = await asyncio.wait(tasks.values(), timeout=budget)
+        for task in pending:
+            task.cancel()
+        if pending:
+            await asyncio.gather(*pending, return_exceptions=True)
+            logger.warning(f"数据聚合超过总时间预算 {budget}s，{len(pending)} 个数据段未完成")
+        
+        results = {}
+        for section in sections:
+            task = tasks[section.name]
+            if task in done and not task.cancelled() and task.exception() is None:
+                results[section.name] = task.result()
+                continue
+            status = report[section.name]["status"]
+            if status == "running":
+                elapsed = round(_elapsed_ms(started) - report[section.name]["started_at_ms"], 2)
+                report[section.name].update(status="budget_exceeded", elapsed_ms=elapsed)
+            error = task.exception() if task in done and not task.cancelled() else None
+            if error is not None:
+                report[section.name]["status"] = "error"
+            results[section.name] = {
+                "success": False,
+                "error": str(error) if error else f"总时间预算 {budget}s 用尽，未完成",
+                "endpoint": section.name
+            }
+        return results, report
+    
+    async def _collect(self, stock_code: str, data_type: str, sections: List[DataSection],
+                       budget: Optional[float] = None) -> Dict[str, Any]:
+        """收集指定接口的数据并整理为聚合结果（超出时间预算时为部分结果）"""
+        scope = _batch_scope.get()
+        queued_ms = None
+        if scope is None:
+            started = time.perf_counter()
+            results, report, fetch_stats = await self._gather_sections(stock_code, sections, budget)
+        else:
+            # 批量分析：等待数据收集名额，名额只在收集期间占用，不包括模型调用
+            queued = time.perf_counter()
+            async with scope.collect_slots:
+                queued_ms = _elapsed_ms(queued)
+                started = time.perf_counter()
+                results, report, fetch_stats = await self._gather_sections(stock_code, sections, budget)
+        
+        # 整理数据（按声明顺序，与完成顺序无关）
+        aggregated_data = {
+            "stock_code": stock_code,
+            "data_type": data_type,
+            "collected_at": datetime.now().isoformat(),
+            "collection_mode": self.mode,
+            "data_sources": {},
+            "errors": [],
+            "success_count": 0,
+            "total_endpoints": len(sections)
+        }
+        
+        for section in sections:
+            result = results[section.name]
+            if result["success"]:
+                aggregated_data["data_sources"][section.name] = result["data"]
+                aggregated_data["success_count"] += 1
+            else:
+                aggregated_data["errors"].append(f"{section.name}: {result['error']}")
+        
+        # 数据完整性检查
+        aggregated_data["data_completeness"] = (
+            aggregated_data["success_count"] / aggregated_data["total_endpoints"]
+        )
+        aggregated_data["partial"] = any(item["status"] in ("budget_exceeded", "skipped") for item in report.values())
+        aggregated_data["sections"] = report
+        aggregated_data["collection_ms"] = _elapsed_ms(started)
+        if fetch_stats:
+            # 底层数据调用次数：calls 为实际执行，reused 为同一聚合内复用
+            aggregated_data["fetch_stats"] = fetch_stats
+        if scope is not None:
+            aggregated_data["queued_ms"] = queued_ms
+            shared = scope.shared_sections.get(stock_code)
+            if shared:
+                # 批次共享数据段不计入 success_count / total_endpoints
+                aggregated_data["data_sources"].update(shared)
+                aggregated_data["shared_sections"] = sorted(shared)
+        return aggregated_data
+    
+    async def _gather_sections(self, stock_code: str, sections: List[DataSection], budget: Optional[float]
+                               ) -> Tuple[Dict[str, Dict[str, Any]], Dict[str, Dict[str, Any]], Optional[Dict[str, Any]]]:
+        """获取各数据段，返回 (各数据段结果, 各数据段状态与耗时, 底层数据调用统计)"""
+        budget = budget or self.total_budget
+        fetch_stats = None
+        if self.mode == "local":
+            # 所有数据段在同一个请求级上下文中执行，重复的底层数据请求只执行一次
+            context = self.local_context_factory() if self.local_context_factory else contextlib.nullcontext()
+            with context as active:
+                results, report = await self._fan_out(
+                    sections, lambda section: self._call_local(stock_code, section.name), budget
+                )
+            fetch_stats = active.info() if hasattr(active, "info") else None
+        else:
+            async with aiohttp.ClientSession() as session:
+                results, report = await self._fan_out(
+                    sections,
+                    lambda section: self._make_request(
+                        session, self.base_url + section.path.format(code=stock_code), section.name
+                    ),
+                    budget
+                )
+        return results, report, fetch_stats
+    
+    async def collect_technical_data(self, stock_code: str, budget: Optional[float] = None) -> Dict[str, Any]:
         """
         收集技术面分析所需的数据
         
@@ -51,68 +321,9 @@ class StockDataAggregator:
         - GET /stocks/{code}/analysis/technical    # 技术分析
         """
         try:
-            async with aiohttp.ClientSession() as session:
-                # 定义要调用的API端点
-                endpoints = [
-                    {
-                        "name": "live_quote",
-                        "url": f"{self.base_url}/stocks/{stock_code}/live/quote",
-                        "description": "实时报价"
-                    },
-                    {
-                        "name": "historical_prices",
-                        "url": f"{self.base_url}/stocks/{stock_code}/historical/prices?days=30",
-                        "description": "30天K线数据"
-                    },
-                    {
-                        "name": "technical_analysis",
-                        "url": f"{self.base_url}/stocks/{stock_code}/analysis/technical",
-                        "description": "技术分析"
-                    }
-                ]
-                
-                # 分批并行发起请求，避免过多并发
-                results = []
-                for i in range(0, len(endpoints), self.max_concurrent):
-                    batch = endpoints[i:i + self.max_concurrent]
-                    tasks = [
-                        self._make_request(session, endpoint["url"], endpoint["name"])
-                        for endpoint in batch
-                    ]
-                    batch_results = await asyncio.gather(*tasks, return_exceptions=True)
-                    results.extend(batch_results)
-                
-                # 整理数据
-                aggregated_data = {
-                    "stock_code": stock_code,
-                    "data_type": "technical_analysis",
-                    "collected_at": datetime.now().isoformat(),
-                    "data_sources": {},
-                    "errors": [],
-                    "success_count": 0,
-                    "total_endpoints": len(endpoints)
-                }
-                
-                for i, result in enumerate(results):
-                    endpoint_name = endpoints[i]["name"]
-                    
-                    if isinstance(result, Exception):
-                        error_msg = f"{endpoint_name}: {str(result)}"
-                        aggregated_data["errors"].append(error_msg)
-                        logger.error(error_msg)
-                    elif result["success"]:
-                        aggregated_data["data_sources"][endpoint_name] = result["data"]
-                        aggregated_data["success_count"] += 1
-                    else:
-                        aggregated_data["errors"].append(f"{endpoint_name}: {result['error']}")
-                
-                # 数据完整性检查
-                aggregated_data["data_completeness"] = (
-                    aggregated_data["success_count"] / aggregated_data["total_endpoints"]
-                )
-                
-                logger.info(f"技术面数据收集完成: {stock_code}, 成功率: {aggregated_data['data_completeness']:.2%}")
-                return aggregated_data
+            aggregated_data = await self._collect(stock_code, "technical_analysis", self.TECHNICAL_ENDPOINTS, budget)
+            logger.info(f"技术面数据收集完成: {stock_code}, 成功率: {aggregated_data['data_completeness']:.2%}")
+            return aggregated_data
                 
         except Exception as e:
             logger.error(f"技术面数据聚合失败 {stock_code}: {e}")
@@ -124,7 +335,7 @@ class StockDataAggregator:
                 "collected_at": datetime.now().isoformat()
             }
     
-    async def collect_comprehensive_data(self, stock_code: str) -> Dict[str, Any]:
+    async def collect_comprehensive_data(self, stock_code: str, budget: Optional[float] = None) -> Dict[str, Any]:
         """
         收集综合评估所需的所有数据
         
@@ -139,93 +350,11 @@ class StockDataAggregator:
         - GET /stocks/{code}/live/flow            # 资金流向
         """
         try:
-            async with aiohttp.ClientSession() as session:
-                # 定义要调用的所有API端点
-                endpoints = [
-                    {
-                        "name": "core_data",
-                        "url": f"{self.base_url}/stocks/{stock_code}",
-                        "description": "统一核心数据"
-                    },
-                    {
-                        "name": "fundamental_analysis",
-                        "url": f"{self.base_url}/stocks/{stock_code}/analysis/fundamental",
-                        "description": "基本面分析"
-                    },
-                    {
-                        "name": "technical_analysis",
-                        "url": f"{self.base_url}/stocks/{stock_code}/analysis/technical",
-                        "description": "技术面分析"
-                    },
-                    {
-                        "name": "financial_history",
-                        "url": f"{self.base_url}/stocks/{stock_code}/historical/financial",
-                        "description": "历史财务数据"
-                    },
-                    {
-                        "name": "announcements",
-                        "url": f"{self.base_url}/stocks/{stock_code}/news/announcements",
-                        "description": "公司公告"
-                    },
-                    {
-                        "name": "dragon_tiger",
-                        "url": f"{self.base_url}/stocks/{stock_code}/news/dragon-tiger",
-                        "description": "龙虎榜数据"
-                    },
-                    {
-                        "name": "historical_prices",
-                        "url": f"{self.base_url}/stocks/{stock_code}/historical/prices",
-                        "description": "历史价格"
-                    },
-                    {
-                        "name": "money_flow",
-                        "url": f"{self.base_url}/stocks/{stock_code}/live/flow",
-                        "description": "资金流向"
-                    }
-                ]
-                
-                # 分批并行发起请求，避免过多并发
-                results = []
-                for i in range(0, len(endpoints), self.max_concurrent):
-                    batch = endpoints[i:i + self.max_concurrent]
-                    tasks = [
-                        self._make_request(session, endpoint["url"], endpoint["name"])
-                        for endpoint in batch
-                    ]
-                    batch_results = await asyncio.gather(*tasks, return_exceptions=True)
-                    results.extend(batch_results)
-                
-                # 整理数据
-                aggregated_data = {
-                    "stock_code": stock_code,
-                    "data_type": "comprehensive_evaluation",
-                    "collected_at": datetime.now().isoformat(),
-                    "data_sources": {},
-                    "errors": [],
-                    "success_count": 0,
-                    "total_endpoints": len(endpoints)
-                }
-                
-                for i, result in enumerate(results):
-                    endpoint_name = endpoints[i]["name"]
-                    
-                    if isinstance(result, Exception):
-                        error_msg = f"{endpoint_name}: {str(result)}"
-                        aggregated_data["errors"].append(error_msg)
-                        logger.error(error_msg)
-                    elif result["success"]:
-                        aggregated_data["data_sources"][endpoint_name] = result["data"]
-                        aggregated_data["success_count"] += 1
-                    else:
-                        aggregated_data["errors"].append(f"{endpoint_name}: {result['error']}")
-                
-                # 数据完整性检查
-                aggregated_data["data_completeness"] = (
-                    aggregated_data["success_count"] / aggregated_data["total_endpoints"]
-                )
-                
-                logger.info(f"综合数据收集完成: {stock_code}, 成功率: {aggregated_data['data_completeness']:.2%}")
-                return aggregated_data
+            aggregated_data = await self._collect(
+                stock_code, "comprehensive_evaluation", self.COMPREHENSIVE_ENDPOINTS, budget
+            )
+            logger.info(f"综合数据收集完成: {stock_code}, 成功率: {aggregated_data['data_completeness']:.2%}")
+            return aggregated_data
                 
         except Exception as e:
             logger.error(f"综合数据聚合失败 {stock_code}: {e}")
@@ -285,31 +414,64 @@ class StockDataAggregator:
         
         return trimmed_data
 
-    def format_data_for_ai(self, aggregated_data: Dict[str, Any]) -> str:
-        """将聚合数据格式化为AI分析可用的文本格式"""
+    def _section_priority(self, source_name: str) -> int:
+        for section in self.TECHNICAL_ENDPOINTS + self.COMPREHENSIVE_ENDPOINTS:
+            if section.name == source_name:
+                return section.priority
+        return 1
+    
+    def format_data_for_ai(self, aggregated_data: Dict[str, Any], normalize: bool = False,
+                           encoding: str = "compact") -> str:
+        """
+        将聚合数据格式化为AI分析可用的文本格式
+        
+        Args:
+            normalize: 为True时省略数据收集时间、剔除易变字段和批次共享数据段（市场概况每分钟都在变），
+                       行情和财务数据不变时输出逐字节相同，用于计算输入指纹；
+                       批量分析与单只股票分析的指纹因此一致
+            encoding: compact（默认）按token预算输出紧凑表格文本，数据段按优先级排列；
+                      json 为原来的 json.dumps(indent=2) 格式（每个列表保留8条）
+        """
         try:
             if not aggregated_data.get("data_sources"):
                 return "数据收集失败，无法进行分析。"
             
             formatted_sections = []
+            data_sources = aggregated_data["data_sources"]
+            if normalize and aggregated_data.get("shared_sections"):
+                shared = set(aggregated_data["shared_sections"])
+                data_sources = {name: data for name, data in data_sources.items() if name not in shared}
             
             # 数据概览
+            collected_at_line = "" if normalize else f"数据收集时间: {aggregated_data['collected_at']}\n"
             formatted_sections.append(f"""
 === 股票数据概览 ===
 股票代码: {aggregated_data['stock_code']}
 数据类型: {aggregated_data['data_type']}
-数据收集时间: {aggregated_data['collected_at']}
-数据完整性: {aggregated_data.get('data_completeness', 0):.2%}
+{collected_at_line}数据完整性: {aggregated_data.get('data_completeness', 0):.2%}
 """)
             
-            # 逐个处理数据源，并裁剪大数据集
-            for source_name, source_data in aggregated_data["data_sources"].items():
-                # 裁剪数据，只保留最新8条
-                trimmed_data = self._trim_large_datasets(source_data, max_items=8)
-                
-                formatted_sections.append(f"""
+            if encoding == "compact":
+                # 关键数据段在前，先占用总预算
+                sources = sorted(
+                    data_sources.items(), key=lambda item: self._section_priority(item[0])
+                )
+                if normalize:
+                    sources = [(name, _strip_volatile_fields(data)) for name, data in sources]
+                encoded, report = self.prompt_encoder.encode(sources, sort_keys=normalize)
+                formatted_sections.append(encoded)
+                logger.debug(f"提示词数据编码: {report}")
+            else:
+                # 逐个处理数据源，并裁剪大数据集
+                for source_name, source_data in data_sources.items():
+                    if normalize:
+                        source_data = _strip_volatile_fields(source_data)
+                    # 裁剪数据，只保留最新8条
+                    trimmed_data = self._trim_large_datasets(source_data, max_items=8)
+                    
+                    formatted_sections.append(f"""
 === {source_name.upper()} ===
-{json.dumps(trimmed_data, ensure_ascii=False, indent=2)}
+{json.dumps(trimmed_data, ensure_ascii=False, indent=2, sort_keys=normalize)}
 """)
             
             # 错误信息（如果有）
@@ -327,6 +489,14 @@ class StockDataAggregator:
     
     async def health_check(self) -> Dict[str, Any]:
         """数据聚合服务健康检查"""
+        if self.mode == "local":
+            return {
+                "service": "StockDataAggregator",
+                "status": "healthy",
+                "mode": "local",
+                "local_sources": sorted(self.local_sources),
+                "timestamp": datetime.now().isoformat()
+            }
         try:
             # 测试基础连接
             async with aiohttp.ClientSession() as session:
@@ -336,6 +506,7 @@ class StockDataAggregator:
                 return {
                     "service": "StockDataAggregator",
                     "status": "healthy" if result["success"] else "unhealthy",
+                    "mode": "http",
                     "base_url": self.base_url,
                     "timeout": self.timeout,
                     "timestamp": datetime.now().isoformat()
@@ -0,0 +1,358 @@
+# -*- coding: utf-8 -*-
+"""
+AI分析任务队列
+AI analysis job queue
+
+一次AI分析（数据聚合 + 模型调用）需要20~60秒，不适合在HTTP请求中同步等待。
+提交任务立即返回任务ID，进程内并发数有上限的worker池在后台执行分析：
+- 去重: 同一股票、同一类型已有排队或执行中的任务时，直接返回该任务
+- 查询: 按任务ID查询状态和结果，或长轮询等待任务完成
+- 持久化: 任务状态保存在AI分析缓存后端（Redis；不可用时为进程内存储，可配置持久化文件），
+  服务重启后未完成的任务重新排队执行
+- 多进程: 执行中的任务持有定时续期的租约，进程退出后租约过期，其他进程的定期恢复扫描会接手
+任务执行复用普通接口的分析流程（缓存、单飞、按输入内容复用结果），结果同样写入分析缓存。
+"""
+import asyncio
+import logging
+import time
+import uuid
+from collections import Counter
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+from fastapi import HTTPException
+
+from .analysis_stream import progress_listener
+from .cache_manager import AnalysisCache, analysis_cache
+
+try:
+    from config import Config
+    JOB_WORKERS = Config.ANALYSIS_JOB_WORKERS
+    JOB_MAX_PENDING = Config.ANALYSIS_JOB_MAX_PENDING
+    JOB_TIMEOUT = Config.ANALYSIS_JOB_TIMEOUT
+    JOB_RETENTION = Config.ANALYSIS_JOB_RETENTION
+except (ImportError, AttributeError):
+    JOB_WORKERS = 2
+    JOB_MAX_PENDING = 200
+    JOB_TIMEOUT = 300
+    JOB_RETENTION = 86400
+
+logger = logging.getLogger(__name__)
+
+# 任务状态
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_SUCCEEDED = "succeeded"
+JOB_FAILED = "failed"
+FINISHED_STATUSES = (JOB_SUCCEEDED, JOB_FAILED)
+
+# 任务执行函数：(股票代码, 是否强制刷新) -> 与普通接口相同的响应
+JobRunner = Callable[[str, bool], Awaitable[Dict[str, Any]]]
+
+
+class JobQueueFull(Exception):
+    """排队任务已达上限"""
+
+
+class _JobProgress:
+    """接收分析进度事件，记录到任务状态中"""
+
+    # 任务不会中途断开，模型调用使用流式接口，输出字数可实时查询
+    closed = False
+
+    def __init__(self, job: Dict[str, Any]):
+        self.job = job
+        self.dirty = False
+
+    def emit(self, event: str, data: Optional[Dict[str, Any]] = None):
+        data = data or {}
+        progress = self.job["progress"]
+        if event == "phase":
+            progress["phase"] = data.get("phase")
+            if "data_completeness" in data:
+                progress["data_completeness"] = data["data_completeness"]
+        elif event == "token":
+            progress["output_chars"] = progress.get("output_chars", 0) + len(data.get("text", ""))
+        elif event == "retry":
+            progress.update(output_chars=0, model_attempt=data.get("attempt"))
+        else:
+            return
+        progress["updated_at"] = datetime.now().isoformat()
+        self.dirty = True
+
+
+class AnalysisJobQueue:
+    """AI分析任务队列与worker池"""
+
+    KEY_PREFIX = "jobs"
+    LEASE_SECONDS = 30  # 执行租约有效期，worker每 1/3 有效期续期一次
+    RECOVER_SECONDS = 60  # 扫描无人执行的未完成任务的间隔
+    MAX_ATTEMPTS = 3  # 同一任务最多执行次数（进程反复在执行中退出时不再重试）
+    POLL_INTERVAL = 0.5  # 长轮询其他进程执行的任务时的检查间隔
+    MAX_WAIT_SECONDS = 60  # 长轮询最长等待时间
+
+    def __init__(self, cache: AnalysisCache, workers: int = JOB_WORKERS, max_pending: int = JOB_MAX_PENDING,
+                 job_timeout: int = JOB_TIMEOUT, retention: int = JOB_RETENTION):
+        self.cache = cache
+        self.workers = workers
+        self.max_pending = max_pending
+        self.job_timeout = job_timeout
+        self.retention = retention
+        self.runners: Dict[str, JobRunner] = {}
+        self.stats: Counter = Counter()
+        # 本进程的租约标记
+        self.worker_id = uuid.uuid4().hex
+        self._queue: Optional[asyncio.Queue] = None
+        self._queued: Set[str] = set()
+        self._running: Dict[str, Dict[str, Any]] = {}
+        self._done: Dict[str, asyncio.Event] = {}
+        self._worker_tasks: List[asyncio.Task] = []
+        self._recover_task: Optional[asyncio.Task] = None
+
+    def register(self, job_type: str, runner: JobRunner):
+        """注册任务类型及其执行函数"""
+        self.runners[job_type] = runner
+
+    @property
+    def started(self) -> bool:
+        return bool(self._worker_tasks)
+
+    # ---------- 存储 ----------
+
+    def _record_key(self, job_id: str) -> str:
+        return f"{self.KEY_PREFIX}:record:{job_id}"
+
+    def _active_key(self, job_type: str, stock_code: str) -> str:
+        return f"{self.KEY_PREFIX}:active:{job_type}:{stock_code}"
+
+    def _lease_key(self, job_id: str) -> str:
+        return f"{self.KEY_PREFIX}:lease:{job_id}"
+
+    async def _save(self, job: Dict[str, Any]):
+        await self.cache.backend.set(self._record_key(job["job_id"]), self.cache.codec.encode(job), self.retention)
+
+    async def _load(self, job_id: str) -> Optional[Dict[str, Any]]:
+        if job_id in self._running:
+            return self._running[job_id]
+        raw = await self.cache.backend.get(self._record_key(job_id))
+        return self.cache.codec.decode(raw) if raw else None
+
+    # ---------- 提交与查询 ----------
+
+    async def submit(self, job_type: str, stock_code: str, force_refresh: bool = False) -> Tuple[Dict[str, Any], bool]:
+        """
+        提交任务，返回 (任务, 是否新建)
+        同一股票、同一类型已有未完成的任务时返回该任务；排队已满时抛出 JobQueueFull
+        """
+        if job_type not in self.runners:
+            raise ValueError(f"未知的任务类型: {job_type}")
+        if not self.started:
+            raise RuntimeError("任务队列未启动")
+        active_key = self._active_key(job_type, stock_code)
+
+        for _ in range(3):
+            existing_id = await self.cache.backend.get(active_key)
+            if existing_id:
+                existing = await self._load(existing_id.decode())
+                if existing and existing["status"] not in FINISHED_STATUSES:
+                    self.stats["deduplicated"] += 1
+                    return dict(existing), False
+                # 任务已结束或记录已过期：清除残留的去重键
+                await self.cache.backend.delete_if_equals(active_key, existing_id)
+
+            if len(self._queued) + len(self._running) >= self.max_pending:
+                raise JobQueueFull(f"排队任务已达上限 {self.max_pending}")
+
+            job = {
+                "job_id": uuid.uuid4().hex,
+                "job_type": job_type,
+                "stock_code": stock_code,
+                "force_refresh": force_refresh,
+                "status": JOB_QUEUED,
+                "created_at": datetime.now().isoformat(),
+                "started_at": None,
+                "finished_at": None,
+                "attempts": 0,
+                "progress": {},
+                "result": None,
+                "error": None
+            }
+            # 先写任务记录再占用去重键，其他提交者读到去重键时一定能读到记录
+            await self._save(job)
+            if await self.cache.backend.set_if_absent(active_key, job["job_id"].encode(), self.retention):
+                self._enqueue(job["job_id"])
+                self.stats["submitted"] += 1
+                return dict(job), True
+            await self.cache.backend.delete(self._record_key(job["job_id"]))
+        raise RuntimeError(f"提交任务冲突，请重试: {job_type}:{stock_code}")
+
+    async def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """查询任务状态，不存在（或已超过保留时间）时返回None"""
+        job = await self._load(job_id)
+        return dict(job) if job else None
+
+    async def wait(self, job_id: str, timeout: float) -> Optional[Dict[str, Any]]:
+        """长轮询：等待任务完成或超时，返回任务的最新状态"""
+        deadline = time.monotonic() + min(max(timeout, 0), self.MAX_WAIT_SECONDS)
+        while True:
+            job = await self.get(job_id)
+            remaining = deadline - time.monotonic()
+            if job is None or job["status"] in FINISHED_STATUSES or remaining <= 0:
+                return job
+            if job_id in self._queued or job_id in self._running:
+                # 本进程执行的任务：完成时立即唤醒
+                event = self._done.setdefault(job_id, asyncio.Event())
+                try:
+                    await asyncio.wait_for(event.wait(), remaining)
+                except asyncio.TimeoutError:
+                    pass
+            else:
+                await asyncio.sleep(min(self.POLL_INTERVAL, remaining))
+
+    # ---------- 执行 ----------
+
+    def _enqueue(self, job_id: str):
+        self._queued.add(job_id)
+        self._queue.put_nowait(job_id)
+
+    async def _worker(self):
+        while True:
+            job_id = await self._queue.get()
+            self._queued.discard(job_id)
+            try:
+                await self._execute(job_id)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"执行分析任务出错 {job_id}: {e}")
+
+    async def _execute(self, job_id: str):
+        lease_key, token = self._lease_key(job_id), self.worker_id.encode()
+        leased = False
+        try:
+            leased = await self.cache.backend.set_if_absent(lease_key, token, self.LEASE_SECONDS)
+            if not leased:
+                return  # 其他进程正在执行，本进程的等待者改为轮询任务记录
+            job = await self._load(job_id)
+            if not job or job["status"] in FINISHED_STATUSES:
+                return
+            if job["attempts"] >= self.MAX_ATTEMPTS:
+                job.update(status=JOB_FAILED, finished_at=datetime.now().isoformat(),
+                           error={"status_code": 500, "detail": f"任务已执行 {job['attempts']} 次仍未完成"})
+            else:
+                await self._run(job, lease_key, token)
+            await self._save(job)
+            await self.cache.backend.delete_if_equals(
+                self._active_key(job["job_type"], job["stock_code"]), job_id.encode()
+            )
+            self.stats[job["status"]] += 1
+        finally:
+            # 被取消（服务关闭）时任务保持 running 状态，租约释放后由恢复扫描重新执行
+            self._running.pop(job_id, None)
+            if leased:
+                await self.cache.backend.delete_if_equals(lease_key, token)
+            event = self._done.pop(job_id, None)
+            if event:
+                event.set()
+
+    async def _run(self, job: Dict[str, Any], lease_key: str, token: bytes):
+        job.update(status=JOB_RUNNING, started_at=datetime.now().isoformat(),
+                   attempts=job["attempts"] + 1, progress={})
+        self._running[job["job_id"]] = job
+        await self._save(job)
+        logger.info(f"开始执行分析任务 {job['job_id']}: {job['job_type']}:{job['stock_code']}")
+
+        progress = _JobProgress(job)
+        heartbeat = asyncio.create_task(self._heartbeat(job, progress, lease_key, token))
+        started = time.monotonic()
+        try:
+            with progress_listener(progress):
+                result = await asyncio.wait_for(
+                    self.runners[job["job_type"]](job["stock_code"], job["force_refresh"]), self.job_timeout
+                )
+            job.update(status=JOB_SUCCEEDED, result=result)
+        except HTTPException as e:
+            job.update(status=JOB_FAILED, error={"status_code": e.status_code, "detail": e.detail})
+        except asyncio.TimeoutError:
+            job.update(status=JOB_FAILED, error={"status_code": 504, "detail": f"任务执行超过 {self.job_timeout} 秒"})
+        except Exception as e:
+            logger.error(f"分析任务失败 {job['job_id']}: {e}")
+            job.update(status=JOB_FAILED, error={"status_code": 500, "detail": str(e)})
+        finally:
+            heartbeat.cancel()
+        job.update(finished_at=datetime.now().isoformat(), elapsed_seconds=round(time.monotonic() - started, 2))
+
+    async def _heartbeat(self, job: Dict[str, Any], progress: _JobProgress, lease_key: str, token: bytes):
+        """续期租约，并保存进度供其他进程查询"""
+        while True:
+            await asyncio.sleep(self.LEASE_SECONDS / 3)
+            try:
+                await self.cache.backend.set(lease_key, token, self.LEASE_SECONDS)
+                if progress.dirty:
+                    progress.dirty = False
+                    await self._save(job)
+            except Exception as e:
+                logger.warning(f"任务租约续期失败 {job['job_id']}: {e}")
+
+    async def recover(self) -> int:
+        """重新排队未完成且无人执行（租约已过期）的任务，返回数量"""
+        recovered = 0
+        for key in await self.cache.backend.scan_keys(f"{self.KEY_PREFIX}:record:"):
+            job_id = key.rsplit(":", 1)[-1]
+            if job_id in self._queued or job_id in self._running:
+                continue
+            job = await self._load(job_id)
+            if not job or job["status"] in FINISHED_STATUSES:
+                continue
+            if await self.cache.backend.exists(self._lease_key(job_id)):
+                continue
+            self._enqueue(job_id)
+            recovered += 1
+        if recovered:
+            self.stats["recovered"] += recovered
+            logger.info(f"恢复未完成的分析任务: {recovered} 个")
+        return recovered
+
+    async def _recover_loop(self):
+        while True:
+            try:
+                await self.recover()
+            except Exception as e:
+                logger.warning(f"恢复分析任务失败: {e}")
+            await asyncio.sleep(self.RECOVER_SECONDS)
+
+    # ---------- 生命周期 ----------
+
+    async def start(self):
+        """启动worker池和恢复扫描（需在缓存连接之后调用）"""
+        if self.started:
+            return
+        self._queue = asyncio.Queue()
+        self._worker_tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        self._recover_task = asyncio.create_task(self._recover_loop())
+        logger.info(f"AI分析任务队列已启动: {self.workers} 个worker")
+
+    async def stop(self):
+        """停止worker；执行中的任务保持未完成状态，下次启动时恢复"""
+        tasks = self._worker_tasks + ([self._recover_task] if self._recover_task else [])
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._worker_tasks, self._recover_task = [], None
+        self._queued.clear()
+
+    def info(self) -> Dict[str, Any]:
+        """队列状态"""
+        return {
+            "started": self.started,
+            "workers": self.workers,
+            "queued": len(self._queued),
+            "running": len(self._running),
+            "max_pending": self.max_pending,
+            "job_types": sorted(self.runners),
+            "stats": dict(self.stats)
+        }
+
+
+# 全局任务队列实例
+analysis_job_queue = AnalysisJobQueue(analysis_cache)
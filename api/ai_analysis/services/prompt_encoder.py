@@ -0,0 +1,241 @@
+# -*- coding: utf-8 -*-
+"""
+提示词数据编码器
+Prompt Data Encoder
+
+把聚合数据编码为紧凑文本，替代 json.dumps(indent=2)：
+- 标量: key: value（嵌套字典用点号路径）
+- 记录列表（K线、财务指标表等）: 表格块，首行为 名称[行数]{列1,列2,...}，之后每行一条记录，逗号分隔
+- 各值均为字典的字典（如 quarterly_data）: 以键为首列 "key" 的表格块
+- 标量列表: 逗号连接
+每个数据段有token预算，超出时依次裁剪：表格保留最新的行和报告期列 → 省略最大的字段 → 截断。
+token数在本地估算（中日韩字符按1个token/字，其他字符按3个字符/token），不调用分词接口。
+"""
+import logging
+import math
+import re
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# 各数据段的token预算，未列出的使用 DEFAULT_SECTION_BUDGET
+SECTION_TOKEN_BUDGETS = {
+    "core_data": 1500,
+    "technical_analysis": 1500,
+    "live_quote": 400,
+    "historical_prices": 1200,
+    "fundamental_analysis": 1200,
+    "financial_history": 1500,
+    "money_flow": 500,
+    "announcements": 800,
+    "dragon_tiger": 600,
+    "market_context": 400,  # 批量分析共享的市场概况和行业统计
+}
+DEFAULT_SECTION_BUDGET = 800
+# 所有数据段合计的token预算
+TOTAL_TOKEN_BUDGET = 8000
+
+# 裁剪表格时至少保留的行数和报告期列数
+MIN_TABLE_ROWS = 5
+MIN_PERIOD_COLUMNS = 4
+
+_CJK = re.compile(r"[\u2e80-\u9fff\uac00-\ud7af\uf900-\ufaff\uff00-\uffef]")
+# 报告期列名，如 20250630、2025-06-30、2025Q2
+_PERIOD_COLUMN = re.compile(r"^\d{4}(-?\d{2}-?\d{2}|Q[1-4])$")
+_DATE_COLUMN_HINTS = ("date", "日期", "报告期", "时间", "period", "上榜日")
+
+
+def estimate_tokens(text: str) -> int:
+    """本地估算token数（偏保守）"""
+    cjk = len(_CJK.findall(text))
+    return cjk + math.ceil((len(text) - cjk) / 3)
+
+
+def _format_value(value: Any) -> str:
+    if value is None:
+        return ""
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if isinstance(value, float):
+        if math.isnan(value) or math.isinf(value):
+            return ""
+        if abs(value) >= 1e4:
+            # 金额、成交量等大数的小数位对分析没有意义
+            return str(round(value))
+        return f"{value:.4f}".rstrip("0").rstrip(".")
+    text = str(value)
+    if any(char in text for char in ',"\n'):
+        return '"' + text.replace('"', '""').replace("\n", " ") + '"'
+    return text
+
+
+def _is_date_column(name: str) -> bool:
+    lowered = name.lower()
+    return any(hint in lowered for hint in _DATE_COLUMN_HINTS)
+
+
+@dataclass
+class _Table:
+    """表格块：可按行（保留最新）和报告期列（保留最新）裁剪"""
+    name: str
+    columns: List[str]
+    rows: List[List[Any]]
+    row_limit: int = 0
+    period_limit: int = 0
+    newest_first: bool = True
+    period_columns: List[str] = field(default_factory=list)
+
+    def __post_init__(self):
+        self.row_limit = len(self.rows)
+        self.period_columns = sorted((c for c in self.columns if _PERIOD_COLUMN.match(c)), reverse=True)
+        self.period_limit = len(self.period_columns)
+        # 判断行的时间顺序，裁剪时保留最新的行
+        date_column = next((i for i, c in enumerate(self.columns) if _is_date_column(c)), None)
+        if date_column is not None and len(self.rows) > 1:
+            first, last = self.rows[0][date_column], self.rows[-1][date_column]
+            self.newest_first = str(first) >= str(last)
+
+    def can_shrink(self) -> bool:
+        return self.row_limit > MIN_TABLE_ROWS or self.period_limit > MIN_PERIOD_COLUMNS
+
+    def shrink(self):
+        """报告期列多于行时先减列，否则减行，每次减半"""
+        if self.period_limit > MIN_PERIOD_COLUMNS and (
+                self.period_limit >= self.row_limit or self.row_limit <= MIN_TABLE_ROWS):
+            self.period_limit = max(MIN_PERIOD_COLUMNS, self.period_limit // 2)
+        else:
+            self.row_limit = max(MIN_TABLE_ROWS, self.row_limit // 2)
+
+    def render(self) -> List[str]:
+        kept_periods = set(self.period_columns[:self.period_limit])
+        column_indexes = [
+            i for i, c in enumerate(self.columns)
+            if not _PERIOD_COLUMN.match(c) or c in kept_periods
+        ]
+        rows = self.rows[:self.row_limit] if self.newest_first else self.rows[len(self.rows) - self.row_limit:]
+        header = f"{self.name}[{len(rows)}/{len(self.rows)}]" if len(rows) < len(self.rows) else f"{self.name}[{len(rows)}]"
+        lines = [header + "{" + ",".join(self.columns[i] for i in column_indexes) + "}"]
+        lines.extend(",".join(_format_value(row[i]) for i in column_indexes) for row in rows)
+        return lines
+
+
+@dataclass
+class _Block:
+    """数据段中的一个字段：标量行或表格"""
+    name: str
+    lines: List[str] = field(default_factory=list)
+    table: Optional[_Table] = None
+
+    def render(self) -> List[str]:
+        return self.table.render() if self.table else self.lines
+
+
+class PromptDataEncoder:
+    """按token预算把各数据段编码为紧凑文本"""
+
+    def __init__(self, section_budgets: Optional[Dict[str, int]] = None,
+                 default_budget: int = DEFAULT_SECTION_BUDGET, total_budget: int = TOTAL_TOKEN_BUDGET):
+        self.section_budgets = dict(SECTION_TOKEN_BUDGETS if section_budgets is None else section_budgets)
+        self.default_budget = default_budget
+        self.total_budget = total_budget
+
+    # ---------- 结构化为字段块 ----------
+
+    def _blocks(self, value: Any, prefix: str, sort_keys: bool) -> List[_Block]:
+        if isinstance(value, dict):
+            items = sorted(value.items()) if sort_keys else list(value.items())
+            if len(items) >= 2 and all(isinstance(v, dict) for _, v in items) and not any(
+                    isinstance(x, (dict, list)) for _, v in items for x in v.values()):
+                # 各值均为扁平字典：以键为首列的表格
+                columns = self._columns([v for _, v in items], sort_keys)
+                rows = [[k] + [v.get(c) for c in columns] for k, v in items]
+                return [_Block(prefix, table=_Table(prefix or "table", ["key"] + columns, rows))]
+            blocks, scalars = [], []
+            for key, item in items:
+                path = f"{prefix}.{key}" if prefix else str(key)
+                if isinstance(item, (dict, list)):
+                    blocks.extend(self._blocks(item, path, sort_keys))
+                else:
+                    scalars.append(f"{path}: {_format_value(item)}")
+            if scalars:
+                blocks.insert(0, _Block(prefix or "_", lines=scalars))
+            return blocks
+        if isinstance(value, list):
+            if not value:
+                return []
+            if all(isinstance(item, dict) for item in value):
+                columns = self._columns(value, sort_keys)
+                if not any(isinstance(item.get(c), (dict, list)) for item in value for c in columns):
+                    rows = [[item.get(c) for c in columns] for item in value]
+                    return [_Block(prefix, table=_Table(prefix or "table", columns, rows))]
+            if not any(isinstance(item, (dict, list)) for item in value):
+                return [_Block(prefix, lines=[f"{prefix}: " + ",".join(_format_value(item) for item in value)])]
+            blocks = []
+            for index, item in enumerate(value):
+                blocks.extend(self._blocks(item, f"{prefix}[{index}]", sort_keys))
+            return blocks
+        return [_Block(prefix, lines=[f"{prefix}: {_format_value(value)}"])]
+
+    @staticmethod
+    def _columns(records: List[Dict[str, Any]], sort_keys: bool) -> List[str]:
+        columns: Dict[str, None] = {}
+        for record in records:
+            for key in record:
+                columns.setdefault(str(key), None)
+        return sorted(columns) if sort_keys else list(columns)
+
+    # ---------- 按预算裁剪 ----------
+
+    @staticmethod
+    def _render(blocks: List[_Block], omitted: List[str]) -> str:
+        lines = [line for block in blocks for line in block.render()]
+        if omitted:
+            lines.append("(预算所限已省略: " + ",".join(omitted) + ")")
+        return "\n".join(lines)
+
+    def encode_section(self, data: Any, budget: int, sort_keys: bool = False) -> Tuple[str, Dict[str, Any]]:
+        """编码一个数据段，返回文本和裁剪统计"""
+        blocks = self._blocks(data, "", sort_keys)
+        omitted: List[str] = []
+        text = self._render(blocks, omitted)
+        full_tokens = tokens = estimate_tokens(text)
+        while tokens > budget:
+            tables = [b for b in blocks if b.table and b.table.can_shrink()]
+            if tables:
+                max(tables, key=lambda b: estimate_tokens("\n".join(b.render()))).table.shrink()
+            elif len(blocks) > 1:
+                # 表格已无法再裁剪：省略最大的字段（保留第一个标量块）
+                largest = max(blocks[1:], key=lambda b: estimate_tokens("\n".join(b.render())))
+                blocks.remove(largest)
+                omitted.append(largest.name)
+            else:
+                break
+            text = self._render(blocks, omitted)
+            tokens = estimate_tokens(text)
+        if tokens > budget:
+            # 仍超出：按比例截断
+            text = text[:max(int(len(text) * budget / tokens), 0)] + "\n(已截断)"
+            tokens = estimate_tokens(text)
+        return text, {"budget": budget, "tokens_full": full_tokens, "tokens": tokens, "omitted": omitted}
+
+    def encode(self, sections: List[Tuple[str, Any]], sort_keys: bool = False) -> Tuple[str, Dict[str, Any]]:
+        """
+        按给定顺序（优先级从高到低）编码各数据段
+
+        每段使用 min(段预算, 剩余总预算)；总预算用尽后的数据段只保留标题。
+        返回文本和各段统计。
+        """
+        remaining = self.total_budget
+        parts, report = [], {}
+        for name, data in sections:
+            budget = min(self.section_budgets.get(name, self.default_budget), remaining)
+            if budget <= 0:
+                parts.append(f"=== {name.upper()} ===\n(总预算已用尽，省略)")
+                report[name] = {"budget": 0, "tokens": 0, "omitted": ["*"]}
+                continue
+            text, stats = self.encode_section(data, budget, sort_keys)
+            remaining -= stats["tokens"]
+            parts.append(f"=== {name.upper()} ===\n{text}")
+            report[name] = stats
+        return "\n\n".join(parts), report
@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+"""
+模型调用的每分钟token预算
+Tokens-per-minute budget for model calls
+
+Anthropic 按每分钟输入token和输出token分别限流，超出时返回429。批量分析一次发起几十个模型调用，
+不加控制会集中触发限流并反复重试。调用模型前按预估的token数预占预算，预算不足时排队等待：
+- 输入token: 按提示词文本估算（prompt_encoder.estimate_tokens）
+- 输出token: 按 max_tokens 预占（与Anthropic在请求开始时的估算方式一致）
+- 调用结束后按响应中的实际用量结算，多占的部分退回，失败的调用全部退回
+预算按令牌桶方式连续恢复（每秒恢复 每分钟预算/60），等待的调用按先后顺序获得预算。
+"""
+import asyncio
+import logging
+import time
+from typing import Any, Callable, Dict, NamedTuple, Optional
+
+try:
+    from config import Config
+    INPUT_TOKENS_PER_MINUTE = Config.ANTHROPIC_INPUT_TOKENS_PER_MINUTE
+    OUTPUT_TOKENS_PER_MINUTE = Config.ANTHROPIC_OUTPUT_TOKENS_PER_MINUTE
+except (ImportError, AttributeError):
+    INPUT_TOKENS_PER_MINUTE = 80000
+    OUTPUT_TOKENS_PER_MINUTE = 16000
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """每分钟token预算的令牌桶，容量为一分钟的预算"""
+
+    def __init__(self, tokens_per_minute: int):
+        self.capacity = float(tokens_per_minute)
+        self.rate = tokens_per_minute / 60.0
+        self.tokens = self.capacity
+        self._updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def wait_seconds(self, amount: float) -> float:
+        """预算足够 amount 还需等待的秒数；超过容量的请求按容量计算，避免永远等待"""
+        self._refill()
+        deficit = min(amount, self.capacity) - self.tokens
+        return max(0.0, deficit / self.rate)
+
+    def take(self, amount: float):
+        self._refill()
+        self.tokens -= min(amount, self.capacity)
+
+    def give_back(self, amount: float):
+        """结算：amount 为正时退回，为负时补扣（可为负数，之后的调用相应等待）"""
+        self._refill()
+        self.tokens = min(self.capacity, self.tokens + amount)
+
+
+class TokenReservation(NamedTuple):
+    """一次模型调用预占的token数"""
+    input_tokens: int
+    output_tokens: int
+    waited_seconds: float
+
+
+class ModelRateLimiter:
+    """按每分钟输入/输出token预算调度模型调用"""
+
+    def __init__(self, input_tokens_per_minute: int = INPUT_TOKENS_PER_MINUTE,
+                 output_tokens_per_minute: int = OUTPUT_TOKENS_PER_MINUTE):
+        self.configure(input_tokens_per_minute, output_tokens_per_minute)
+        self.stats = {"calls": 0, "waited": 0, "wait_seconds": 0.0, "input_tokens": 0, "output_tokens": 0}
+
+    def configure(self, input_tokens_per_minute: int, output_tokens_per_minute: int):
+        """设置每分钟预算，0 表示不限制"""
+        self.input_tokens_per_minute = input_tokens_per_minute
+        self.output_tokens_per_minute = output_tokens_per_minute
+        self._input = TokenBucket(input_tokens_per_minute) if input_tokens_per_minute > 0 else None
+        self._output = TokenBucket(output_tokens_per_minute) if output_tokens_per_minute > 0 else None
+        # 排队等待时持有锁，先到的调用先获得预算，大请求不会被小请求一直插队
+        self._lock = asyncio.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self._input is not None or self._output is not None
+
+    def _wait_seconds(self, input_tokens: int, output_tokens: int) -> float:
+        return max(
+            self._input.wait_seconds(input_tokens) if self._input else 0.0,
+            self._output.wait_seconds(output_tokens) if self._output else 0.0
+        )
+
+    async def acquire(self, input_tokens: int, output_tokens: int,
+                      on_wait: Optional[Callable[[float], Any]] = None) -> TokenReservation:
+        """
+        预占一次模型调用的token，预算不足时等待
+
+        Args:
+            input_tokens: 预估输入token数
+            output_tokens: 预占的输出token数（通常为 max_tokens）
+            on_wait: 需要等待时调用一次，参数为预计等待秒数
+        """
+        self.stats["calls"] += 1
+        if not self.enabled:
+            return TokenReservation(input_tokens, output_tokens, 0.0)
+        started = time.monotonic()
+        async with self._lock:
+            notified = False
+            while True:
+                wait = self._wait_seconds(input_tokens, output_tokens)
+                if wait <= 0:
+                    break
+                if not notified:
+                    notified = True
+                    self.stats["waited"] += 1
+                    logger.info(f"模型调用等待token预算 {wait:.1f}s")
+                    if on_wait:
+                        on_wait(wait)
+                await asyncio.sleep(wait)
+            if self._input:
+                self._input.take(input_tokens)
+            if self._output:
+                self._output.take(output_tokens)
+        waited = time.monotonic() - started
+        self.stats["wait_seconds"] += waited
+        return TokenReservation(input_tokens, output_tokens, waited)
+
+    def settle(self, reservation: TokenReservation, input_tokens: int = 0, output_tokens: int = 0):
+        """按实际用量结算预占的token；调用失败时传 0 全部退回"""
+        self.stats["input_tokens"] += input_tokens
+        self.stats["output_tokens"] += output_tokens
+        if self._input:
+            self._input.give_back(reservation.input_tokens - input_tokens)
+        if self._output:
+            self._output.give_back(reservation.output_tokens - output_tokens)
+
+    def info(self) -> Dict[str, Any]:
+        """预算配置、剩余预算和累计统计"""
+        remaining = {}
+        for name, bucket in (("input", self._input), ("output", self._output)):
+            if bucket:
+                bucket._refill()
+                remaining[name] = int(bucket.tokens)
+        return {
+            "enabled": self.enabled,
+            "input_tokens_per_minute": self.input_tokens_per_minute,
+            "output_tokens_per_minute": self.output_tokens_per_minute,
+            "remaining": remaining,
+            **{key: round(value, 2) if isinstance(value, float) else value for key, value in self.stats.items()}
+        }
+
+
+# 全局模型调用限流器（进程内所有Agent共享）
+model_rate_limiter = ModelRateLimiter()
@@ -13,6 +13,7 @@ from datetime import datetime
 # 导入AI Agent
 from ai_agent.stock_agents import stock_analyzer
 from ai_agent.prompt_manager import prompt_manager
+from ai_agent.client_pool import llm_client_pool
 
 # 配置日志
 logging.basicConfig(level=logging.INFO)
@@ -43,6 +44,17 @@ class AgentStatusResponse(BaseModel):
     available_agents: List[str]
     agent_info: dict
 
+@ai_app.on_event("startup")
+async def startup_event():
+    """应用启动事件：监听提示词文件，修改后自动重新加载"""
+    await prompt_manager.start_watching()
+
+@ai_app.on_event("shutdown")
+async def shutdown_event():
+    """应用关闭事件：停止提示词监听，关闭共享的模型客户端和Redis连接"""
+    await prompt_manager.stop_watching()
+    await llm_client_pool.close()
+
 @ai_app.get("/")
 async def root():
     """健康检查"""
@@ -50,7 +62,9 @@ async def root():
         "service": "Stock AI Analysis API",
         "status": "running",
         "timestamp": datetime.now().isoformat(),
-        "version": "1.0.0"
+        "version": "1.0.0",
+        "llm_client_pool": llm_client_pool.info(),
+        "prompts": prompt_manager.info()
     }
 
 @ai_app.get("/agents/status")
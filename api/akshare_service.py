@@ -7,7 +7,7 @@ import akshare as ak
 import pandas as pd
 from typing import Optional, Dict, Any, List
 import time
-from datetime import datetime
+from datetime import datetime, timedelta
 import logging
 try:
     from config import Config
@@ -1094,48 +1094,21 @@ class AkshareService:
     
     def get_dragon_tiger_data(self, stock_code: str, days: int = 90) -> Optional[Dict[str, Any]]:
         """获取龙虎榜数据 / Get dragon tiger list data"""
+        stock_lhb = self.get_dragon_tiger_frame(stock_code, days)
+        if stock_lhb is None:
+            return None
+        
         try:
-            # 计算查询日期范围
-            end_date = datetime.now().strftime('%Y%m%d')
-            start_date = (datetime.now() - timedelta(days=days)).strftime('%Y%m%d')
-            
-            def get_lhb_data():
-                return ak.stock_lhb_detail_em(start_date=start_date, end_date=end_date)
-            
-            lhb_data = self._retry_request(get_lhb_data)
-            
-            if lhb_data is None or lhb_data.empty:
-                logger.warning(f"无法获取龙虎榜数据")
-                return None
-            
-            # 筛选特定股票的龙虎榜记录
-            stock_lhb = lhb_data[lhb_data['代码'] == stock_code]
-            
-            if stock_lhb.empty:
-                # 返回空结果但不是None
-                result = {
-                    'stock_code': stock_code,
-                    'data_source': 'akshare_dragon_tiger',
-                    'update_time': datetime.utcnow().isoformat(),
-                    'query_period_days': days,
-                    'total_records': 0,
-                    'dragon_tiger_records': [],
-                    'summary': {
-                        'total_appearances': 0,
-                        'total_net_buy': 0,
-                        'reasons': []
-                    }
-                }
-                return result
-            
             # 处理数据
-            stock_lhb = stock_lhb.fillna('')
-            records = stock_lhb.to_dict('records')
+            records = list(self.iter_frame_records(stock_lhb))
             
             # 计算汇总数据
-            total_net_buy = stock_lhb['龙虎榜净买额'].sum()
-            reasons = stock_lhb['上榜原因'].unique().tolist()
-            reasons = [r for r in reasons if r != '']
+            if records:
+                total_net_buy = stock_lhb['龙虎榜净买额'].fillna(0).sum()
+                reasons = [r for r in stock_lhb['上榜原因'].fillna('').unique().tolist() if r != '']
+            else:
+                # 返回空结果但不是None
+                total_net_buy, reasons = 0, []
             
             result = {
                 'stock_code': stock_code,
@@ -1158,6 +1131,38 @@ class AkshareService:
             logger.error(f"获取龙虎榜数据失败: {str(e)}")
             return None
 
+    def get_dragon_tiger_frame(self, stock_code: str, days: int = 90) -> Optional[pd.DataFrame]:
+        """
+        获取指定股票的龙虎榜明细DataFrame（龙虎榜数据的唯一获取路径，也供流式输出使用）
+        Get the dragon tiger detail frame of a stock; the single fetch path, also used for streaming responses
+        """
+        try:
+            end_date = datetime.now().strftime('%Y%m%d')
+            start_date = (datetime.now() - timedelta(days=days)).strftime('%Y%m%d')
+            
+            def get_lhb_data():
+                return ak.stock_lhb_detail_em(start_date=start_date, end_date=end_date)
+            
+            lhb_data = self._retry_request(get_lhb_data)
+            
+            if lhb_data is None or lhb_data.empty:
+                logger.warning(f"无法获取龙虎榜数据: {start_date} - {end_date}")
+                return None
+            
+            # 筛选特定股票的龙虎榜记录
+            return lhb_data[lhb_data['代码'] == stock_code]
+            
+        except Exception as e:
+            logger.error(f"获取龙虎榜数据失败: {str(e)}")
+            return None
+    
+    @staticmethod
+    def iter_frame_records(frame: pd.DataFrame):
+        """逐行生成DataFrame记录，不构建完整的记录列表 / Yield frame rows as dicts without building the full list"""
+        columns = list(frame.columns)
+        for values in frame.itertuples(index=False, name=None):
+            yield {column: ('' if pd.isna(value) else value) for column, value in zip(columns, values)}
+
     def get_news_and_research_data(self, stock_code: str) -> Optional[Dict[str, Any]]:
         """获取新闻和研报数据 / Get news and research data"""
         try:
@@ -5,15 +5,26 @@ Chinese Stock Service API - Port 3003
 """
 from fastapi import FastAPI, HTTPException, Depends, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
-from sqlalchemy.orm import Session
-from sqlalchemy import and_, or_
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import and_, or_, select
 from typing import List, Optional
 from datetime import datetime, timedelta
 import logging
 import time
 
-from database import get_db, ChineseStock, APILog, init_database, test_database_connection
+from database import (
+    get_async_db, AsyncSessionLocal, CHINESE_STOCK_SORT_COLUMNS, ChineseStock, fetch_first, count_rows,
+    init_async_database, test_async_database_connection, close_async_database
+)
 from akshare_service import AkshareService
+from log_buffer import api_log_buffer
+from pagination import CursorError, KeysetPaginator, count_cache, filters_fingerprint
+from market_sync import market_sync_job
+from market_snapshot import market_snapshot
+from search_index import stock_search_index
+from price_history import price_history
+from latency_rollup import DEFAULT_QUERY_WINDOWS, RESOLUTIONS, LatencyRollupJob, query_latency, route_normalizer
+from service_stats import TableStats, backfill_today_api_calls, today_api_calls
 from config import Config
 
 # 配置日志 / Configure logging
@@ -38,11 +49,42 @@ app.add_middleware(
 # 初始化akshare服务 / Initialize akshare service
 akshare_service = AkshareService()
 
+# 列表接口的键集分页器 / Keyset paginator for the list endpoint
+stock_paginator = KeysetPaginator(ChineseStock, "stock_code", CHINESE_STOCK_SORT_COLUMNS)
+
+# 接口延迟汇总与原始日志保留任务 / Latency rollup and raw log retention job
+latency_rollup = LatencyRollupJob("chinese_stock", route_normalizer(app.routes))
+
+
+async def _compute_stock_stats(db: AsyncSession) -> dict:
+    """完整计算表统计（仅在校准时执行） / Full table statistics, only run on reconcile"""
+    return {
+        "active_stocks_count": await count_rows(db, select(ChineseStock).where(ChineseStock.is_active == True)),
+        "total_stocks_count": await count_rows(db, select(ChineseStock))
+    }
+
+
+# /stats 使用的内存统计 / In-memory statistics behind /stats
+stock_stats = TableStats("chinese_stocks", _compute_stock_stats)
+
+
+async def _invalidate_counts():
+    """全市场同步后清除带筛选条件的总数缓存 / Drop cached filtered counts after a market sync"""
+    count_cache.invalidate("chinese_stocks:")
+
+
+async def _load_english_names():
+    """从 chinese_stocks.stock_name_en 载入搜索索引的英文名称 / Load English names into the search index"""
+    async with AsyncSessionLocal() as db:
+        rows = (await db.execute(select(ChineseStock.stock_code, ChineseStock.stock_name_en))).all()
+    loaded = stock_search_index.set_english_names({code: name for code, name in rows})
+    logger.info(f"搜索索引英文名称已载入 / Loaded English names for the search index: {loaded}")
+
 # 在应用末尾添加新的API端点
 @app.get("/api/financial-abstract/{stock_code}", summary="获取财务摘要数据")
 async def get_financial_abstract(
     stock_code: str,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     获取股票财务摘要数据 / Get stock financial abstract data
@@ -72,7 +114,7 @@ async def get_financial_abstract(
 @app.get("/api/comprehensive-financial/{stock_code}", summary="获取全面财务指标数据")
 async def get_comprehensive_financial(
     stock_code: str,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     获取股票全面财务指标数据 / Get comprehensive financial indicators data
@@ -94,7 +136,7 @@ async def get_comprehensive_financial(
 @app.get("/api/stock-info/{stock_code}", summary="获取股票基本信息")
 async def get_stock_info(
     stock_code: str,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     获取股票基本信息 / Get stock basic information
@@ -123,7 +165,7 @@ async def get_stock_info(
 @app.get("/api/comprehensive-data/{stock_code}", summary="获取股票综合数据")
 async def get_comprehensive_data(
     stock_code: str,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     获取股票综合数据 / Get comprehensive stock data
@@ -146,7 +188,7 @@ async def get_comprehensive_data(
 async def get_technical_indicators(
     stock_code: str,
     days: int = Query(60, ge=20, le=250, description="历史数据天数"),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     获取股票技术指标 / Get stock technical indicators
@@ -179,7 +221,7 @@ async def get_technical_indicators(
 @app.get("/api/industry-analysis/{stock_code}", summary="获取股票行业分析")
 async def get_industry_analysis_data(
     stock_code: str,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     获取股票行业分析数据 / Get stock industry analysis data
@@ -203,7 +245,7 @@ async def get_historical_data(
     stock_code: str,
     period: str = Query("daily", description="数据周期: daily, weekly, monthly"),
     days: int = Query(30, ge=1, le=1000, description="获取天数"),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     获取股票历史数据 / Get stock historical data
@@ -254,7 +296,7 @@ async def get_historical_data(
 @app.get("/api/fund-flow/{stock_code}", summary="获取资金流向数据")
 async def get_fund_flow(
     stock_code: str,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     获取资金流向数据 / Get fund flow data
@@ -276,7 +318,7 @@ async def get_fund_flow(
 @app.get("/api/news-research/{stock_code}", summary="获取新闻和研报数据")
 async def get_news_research(
     stock_code: str,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     获取新闻和研报数据 / Get news and research data
@@ -299,7 +341,7 @@ async def get_news_research(
 async def get_minute_data(
     stock_code: str,
     period: str = Query("5", description="分钟周期: 1, 5, 15, 30, 60"),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     获取分钟级数据 / Get minute-level data
@@ -326,7 +368,7 @@ async def get_minute_data(
 @app.get("/api/comprehensive-market/{stock_code}", summary="获取综合市场数据")
 async def get_comprehensive_market(
     stock_code: str,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     获取综合市场数据 / Get comprehensive market data
@@ -349,7 +391,7 @@ async def get_comprehensive_market(
 async def get_advanced_technical(
     stock_code: str,
     days: int = Query(100, ge=30, le=500, description="历史数据天数"),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     获取高级技术指标 / Get advanced technical indicators
@@ -454,22 +496,17 @@ async def log_requests(request: Request, call_next):
     response = await call_next(request)
     process_time = time.time() - start_time
     
-    # 记录API调用日志 / Log API calls
+    # 记录API调用日志（放入缓冲区，由后台任务批量写入）/ Log API calls via the batched buffer
     try:
-        db = next(get_db())
-        log_entry = APILog(
+        api_log_buffer.enqueue(
             service_type="chinese_stock",
             endpoint=str(request.url.path),
             method=request.method,
             request_params=str(request.query_params) if request.query_params else None,
             response_status=response.status_code,
             response_time=process_time,
-            client_ip=request.client.host,
-            created_at=datetime.utcnow()
+            client_ip=request.client.host if request.client else None
         )
-        db.add(log_entry)
-        db.commit()
-        db.close()
     except Exception as e:
         logger.error(f"日志记录失败 / Failed to log request: {str(e)}")
     
@@ -481,17 +518,50 @@ async def startup_event():
     logger.info("中国股票服务API启动中 / Chinese Stock Service API starting...")
     
     # 测试数据库连接 / Test database connection
-    if not test_database_connection():
+    if not await test_async_database_connection():
         logger.error("数据库连接失败，服务无法启动 / Database connection failed, service cannot start")
         raise Exception("Database connection failed")
     
     # 初始化数据库表 / Initialize database tables
-    if not init_database():
+    if not await init_async_database():
         logger.error("数据库初始化失败 / Database initialization failed")
         raise Exception("Database initialization failed")
     
+    # 启动API日志批量写入任务 / Start the batched API log writer
+    await backfill_today_api_calls("chinese_stock")
+    api_log_buffer.start()
+    
+    # 启动统计定时校准，每次全市场同步后也重新计算 / Reconcile statistics periodically and after every market sync
+    stock_stats.start()
+    market_sync_job.add_listener(stock_stats.refresh)
+    market_sync_job.add_listener(_invalidate_counts)
+    
+    # 搜索索引的英文名称来自数据库，同步新增股票后重新载入 / English search names come from the DB
+    await _load_english_names()
+    market_sync_job.add_listener(_load_english_names)
+    
+    # 启动接口延迟汇总 / Start the latency rollup job
+    latency_rollup.start()
+    
+    # 启动全市场定时同步，保证 /stocks、/stats 数据完整 / Start the periodic whole-market sync
+    market_sync_job.start()
+    
+    # 每次快照刷新后追加盘中价格历史，并定时维护分区 / Record intraday history on every snapshot refresh
+    market_snapshot.add_listener(price_history.on_snapshot)
+    price_history.start()
+    
     logger.info(f"中国股票服务API已在端口{Config.CHINESE_STOCK_PORT}启动 / Chinese Stock Service API started on port {Config.CHINESE_STOCK_PORT}")
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    """应用关闭事件 / Application shutdown event"""
+    await market_sync_job.stop()
+    await price_history.stop()
+    await stock_stats.stop()
+    await latency_rollup.stop()
+    await api_log_buffer.stop()
+    await close_async_database()
+
 @app.get("/", summary="服务状态检查 / Service health check")
 async def root():
     """服务状态检查端点 / Service health check endpoint"""
@@ -505,15 +575,16 @@ async def root():
     }
 
 @app.get("/health", summary="健康检查 / Health check")
-async def health_check(db: Session = Depends(get_db)):
+async def health_check(db: AsyncSession = Depends(get_async_db)):
     """健康检查端点，包含数据库连接测试 / Health check endpoint with database connection test"""
     try:
         # 测试数据库查询 / Test database query
         from sqlalchemy import text
-        db.execute(text("SELECT 1"))
+        await db.execute(text("SELECT 1"))
         return {
             "status": "healthy",
             "database": "connected",
+            "request_log": api_log_buffer.stats(),
             "timestamp": datetime.utcnow().isoformat()
         }
     except Exception as e:
@@ -523,7 +594,7 @@ async def health_check(db: Session = Depends(get_db)):
 async def get_stock_info(
     stock_code: str,
     refresh: bool = Query(False, description="是否强制刷新数据 / Whether to force refresh data"),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     获取指定股票的详细信息
@@ -534,7 +605,7 @@ async def get_stock_info(
     """
     try:
         # 检查数据库中是否有缓存数据 / Check if there's cached data in database
-        cached_stock = db.query(ChineseStock).filter(ChineseStock.stock_code == stock_code).first()
+        cached_stock = await fetch_first(db, select(ChineseStock).where(ChineseStock.stock_code == stock_code))
         
         # 判断是否需要刷新数据 / Determine if data refresh is needed
         need_refresh = (
@@ -554,6 +625,7 @@ async def get_stock_info(
                 )
             
             # 更新或创建数据库记录 / Update or create database record
+            created = cached_stock is None
             if cached_stock:
                 # 更新现有记录 / Update existing record
                 for key, value in stock_data.items():
@@ -565,11 +637,14 @@ async def get_stock_info(
                 cached_stock = ChineseStock(**stock_data)
                 db.add(cached_stock)
             
-            db.commit()
+            await db.commit()
+            # 提交成功后才调整统计 / Adjust statistics only after a successful commit
+            if created:
+                stock_stats.adjust(total_stocks_count=1, active_stocks_count=1)
             
             # 验证数据库操作 / Verify database operation
-            db.refresh(cached_stock)
-            verification_query = db.query(ChineseStock).filter(ChineseStock.stock_code == stock_code).first()
+            await db.refresh(cached_stock)
+            verification_query = await fetch_first(db, select(ChineseStock).where(ChineseStock.stock_code == stock_code))
             if verification_query is None:
                 logger.error(f"数据库验证失败：股票 {stock_code} 未找到 / Database verification failed: Stock {stock_code} not found")
                 raise HTTPException(status_code=500, detail="数据库操作验证失败 / Database operation verification failed")
@@ -609,44 +684,64 @@ async def get_stocks_list(
     page: int = Query(1, ge=1, description="页码 / Page number"),
     limit: int = Query(20, ge=1, le=100, description="每页数量 / Items per page"),
     search: Optional[str] = Query(None, description="搜索关键词（股票代码或名称）/ Search keyword (stock code or name)"),
-    sort_by: str = Query("stock_code", description="排序字段 / Sort field"),
+    sort_by: Optional[str] = Query(None, description="排序字段，默认按代码；搜索时默认按相关度 / Sort field; defaults to stock_code, or relevance when searching"),
     sort_order: str = Query("asc", description="排序顺序：asc或desc / Sort order: asc or desc"),
     active_only: bool = Query(True, description="只显示活跃股票 / Show active stocks only"),
-    db: Session = Depends(get_db)
+    cursor: Optional[str] = Query(None, description="上一页返回的next_cursor，传入后忽略page / next_cursor from the previous page; overrides page"),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     获取股票列表，支持分页、搜索和排序
     Get stock list with pagination, search and sorting support
+
+    带 search 时结果来自内存搜索索引，按页码分页（不返回游标）：未指定 sort_by 时按相关度排序，
+    指定时按该字段排序。
+    With `search`, results come from the in-memory index and are paged by `page` (no cursor):
+    ranked by relevance unless `sort_by` is given.
     """
     try:
+        sort_by_given = sort_by is not None
+        sort_by, descending = stock_paginator.validate_sort(sort_by or "stock_code", sort_order)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    try:
+        if search:
+            # 优先使用内存搜索索引，按相关度排序 / Prefer the in-memory index, ranked by relevance
+            if len(stock_search_index) == 0:
+                await market_snapshot.refresh()
+            if len(stock_search_index) > 0:
+                return await _search_stocks_page(db, search, page, limit, active_only,
+                                                 sort_by if sort_by_given else None, descending)
+        
         # 构建查询条件 / Build query conditions
-        query = db.query(ChineseStock)
+        query = select(ChineseStock)
         
         if active_only:
-            query = query.filter(ChineseStock.is_active == True)
+            query = query.where(ChineseStock.is_active == True)
         
         if search:
+            # 索引不可用时退回数据库模糊查询 / Fall back to LIKE matching when the index is unavailable
             search_condition = or_(
                 ChineseStock.stock_code.contains(search),
                 ChineseStock.stock_name_cn.contains(search),
                 ChineseStock.stock_name_en.contains(search)
             )
-            query = query.filter(search_condition)
-        
-        # 排序 / Sorting
-        if hasattr(ChineseStock, sort_by):
-            sort_column = getattr(ChineseStock, sort_by)
-            if sort_order.lower() == "desc":
-                query = query.order_by(sort_column.desc())
-            else:
-                query = query.order_by(sort_column.asc())
+            query = query.where(search_condition)
         
-        # 计算总数 / Calculate total count
-        total_count = query.count()
+        # 无搜索条件时读取增量维护的计数，否则按筛选条件缓存总数 / Maintained counters without a search, cached counts otherwise
+        fingerprint = filters_fingerprint({"active_only": active_only, "search": search})
+        if not search:
+            count_info = await stock_stats.count_info("active_stocks_count" if active_only else "total_stocks_count")
+        else:
+            count_info = await count_cache.count(f"chinese_stocks:{fingerprint}", lambda: count_rows(db, query))
+        total_count = count_info["total_count"]
         
-        # 分页 / Pagination
-        offset = (page - 1) * limit
-        stocks = query.offset(offset).limit(limit).all()
+        # 键集分页：按 (排序列, 主键) 排序，多取一行判断是否有下一页 / Keyset pagination, fetching one extra row
+        query = stock_paginator.apply(query, sort_by, descending, fingerprint, cursor=cursor, offset=(page - 1) * limit)
+        rows = (await db.execute(query.limit(limit + 1))).scalars().all()
+        next_cursor = stock_paginator.next_cursor(rows, limit, sort_by, descending, fingerprint)
+        stocks = rows[:limit]
         
         # 格式化返回数据 / Format return data
         stocks_data = []
@@ -666,19 +761,154 @@ async def get_stocks_list(
         return {
             "stocks": stocks_data,
             "pagination": {
-                "page": page,
+                "page": None if cursor else page,
                 "limit": limit,
                 "total_count": total_count,
-                "total_pages": (total_count + limit - 1) // limit
+                "total_pages": (total_count + limit - 1) // limit,
+                "count_source": count_info["count_source"],
+                "next_cursor": next_cursor,
+                "has_more": next_cursor is not None
             }
         }
         
+    except CursorError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         logger.error(f"获取股票列表失败 / Failed to get stock list: {str(e)}")
         raise HTTPException(status_code=500, detail=f"内部服务器错误 / Internal server error: {str(e)}")
 
+async def _search_stocks_page(db: AsyncSession, search: str, page: int, limit: int, active_only: bool,
+                              sort_by: Optional[str] = None, descending: bool = False):
+    """
+    通过内存索引搜索并分页，行情数据取自数据库，库中没有的股票用快照补齐
+    Search through the in-memory index; rows come from the DB, falling back to the snapshot
+
+    总数是全部匹配数；sort_by 为空时按相关度排序，否则按该字段排序（NULL 规则与键集分页相同）。
+    """
+    matches = stock_search_index.search(search)
+    if active_only and matches:
+        # 停牌/退市股票很少，直接取全部非活跃代码 / Inactive stocks are few; fetch them all
+        inactive = set((await db.execute(
+            select(ChineseStock.stock_code).where(ChineseStock.is_active == False)
+        )).scalars().all())
+        matches = [match for match in matches if match["stock_code"] not in inactive]
+    
+    total_count = len(matches)
+    offset = (page - 1) * limit
+    # 按相关度时只读取本页的行，按字段排序时需要全部匹配行 / Relevance order only needs this page's rows
+    selected = matches if sort_by else matches[offset:offset + limit]
+    codes = [match["stock_code"] for match in selected]
+    stored = {}
+    if codes:
+        rows = (await db.execute(select(ChineseStock).where(ChineseStock.stock_code.in_(codes)))).scalars().all()
+        stored = {stock.stock_code: stock for stock in rows}
+    
+    stocks_data = []
+    for match in selected:
+        stock = stored.get(match["stock_code"])
+        if stock is not None:
+            item = {
+                "stock_code": stock.stock_code,
+                "stock_name_cn": stock.stock_name_cn,
+                "stock_name_en": stock.stock_name_en,
+                "current_price": stock.current_price,
+                "price_change": stock.price_change,
+                "price_change_pct": stock.price_change_pct,
+                "market_cap": stock.market_cap,
+                "volume": stock.volume,
+                "last_updated": stock.last_updated.isoformat() if stock.last_updated else None
+            }
+        else:
+            row = market_snapshot.rows.get(match["stock_code"], {})
+            item = {
+                "stock_code": match["stock_code"],
+                "stock_name_cn": match["stock_name_cn"],
+                "stock_name_en": match["stock_name_en"] or None,
+                "current_price": float(row.get("最新价", 0)) if row else None,
+                "price_change": float(row.get("涨跌额", 0)) if row else None,
+                "price_change_pct": float(row.get("涨跌幅", 0)) if row else None,
+                "market_cap": float(row.get("总市值", 0)) if row else None,
+                "volume": float(row.get("成交量", 0)) if row else None,
+                "last_updated": market_snapshot.fetched_at.isoformat() if market_snapshot.fetched_at else None
+            }
+        item["match"] = match["match"]
+        item["score"] = match["score"]
+        stocks_data.append(item)
+    
+    if sort_by:
+        # 升序NULL在后、降序NULL在前，相同值按代码 / NULLs last ascending, first descending, ties by code
+        present = [item for item in stocks_data if item[sort_by] is not None]
+        missing = [item for item in stocks_data if item[sort_by] is None]
+        present.sort(key=lambda item: (item[sort_by], item["stock_code"]), reverse=descending)
+        missing.sort(key=lambda item: item["stock_code"], reverse=descending)
+        stocks_data = (missing + present if descending else present + missing)[offset:offset + limit]
+    
+    return {
+        "stocks": stocks_data,
+        "pagination": {
+            "page": page,
+            "limit": limit,
+            "total_count": total_count,
+            "total_pages": (total_count + limit - 1) // limit
+        },
+        "search": {
+            "query": search,
+            "engine": "memory_index",
+            "order": sort_by or "relevance",
+            "index": stock_search_index.info()
+        }
+    }
+
+@app.get("/stocks/{stock_code}/intraday", summary="获取盘中价格历史 / Get intraday price history")
+async def get_intraday_history(
+    stock_code: str,
+    start: Optional[datetime] = Query(None, description="开始时间，默认当天零点 / Range start, defaults to today 00:00"),
+    end: Optional[datetime] = Query(None, description="结束时间，默认当前时间 / Range end, defaults to now"),
+    resolution: int = Query(5, ge=0, le=1440, description="K线周期（分钟），0为原始快照 / Bar width in minutes, 0 for raw snapshots"),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """
+    按时间范围和周期查询盘中价格序列（服务器本地时间）
+    Intraday price series for a time range at the requested resolution (server local time)
+    
+    超过原始数据保留期的部分来自降采样K线，精度不会高于降采样周期。
+    """
+    end = end or datetime.now()
+    start = start or end.replace(hour=0, minute=0, second=0, microsecond=0)
+    if start > end:
+        raise HTTPException(status_code=400, detail="开始时间不能晚于结束时间 / start must not be after end")
+    
+    try:
+        bars = await price_history.query(db, stock_code, start, end, resolution)
+        return {
+            "stock_code": stock_code,
+            "start": start.isoformat(),
+            "end": end.isoformat(),
+            "resolution_minutes": resolution,
+            "bars": bars,
+            "total_bars": len(bars),
+            "history": price_history.info()
+        }
+    except Exception as e:
+        logger.error(f"获取盘中价格历史失败 / Failed to get intraday history: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"内部服务器错误 / Internal server error: {str(e)}")
+
+@app.post("/stocks/bulk-refresh", summary="全市场批量刷新股票数据 / Bulk refresh all stocks")
+async def bulk_refresh_stocks():
+    """
+    用一份全市场行情快照批量upsert全部A股
+    Upsert every A-share from one market snapshot, reporting rows and timing per batch
+    """
+    try:
+        result = await market_sync_job.run_once(force_snapshot=True)
+        count_cache.invalidate("chinese_stocks:")
+        return result
+    except Exception as e:
+        logger.error(f"全市场批量刷新失败 / Bulk refresh failed: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"内部服务器错误 / Internal server error: {str(e)}")
+
 @app.post("/stocks/{stock_code}/refresh", summary="刷新指定股票数据 / Refresh specific stock data")
-async def refresh_stock_data(stock_code: str, db: Session = Depends(get_db)):
+async def refresh_stock_data(stock_code: str, db: AsyncSession = Depends(get_async_db)):
     """
     强制刷新指定股票的数据
     Force refresh data for a specific stock
@@ -694,8 +924,9 @@ async def refresh_stock_data(stock_code: str, db: Session = Depends(get_db)):
             )
         
         # 查找现有记录 / Find existing record
-        existing_stock = db.query(ChineseStock).filter(ChineseStock.stock_code == stock_code).first()
+        existing_stock = await fetch_first(db, select(ChineseStock).where(ChineseStock.stock_code == stock_code))
         
+        created = existing_stock is None
         if existing_stock:
             # 更新现有记录 / Update existing record
             for key, value in stock_data.items():
@@ -707,11 +938,14 @@ async def refresh_stock_data(stock_code: str, db: Session = Depends(get_db)):
             existing_stock = ChineseStock(**stock_data)
             db.add(existing_stock)
         
-        db.commit()
+        await db.commit()
+        # 提交成功后才调整统计 / Adjust statistics only after a successful commit
+        if created:
+            stock_stats.adjust(total_stocks_count=1, active_stocks_count=1)
         
         # 验证数据库操作 / Verify database operation
-        db.refresh(existing_stock)
-        verification_query = db.query(ChineseStock).filter(ChineseStock.stock_code == stock_code).first()
+        await db.refresh(existing_stock)
+        verification_query = await fetch_first(db, select(ChineseStock).where(ChineseStock.stock_code == stock_code))
         if verification_query is None:
             logger.error(f"数据库验证失败：股票 {stock_code} 刷新后未找到 / Database verification failed: Stock {stock_code} not found after refresh")
             raise HTTPException(status_code=500, detail="数据库操作验证失败 / Database operation verification failed")
@@ -730,14 +964,14 @@ async def refresh_stock_data(stock_code: str, db: Session = Depends(get_db)):
         raise HTTPException(status_code=500, detail=f"内部服务器错误 / Internal server error: {str(e)}")
 
 @app.delete("/stocks/{stock_code}", summary="删除指定股票数据 / Delete specific stock data")
-async def delete_stock_data(stock_code: str, db: Session = Depends(get_db)):
+async def delete_stock_data(stock_code: str, db: AsyncSession = Depends(get_async_db)):
     """
     删除指定股票的数据（软删除，设置为不活跃）
     Delete data for a specific stock (soft delete, set as inactive)
     """
     try:
         # 查找股票记录 / Find stock record
-        stock = db.query(ChineseStock).filter(ChineseStock.stock_code == stock_code).first()
+        stock = await fetch_first(db, select(ChineseStock).where(ChineseStock.stock_code == stock_code))
         
         if not stock:
             raise HTTPException(
@@ -746,16 +980,20 @@ async def delete_stock_data(stock_code: str, db: Session = Depends(get_db)):
             )
         
         # 软删除：设置为不活跃 / Soft delete: set as inactive
+        was_active = stock.is_active
         stock.is_active = False
         stock.last_updated = datetime.utcnow()
         
-        db.commit()
+        await db.commit()
+        count_cache.invalidate("chinese_stocks:")
+        if was_active:
+            stock_stats.adjust(active_stocks_count=-1)
         
         # 验证数据库操作 / Verify database operation
-        db.refresh(stock)
-        verification_query = db.query(ChineseStock).filter(
+        await db.refresh(stock)
+        verification_query = await fetch_first(db, select(ChineseStock).where(
             and_(ChineseStock.stock_code == stock_code, ChineseStock.is_active == False)
-        ).first()
+        ))
         if verification_query is None:
             logger.error(f"数据库验证失败：股票 {stock_code} 删除后验证失败 / Database verification failed: Stock {stock_code} deletion verification failed")
             raise HTTPException(status_code=500, detail="数据库操作验证失败 / Database operation verification failed")
@@ -772,32 +1010,54 @@ async def delete_stock_data(stock_code: str, db: Session = Depends(get_db)):
         logger.error(f"删除股票数据失败 / Failed to delete stock data: {str(e)}")
         raise HTTPException(status_code=500, detail=f"内部服务器错误 / Internal server error: {str(e)}")
 
+@app.get("/metrics/latency", summary="获取接口延迟汇总 / Get API latency rollups")
+async def get_latency_metrics(
+    resolution: str = Query("hour", description="汇总粒度 minute/hour/day / Rollup resolution"),
+    start: Optional[datetime] = Query(None, description="开始时间（UTC，默认按粒度回溯） / Start time in UTC"),
+    end: Optional[datetime] = Query(None, description="结束时间（UTC，默认为当前时间） / End time in UTC"),
+    endpoint: Optional[str] = Query(None, description="路由模板，如 /stats / Route template, e.g. /stats"),
+    method: Optional[str] = Query(None, description="HTTP方法 / HTTP method"),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """
+    按端点查询延迟汇总：调用次数、错误率、平均/最大响应时间和 p50/p90/p95/p99
+    Query per-endpoint latency rollups: calls, error rate, avg/max latency and p50/p90/p95/p99
+    """
+    if resolution not in RESOLUTIONS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"不支持的汇总粒度 '{resolution}'，可选: {', '.join(RESOLUTIONS)} / "
+                   f"Unsupported resolution '{resolution}', available: {', '.join(RESOLUTIONS)}"
+        )
+    try:
+        end = end or datetime.utcnow()
+        start = start or end - DEFAULT_QUERY_WINDOWS[resolution]
+        result = await query_latency(db, "chinese_stock", resolution, start, end, endpoint, method)
+        result["rollup"] = latency_rollup.info()
+        return result
+    except Exception as e:
+        logger.error(f"获取接口延迟汇总失败 / Failed to get latency rollups: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"内部服务器错误 / Internal server error: {str(e)}")
+
 @app.get("/stats", summary="获取股票统计信息 / Get stock statistics")
-async def get_statistics(db: Session = Depends(get_db)):
+async def get_statistics(db: AsyncSession = Depends(get_async_db)):
     """
     获取股票服务统计信息
     Get stock service statistics
     """
     try:
-        # 统计活跃股票数量 / Count active stocks
-        active_stocks_count = db.query(ChineseStock).filter(ChineseStock.is_active == True).count()
-        
-        # 统计总股票数量 / Count total stocks
-        total_stocks_count = db.query(ChineseStock).count()
-        
-        # 统计今日API调用次数 / Count today's API calls
-        today_start = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
-        today_api_calls = db.query(APILog).filter(
-            and_(
-                APILog.service_type == "chinese_stock",
-                APILog.created_at >= today_start
-            )
-        ).count()
+        # 活跃/总股票数量来自内存统计 / Active and total counts from the in-memory statistics
+        table_stats = await stock_stats.get()
+        
+        # 今日API调用次数：汇总表一行 + 尚未写入的缓冲日志 / Today's API calls: rollup row plus buffered entries
+        api_calls_today = await today_api_calls(db, "chinese_stock", api_log_buffer.pending("chinese_stock"))
         
         # 获取最新更新的股票 / Get latest updated stocks
-        latest_updated_stocks = db.query(ChineseStock).filter(
-            ChineseStock.is_active == True
-        ).order_by(ChineseStock.last_updated.desc()).limit(5).all()
+        latest_updated_stocks = (await db.execute(
+            select(ChineseStock).where(
+                ChineseStock.is_active == True
+            ).order_by(ChineseStock.last_updated.desc()).limit(5)
+        )).scalars().all()
         
         latest_stocks_data = []
         for stock in latest_updated_stocks:
@@ -812,10 +1072,11 @@ async def get_statistics(db: Session = Depends(get_db)):
         return {
             "service": "Chinese Stock Service",
             "statistics": {
-                "active_stocks_count": active_stocks_count,
-                "total_stocks_count": total_stocks_count,
-                "today_api_calls": today_api_calls,
-                "latest_updated_stocks": latest_stocks_data
+                "active_stocks_count": table_stats.get("active_stocks_count", 0),
+                "total_stocks_count": table_stats.get("total_stocks_count", 0),
+                "today_api_calls": api_calls_today,
+                "latest_updated_stocks": latest_stocks_data,
+                "stats_computed_at": stock_stats.info()["computed_at"]
             },
             "timestamp": datetime.utcnow().isoformat()
         }
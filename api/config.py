@@ -38,6 +38,83 @@ class Config:
     STOCK_DATA_CACHE_MINUTES = 5  # 股票数据缓存5分钟
     FUTURES_DATA_CACHE_MINUTES = 3  # 期货数据缓存3分钟
     
+    # HTTP缓存配置 / HTTP caching configuration
+    DATA_VERSION_TTL_SECONDS = 300  # 数据版本有效期，用于ETag条件请求（行情/K线版本不超过 MARKET_SNAPSHOT_TTL_SECONDS）
+    GZIP_MINIMUM_SIZE = 1000  # 超过该字节数的响应才进行gzip压缩
+    
+    # 响应缓存配置（进程内LRU + Redis）/ Response cache configuration (in-process LRU + Redis)
+    RESPONSE_CACHE_MAX_ENTRIES = 2000  # 进程内LRU最多条目数
+    RESPONSE_CACHE_STALE_SECONDS = 300  # 过期后仍可直接返回旧数据（同时后台刷新）的时间
+    RESPONSE_CACHE_TTLS = {  # 各接口缓存有效期（秒）
+        "unified": 60,
+        "technical": 60,
+        "fundamental": 3600,
+        "historical_prices": 300,
+        "historical_financial": 6 * 3600,
+        "live_flow": 60,
+    }
+    
+    # AI分析缓存配置（Redis + 进程内后备）/ AI analysis cache configuration (Redis with in-process fallback)
+    ANALYSIS_CACHE_MEMORY_MAX_ENTRIES = 2000  # 进程内后备缓存最多条目数
+    ANALYSIS_CACHE_PERSIST_PATH = os.getenv("ANALYSIS_CACHE_PERSIST_PATH", "")  # 进程内缓存持久化文件，空表示不持久化
+    ANALYSIS_CACHE_PERSIST_SECONDS = 60  # 持久化文件写入间隔
+    ANALYSIS_CACHE_RECONNECT_SECONDS = 30  # Redis不可用时后台重连间隔
+    
+    # AI分析任务队列配置 / AI analysis job queue configuration
+    ANALYSIS_JOB_WORKERS = int(os.getenv("ANALYSIS_JOB_WORKERS", "2"))  # 每个进程执行分析任务的worker数
+    ANALYSIS_JOB_MAX_PENDING = 200  # 每个进程排队任务上限，超出时拒绝提交
+    ANALYSIS_JOB_TIMEOUT = 300  # 单个任务最长执行时间（秒）
+    ANALYSIS_JOB_RETENTION = 86400  # 任务状态和结果保留时间（秒）
+    
+    # AI批量分析与模型调用限流配置 / AI batch analysis and model rate limit configuration
+    ANALYSIS_BATCH_MAX_CODES = 100  # 批量分析单次最多股票数
+    ANALYSIS_BATCH_COLLECT_CONCURRENCY = 4  # 批量分析同时进行数据收集的股票数
+    # 每分钟模型token预算，应与账户的速率限制一致（默认值为Anthropic第2级账户的限制），0 表示不限制
+    ANTHROPIC_INPUT_TOKENS_PER_MINUTE = int(os.getenv("ANTHROPIC_INPUT_TOKENS_PER_MINUTE", "80000"))
+    ANTHROPIC_OUTPUT_TOKENS_PER_MINUTE = int(os.getenv("ANTHROPIC_OUTPUT_TOKENS_PER_MINUTE", "16000"))
+    
+    # ai_agent 共享模型客户端与提示词配置 / ai_agent shared model client and prompt registry configuration
+    AI_AGENT_MAX_CONCURRENT_CALLS = int(os.getenv("AI_AGENT_MAX_CONCURRENT_CALLS", "8"))  # 进程内同时进行的模型调用上限
+    AI_AGENT_MAX_CONNECTIONS = 20  # 模型客户端HTTP连接池大小
+    AI_AGENT_REQUEST_TIMEOUT = 120  # 单次模型调用超时（秒）
+    PROMPT_WATCH_INTERVAL_SECONDS = 2.0  # 未安装watchfiles时轮询提示词目录的间隔
+    
+    # 全市场快照与批量接口配置 / Market snapshot and batch endpoint configuration
+    MARKET_SNAPSHOT_TTL_SECONDS = 60  # 全市场行情快照有效期
+    PROFILE_CACHE_TTL_SECONDS = 6 * 3600  # 个股基本信息缓存有效期
+    BATCH_MAX_CODES = 50  # 批量接口单次最多股票数
+    BATCH_FETCH_CONCURRENCY = 5  # 批量接口补充获取缺失数据的并发上限
+    
+    # API日志缓冲写入配置 / Buffered API log writer configuration
+    LOG_BUFFER_MAX_SIZE = 10000  # 内存中最多缓冲的日志条数，超出后丢弃并计数
+    LOG_BATCH_SIZE = 500  # 每批写入的最大条数
+    LOG_FLUSH_INTERVAL_SECONDS = 2.0  # 未满一批时的最长刷新间隔
+    
+    # 全市场批量同步配置 / Whole-market bulk sync configuration
+    MARKET_SYNC_INTERVAL_SECONDS = 300  # chinese_stocks 全表同步间隔，0表示不定时同步
+    BULK_UPSERT_BATCH_SIZE = 1000  # 每条upsert语句的行数（受数据库绑定参数数量上限约束）
+    COUNT_CACHE_TTL_SECONDS = 60  # 列表接口总数缓存有效期（带筛选条件时）
+    COUNT_CACHE_MAX_ENTRIES = 1000  # 总数缓存最多条目数（键包含搜索词）
+    
+    # 盘中价格历史配置 / Intraday price history configuration
+    INTRADAY_RAW_RETENTION_DAYS = 7  # 原始快照数据保留天数，之后降采样并删除分区
+    INTRADAY_DOWNSAMPLE_MINUTES = 30  # 降采样K线周期
+    INTRADAY_BAR_RETENTION_DAYS = 180  # 降采样K线保留天数
+    INTRADAY_MAINTENANCE_INTERVAL_SECONDS = 3600  # 分区维护任务执行间隔
+    
+    # 统计信息配置 / Statistics configuration
+    STATS_RECONCILE_SECONDS = 300  # /stats 内存计数定时校准间隔
+    
+    # 接口延迟汇总配置 / API latency rollup configuration
+    LATENCY_ROLLUP_INTERVAL_SECONDS = 60  # 汇总任务执行间隔
+    LATENCY_ROLLUP_BATCH_SIZE = 5000  # 每次读取的原始日志条数
+    LATENCY_ROLLUP_SAFETY_LAG_SECONDS = 120  # 只汇总早于此时间的日志，需大于日志从产生到提交的最长延迟
+    LATENCY_SKETCH_RELATIVE_ACCURACY = 0.01  # 分位数相对误差
+    API_LOG_RETENTION_DAYS = 7  # 原始API日志保留天数（只删除已汇总的日志）
+    LATENCY_MINUTE_RETENTION_DAYS = 2  # 分钟级汇总保留天数
+    LATENCY_HOUR_RETENTION_DAYS = 30  # 小时级汇总保留天数
+    LATENCY_DAY_RETENTION_DAYS = 365  # 天级汇总保留天数
+    
     # akshare配置 / akshare configuration
     AKSHARE_TIMEOUT = 30  # 请求超时时间
     MAX_RETRY_ATTEMPTS = 3  # 最大重试次数
\ No newline at end of file
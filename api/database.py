@@ -3,7 +3,8 @@
 数据库连接和模型定义模块
 Database connection and model definition module
 """
-from sqlalchemy import create_engine, Column, String, Float, DateTime, Text, Boolean, Integer
+from sqlalchemy import create_engine, Column, String, Float, Date, DateTime, Text, Boolean, Integer, Index, func, select
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.pool import QueuePool
@@ -25,12 +26,52 @@ engine = create_engine(
 # 创建会话工厂 / Create session factory
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+def create_async_db_engine(database_url: str = Config.ASYNC_DATABASE_URL, **kwargs):
+    """
+    创建异步数据库引擎 / Create an async database engine
+    
+    SQLite（aiosqlite）不支持连接池大小参数，仅对其他数据库设置连接池
+    """
+    options = {"pool_pre_ping": True, "echo": False}
+    if not database_url.startswith("sqlite"):
+        options.update(pool_size=10, max_overflow=20, pool_recycle=3600)
+    options.update(kwargs)
+    return create_async_engine(database_url, **options)
+
+# 异步数据库引擎和会话工厂，供FastAPI异步处理函数使用 / Async engine and session factory for async handlers
+async_engine = create_async_db_engine()
+AsyncSessionLocal = async_sessionmaker(async_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False)
+
 # 创建基础模型类 / Create base model class
 Base = declarative_base()
 
+# 列表接口允许的排序字段 / Sort fields allowed by the list endpoints
+CHINESE_STOCK_SORT_COLUMNS = (
+    "stock_code", "stock_name_cn", "current_price", "price_change_pct", "market_cap", "volume", "last_updated",
+)
+US_STOCK_SORT_COLUMNS = (
+    "stock_symbol", "stock_name_en", "current_price", "price_change_pct", "market_cap", "volume", "last_updated",
+)
+FUTURES_SORT_COLUMNS = (
+    "futures_code", "futures_name", "contract_month", "current_price", "price_change_pct", "volume",
+    "open_interest", "last_updated",
+)
+
+def keyset_indexes(table_name: str, primary_key: str, sort_columns):
+    """
+    为键集分页生成 (is_active, 排序列, 主键) 复合索引
+    Composite (is_active, sort column, primary key) indexes backing keyset pagination
+    """
+    indexes = []
+    for column in sort_columns:
+        columns = ("is_active", column) if column == primary_key else ("is_active", column, primary_key)
+        indexes.append(Index(f"ix_{table_name}_active_{column}", *columns))
+    return tuple(indexes)
+
 class ChineseStock(Base):
     """中国股票信息表 / Chinese stock information table"""
     __tablename__ = "chinese_stocks"
+    __table_args__ = keyset_indexes("chinese_stocks", "stock_code", CHINESE_STOCK_SORT_COLUMNS)
     
     stock_code = Column(String(20), primary_key=True, comment="股票代码")
     stock_name_cn = Column(String(100), nullable=False, comment="中文股票名称")
@@ -56,6 +97,7 @@ class ChineseStock(Base):
 class USStock(Base):
     """美国股票信息表 / US stock information table"""
     __tablename__ = "us_stocks"
+    __table_args__ = keyset_indexes("us_stocks", "stock_symbol", US_STOCK_SORT_COLUMNS)
     
     stock_symbol = Column(String(20), primary_key=True, comment="股票代码")
     stock_name_en = Column(String(200), nullable=False, comment="英文股票名称")
@@ -83,6 +125,7 @@ class USStock(Base):
 class ChineseFutures(Base):
     """中国期货信息表 / Chinese futures information table"""
     __tablename__ = "chinese_futures"
+    __table_args__ = keyset_indexes("chinese_futures", "futures_code", FUTURES_SORT_COLUMNS)
     
     futures_code = Column(String(20), primary_key=True, comment="期货代码")
     futures_name = Column(String(100), nullable=False, comment="期货名称")
@@ -107,6 +150,38 @@ class ChineseFutures(Base):
     last_updated = Column(DateTime, default=datetime.utcnow, comment="最后更新时间")
     created_at = Column(DateTime, default=datetime.utcnow, comment="创建时间")
 
+class IntradayPrice(Base):
+    """
+    盘中价格时间序列表，PostgreSQL上按交易日范围分区 / Intraday price ticks, range-partitioned by trading day on PostgreSQL
+    分区由 price_history 模块按天创建和删除 / Daily partitions are created and dropped by the price_history module
+    """
+    __tablename__ = "intraday_prices"
+    __table_args__ = {"postgresql_partition_by": "RANGE (recorded_at)"}
+    
+    market = Column(String(20), primary_key=True, comment="市场类型")
+    code = Column(String(20), primary_key=True, comment="代码")
+    recorded_at = Column(DateTime, primary_key=True, comment="快照时间（服务器本地时间）")
+    price = Column(Float, comment="最新价格")
+    price_change_pct = Column(Float, comment="涨跌幅百分比")
+    volume = Column(Float, comment="当日累计成交量")
+    turnover = Column(Float, comment="当日累计成交额")
+
+class IntradayPriceBar(Base):
+    """盘中价格降采样K线表，保存超过原始数据保留期的历史 / Downsampled intraday bars kept after raw ticks expire"""
+    __tablename__ = "intraday_price_bars"
+    
+    market = Column(String(20), primary_key=True, comment="市场类型")
+    code = Column(String(20), primary_key=True, comment="代码")
+    resolution_minutes = Column(Integer, primary_key=True, comment="K线周期（分钟）")
+    bucket_start = Column(DateTime, primary_key=True, comment="K线开始时间")
+    open_price = Column(Float, comment="开盘价")
+    high_price = Column(Float, comment="最高价")
+    low_price = Column(Float, comment="最低价")
+    close_price = Column(Float, comment="收盘价")
+    volume = Column(Float, comment="期末累计成交量")
+    turnover = Column(Float, comment="期末累计成交额")
+    samples = Column(Integer, comment="原始数据点数")
+
 class APILog(Base):
     """API调用日志表 / API call log table"""
     __tablename__ = "api_logs"
@@ -121,6 +196,46 @@ class APILog(Base):
     client_ip = Column(String(50), comment="客户端IP")
     error_message = Column(Text, comment="错误信息")
     created_at = Column(DateTime, default=datetime.utcnow, comment="创建时间")
+    
+    __table_args__ = (
+        # 延迟汇总按服务和 (created_at, id) 增量读取，原始日志保留策略按时间删除
+        # Incremental rollup reads per service by (created_at, id), retention deletes by time
+        Index("ix_api_logs_service_created", "service_type", "created_at", "id"),
+        Index("ix_api_logs_created_at", "created_at"),
+    )
+
+class APICallDaily(Base):
+    """每日API调用汇总表，由日志写入器增量累加 / Daily API call rollup, incremented by the log writer"""
+    __tablename__ = "api_call_daily"
+    
+    service_type = Column(String(50), primary_key=True, comment="服务类型")
+    day = Column(Date, primary_key=True, comment="日期（UTC）")
+    call_count = Column(Integer, nullable=False, default=0, comment="调用次数")
+    error_count = Column(Integer, nullable=False, default=0, comment="5xx错误次数")
+
+class APILatencyRollup(Base):
+    """按端点的延迟汇总表（分钟/小时/天） / Per-endpoint latency rollups by minute, hour and day"""
+    __tablename__ = "api_latency_rollups"
+    
+    service_type = Column(String(50), primary_key=True, comment="服务类型")
+    resolution = Column(String(10), primary_key=True, comment="汇总粒度 minute/hour/day")
+    bucket_start = Column(DateTime, primary_key=True, comment="时间桶开始时间（UTC）")
+    endpoint = Column(String(200), primary_key=True, comment="API端点（路由模板）")
+    method = Column(String(10), primary_key=True, comment="HTTP方法")
+    call_count = Column(Integer, nullable=False, default=0, comment="调用次数")
+    error_count = Column(Integer, nullable=False, default=0, comment="5xx错误次数")
+    latency_sum = Column(Float, nullable=False, default=0, comment="响应时间合计(秒)")
+    latency_max = Column(Float, nullable=False, default=0, comment="最大响应时间(秒)")
+    sketch = Column(Text, nullable=False, comment="可合并的响应时间分布（JSON）")
+
+class APILogRollupState(Base):
+    """每个服务已汇总到的日志位置 / Last api_logs (created_at, id) rolled up per service"""
+    __tablename__ = "api_log_rollup_state"
+    
+    service_type = Column(String(50), primary_key=True, comment="服务类型")
+    last_created_at = Column(DateTime, comment="已汇总的最新日志时间")
+    last_log_id = Column(Integer, nullable=False, default=0, comment="同一时间内已汇总的最大日志ID")
+    updated_at = Column(DateTime, default=datetime.utcnow, comment="更新时间")
 
 def get_db():
     """获取数据库会话 / Get database session"""
@@ -130,10 +245,38 @@ def get_db():
     finally:
         db.close()
 
+async def get_async_db():
+    """获取异步数据库会话 / Get async database session"""
+    async with AsyncSessionLocal() as db:
+        yield db
+
+async def fetch_first(db: AsyncSession, statement):
+    """执行查询并返回第一个ORM对象 / Execute a select and return the first ORM object"""
+    result = await db.execute(statement.limit(1))
+    return result.scalars().first()
+
+async def count_rows(db: AsyncSession, statement) -> int:
+    """统计查询结果行数 / Count the rows a select would return"""
+    result = await db.execute(
+        select(func.count()).select_from(statement.order_by(None).subquery())
+    )
+    return result.scalar_one()
+
+def create_missing_indexes(connection):
+    """
+    为已存在的表补建索引（create_all 只为新建的表创建索引）
+    Create indexes missing on tables that already existed, which create_all skips
+    """
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(connection, checkfirst=True)
+
 def init_database():
     """初始化数据库，创建所有表 / Initialize database, create all tables"""
     try:
         Base.metadata.create_all(bind=engine)
+        with engine.begin() as connection:
+            create_missing_indexes(connection)
         print("数据库表创建成功 / Database tables created successfully")
         return True
     except Exception as e:
@@ -151,4 +294,32 @@ def test_database_connection():
         return True
     except Exception as e:
         print(f"数据库连接测试失败 / Database connection test failed: {str(e)}")
-        return False
\ No newline at end of file
+        return False
+
+async def init_async_database():
+    """使用异步引擎初始化数据库表 / Initialize database tables through the async engine"""
+    try:
+        async with async_engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+            await conn.run_sync(create_missing_indexes)
+        print("数据库表创建成功 / Database tables created successfully")
+        return True
+    except Exception as e:
+        print(f"数据库初始化失败 / Database initialization failed: {str(e)}")
+        return False
+
+async def test_async_database_connection():
+    """测试异步数据库连接 / Test async database connection"""
+    try:
+        from sqlalchemy import text
+        async with AsyncSessionLocal() as db:
+            await db.execute(text("SELECT 1"))
+        print("数据库连接测试成功 / Database connection test successful")
+        return True
+    except Exception as e:
+        print(f"数据库连接测试失败 / Database connection test failed: {str(e)}")
+        return False
+
+async def close_async_database():
+    """释放异步连接池 / Dispose the async connection pool"""
+    await async_engine.dispose()
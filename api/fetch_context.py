@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+"""
+请求级数据抓取上下文
+Request-scoped fetch context
+
+AI数据聚合在进程内依次调用多个接口处理函数（统一数据、基本面、技术面、历史财务、公告……），
+它们各自调用同样的akshare函数（如 stock_financial_abstract、stock_individual_info_em）。
+在 fetch_context() 内，经 MemoizedModule 代理的函数调用按 (函数名, 参数) 只执行一次，
+其余调用直接得到同一结果的副本；上下文之外调用照常直通，不做任何缓存。
+"""
+import functools
+import logging
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, Iterator, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class FetchContext:
+    """一次聚合内共享的调用结果 / Call results shared within one aggregation"""
+
+    def __init__(self):
+        self.results: Dict[Any, Any] = {}
+        self.calls = 0
+        self.reused = 0
+        # to_thread 中的调用与事件循环线程共享同一个上下文
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(name: str, args: tuple, kwargs: Dict[str, Any]):
+        key = (name, args, tuple(sorted(kwargs.items())))
+        try:
+            hash(key)
+            return key
+        except TypeError:
+            return name, repr(args), repr(sorted(kwargs.items()))
+
+    def call(self, name: str, func: Callable, args: tuple, kwargs: Dict[str, Any]) -> Any:
+        key = self._key(name, args, kwargs)
+        with self._lock:
+            found = key in self.results
+            if found:
+                self.reused += 1
+                result = self.results[key]
+        if not found:
+            result = func(*args, **kwargs)
+            with self._lock:
+                self.calls += 1
+                self.results[key] = result
+        # DataFrame等可变结果返回副本，调用方修改不会影响其他调用方
+        return result.copy() if hasattr(result, "copy") else result
+
+    def info(self) -> Dict[str, int]:
+        return {"calls": self.calls, "reused": self.reused}
+
+
+_active_context: ContextVar[Optional[FetchContext]] = ContextVar("active_fetch_context", default=None)
+
+
+@contextmanager
+def fetch_context() -> Iterator[FetchContext]:
+    """
+    开启请求级抓取上下文；嵌套调用时复用外层上下文
+    Open a request-scoped fetch context, reusing an enclosing one
+    """
+    current = _active_context.get()
+    if current is not None:
+        yield current
+        return
+    context = FetchContext()
+    token = _active_context.set(context)
+    try:
+        yield context
+    finally:
+        _active_context.reset(token)
+        logger.debug(f"抓取上下文结束 / Fetch context closed: {context.info()}")
+
+
+class MemoizedModule:
+    """
+    模块代理：在抓取上下文中按参数复用函数调用结果
+    Module proxy that memoizes calls inside an active fetch context
+    """
+
+    def __init__(self, module):
+        self._module = module
+        self._wrappers: Dict[str, Callable] = {}
+
+    def __getattr__(self, name: str):
+        attribute = getattr(self._module, name)
+        if not callable(attribute):
+            return attribute
+        wrapper = self._wrappers.get(name)
+        if wrapper is None:
+            @functools.wraps(attribute)
+            def wrapper(*args, **kwargs):
+                context = _active_context.get()
+                if context is None:
+                    return attribute(*args, **kwargs)
+                return context.call(name, attribute, args, kwargs)
+            self._wrappers[name] = wrapper
+        return wrapper
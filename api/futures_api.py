@@ -5,15 +5,22 @@ Chinese Futures Service API - Port 3005
 """
 from fastapi import FastAPI, HTTPException, Depends, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
-from sqlalchemy.orm import Session
-from sqlalchemy import and_, or_
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import and_, or_, func, select
 from typing import List, Optional
 from datetime import datetime, timedelta
 import logging
 import time
 
-from database import get_db, ChineseFutures, APILog, init_database, test_database_connection
+from database import (
+    get_async_db, FUTURES_SORT_COLUMNS, ChineseFutures, fetch_first, count_rows,
+    init_async_database, test_async_database_connection, close_async_database
+)
 from akshare_service import AkshareService
+from log_buffer import api_log_buffer
+from pagination import CursorError, KeysetPaginator, count_cache, filters_fingerprint
+from latency_rollup import DEFAULT_QUERY_WINDOWS, RESOLUTIONS, LatencyRollupJob, query_latency, route_normalizer
+from service_stats import TableStats, backfill_today_api_calls, today_api_calls
 from config import Config
 
 # 配置日志 / Configure logging
@@ -38,6 +45,34 @@ app.add_middleware(
 # 初始化akshare服务 / Initialize akshare service
 akshare_service = AkshareService()
 
+# 列表接口的键集分页器 / Keyset paginator for the list endpoint
+futures_paginator = KeysetPaginator(ChineseFutures, "futures_code", FUTURES_SORT_COLUMNS)
+
+# 接口延迟汇总与原始日志保留任务 / Latency rollup and raw log retention job
+latency_rollup = LatencyRollupJob("futures", route_normalizer(app.routes))
+
+
+async def _compute_futures_stats(db: AsyncSession) -> dict:
+    """完整计算表统计（仅在校准时执行） / Full table statistics, only run on reconcile"""
+    exchange_stats = (await db.execute(select(
+        ChineseFutures.exchange,
+        func.count(ChineseFutures.futures_code).label('count')
+    ).where(ChineseFutures.is_active == True).group_by(ChineseFutures.exchange))).all()
+    asset_stats = (await db.execute(select(
+        ChineseFutures.underlying_asset,
+        func.count(ChineseFutures.futures_code).label('count')
+    ).where(ChineseFutures.is_active == True).group_by(ChineseFutures.underlying_asset))).all()
+    return {
+        "active_contracts_count": await count_rows(db, select(ChineseFutures).where(ChineseFutures.is_active == True)),
+        "total_contracts_count": await count_rows(db, select(ChineseFutures)),
+        "exchange_distribution": {exchange: count for exchange, count in exchange_stats if exchange},
+        "asset_distribution": {asset: count for asset, count in asset_stats if asset}
+    }
+
+
+# /stats 使用的内存统计 / In-memory statistics behind /stats
+futures_stats = TableStats("chinese_futures", _compute_futures_stats)
+
 @app.middleware("http")
 async def log_requests(request: Request, call_next):
     """API请求日志中间件 / API request logging middleware"""
@@ -45,22 +80,17 @@ async def log_requests(request: Request, call_next):
     response = await call_next(request)
     process_time = time.time() - start_time
     
-    # 记录API调用日志 / Log API calls
+    # 记录API调用日志（放入缓冲区，由后台任务批量写入）/ Log API calls via the batched buffer
     try:
-        db = next(get_db())
-        log_entry = APILog(
+        api_log_buffer.enqueue(
             service_type="futures",
             endpoint=str(request.url.path),
             method=request.method,
             request_params=str(request.query_params) if request.query_params else None,
             response_status=response.status_code,
             response_time=process_time,
-            client_ip=request.client.host,
-            created_at=datetime.utcnow()
+            client_ip=request.client.host if request.client else None
         )
-        db.add(log_entry)
-        db.commit()
-        db.close()
     except Exception as e:
         logger.error(f"日志记录失败 / Failed to log request: {str(e)}")
     
@@ -72,17 +102,35 @@ async def startup_event():
     logger.info("中国期货服务API启动中 / Chinese Futures Service API starting...")
     
     # 测试数据库连接 / Test database connection
-    if not test_database_connection():
+    if not await test_async_database_connection():
         logger.error("数据库连接失败，服务无法启动 / Database connection failed, service cannot start")
         raise Exception("Database connection failed")
     
     # 初始化数据库表 / Initialize database tables
-    if not init_database():
+    if not await init_async_database():
         logger.error("数据库初始化失败 / Database initialization failed")
         raise Exception("Database initialization failed")
     
+    # 启动API日志批量写入任务 / Start the batched API log writer
+    await backfill_today_api_calls("futures")
+    api_log_buffer.start()
+    
+    # 启动统计定时校准 / Start periodic statistics reconciliation
+    futures_stats.start()
+    
+    # 启动接口延迟汇总 / Start the latency rollup job
+    latency_rollup.start()
+    
     logger.info(f"中国期货服务API已在端口{Config.FUTURES_PORT}启动 / Chinese Futures Service API started on port {Config.FUTURES_PORT}")
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    """应用关闭事件 / Application shutdown event"""
+    await futures_stats.stop()
+    await latency_rollup.stop()
+    await api_log_buffer.stop()
+    await close_async_database()
+
 @app.get("/", summary="服务状态检查 / Service health check")
 async def root():
     """服务状态检查端点 / Service health check endpoint"""
@@ -96,15 +144,16 @@ async def root():
     }
 
 @app.get("/health", summary="健康检查 / Health check")
-async def health_check(db: Session = Depends(get_db)):
+async def health_check(db: AsyncSession = Depends(get_async_db)):
     """健康检查端点，包含数据库连接测试 / Health check endpoint with database connection test"""
     try:
         # 测试数据库查询 / Test database query
         from sqlalchemy import text
-        db.execute(text("SELECT 1"))
+        await db.execute(text("SELECT 1"))
         return {
             "status": "healthy",
             "database": "connected",
+            "request_log": api_log_buffer.stats(),
             "timestamp": datetime.utcnow().isoformat()
         }
     except Exception as e:
@@ -114,7 +163,7 @@ async def health_check(db: Session = Depends(get_db)):
 async def get_futures_info(
     futures_code: str,
     refresh: bool = Query(False, description="是否强制刷新数据 / Whether to force refresh data"),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     获取指定期货的详细信息
@@ -128,7 +177,7 @@ async def get_futures_info(
         futures_code = futures_code.lower()
         
         # 检查数据库中是否有缓存数据 / Check if there's cached data in database
-        cached_futures = db.query(ChineseFutures).filter(ChineseFutures.futures_code == futures_code).first()
+        cached_futures = await fetch_first(db, select(ChineseFutures).where(ChineseFutures.futures_code == futures_code))
         
         # 判断是否需要刷新数据 / Determine if data refresh is needed
         need_refresh = (
@@ -148,6 +197,7 @@ async def get_futures_info(
                 )
             
             # 更新或创建数据库记录 / Update or create database record
+            created = cached_futures is None
             if cached_futures:
                 # 更新现有记录 / Update existing record
                 for key, value in futures_data.items():
@@ -159,11 +209,16 @@ async def get_futures_info(
                 cached_futures = ChineseFutures(**futures_data)
                 db.add(cached_futures)
             
-            db.commit()
+            await db.commit()
+            # 提交成功后才调整统计 / Adjust statistics only after a successful commit
+            if created:
+                futures_stats.adjust(total_contracts_count=1, active_contracts_count=1)
+                futures_stats.adjust_distribution("exchange_distribution", cached_futures.exchange, 1)
+                futures_stats.adjust_distribution("asset_distribution", cached_futures.underlying_asset, 1)
             
             # 验证数据库操作 / Verify database operation
-            db.refresh(cached_futures)
-            verification_query = db.query(ChineseFutures).filter(ChineseFutures.futures_code == futures_code).first()
+            await db.refresh(cached_futures)
+            verification_query = await fetch_first(db, select(ChineseFutures).where(ChineseFutures.futures_code == futures_code))
             if verification_query is None:
                 logger.error(f"数据库验证失败：期货 {futures_code} 未找到 / Database verification failed: Futures {futures_code} not found")
                 raise HTTPException(status_code=500, detail="数据库操作验证失败 / Database operation verification failed")
@@ -210,18 +265,24 @@ async def get_futures_list(
     sort_by: str = Query("futures_code", description="排序字段 / Sort field"),
     sort_order: str = Query("asc", description="排序顺序：asc或desc / Sort order: asc or desc"),
     active_only: bool = Query(True, description="只显示活跃合约 / Show active contracts only"),
-    db: Session = Depends(get_db)
+    cursor: Optional[str] = Query(None, description="上一页返回的next_cursor，传入后忽略page / next_cursor from the previous page; overrides page"),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     获取期货列表，支持分页、搜索和排序
     Get futures list with pagination, search and sorting support
     """
+    try:
+        sort_by, descending = futures_paginator.validate_sort(sort_by, sort_order)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
     try:
         # 构建查询条件 / Build query conditions
-        query = db.query(ChineseFutures)
+        query = select(ChineseFutures)
         
         if active_only:
-            query = query.filter(ChineseFutures.is_active == True)
+            query = query.where(ChineseFutures.is_active == True)
         
         if search:
             search_condition = or_(
@@ -229,28 +290,30 @@ async def get_futures_list(
                 ChineseFutures.futures_name.contains(search),
                 ChineseFutures.underlying_asset.contains(search)
             )
-            query = query.filter(search_condition)
+            query = query.where(search_condition)
         
         if exchange:
-            query = query.filter(ChineseFutures.exchange == exchange.upper())
+            query = query.where(ChineseFutures.exchange == exchange.upper())
         
         if underlying_asset:
-            query = query.filter(ChineseFutures.underlying_asset.contains(underlying_asset))
-        
-        # 排序 / Sorting
-        if hasattr(ChineseFutures, sort_by):
-            sort_column = getattr(ChineseFutures, sort_by)
-            if sort_order.lower() == "desc":
-                query = query.order_by(sort_column.desc())
-            else:
-                query = query.order_by(sort_column.asc())
-        
-        # 计算总数 / Calculate total count
-        total_count = query.count()
+            query = query.where(ChineseFutures.underlying_asset.contains(underlying_asset))
+        
+        # 无筛选、只按活跃状态或交易所筛选时读取增量维护的计数，否则按筛选条件缓存总数
+        # Maintained counters for no filter, active-only or active exchange filters; cached counts otherwise
+        fingerprint = filters_fingerprint({"active_only": active_only, "search": search, "exchange": exchange, "underlying_asset": underlying_asset})
+        if not (search or exchange or underlying_asset):
+            count_info = await futures_stats.count_info("active_contracts_count" if active_only else "total_contracts_count")
+        elif active_only and exchange and not (search or underlying_asset):
+            count_info = await futures_stats.count_info("exchange_distribution", exchange.upper())
+        else:
+            count_info = await count_cache.count(f"chinese_futures:{fingerprint}", lambda: count_rows(db, query))
+        total_count = count_info["total_count"]
         
-        # 分页 / Pagination
-        offset = (page - 1) * limit
-        futures = query.offset(offset).limit(limit).all()
+        # 键集分页：按 (排序列, 主键) 排序，多取一行判断是否有下一页 / Keyset pagination, fetching one extra row
+        query = futures_paginator.apply(query, sort_by, descending, fingerprint, cursor=cursor, offset=(page - 1) * limit)
+        rows = (await db.execute(query.limit(limit + 1))).scalars().all()
+        next_cursor = futures_paginator.next_cursor(rows, limit, sort_by, descending, fingerprint)
+        futures = rows[:limit]
         
         # 格式化返回数据 / Format return data
         futures_data = []
@@ -272,19 +335,24 @@ async def get_futures_list(
         return {
             "futures": futures_data,
             "pagination": {
-                "page": page,
+                "page": None if cursor else page,
                 "limit": limit,
                 "total_count": total_count,
-                "total_pages": (total_count + limit - 1) // limit
+                "total_pages": (total_count + limit - 1) // limit,
+                "count_source": count_info["count_source"],
+                "next_cursor": next_cursor,
+                "has_more": next_cursor is not None
             }
         }
         
+    except CursorError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         logger.error(f"获取期货列表失败 / Failed to get futures list: {str(e)}")
         raise HTTPException(status_code=500, detail=f"内部服务器错误 / Internal server error: {str(e)}")
 
 @app.post("/futures/{futures_code}/refresh", summary="刷新指定期货数据 / Refresh specific futures data")
-async def refresh_futures_data(futures_code: str, db: Session = Depends(get_db)):
+async def refresh_futures_data(futures_code: str, db: AsyncSession = Depends(get_async_db)):
     """
     强制刷新指定期货的数据
     Force refresh data for a specific futures contract
@@ -302,8 +370,9 @@ async def refresh_futures_data(futures_code: str, db: Session = Depends(get_db))
             )
         
         # 查找现有记录 / Find existing record
-        existing_futures = db.query(ChineseFutures).filter(ChineseFutures.futures_code == futures_code).first()
+        existing_futures = await fetch_first(db, select(ChineseFutures).where(ChineseFutures.futures_code == futures_code))
         
+        created = existing_futures is None
         if existing_futures:
             # 更新现有记录 / Update existing record
             for key, value in futures_data.items():
@@ -315,11 +384,16 @@ async def refresh_futures_data(futures_code: str, db: Session = Depends(get_db))
             existing_futures = ChineseFutures(**futures_data)
             db.add(existing_futures)
         
-        db.commit()
+        await db.commit()
+        # 提交成功后才调整统计 / Adjust statistics only after a successful commit
+        if created:
+            futures_stats.adjust(total_contracts_count=1, active_contracts_count=1)
+            futures_stats.adjust_distribution("exchange_distribution", existing_futures.exchange, 1)
+            futures_stats.adjust_distribution("asset_distribution", existing_futures.underlying_asset, 1)
         
         # 验证数据库操作 / Verify database operation
-        db.refresh(existing_futures)
-        verification_query = db.query(ChineseFutures).filter(ChineseFutures.futures_code == futures_code).first()
+        await db.refresh(existing_futures)
+        verification_query = await fetch_first(db, select(ChineseFutures).where(ChineseFutures.futures_code == futures_code))
         if verification_query is None:
             logger.error(f"数据库验证失败：期货 {futures_code} 刷新后未找到 / Database verification failed: Futures {futures_code} not found after refresh")
             raise HTTPException(status_code=500, detail="数据库操作验证失败 / Database operation verification failed")
@@ -338,7 +412,7 @@ async def refresh_futures_data(futures_code: str, db: Session = Depends(get_db))
         raise HTTPException(status_code=500, detail=f"内部服务器错误 / Internal server error: {str(e)}")
 
 @app.delete("/futures/{futures_code}", summary="删除指定期货数据 / Delete specific futures data")
-async def delete_futures_data(futures_code: str, db: Session = Depends(get_db)):
+async def delete_futures_data(futures_code: str, db: AsyncSession = Depends(get_async_db)):
     """
     删除指定期货的数据（软删除，设置为不活跃）
     Delete data for a specific futures contract (soft delete, set as inactive)
@@ -347,7 +421,7 @@ async def delete_futures_data(futures_code: str, db: Session = Depends(get_db)):
         futures_code = futures_code.lower()
         
         # 查找期货记录 / Find futures record
-        futures = db.query(ChineseFutures).filter(ChineseFutures.futures_code == futures_code).first()
+        futures = await fetch_first(db, select(ChineseFutures).where(ChineseFutures.futures_code == futures_code))
         
         if not futures:
             raise HTTPException(
@@ -356,16 +430,22 @@ async def delete_futures_data(futures_code: str, db: Session = Depends(get_db)):
             )
         
         # 软删除：设置为不活跃 / Soft delete: set as inactive
+        was_active = futures.is_active
         futures.is_active = False
         futures.last_updated = datetime.utcnow()
         
-        db.commit()
+        await db.commit()
+        count_cache.invalidate("chinese_futures:")
+        if was_active:
+            futures_stats.adjust(active_contracts_count=-1)
+            futures_stats.adjust_distribution("exchange_distribution", futures.exchange, -1)
+            futures_stats.adjust_distribution("asset_distribution", futures.underlying_asset, -1)
         
         # 验证数据库操作 / Verify database operation
-        db.refresh(futures)
-        verification_query = db.query(ChineseFutures).filter(
+        await db.refresh(futures)
+        verification_query = await fetch_first(db, select(ChineseFutures).where(
             and_(ChineseFutures.futures_code == futures_code, ChineseFutures.is_active == False)
-        ).first()
+        ))
         if verification_query is None:
             logger.error(f"数据库验证失败：期货 {futures_code} 删除后验证失败 / Database verification failed: Futures {futures_code} deletion verification failed")
             raise HTTPException(status_code=500, detail="数据库操作验证失败 / Database operation verification failed")
@@ -383,15 +463,15 @@ async def delete_futures_data(futures_code: str, db: Session = Depends(get_db)):
         raise HTTPException(status_code=500, detail=f"内部服务器错误 / Internal server error: {str(e)}")
 
 @app.get("/exchanges", summary="获取期货交易所列表 / Get futures exchange list")
-async def get_exchanges(db: Session = Depends(get_db)):
+async def get_exchanges(db: AsyncSession = Depends(get_async_db)):
     """
     获取所有期货交易所列表
     Get all futures exchange list
     """
     try:
-        exchanges_query = db.query(ChineseFutures.exchange).filter(
+        exchanges_query = (await db.execute(select(ChineseFutures.exchange).where(
             and_(ChineseFutures.exchange.isnot(None), ChineseFutures.exchange != "", ChineseFutures.is_active == True)
-        ).distinct().all()
+        ).distinct())).all()
         
         exchanges = [exchange[0] for exchange in exchanges_query if exchange[0]]
         
@@ -422,15 +502,15 @@ async def get_exchanges(db: Session = Depends(get_db)):
         raise HTTPException(status_code=500, detail=f"内部服务器错误 / Internal server error: {str(e)}")
 
 @app.get("/assets", summary="获取标的资产列表 / Get underlying assets list")
-async def get_underlying_assets(db: Session = Depends(get_db)):
+async def get_underlying_assets(db: AsyncSession = Depends(get_async_db)):
     """
     获取所有标的资产列表
     Get all underlying assets list
     """
     try:
-        assets_query = db.query(ChineseFutures.underlying_asset).filter(
+        assets_query = (await db.execute(select(ChineseFutures.underlying_asset).where(
             and_(ChineseFutures.underlying_asset.isnot(None), ChineseFutures.underlying_asset != "", ChineseFutures.is_active == True)
-        ).distinct().all()
+        ).distinct())).all()
         
         assets = [asset[0] for asset in assets_query if asset[0]]
         
@@ -447,19 +527,19 @@ async def get_underlying_assets(db: Session = Depends(get_db)):
 async def get_contracts_by_asset(
     underlying_asset: str,
     active_only: bool = Query(True, description="只显示活跃合约 / Show active contracts only"),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     获取指定标的资产的所有合约
     Get all contracts for a specific underlying asset
     """
     try:
-        query = db.query(ChineseFutures).filter(ChineseFutures.underlying_asset.contains(underlying_asset))
+        query = select(ChineseFutures).where(ChineseFutures.underlying_asset.contains(underlying_asset))
         
         if active_only:
-            query = query.filter(ChineseFutures.is_active == True)
+            query = query.where(ChineseFutures.is_active == True)
         
-        contracts = query.order_by(ChineseFutures.contract_month.asc()).all()
+        contracts = (await db.execute(query.order_by(ChineseFutures.contract_month.asc()))).scalars().all()
         
         contracts_data = []
         for contract in contracts:
@@ -485,49 +565,52 @@ async def get_contracts_by_asset(
         logger.error(f"获取合约列表失败 / Failed to get contracts: {str(e)}")
         raise HTTPException(status_code=500, detail=f"内部服务器错误 / Internal server error: {str(e)}")
 
+@app.get("/metrics/latency", summary="获取接口延迟汇总 / Get API latency rollups")
+async def get_latency_metrics(
+    resolution: str = Query("hour", description="汇总粒度 minute/hour/day / Rollup resolution"),
+    start: Optional[datetime] = Query(None, description="开始时间（UTC，默认按粒度回溯） / Start time in UTC"),
+    end: Optional[datetime] = Query(None, description="结束时间（UTC，默认为当前时间） / End time in UTC"),
+    endpoint: Optional[str] = Query(None, description="路由模板，如 /stats / Route template, e.g. /stats"),
+    method: Optional[str] = Query(None, description="HTTP方法 / HTTP method"),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """
+    按端点查询延迟汇总：调用次数、错误率、平均/最大响应时间和 p50/p90/p95/p99
+    Query per-endpoint latency rollups: calls, error rate, avg/max latency and p50/p90/p95/p99
+    """
+    if resolution not in RESOLUTIONS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"不支持的汇总粒度 '{resolution}'，可选: {', '.join(RESOLUTIONS)} / "
+                   f"Unsupported resolution '{resolution}', available: {', '.join(RESOLUTIONS)}"
+        )
+    try:
+        end = end or datetime.utcnow()
+        start = start or end - DEFAULT_QUERY_WINDOWS[resolution]
+        result = await query_latency(db, "futures", resolution, start, end, endpoint, method)
+        result["rollup"] = latency_rollup.info()
+        return result
+    except Exception as e:
+        logger.error(f"获取接口延迟汇总失败 / Failed to get latency rollups: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"内部服务器错误 / Internal server error: {str(e)}")
+
 @app.get("/stats", summary="获取期货统计信息 / Get futures statistics")
-async def get_statistics(db: Session = Depends(get_db)):
+async def get_statistics(db: AsyncSession = Depends(get_async_db)):
     """
     获取期货服务统计信息
     Get futures service statistics
     """
     try:
-        # 统计活跃合约数量 / Count active contracts
-        active_contracts_count = db.query(ChineseFutures).filter(ChineseFutures.is_active == True).count()
-        
-        # 统计总合约数量 / Count total contracts
-        total_contracts_count = db.query(ChineseFutures).count()
-        
-        # 统计今日API调用次数 / Count today's API calls
-        today_start = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
-        today_api_calls = db.query(APILog).filter(
-            and_(
-                APILog.service_type == "futures",
-                APILog.created_at >= today_start
-            )
-        ).count()
-        
-        # 统计各交易所合约数量 / Count contracts by exchange
-        from sqlalchemy import func
-        exchange_stats = db.query(
-            ChineseFutures.exchange,
-            func.count(ChineseFutures.futures_code).label('count')
-        ).filter(ChineseFutures.is_active == True).group_by(ChineseFutures.exchange).all()
-        
-        exchange_distribution = {exchange: count for exchange, count in exchange_stats if exchange}
-        
-        # 统计各标的资产合约数量 / Count contracts by underlying asset
-        asset_stats = db.query(
-            ChineseFutures.underlying_asset,
-            func.count(ChineseFutures.futures_code).label('count')
-        ).filter(ChineseFutures.is_active == True).group_by(ChineseFutures.underlying_asset).all()
+        # 合约数量和分布来自内存统计 / Counts and distributions from the in-memory statistics
+        table_stats = await futures_stats.get()
         
-        asset_distribution = {asset: count for asset, count in asset_stats if asset}
+        # 今日API调用次数：汇总表一行 + 尚未写入的缓冲日志 / Today's API calls: rollup row plus buffered entries
+        api_calls_today = await today_api_calls(db, "futures", api_log_buffer.pending("futures"))
         
         # 获取最新更新的合约 / Get latest updated contracts
-        latest_updated_futures = db.query(ChineseFutures).filter(
+        latest_updated_futures = (await db.execute(select(ChineseFutures).where(
             ChineseFutures.is_active == True
-        ).order_by(ChineseFutures.last_updated.desc()).limit(5).all()
+        ).order_by(ChineseFutures.last_updated.desc()).limit(5))).scalars().all()
         
         latest_futures_data = []
         for futures in latest_updated_futures:
@@ -544,11 +627,11 @@ async def get_statistics(db: Session = Depends(get_db)):
         return {
             "service": "Chinese Futures Service",
             "statistics": {
-                "active_contracts_count": active_contracts_count,
-                "total_contracts_count": total_contracts_count,
-                "today_api_calls": today_api_calls,
-                "exchange_distribution": exchange_distribution,
-                "asset_distribution": asset_distribution,
+                "active_contracts_count": table_stats.get("active_contracts_count", 0),
+                "total_contracts_count": table_stats.get("total_contracts_count", 0),
+                "today_api_calls": api_calls_today,
+                "exchange_distribution": dict(table_stats.get("exchange_distribution", {})),
+                "asset_distribution": dict(table_stats.get("asset_distribution", {})),
                 "latest_updated_contracts": latest_futures_data
             },
             "timestamp": datetime.utcnow().isoformat()
@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+"""
+HTTP条件请求与数据版本管理模块
+HTTP conditional-GET and data version module
+
+为 /stocks/{code}/* 接口生成基于数据版本的强ETag：
+- snapshot: 实时行情快照（五档行情内容摘要）
+- profile:  个股基本信息（内容摘要）
+- bars:     K线数据最后一个交易日及其收盘价、成交量
+- report:   财务报告最新报告期
+当客户端携带 If-None-Match 且所有依赖的数据版本仍然有效时，直接返回304，
+不再调用akshare、不再计算和序列化响应体。
+行情和K线版本的有效期不超过全市场快照的有效期；/live/* 实时接口总是执行处理函数，
+只在内容未变时返回304。
+"""
+import hashlib
+import re
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Iterable, Iterator, Optional, Tuple
+
+try:
+    from config import Config
+    DEFAULT_VERSION_TTL = Config.DATA_VERSION_TTL_SECONDS
+    SNAPSHOT_TTL = Config.MARKET_SNAPSHOT_TTL_SECONDS
+    GZIP_MINIMUM_SIZE = Config.GZIP_MINIMUM_SIZE
+except (ImportError, AttributeError):
+    DEFAULT_VERSION_TTL = 300
+    SNAPSHOT_TTL = 60
+    GZIP_MINIMUM_SIZE = 1000
+
+# 各类数据版本的有效期（秒）/ Validity window per data version kind
+# 盘中行情和当日K线随时在变，其版本的有效期不超过全市场快照的有效期
+# Intraday quotes and today's bar keep moving, so their versions expire no later than the market snapshot
+VERSION_TTLS = {
+    "snapshot": min(DEFAULT_VERSION_TTL, SNAPSHOT_TTL),
+    "profile": DEFAULT_VERSION_TTL,
+    "bars": min(DEFAULT_VERSION_TTL, SNAPSHOT_TTL),
+    "report": 6 * 3600,
+}
+
+# 路由后缀 -> 依赖的数据版本 / Route suffix -> data version kinds it depends on
+ROUTE_VERSION_KINDS = {
+    "": ("profile", "snapshot", "report"),
+    "/profile": ("profile",),
+    "/analysis/fundamental": ("profile", "report"),
+    "/analysis/technical": ("snapshot", "bars"),
+    "/historical/prices": ("bars",),
+    "/historical/financial": ("report",),
+    "/live/quote": ("snapshot",),
+    "/news/announcements": ("report",),
+}
+
+# 不做处理前304判断的路由：实时接口总是获取最新数据，再与客户端的ETag比较
+# Routes without the pre-handler 304 shortcut: live endpoints always fetch, then compare ETags
+PRECHECK_EXCLUDED_PREFIXES = ("/live/",)
+
+# 当前上下文中正在收集的数据版本（见 DataVersionRegistry.capture）/ Versions being captured in this context
+_captured_versions: ContextVar[Optional[Dict[Tuple[str, str], str]]] = ContextVar("captured_versions", default=None)
+
+_STOCK_ROUTE_PATTERN = re.compile(r"^/stocks/(?P<code>\d{6})(?P<suffix>(/[a-z\-]+)*)$")
+
+
+def digest_values(values: Any) -> str:
+    """对行情等数据生成短摘要，作为版本号 / Short digest of data used as a version token"""
+    return hashlib.sha1(repr(values).encode("utf-8")).hexdigest()[:16]
+
+
+def bars_version(kline_df) -> Optional[str]:
+    """K线数据版本：最后一根K线的日期、收盘价和成交量 / Version of a K-line frame"""
+    if kline_df is None or len(kline_df) == 0:
+        return None
+    last_bar = kline_df.iloc[-1]
+    return f"{last_bar['日期']}:{digest_values((last_bar['收盘'], last_bar['成交量']))}"
+
+
+def report_version(financial_df) -> Optional[str]:
+    """财务数据版本：最新报告期 / Version of a financial abstract frame: latest report period"""
+    if financial_df is None or len(financial_df) == 0:
+        return None
+    date_columns = [str(col) for col in financial_df.columns if str(col).isdigit() and len(str(col)) == 8]
+    return max(date_columns) if date_columns else None
+
+
+class DataVersionRegistry:
+    """数据版本登记表 / Registry of the latest known data version per stock"""
+
+    def __init__(self, ttls: Optional[Dict[str, int]] = None):
+        self.ttls = ttls or VERSION_TTLS
+        self._versions: Dict[Tuple[str, str], Tuple[str, float]] = {}
+        self._lock = threading.Lock()
+
+    def record(self, stock_code: str, kind: str, version: Any):
+        """登记数据版本 / Record a data version observed by a handler"""
+        if version is None or version == "":
+            return
+        with self._lock:
+            self._versions[(stock_code, kind)] = (str(version), time.monotonic())
+        captured = _captured_versions.get()
+        if captured is not None:
+            captured[(stock_code, kind)] = str(version)
+
+    @contextmanager
+    def capture(self) -> Iterator[Dict[Tuple[str, str], str]]:
+        """
+        收集本上下文中登记的数据版本，供响应缓存命中时重新登记
+        Collect versions recorded in this context so a cached response can re-record them on a hit
+        """
+        token = _captured_versions.set({})
+        try:
+            yield _captured_versions.get()
+        finally:
+            _captured_versions.reset(token)
+
+    def get(self, stock_code: str, kind: str, since: Optional[float] = None) -> Optional[str]:
+        """
+        获取仍在有效期内的数据版本；指定since时只接受该时间点之后登记的版本
+        Get a version still within its validity window, optionally only if recorded after `since`
+        """
+        with self._lock:
+            entry = self._versions.get((stock_code, kind))
+        if entry is None:
+            return None
+        version, recorded_at = entry
+        if since is not None and recorded_at < since:
+            return None
+        if time.monotonic() - recorded_at > self.ttls.get(kind, DEFAULT_VERSION_TTL):
+            return None
+        return version
+
+    def compose_etag(self, stock_code: str, kinds: Iterable[str], variant: str,
+                     since: Optional[float] = None) -> Optional[str]:
+        """
+        由依赖的数据版本组合出强ETag；任一版本未知或已过期时返回None
+        Compose a strong ETag from the dependent versions, None if any is unknown or stale
+        """
+        parts = [variant]
+        for kind in kinds:
+            version = self.get(stock_code, kind, since=since)
+            if version is None:
+                return None
+            parts.append(f"{kind}={version}")
+        return '"' + hashlib.sha1("|".join(parts).encode("utf-8")).hexdigest() + '"'
+
+
+def match_stock_route(path: str) -> Optional[Tuple[str, Tuple[str, ...], bool]]:
+    """
+    解析 /stocks/{code}/* 路由，返回股票代码、依赖的数据版本以及是否允许处理前304判断
+    Resolve stock code, version kinds and whether the pre-handler 304 shortcut applies for a path
+    """
+    match = _STOCK_ROUTE_PATTERN.match(path)
+    if not match:
+        return None
+    suffix = match.group("suffix") or ""
+    kinds = ROUTE_VERSION_KINDS.get(suffix)
+    if kinds is None:
+        return None
+    return match.group("code"), kinds, not suffix.startswith(PRECHECK_EXCLUDED_PREFIXES)
+
+
+def request_variant(path: str, query: str, accept_encoding: str) -> str:
+    """
+    同一数据版本下，不同查询参数和内容编码对应不同的表示
+    Different query strings and content encodings are distinct representations
+    """
+    encoding = "gzip" if "gzip" in (accept_encoding or "").lower() else "identity"
+    return f"{path}?{query}#{encoding}"
+
+
+def if_none_match(header_value: Optional[str], etag: str) -> bool:
+    """判断If-None-Match是否命中 / Whether If-None-Match matches the current ETag"""
+    if not header_value:
+        return False
+    if header_value.strip() == "*":
+        return True
+    # If-None-Match 使用弱比较 / If-None-Match uses weak comparison
+    candidates = [value.strip().replace("W/", "", 1) for value in header_value.split(",")]
+    return etag in candidates
+
+
+# 全局数据版本登记表 / Global data version registry
+data_versions = DataVersionRegistry()
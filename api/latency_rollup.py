@@ -0,0 +1,476 @@
+# -*- coding: utf-8 -*-
+"""
+接口延迟汇总模块
+API latency rollup module
+
+后台任务把 api_logs 中的原始请求日志按 服务/端点/方法 汇总为分钟、小时、天三个粒度的时间桶，
+写入 api_latency_rollups。每个桶保存调用次数、5xx错误次数、响应时间合计/最大值，
+以及一个可合并的对数分桶直方图（LatencySketch，相对误差 LATENCY_SKETCH_RELATIVE_ACCURACY），
+任意多个桶合并后仍可计算 p50/p90/p99，因此查询一天的分位数不需要扫描原始日志。
+- 按 (created_at, id) 增量处理，进度保存在 api_log_rollup_state，与汇总结果在同一事务中提交；
+  只处理早于 LATENCY_ROLLUP_SAFETY_LAG_SECONDS 的日志。日志ID按分配顺序而不是提交顺序可见，
+  按ID推进会跳过晚提交的日志，之后又被保留策略当作已汇总删除
+- 端点按路由模板归类（/stocks/{stock_code}），避免每个股票代码各占一行
+- 超过 API_LOG_RETENTION_DAYS 且已汇总的原始日志分批删除，各粒度汇总按各自的保留天数删除
+时间均为UTC，与 APILog.created_at 一致。
+"""
+import asyncio
+import json
+import logging
+import math
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import and_, delete, or_, select
+from sqlalchemy.dialects import postgresql, sqlite
+
+from database import APILatencyRollup, APILog, APILogRollupState, async_engine
+
+try:
+    from config import Config
+    ROLLUP_INTERVAL_SECONDS = Config.LATENCY_ROLLUP_INTERVAL_SECONDS
+    ROLLUP_BATCH_SIZE = Config.LATENCY_ROLLUP_BATCH_SIZE
+    ROLLUP_SAFETY_LAG_SECONDS = Config.LATENCY_ROLLUP_SAFETY_LAG_SECONDS
+    SKETCH_RELATIVE_ACCURACY = Config.LATENCY_SKETCH_RELATIVE_ACCURACY
+    API_LOG_RETENTION_DAYS = Config.API_LOG_RETENTION_DAYS
+    ROLLUP_RETENTION_DAYS = {
+        "minute": Config.LATENCY_MINUTE_RETENTION_DAYS,
+        "hour": Config.LATENCY_HOUR_RETENTION_DAYS,
+        "day": Config.LATENCY_DAY_RETENTION_DAYS,
+    }
+except (ImportError, AttributeError):
+    ROLLUP_INTERVAL_SECONDS = 60
+    ROLLUP_BATCH_SIZE = 5000
+    ROLLUP_SAFETY_LAG_SECONDS = 120
+    SKETCH_RELATIVE_ACCURACY = 0.01
+    API_LOG_RETENTION_DAYS = 7
+    ROLLUP_RETENTION_DAYS = {"minute": 2, "hour": 30, "day": 365}
+
+logger = logging.getLogger(__name__)
+
+RESOLUTIONS = ("minute", "hour", "day")
+QUANTILES = (0.5, 0.9, 0.95, 0.99)
+
+# 未指定开始时间时各粒度的默认查询范围 / Default query window per resolution when no start is given
+DEFAULT_QUERY_WINDOWS = {
+    "minute": timedelta(hours=1),
+    "hour": timedelta(days=1),
+    "day": timedelta(days=30),
+}
+
+# 不匹配任何路由的请求（404扫描等）归为一类 / Requests matching no route share one bucket
+UNMATCHED_ENDPOINT = "<unmatched>"
+
+# 每条upsert语句的行数上限，避免超出绑定参数限制 / Rows per upsert statement, under bind-parameter limits
+UPSERT_CHUNK_SIZE = 1000
+RETENTION_DELETE_BATCH = 10000
+
+# 小于该值的响应时间计入零桶 / Latencies below this count towards the zero bucket
+MIN_TRACKED_LATENCY = 1e-6
+
+_DIALECT_INSERTS = {
+    "postgresql": postgresql.insert,
+    "sqlite": sqlite.insert,
+}
+
+
+class LatencySketch:
+    """
+    可合并的对数分桶直方图 / Mergeable log-bucketed latency histogram
+
+    值 x 落在下标 ceil(log_gamma(x)) 的桶中，gamma = (1+a)/(1-a)，
+    每个桶的代表值与桶内任意值的相对误差不超过 a。两个精度相同的sketch合并只需把桶计数相加。
+    """
+
+    def __init__(self, relative_accuracy: float = SKETCH_RELATIVE_ACCURACY,
+                 bins: Optional[Dict[int, int]] = None, zero_count: int = 0):
+        self.relative_accuracy = relative_accuracy
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = math.log(self.gamma)
+        self.bins: Dict[int, int] = dict(bins or {})
+        self.zero_count = zero_count
+
+    @property
+    def count(self) -> int:
+        return self.zero_count + sum(self.bins.values())
+
+    def add(self, value: Optional[float], count: int = 1):
+        """加入一个响应时间（秒） / Record one latency in seconds"""
+        if value is None:
+            return
+        if value < MIN_TRACKED_LATENCY:
+            self.zero_count += count
+            return
+        index = math.ceil(math.log(value) / self._log_gamma)
+        self.bins[index] = self.bins.get(index, 0) + count
+
+    def merge(self, other: "LatencySketch"):
+        """合并另一个sketch / Merge another sketch into this one"""
+        if other.relative_accuracy != self.relative_accuracy:
+            raise ValueError("只能合并精度相同的sketch / Cannot merge sketches with different accuracy")
+        self.zero_count += other.zero_count
+        for index, count in other.bins.items():
+            self.bins[index] = self.bins.get(index, 0) + count
+
+    def quantile(self, q: float) -> Optional[float]:
+        """分位数（秒），空sketch返回None / Latency at quantile q, None when empty"""
+        total = self.count
+        if total == 0:
+            return None
+        rank = q * (total - 1)
+        seen = self.zero_count
+        if seen > rank:
+            return 0.0
+        for index in sorted(self.bins):
+            seen += self.bins[index]
+            if seen > rank:
+                return 2 * self.gamma ** index / (self.gamma + 1)
+        return 2 * self.gamma ** max(self.bins) / (self.gamma + 1)
+
+    def to_json(self) -> str:
+        return json.dumps(
+            {"a": self.relative_accuracy, "z": self.zero_count, "b": {str(k): v for k, v in self.bins.items()}},
+            separators=(",", ":")
+        )
+
+    @classmethod
+    def from_json(cls, raw: str) -> "LatencySketch":
+        payload = json.loads(raw)
+        return cls(payload["a"], {int(k): v for k, v in payload["b"].items()}, payload["z"])
+
+
+class _Bucket:
+    """一个汇总时间桶的累加器 / Accumulator for one rollup bucket"""
+
+    __slots__ = ("call_count", "error_count", "latency_sum", "latency_max", "sketch")
+
+    def __init__(self, sketch: Optional[LatencySketch] = None):
+        self.call_count = 0
+        self.error_count = 0
+        self.latency_sum = 0.0
+        self.latency_max = 0.0
+        self.sketch = sketch or LatencySketch()
+
+    def add(self, response_status: Optional[int], response_time: Optional[float]):
+        self.call_count += 1
+        if (response_status or 0) >= 500:
+            self.error_count += 1
+        if response_time is not None:
+            self.latency_sum += response_time
+            self.latency_max = max(self.latency_max, response_time)
+            self.sketch.add(response_time)
+
+    def merge_row(self, row: APILatencyRollup):
+        self.call_count += row.call_count
+        self.error_count += row.error_count
+        self.latency_sum += row.latency_sum
+        self.latency_max = max(self.latency_max, row.latency_max)
+        self.sketch.merge(LatencySketch.from_json(row.sketch))
+
+    def summary(self) -> Dict[str, Any]:
+        measured = self.sketch.count
+        result = {
+            "call_count": self.call_count,
+            "error_count": self.error_count,
+            "error_rate": round(self.error_count / self.call_count, 4) if self.call_count else 0,
+            "avg_ms": round(self.latency_sum / measured * 1000, 2) if measured else None,
+            "max_ms": round(self.latency_max * 1000, 2) if measured else None,
+        }
+        for q in QUANTILES:
+            value = self.sketch.quantile(q)
+            result[f"p{int(q * 100)}_ms"] = round(value * 1000, 2) if value is not None else None
+        return result
+
+
+def truncate(moment: datetime, resolution: str) -> datetime:
+    """时间所在汇总桶的开始时间 / Start of the rollup bucket containing `moment`"""
+    if resolution == "minute":
+        return moment.replace(second=0, microsecond=0)
+    if resolution == "hour":
+        return moment.replace(minute=0, second=0, microsecond=0)
+    if resolution == "day":
+        return moment.replace(hour=0, minute=0, second=0, microsecond=0)
+    raise ValueError(f"不支持的汇总粒度 '{resolution}'，可选: {', '.join(RESOLUTIONS)} / "
+                     f"Unsupported resolution '{resolution}', available: {', '.join(RESOLUTIONS)}")
+
+
+def route_normalizer(routes: Iterable[Any]) -> Callable[[str, str], str]:
+    """
+    按应用路由把请求路径和方法归类为路由模板 / Map request paths and methods onto the app's route templates
+
+    路径和方法都匹配的路由优先（POST /stocks/bulk-refresh 不会归入 GET /stocks/{stock_code}）；
+    只有路径匹配时（405响应）归入第一个路径匹配的路由。
+
+    Args:
+        routes: FastAPI/Starlette 的 app.routes（需要 path 和 path_regex 属性）；
+                首次调用时才读取，因此可以在模块中路由注册之前创建
+    """
+    patterns: List[Tuple[Any, Optional[set], str]] = []
+
+    def normalize(path: str, method: str) -> str:
+        if not patterns:
+            patterns.extend((route.path_regex, getattr(route, "methods", None), route.path)
+                            for route in routes if hasattr(route, "path_regex"))
+        path_match = None
+        for regex, methods, template in patterns:
+            if regex.match(path):
+                if methods is None or method in methods:
+                    return template
+                path_match = path_match or template
+        return path_match or UNMATCHED_ENDPOINT
+
+    return normalize
+
+
+class LatencyRollupJob:
+    """单个服务的延迟汇总与日志保留任务 / Latency rollup and log retention job for one service"""
+
+    def __init__(self, service_type: str, normalize: Optional[Callable[[str, str], str]] = None,
+                 engine=async_engine, interval_seconds: int = ROLLUP_INTERVAL_SECONDS,
+                 batch_size: int = ROLLUP_BATCH_SIZE, safety_lag_seconds: float = ROLLUP_SAFETY_LAG_SECONDS):
+        self.service_type = service_type
+        self.normalize = normalize or (lambda path, method: path)
+        self.engine = engine
+        self.interval_seconds = interval_seconds
+        self.batch_size = batch_size
+        self.safety_lag_seconds = safety_lag_seconds
+        self.last_result: Optional[Dict[str, Any]] = None
+        self.last_error: Optional[str] = None
+        self._task: Optional[asyncio.Task] = None
+        self._lock = asyncio.Lock()
+
+    def _upsert(self, model, rows: List[Dict[str, Any]], index_elements: List[Any]):
+        dialect_insert = _DIALECT_INSERTS.get(self.engine.dialect.name)
+        if dialect_insert is None:
+            raise ValueError(f"不支持延迟汇总的数据库 / Latency rollups not supported on {self.engine.dialect.name}")
+        statement = dialect_insert(model).values(rows)
+        key_names = {column.name for column in index_elements}
+        return statement.on_conflict_do_update(
+            index_elements=index_elements,
+            set_={name: statement.excluded[name] for name in rows[0] if name not in key_names}
+        )
+
+    async def _watermark(self, conn) -> Tuple[Optional[datetime], int]:
+        """已汇总到的 (created_at, id) / Position of the last log rolled up"""
+        state = (await conn.execute(
+            select(APILogRollupState.last_created_at, APILogRollupState.last_log_id)
+            .where(APILogRollupState.service_type == self.service_type)
+        )).first()
+        return (state.last_created_at, state.last_log_id) if state else (None, 0)
+
+    async def _rollup_batch(self, cutoff: datetime) -> int:
+        """
+        汇总一批早于 cutoff 的原始日志，返回处理条数
+        Roll up one batch of raw logs created before `cutoff`, returns the number of logs read
+        """
+        async with self.engine.begin() as conn:
+            last_created_at, last_log_id = await self._watermark(conn)
+            conditions = [APILog.service_type == self.service_type, APILog.created_at < cutoff]
+            if last_created_at is not None:
+                conditions.append(or_(
+                    APILog.created_at > last_created_at,
+                    and_(APILog.created_at == last_created_at, APILog.id > last_log_id)
+                ))
+            logs = (await conn.execute(
+                select(APILog.id, APILog.endpoint, APILog.method, APILog.response_status,
+                       APILog.response_time, APILog.created_at)
+                .where(and_(*conditions))
+                .order_by(APILog.created_at, APILog.id)
+                .limit(self.batch_size)
+            )).all()
+            if not logs:
+                return 0
+
+            buckets: Dict[Tuple[str, datetime, str, str], _Bucket] = {}
+            for log in logs:
+                endpoint = self.normalize(log.endpoint, log.method)
+                for resolution in RESOLUTIONS:
+                    key = (resolution, truncate(log.created_at, resolution), endpoint, log.method)
+                    bucket = buckets.get(key)
+                    if bucket is None:
+                        bucket = buckets[key] = _Bucket()
+                    bucket.add(log.response_status, log.response_time)
+
+            # 与已有的桶合并 / Merge with buckets already stored
+            for resolution in RESOLUTIONS:
+                starts = {key[1] for key in buckets if key[0] == resolution}
+                existing = (await conn.execute(select(APILatencyRollup).where(and_(
+                    APILatencyRollup.service_type == self.service_type,
+                    APILatencyRollup.resolution == resolution,
+                    APILatencyRollup.bucket_start.in_(starts)
+                )))).all()
+                for row in existing:
+                    bucket = buckets.get((resolution, row.bucket_start, row.endpoint, row.method))
+                    if bucket is not None:
+                        bucket.merge_row(row)
+
+            records = [
+                {
+                    "service_type": self.service_type,
+                    "resolution": resolution,
+                    "bucket_start": start,
+                    "endpoint": endpoint,
+                    "method": method,
+                    "call_count": bucket.call_count,
+                    "error_count": bucket.error_count,
+                    "latency_sum": bucket.latency_sum,
+                    "latency_max": bucket.latency_max,
+                    "sketch": bucket.sketch.to_json(),
+                }
+                for (resolution, start, endpoint, method), bucket in buckets.items()
+            ]
+            rollup_keys = [APILatencyRollup.service_type, APILatencyRollup.resolution,
+                           APILatencyRollup.bucket_start, APILatencyRollup.endpoint, APILatencyRollup.method]
+            for offset in range(0, len(records), UPSERT_CHUNK_SIZE):
+                await conn.execute(self._upsert(APILatencyRollup, records[offset:offset + UPSERT_CHUNK_SIZE], rollup_keys))
+            await conn.execute(self._upsert(
+                APILogRollupState,
+                [{"service_type": self.service_type, "last_created_at": logs[-1].created_at,
+                  "last_log_id": logs[-1].id, "updated_at": datetime.utcnow()}],
+                [APILogRollupState.service_type]
+            ))
+        return len(logs)
+
+    async def rollup(self, now: Optional[datetime] = None) -> Dict[str, Any]:
+        """
+        汇总所有早于安全延迟的未处理日志
+        Roll up every log not yet processed that is older than the safety lag
+        """
+        started = time.perf_counter()
+        cutoff = (now or datetime.utcnow()) - timedelta(seconds=self.safety_lag_seconds)
+        processed = 0
+        while True:
+            count = await self._rollup_batch(cutoff)
+            processed += count
+            if count < self.batch_size:
+                break
+        return {"logs_rolled_up": processed, "rollup_ms": round((time.perf_counter() - started) * 1000, 2)}
+
+    async def enforce_retention(self, now: Optional[datetime] = None) -> Dict[str, Any]:
+        """
+        删除过期的原始日志（仅限已汇总的）和汇总数据
+        Delete raw logs past retention that were already rolled up, and expired rollups
+        """
+        now = now or datetime.utcnow()
+        async with self.engine.connect() as conn:
+            last_created_at, last_log_id = await self._watermark(conn)
+
+        raw_deleted = 0
+        raw_cutoff = now - timedelta(days=API_LOG_RETENTION_DAYS)
+        while last_created_at is not None:
+            async with self.engine.begin() as conn:
+                # 只删除汇总位置及之前的日志 / Only logs at or before the rollup position
+                expired_ids = select(APILog.id).where(and_(
+                    APILog.service_type == self.service_type,
+                    APILog.created_at < raw_cutoff,
+                    or_(APILog.created_at < last_created_at,
+                        and_(APILog.created_at == last_created_at, APILog.id <= last_log_id))
+                )).limit(RETENTION_DELETE_BATCH)
+                result = await conn.execute(delete(APILog).where(APILog.id.in_(expired_ids)))
+            raw_deleted += result.rowcount
+            if result.rowcount < RETENTION_DELETE_BATCH:
+                break
+
+        rollups_deleted = 0
+        async with self.engine.begin() as conn:
+            for resolution, days in ROLLUP_RETENTION_DAYS.items():
+                result = await conn.execute(delete(APILatencyRollup).where(and_(
+                    APILatencyRollup.service_type == self.service_type,
+                    APILatencyRollup.resolution == resolution,
+                    APILatencyRollup.bucket_start < truncate(now - timedelta(days=days), resolution)
+                )))
+                rollups_deleted += result.rowcount
+        return {"raw_logs_deleted": raw_deleted, "rollups_deleted": rollups_deleted}
+
+    async def run_once(self) -> Dict[str, Any]:
+        """汇总并执行保留策略；并发调用串行执行 / Roll up then apply retention; concurrent calls are serialized"""
+        async with self._lock:
+            try:
+                result = await self.rollup()
+                result.update(await self.enforce_retention())
+                self.last_result = result
+                self.last_error = None
+                if result["logs_rolled_up"] or result["raw_logs_deleted"]:
+                    logger.info(f"{self.service_type} 延迟汇总完成: {result}")
+                return result
+            except Exception as e:
+                self.last_error = str(e)
+                raise
+
+    async def _loop(self):
+        while True:
+            try:
+                await self.run_once()
+            except Exception as e:
+                logger.error(f"{self.service_type} 延迟汇总失败 / Latency rollup failed: {str(e)}")
+            await asyncio.sleep(self.interval_seconds)
+
+    def start(self):
+        """启动定时汇总 / Start the periodic rollup"""
+        if self.interval_seconds > 0 and (self._task is None or self._task.done()):
+            self._task = asyncio.create_task(self._loop())
+
+    async def stop(self):
+        """停止定时汇总 / Stop the periodic rollup"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def info(self) -> Dict[str, Any]:
+        return {
+            "interval_seconds": self.interval_seconds,
+            "last_result": self.last_result,
+            "last_error": self.last_error
+        }
+
+
+async def query_latency(db, service_type: str, resolution: str, start: datetime, end: datetime,
+                        endpoint: Optional[str] = None, method: Optional[str] = None) -> Dict[str, Any]:
+    """
+    查询延迟汇总：每个时间桶的统计，以及整个时间范围内按端点合并的统计
+    Per-bucket rollups plus a per-endpoint summary merged over the whole range
+
+    Raises:
+        ValueError: 汇总粒度无效
+    """
+    if start.tzinfo is not None:
+        start = start.astimezone(timezone.utc).replace(tzinfo=None)
+    if end.tzinfo is not None:
+        end = end.astimezone(timezone.utc).replace(tzinfo=None)
+    start = truncate(start, resolution)
+    conditions = [
+        APILatencyRollup.service_type == service_type,
+        APILatencyRollup.resolution == resolution,
+        APILatencyRollup.bucket_start >= start,
+        APILatencyRollup.bucket_start < end,
+    ]
+    if endpoint:
+        conditions.append(APILatencyRollup.endpoint == endpoint)
+    if method:
+        conditions.append(APILatencyRollup.method == method.upper())
+    rows = (await db.execute(
+        select(APILatencyRollup).where(and_(*conditions)).order_by(APILatencyRollup.bucket_start)
+    )).scalars().all()
+
+    series = []
+    totals: Dict[Tuple[str, str], _Bucket] = {}
+    for row in rows:
+        bucket = _Bucket()
+        bucket.merge_row(row)
+        series.append({"bucket_start": row.bucket_start.isoformat(), "endpoint": row.endpoint,
+                       "method": row.method, **bucket.summary()})
+        total = totals.setdefault((row.endpoint, row.method), _Bucket())
+        total.merge_row(row)
+
+    endpoints = [
+        {"endpoint": endpoint_name, "method": method_name, **total.summary()}
+        for (endpoint_name, method_name), total in totals.items()
+    ]
+    endpoints.sort(key=lambda item: item["call_count"], reverse=True)
+    return {"resolution": resolution, "start": start.isoformat(), "end": end.isoformat(),
+            "endpoints": endpoints, "buckets": series}
@@ -0,0 +1,216 @@
+# -*- coding: utf-8 -*-
+"""
+API日志缓冲写入模块
+Buffered API log writer module
+
+请求日志不再在每个请求的响应路径上同步插入数据库：
+- 中间件只把日志条目放入内存队列（不阻塞、不等待数据库）
+- 后台任务按批量大小或时间间隔批量写入，PostgreSQL(asyncpg)使用COPY，其他数据库使用批量INSERT
+- 队列满时（数据库变慢或不可用）直接丢弃新条目并计数，保护请求处理
+- 应用关闭时刷新队列中剩余的日志
+- 每批写入时在同一事务中累加 api_call_daily 每日调用汇总，供 /stats 读取
+"""
+import asyncio
+import logging
+import time
+from collections import Counter
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import insert
+from sqlalchemy.dialects import postgresql, sqlite
+
+from database import APICallDaily, APILog, async_engine
+
+try:
+    from config import Config
+    LOG_BUFFER_MAX_SIZE = Config.LOG_BUFFER_MAX_SIZE
+    LOG_BATCH_SIZE = Config.LOG_BATCH_SIZE
+    LOG_FLUSH_INTERVAL_SECONDS = Config.LOG_FLUSH_INTERVAL_SECONDS
+except (ImportError, AttributeError):
+    LOG_BUFFER_MAX_SIZE = 10000
+    LOG_BATCH_SIZE = 500
+    LOG_FLUSH_INTERVAL_SECONDS = 2.0
+
+logger = logging.getLogger(__name__)
+
+_DIALECT_INSERTS = {
+    "postgresql": postgresql.insert,
+    "sqlite": sqlite.insert,
+}
+
+# COPY写入的列顺序 / Column order used for COPY
+LOG_COLUMNS = (
+    "service_type", "endpoint", "method", "request_params", "response_status",
+    "response_time", "client_ip", "error_message", "created_at",
+)
+
+
+class APILogBuffer:
+    """API日志缓冲区 / In-process buffer that batches APILog inserts"""
+
+    def __init__(self, engine=async_engine, max_size: int = LOG_BUFFER_MAX_SIZE,
+                 batch_size: int = LOG_BATCH_SIZE, flush_interval: float = LOG_FLUSH_INTERVAL_SECONDS):
+        self.engine = engine
+        self.max_size = max_size
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self._closing = False
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+        self.batches = 0
+        self.last_flush_ms: Optional[float] = None
+        self.last_error: Optional[str] = None
+        self._pending_by_service: Counter = Counter()
+
+    @property
+    def use_copy(self) -> bool:
+        return self.engine.dialect.name == "postgresql" and self.engine.dialect.driver == "asyncpg"
+
+    def enqueue(self, service_type: str, endpoint: str, method: str, request_params: Optional[str] = None,
+                response_status: Optional[int] = None, response_time: Optional[float] = None,
+                client_ip: Optional[str] = None, error_message: Optional[str] = None):
+        """
+        放入一条日志，不等待数据库；缓冲区满时丢弃并计数
+        Enqueue a log entry without waiting on the database; drops and counts when full
+        """
+        if self._queue is None:
+            self._queue = asyncio.Queue(maxsize=self.max_size)
+        try:
+            self._queue.put_nowait({
+                "service_type": service_type,
+                "endpoint": endpoint,
+                "method": method,
+                "request_params": request_params,
+                "response_status": response_status,
+                "response_time": response_time,
+                "client_ip": client_ip,
+                "error_message": error_message,
+                "created_at": datetime.utcnow(),
+            })
+            self._pending_by_service[service_type] += 1
+        except asyncio.QueueFull:
+            self.dropped += 1
+            if self.dropped % 1000 == 1:
+                logger.warning(f"API日志缓冲区已满，累计丢弃 {self.dropped} 条 / Log buffer full, dropped {self.dropped}")
+
+    def start(self):
+        """启动后台刷新任务 / Start the background flush task"""
+        if self._queue is None:
+            self._queue = asyncio.Queue(maxsize=self.max_size)
+        self._closing = False
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """停止后台任务并写入剩余日志 / Stop the flush task and write whatever is still buffered"""
+        self._closing = True
+        if self._task is not None:
+            # 后台任务最多在一个刷新间隔内结束当前批次 / The task finishes its current batch within one interval
+            await self._task
+            self._task = None
+        while self._queue is not None and not self._queue.empty():
+            await self._flush(self._drain(self.batch_size))
+
+    def pending(self, service_type: str) -> int:
+        """已入队但尚未写入的条数 / Entries for a service that are queued or being written"""
+        return self._pending_by_service.get(service_type, 0)
+
+    def _drain(self, limit: int) -> List[Dict[str, Any]]:
+        batch = []
+        while len(batch) < limit and not self._queue.empty():
+            batch.append(self._queue.get_nowait())
+        return batch
+
+    async def _run(self):
+        while not self._closing:
+            # 等待第一条日志，然后在间隔内尽量凑满一批 / Wait for one entry, then fill a batch within the interval
+            try:
+                batch = [await asyncio.wait_for(self._queue.get(), timeout=self.flush_interval)]
+            except asyncio.TimeoutError:
+                continue
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                batch.extend(self._drain(self.batch_size - len(batch)))
+                remaining = deadline - time.monotonic()
+                if len(batch) >= self.batch_size or remaining <= 0 or self._closing:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout=remaining))
+                except asyncio.TimeoutError:
+                    break
+            await self._flush(batch)
+
+    async def _flush(self, batch: List[Dict[str, Any]]):
+        if not batch:
+            return
+        started = time.perf_counter()
+        try:
+            async with self.engine.begin() as conn:
+                if self.use_copy:
+                    raw_connection = await conn.get_raw_connection()
+                    await raw_connection.driver_connection.copy_records_to_table(
+                        APILog.__tablename__,
+                        records=[tuple(entry[column] for column in LOG_COLUMNS) for entry in batch],
+                        columns=list(LOG_COLUMNS)
+                    )
+                else:
+                    await conn.execute(insert(APILog), batch)
+                await self._increment_daily_counts(conn, batch)
+            self.written += len(batch)
+            self.batches += 1
+            self.last_error = None
+        except Exception as e:
+            # 写入失败不重试，避免在数据库变慢时积压 / No retry so a slow DB cannot build a backlog
+            self.failed += len(batch)
+            self.last_error = str(e)
+            logger.error(f"API日志批量写入失败 / Failed to write {len(batch)} log entries: {str(e)}")
+        finally:
+            for entry in batch:
+                self._pending_by_service[entry["service_type"]] -= 1
+            self.last_flush_ms = round((time.perf_counter() - started) * 1000, 2)
+
+    async def _increment_daily_counts(self, conn, batch: List[Dict[str, Any]]):
+        """在写入日志的同一事务中累加每日调用汇总 / Add the batch to the daily rollup in the same transaction"""
+        dialect_insert = _DIALECT_INSERTS.get(self.engine.dialect.name)
+        if dialect_insert is None:
+            return
+        calls: Counter = Counter()
+        errors: Counter = Counter()
+        for entry in batch:
+            key = (entry["service_type"], entry["created_at"].date())
+            calls[key] += 1
+            if (entry["response_status"] or 0) >= 500:
+                errors[key] += 1
+        statement = dialect_insert(APICallDaily).values([
+            {"service_type": service_type, "day": day, "call_count": count, "error_count": errors[(service_type, day)]}
+            for (service_type, day), count in calls.items()
+        ])
+        await conn.execute(statement.on_conflict_do_update(
+            index_elements=[APICallDaily.service_type, APICallDaily.day],
+            set_={
+                "call_count": APICallDaily.call_count + statement.excluded.call_count,
+                "error_count": APICallDaily.error_count + statement.excluded.error_count
+            }
+        ))
+
+    def stats(self) -> Dict[str, Any]:
+        """缓冲区状态 / Buffer status"""
+        return {
+            "buffered": self._queue.qsize() if self._queue is not None else 0,
+            "max_size": self.max_size,
+            "written": self.written,
+            "dropped": self.dropped,
+            "failed": self.failed,
+            "batches": self.batches,
+            "last_flush_ms": self.last_flush_ms,
+            "last_error": self.last_error,
+            "mode": "copy" if self.use_copy else "bulk_insert"
+        }
+
+
+# 全局日志缓冲区 / Global log buffer
+api_log_buffer = APILogBuffer()
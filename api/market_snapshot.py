@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+"""
+全市场行情快照模块
+Shared whole-market snapshot module
+
+ak.stock_zh_a_spot_em() 一次返回全部A股（约5000只）的实时行情，
+单只股票的接口此前每次请求都重新下载整张表。这里在进程内共享一份快照：
+- 在有效期内直接复用，过期后由第一个请求刷新，并发请求等待同一次刷新
+- 刷新在线程池中执行，不阻塞事件循环
+- 按股票代码建立索引，批量查询一次完成
+"""
+import asyncio
+import logging
+import time
+from datetime import datetime
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+import akshare as ak
+
+try:
+    from config import Config
+    SNAPSHOT_TTL_SECONDS = Config.MARKET_SNAPSHOT_TTL_SECONDS
+    PROFILE_CACHE_TTL_SECONDS = Config.PROFILE_CACHE_TTL_SECONDS
+except (ImportError, AttributeError):
+    SNAPSHOT_TTL_SECONDS = 60
+    PROFILE_CACHE_TTL_SECONDS = 6 * 3600
+
+logger = logging.getLogger(__name__)
+
+
+class MarketSnapshot:
+    """全市场行情快照 / Whole-market spot snapshot indexed by stock code"""
+
+    def __init__(self, ttl_seconds: int = SNAPSHOT_TTL_SECONDS):
+        self.ttl_seconds = ttl_seconds
+        self.frame = None
+        self.rows: Dict[str, Dict[str, Any]] = {}
+        self.fetched_at: Optional[datetime] = None
+        self._fetched_monotonic = 0.0
+        self._lock = asyncio.Lock()
+        self._listeners: List[Callable[[Dict[str, Dict[str, Any]]], Any]] = []
+
+    def add_listener(self, listener: Callable[[Dict[str, Dict[str, Any]]], Any]):
+        """
+        注册快照刷新回调，参数为按代码索引的行；协程函数直接等待，普通函数在线程池中执行
+        Register a refresh callback given the rows by code; coroutines are awaited, plain functions run in a worker thread
+        """
+        self._listeners.append(listener)
+
+    @property
+    def is_fresh(self) -> bool:
+        return self.frame is not None and time.monotonic() - self._fetched_monotonic < self.ttl_seconds
+
+    @property
+    def age_seconds(self) -> Optional[float]:
+        if self.frame is None:
+            return None
+        return round(time.monotonic() - self._fetched_monotonic, 3)
+
+    async def refresh(self, force: bool = False) -> bool:
+        """
+        刷新快照；并发调用只触发一次上游下载
+        Refresh the snapshot; concurrent callers share a single upstream download
+        """
+        async with self._lock:
+            if self.is_fresh and not force:
+                return True
+            try:
+                frame = await asyncio.to_thread(ak.stock_zh_a_spot_em)
+            except Exception as e:
+                logger.error(f"全市场行情快照刷新失败: {e}")
+                return self.frame is not None
+            if frame is None or frame.empty:
+                logger.warning("全市场行情快照为空")
+                return self.frame is not None
+            self._apply(frame)
+            await self._notify()
+            return True
+
+    async def _notify(self):
+        for listener in self._listeners:
+            try:
+                if asyncio.iscoroutinefunction(listener):
+                    await listener(self.rows)
+                else:
+                    await asyncio.to_thread(listener, self.rows)
+            except Exception as e:
+                logger.error(f"快照刷新回调失败: {e}")
+
+    def _apply(self, frame):
+        frame = frame.fillna(0)
+        columns = list(frame.columns)
+        rows = {}
+        for values in frame.itertuples(index=False, name=None):
+            row = dict(zip(columns, values))
+            rows[str(row.get('代码', ''))] = row
+        self.frame = frame
+        self.rows = rows
+        self.fetched_at = datetime.now()
+        self._fetched_monotonic = time.monotonic()
+        logger.info(f"全市场行情快照已刷新: {len(rows)} 只股票")
+
+    async def get_rows(self, stock_codes: Iterable[str]) -> Dict[str, Dict[str, Any]]:
+        """一次查询多只股票的快照行，缺失的代码不在结果中 / Look up many codes in one pass"""
+        if not self.is_fresh:
+            await self.refresh()
+        return {code: self.rows[code] for code in stock_codes if code in self.rows}
+
+    async def get_row(self, stock_code: str) -> Optional[Dict[str, Any]]:
+        """查询单只股票的快照行 / Look up a single code"""
+        rows = await self.get_rows([stock_code])
+        return rows.get(stock_code)
+
+    def info(self) -> Dict[str, Any]:
+        """快照状态 / Snapshot status"""
+        return {
+            "fetched_at": self.fetched_at.isoformat() if self.fetched_at else None,
+            "age_seconds": self.age_seconds,
+            "ttl_seconds": self.ttl_seconds,
+            "stock_count": len(self.rows)
+        }
+
+
+class TTLCache:
+    """简单的进程内TTL缓存 / Minimal in-process TTL cache"""
+
+    def __init__(self, ttl_seconds: int):
+        self.ttl_seconds = ttl_seconds
+        self._entries: Dict[str, Any] = {}
+
+    def get(self, key: str) -> Optional[Any]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        value, stored_at = entry
+        if time.monotonic() - stored_at > self.ttl_seconds:
+            self._entries.pop(key, None)
+            return None
+        return value
+
+    def set(self, key: str, value: Any):
+        self._entries[key] = (value, time.monotonic())
+
+
+def spot_row_to_quote(row: Dict[str, Any]) -> Dict[str, Any]:
+    """快照行转换为标准报价 / Convert a snapshot row into a normalized quote"""
+    return {
+        "stock_name": row.get("名称", ""),
+        "current_price": float(row.get("最新价", 0)),
+        "change": float(row.get("涨跌额", 0)),
+        "change_percent": float(row.get("涨跌幅", 0)),
+        "high": float(row.get("最高", 0)),
+        "low": float(row.get("最低", 0)),
+        "open": float(row.get("今开", 0)),
+        "previous_close": float(row.get("昨收", 0)),
+        "volume": float(row.get("成交量", 0)),
+        "amount": float(row.get("成交额", 0)),
+        "turnover_rate": float(row.get("换手率", 0)),
+        "volume_ratio": float(row.get("量比", 0))
+    }
+
+
+def spot_row_to_valuation(row: Dict[str, Any]) -> Dict[str, Any]:
+    """快照行中的估值指标 / Valuation metrics from a snapshot row"""
+    return {
+        "pe_ratio": float(row.get("市盈率-动态", 0)),
+        "pb_ratio": float(row.get("市净率", 0)),
+        "market_cap": float(row.get("总市值", 0)),
+        "circulating_market_cap": float(row.get("流通市值", 0))
+    }
+
+
+# 全局共享实例 / Shared instances
+market_snapshot = MarketSnapshot()
+profile_cache = TTLCache(PROFILE_CACHE_TTL_SECONDS)
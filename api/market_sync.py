@@ -0,0 +1,215 @@
+# -*- coding: utf-8 -*-
+"""
+全市场股票数据批量同步模块
+Whole-market bulk sync of the chinese_stocks table
+
+从一份全市场行情快照（约5000只A股）生成 INSERT ... ON CONFLICT DO UPDATE 语句，
+在同一个事务中分批写入 chinese_stocks，使 /stocks 列表、/stats 和搜索始终有完整且新鲜的数据。
+每批输出行数和耗时。
+
+单独运行 / Run once from the command line:
+    python market_sync.py
+"""
+import asyncio
+import logging
+import time
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional
+
+from sqlalchemy.dialects import postgresql, sqlite
+
+from akshare_service import AkshareService
+from database import ChineseStock, async_engine
+from market_snapshot import market_snapshot
+
+try:
+    from config import Config
+    BULK_UPSERT_BATCH_SIZE = Config.BULK_UPSERT_BATCH_SIZE
+    MARKET_SYNC_INTERVAL_SECONDS = Config.MARKET_SYNC_INTERVAL_SECONDS
+except (ImportError, AttributeError):
+    BULK_UPSERT_BATCH_SIZE = 1000
+    MARKET_SYNC_INTERVAL_SECONDS = 300
+
+logger = logging.getLogger(__name__)
+
+akshare_service = AkshareService()
+
+# 冲突时更新的列；名称英文、公司背景、创建时间和活跃状态保留原值
+# （is_active 只在新增时设为True，通过 DELETE /stocks/{code} 停用的股票不会被同步重新激活）
+# Columns refreshed on conflict; English name, background, created_at and is_active keep their stored values
+UPSERT_UPDATE_COLUMNS = (
+    "stock_name_cn", "current_price", "price_change", "price_change_pct", "open_price", "close_price",
+    "high_price", "low_price", "volume", "turnover", "pe_ratio", "pb_ratio", "market_cap",
+    "total_shares", "last_updated",
+)
+
+_DIALECT_INSERTS = {
+    "postgresql": postgresql.insert,
+    "sqlite": sqlite.insert,
+}
+
+
+def snapshot_row_to_stock(row: Dict[str, Any], now: datetime) -> Dict[str, Any]:
+    """快照行转换为 chinese_stocks 记录 / Map a snapshot row onto a chinese_stocks record"""
+    stock_name = str(row.get("名称", ""))
+    current_price = float(row.get("最新价", 0))
+    market_cap = float(row.get("总市值", 0))
+    return {
+        "stock_code": str(row.get("代码", "")),
+        "stock_name_cn": stock_name,
+        "stock_name_en": akshare_service._get_english_name(stock_name),
+        "current_price": current_price,
+        "price_change": float(row.get("涨跌额", 0)),
+        "price_change_pct": float(row.get("涨跌幅", 0)),
+        "open_price": float(row.get("今开", 0)),
+        "close_price": float(row.get("昨收", 0)),
+        "high_price": float(row.get("最高", 0)),
+        "low_price": float(row.get("最低", 0)),
+        "volume": float(row.get("成交量", 0)),
+        "turnover": float(row.get("成交额", 0)),
+        "pe_ratio": float(row.get("市盈率-动态", 0)),
+        "pb_ratio": float(row.get("市净率", 0)),
+        "market_cap": market_cap or None,
+        "total_shares": market_cap / current_price if market_cap and current_price else None,
+        "is_active": True,
+        "last_updated": now,
+        "created_at": now,
+    }
+
+
+def build_upsert(dialect_name: str, records: List[Dict[str, Any]]):
+    """构建一条多行 INSERT ... ON CONFLICT DO UPDATE 语句 / Build one multi-row upsert statement"""
+    dialect_insert = _DIALECT_INSERTS.get(dialect_name)
+    if dialect_insert is None:
+        raise ValueError(f"不支持批量upsert的数据库 / Bulk upsert not supported on {dialect_name}")
+    statement = dialect_insert(ChineseStock).values(records)
+    return statement.on_conflict_do_update(
+        index_elements=[ChineseStock.stock_code],
+        set_={column: statement.excluded[column] for column in UPSERT_UPDATE_COLUMNS}
+    )
+
+
+async def bulk_upsert_stocks(records: List[Dict[str, Any]], engine=async_engine,
+                             batch_size: int = BULK_UPSERT_BATCH_SIZE) -> Dict[str, Any]:
+    """
+    在一个事务中分批upsert，返回每批耗时
+    Upsert all records in one transaction, split into batches to stay under bind-parameter limits
+    """
+    batches = []
+    started = time.perf_counter()
+    async with engine.begin() as conn:
+        for offset in range(0, len(records), batch_size):
+            batch = records[offset:offset + batch_size]
+            batch_started = time.perf_counter()
+            await conn.execute(build_upsert(engine.dialect.name, batch))
+            elapsed_ms = round((time.perf_counter() - batch_started) * 1000, 2)
+            batches.append({"batch": len(batches) + 1, "rows": len(batch), "elapsed_ms": elapsed_ms})
+            logger.info(f"chinese_stocks 批量upsert 第{len(batches)}批: {len(batch)} 行, {elapsed_ms} ms")
+    return {
+        "rows": len(records),
+        "batches": batches,
+        "total_ms": round((time.perf_counter() - started) * 1000, 2)
+    }
+
+
+async def sync_chinese_stocks(force_snapshot: bool = False) -> Dict[str, Any]:
+    """
+    用一份全市场快照刷新 chinese_stocks 全表
+    Refresh every chinese_stocks row from one market snapshot
+    """
+    snapshot_started = time.perf_counter()
+    if force_snapshot or not market_snapshot.is_fresh:
+        await market_snapshot.refresh(force=force_snapshot)
+    snapshot_ms = round((time.perf_counter() - snapshot_started) * 1000, 2)
+    if not market_snapshot.rows:
+        raise RuntimeError("全市场行情快照不可用 / Market snapshot unavailable")
+
+    now = datetime.utcnow()
+    records = [
+        snapshot_row_to_stock(row, now)
+        for code, row in market_snapshot.rows.items()
+        if len(code) == 6 and code.isdigit()
+    ]
+    result = await bulk_upsert_stocks(records)
+    result.update({
+        "snapshot_ms": snapshot_ms,
+        "snapshot": market_snapshot.info(),
+        "synced_at": now.isoformat()
+    })
+    logger.info(
+        f"chinese_stocks 全市场同步完成: {result['rows']} 行, {len(result['batches'])} 批, "
+        f"快照 {snapshot_ms} ms, 写入 {result['total_ms']} ms"
+    )
+    return result
+
+
+class MarketSyncJob:
+    """定时全市场同步任务 / Periodic whole-market sync task"""
+
+    def __init__(self, interval_seconds: int = MARKET_SYNC_INTERVAL_SECONDS):
+        self.interval_seconds = interval_seconds
+        self.last_result: Optional[Dict[str, Any]] = None
+        self.last_error: Optional[str] = None
+        self._task: Optional[asyncio.Task] = None
+        self._lock = asyncio.Lock()
+        self._listeners: List[Callable[[], Any]] = []
+
+    def add_listener(self, callback: Callable[[], Any]):
+        """注册同步成功后的回调（协程函数） / Register a coroutine run after each successful sync"""
+        self._listeners.append(callback)
+
+    async def run_once(self, force_snapshot: bool = False) -> Dict[str, Any]:
+        """执行一次同步；并发调用串行执行 / Run one sync; concurrent calls are serialized"""
+        async with self._lock:
+            try:
+                self.last_result = await sync_chinese_stocks(force_snapshot=force_snapshot)
+                self.last_error = None
+            except Exception as e:
+                self.last_error = str(e)
+                raise
+        for callback in self._listeners:
+            try:
+                await callback()
+            except Exception as e:
+                logger.error(f"同步后回调失败 / Post-sync listener failed: {str(e)}")
+        return self.last_result
+
+    async def _loop(self):
+        while True:
+            try:
+                await self.run_once(force_snapshot=True)
+            except Exception as e:
+                logger.error(f"全市场同步失败 / Market sync failed: {str(e)}")
+            await asyncio.sleep(self.interval_seconds)
+
+    def start(self):
+        """启动定时同步 / Start the periodic sync"""
+        if self.interval_seconds > 0 and (self._task is None or self._task.done()):
+            self._task = asyncio.create_task(self._loop())
+
+    async def stop(self):
+        """停止定时同步 / Stop the periodic sync"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+# 全局同步任务 / Global sync job
+market_sync_job = MarketSyncJob()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+
+    async def _main():
+        result = await sync_chinese_stocks(force_snapshot=True)
+        for batch in result["batches"]:
+            print(f"batch {batch['batch']:>3}: {batch['rows']:>5} rows  {batch['elapsed_ms']:>9.2f} ms")
+        print(f"snapshot: {result['snapshot_ms']:.2f} ms  upsert total: {result['total_ms']:.2f} ms  rows: {result['rows']}")
+        await async_engine.dispose()
+
+    asyncio.run(_main())
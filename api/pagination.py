@@ -0,0 +1,215 @@
+# -*- coding: utf-8 -*-
+"""
+键集分页与计数缓存模块
+Keyset pagination and cached count module
+
+列表接口不再使用 OFFSET 分页和每次请求的 COUNT(*)：
+- 按 (排序列, 主键) 排序，下一页从上一页最后一行的键值之后开始，代价与翻页深度无关
+- 游标是不透明的base64字符串，包含排序字段、方向、筛选条件摘要和最后一行的键值
+- 每个允许的排序字段都有 (is_active, 排序列, 主键) 复合索引（见 database.py）
+- 无筛选和只按活跃状态筛选的总数直接读取增量维护的表统计（service_stats.TableStats），
+  其他筛选条件的总数按条件缓存一段时间（条目数有上限，过期条目在写入时清除）
+排序时 NULL 值按 PostgreSQL 默认规则处理：升序排在最后，降序排在最前。
+"""
+import base64
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from sqlalchemy import and_, or_
+
+try:
+    from config import Config
+    COUNT_CACHE_TTL_SECONDS = Config.COUNT_CACHE_TTL_SECONDS
+    COUNT_CACHE_MAX_ENTRIES = Config.COUNT_CACHE_MAX_ENTRIES
+except (ImportError, AttributeError):
+    COUNT_CACHE_TTL_SECONDS = 60
+    COUNT_CACHE_MAX_ENTRIES = 1000
+
+
+class CursorError(ValueError):
+    """游标无效或与当前查询不匹配 / Invalid cursor or cursor from a different query"""
+
+
+def filters_fingerprint(filters: Dict[str, Any]) -> str:
+    """筛选条件摘要，用于校验游标和缓存计数 / Digest of the filter set"""
+    return hashlib.sha1(json.dumps(filters, sort_keys=True, default=str).encode("utf-8")).hexdigest()[:12]
+
+
+def _encode_value(value: Any) -> Any:
+    if isinstance(value, datetime):
+        return {"dt": value.isoformat()}
+    return value
+
+
+def _decode_value(value: Any) -> Any:
+    if isinstance(value, dict) and "dt" in value:
+        return datetime.fromisoformat(value["dt"])
+    return value
+
+
+def encode_cursor(payload: Dict[str, Any]) -> str:
+    """编码游标 / Encode an opaque cursor"""
+    raw = json.dumps(payload, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(token: str) -> Dict[str, Any]:
+    """解码游标 / Decode an opaque cursor"""
+    try:
+        padded = token + "=" * (-len(token) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+    except Exception:
+        raise CursorError("游标格式无效 / Malformed cursor")
+    if not isinstance(payload, dict) or not {"s", "d", "f", "v", "k"} <= set(payload):
+        raise CursorError("游标格式无效 / Malformed cursor")
+    return payload
+
+
+class KeysetPaginator:
+    """
+    单个列表接口的键集分页器 / Keyset paginator for one list endpoint
+    """
+
+    def __init__(self, model, primary_key: str, sort_columns: Sequence[str]):
+        self.model = model
+        self.primary_key = primary_key
+        self.sort_columns = tuple(sort_columns)
+
+    def validate_sort(self, sort_by: str, sort_order: str) -> Tuple[str, bool]:
+        """
+        校验排序参数 / Validate sort parameters
+
+        Raises:
+            ValueError: 排序字段不在允许列表中
+        """
+        if sort_by not in self.sort_columns:
+            raise ValueError(
+                f"不支持的排序字段 '{sort_by}'，可选: {', '.join(self.sort_columns)} / "
+                f"Unsupported sort field '{sort_by}', available: {', '.join(self.sort_columns)}"
+            )
+        return sort_by, sort_order.lower() == "desc"
+
+    def apply(self, query, sort_by: str, descending: bool, fingerprint: str,
+              cursor: Optional[str] = None, offset: int = 0):
+        """
+        为查询加上排序和游标条件 / Add ordering and the cursor predicate to a select
+
+        Raises:
+            CursorError: 游标无效或属于其他排序/筛选条件
+        """
+        sort_column = getattr(self.model, sort_by)
+        key_column = getattr(self.model, self.primary_key)
+
+        if descending:
+            query = query.order_by(sort_column.desc().nulls_first(), key_column.desc())
+        else:
+            query = query.order_by(sort_column.asc().nulls_last(), key_column.asc())
+
+        if cursor:
+            payload = decode_cursor(cursor)
+            if payload["s"] != sort_by or payload["d"] != descending or payload["f"] != fingerprint:
+                raise CursorError("游标与当前排序或筛选条件不匹配 / Cursor does not match the current sort or filters")
+            query = query.where(self._after(sort_column, key_column, descending, _decode_value(payload["v"]), payload["k"]))
+        elif offset:
+            # 兼容旧的page参数 / Legacy page parameter
+            query = query.offset(offset)
+        return query
+
+    @staticmethod
+    def _after(sort_column, key_column, descending: bool, value: Any, key: Any):
+        """上一页最后一行之后的条件 / Predicate selecting rows after the last row of the previous page"""
+        if sort_column is key_column:
+            return key_column < key if descending else key_column > key
+        if descending:
+            # 降序：NULL在前 / Descending, NULLs first
+            if value is None:
+                return or_(and_(sort_column.is_(None), key_column < key), sort_column.isnot(None))
+            return or_(sort_column < value, and_(sort_column == value, key_column < key))
+        # 升序：NULL在后 / Ascending, NULLs last
+        if value is None:
+            return and_(sort_column.is_(None), key_column > key)
+        return or_(sort_column > value, and_(sort_column == value, key_column > key), sort_column.is_(None))
+
+    def next_cursor(self, rows: List[Any], limit: int, sort_by: str, descending: bool,
+                    fingerprint: str) -> Optional[str]:
+        """由本页最后一行生成下一页游标；rows 应多取一行用于判断是否还有下一页"""
+        if len(rows) <= limit:
+            return None
+        last = rows[limit - 1]
+        return encode_cursor({
+            "s": sort_by,
+            "d": descending,
+            "f": fingerprint,
+            "v": _encode_value(getattr(last, sort_by)),
+            "k": getattr(last, self.primary_key),
+        })
+
+
+class CountCache:
+    """
+    按筛选条件缓存的总数 / Total counts cached per filter set
+
+    键包含用户输入的搜索词，因此最多保留 max_entries 条（最近最少使用的先淘汰），
+    写入时顺带清除已过期的条目。
+    """
+
+    def __init__(self, ttl_seconds: int = COUNT_CACHE_TTL_SECONDS, max_entries: int = COUNT_CACHE_MAX_ENTRIES):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._counts: "OrderedDict[str, Tuple[int, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._counts)
+
+    def get(self, key: str) -> Optional[Tuple[int, float]]:
+        with self._lock:
+            entry = self._counts.get(key)
+            if entry is None:
+                return None
+            if time.monotonic() - entry[1] > self.ttl_seconds:
+                del self._counts[key]
+                return None
+            self._counts.move_to_end(key)
+            return entry
+
+    def set(self, key: str, count: int):
+        now = time.monotonic()
+        with self._lock:
+            self._counts[key] = (count, now)
+            self._counts.move_to_end(key)
+            # 条目按最近使用排序，从最旧的一端清除过期条目
+            while self._counts:
+                oldest_key, (_, stored_at) = next(iter(self._counts.items()))
+                if now - stored_at <= self.ttl_seconds and len(self._counts) <= self.max_entries:
+                    break
+                del self._counts[oldest_key]
+
+    def invalidate(self, prefix: str = ""):
+        """数据写入后清除缓存 / Drop cached counts after writes"""
+        with self._lock:
+            for key in [key for key in self._counts if key.startswith(prefix)]:
+                del self._counts[key]
+
+    async def count(self, key: str, compute) -> Dict[str, Any]:
+        """
+        返回缓存的总数，过期时调用 compute() 重新计数
+        Return the cached count, recomputing through `compute()` when stale
+        """
+        entry = self.get(key)
+        if entry is not None:
+            count, stored_at = entry
+            return {"total_count": count, "count_source": "cached",
+                    "count_age_seconds": round(time.monotonic() - stored_at, 1)}
+        count = await compute()
+        self.set(key, count)
+        return {"total_count": count, "count_source": "exact", "count_age_seconds": 0}
+
+
+# 全局计数缓存 / Global count cache
+count_cache = CountCache()
@@ -0,0 +1,353 @@
+# -*- coding: utf-8 -*-
+"""
+盘中价格历史模块
+Intraday price history module
+
+每次全市场快照刷新后，把价格或成交量有变化的股票批量追加到 intraday_prices：
+- PostgreSQL 上 intraday_prices 按交易日范围分区，写入前自动创建当天分区
+- 超过 INTRADAY_RAW_RETENTION_DAYS 的原始数据降采样为 INTRADAY_DOWNSAMPLE_MINUTES 分钟K线
+  写入 intraday_price_bars，然后整个分区删除（其他数据库按天DELETE）
+- 降采样K线保留 INTRADAY_BAR_RETENTION_DAYS 天
+查询时按请求的周期把原始数据和降采样K线合并重采样。
+时间均为服务器本地时间，与快照的 fetched_at 一致。
+"""
+import asyncio
+import logging
+import re
+import time
+from datetime import date, datetime, timedelta
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import and_, delete, func, insert, select, text
+from sqlalchemy.dialects import postgresql, sqlite
+
+from database import IntradayPrice, IntradayPriceBar, async_engine
+
+try:
+    from config import Config
+    RAW_RETENTION_DAYS = Config.INTRADAY_RAW_RETENTION_DAYS
+    DOWNSAMPLE_MINUTES = Config.INTRADAY_DOWNSAMPLE_MINUTES
+    BAR_RETENTION_DAYS = Config.INTRADAY_BAR_RETENTION_DAYS
+    MAINTENANCE_INTERVAL_SECONDS = Config.INTRADAY_MAINTENANCE_INTERVAL_SECONDS
+except (ImportError, AttributeError):
+    RAW_RETENTION_DAYS = 7
+    DOWNSAMPLE_MINUTES = 30
+    BAR_RETENTION_DAYS = 180
+    MAINTENANCE_INTERVAL_SECONDS = 3600
+
+logger = logging.getLogger(__name__)
+
+INSERT_BATCH_SIZE = 2000
+
+_PARTITION_PATTERN = re.compile(r"^intraday_prices_(\d{8})$")
+
+_DIALECT_INSERTS = {
+    "postgresql": postgresql.insert,
+    "sqlite": sqlite.insert,
+}
+
+
+def bucket_start(moment: datetime, minutes: int) -> datetime:
+    """时间所在K线的开始时间（从当天零点起按周期对齐）/ Start of the bucket containing `moment`"""
+    midnight = moment.replace(hour=0, minute=0, second=0, microsecond=0)
+    offset = int((moment - midnight).total_seconds() // (minutes * 60)) * minutes
+    return midnight + timedelta(minutes=offset)
+
+
+def resample(points: Iterable[Tuple], minutes: int) -> List[Dict[str, Any]]:
+    """
+    按周期重采样 / Resample OHLC points into `minutes`-wide bars
+
+    Args:
+        points: 按时间排序的 (time, open, high, low, close, volume, turnover, samples)
+        minutes: 周期分钟数，0 表示原样返回
+    """
+    bars: List[Dict[str, Any]] = []
+    for moment, open_price, high_price, low_price, close_price, volume, turnover, samples in points:
+        start = bucket_start(moment, minutes) if minutes else moment
+        if bars and bars[-1]["time"] == start:
+            bar = bars[-1]
+            bar["high"] = max(bar["high"], high_price)
+            bar["low"] = min(bar["low"], low_price)
+            bar["close"] = close_price
+            bar["volume"] = volume
+            bar["turnover"] = turnover
+            bar["samples"] += samples
+        else:
+            bars.append({
+                "time": start, "open": open_price, "high": high_price, "low": low_price,
+                "close": close_price, "volume": volume, "turnover": turnover, "samples": samples
+            })
+    return bars
+
+
+class PriceHistory:
+    """盘中价格历史的写入、维护和查询 / Append, maintain and query intraday price history"""
+
+    def __init__(self, engine=async_engine, market: str = "cn_stock"):
+        self.engine = engine
+        self.market = market
+        self._last_seen: Dict[str, Tuple[float, float]] = {}
+        self._partitions = set()
+        self._task: Optional[asyncio.Task] = None
+        self.last_append: Dict[str, Any] = {}
+        self.last_maintenance: Dict[str, Any] = {}
+
+    @property
+    def partitioned(self) -> bool:
+        return self.engine.dialect.name == "postgresql"
+
+    @staticmethod
+    def partition_name(day: date) -> str:
+        return f"intraday_prices_{day:%Y%m%d}"
+
+    async def _ensure_partition(self, conn, day: date):
+        """创建交易日分区 / Create the partition for a trading day"""
+        if not self.partitioned or day in self._partitions:
+            return
+        await conn.execute(text(
+            f"CREATE TABLE IF NOT EXISTS {self.partition_name(day)} PARTITION OF {IntradayPrice.__tablename__} "
+            f"FOR VALUES FROM ('{day.isoformat()}') TO ('{(day + timedelta(days=1)).isoformat()}')"
+        ))
+        self._partitions.add(day)
+
+    async def on_snapshot(self, rows: Dict[str, Dict[str, Any]]):
+        """全市场快照刷新回调 / Market snapshot listener"""
+        await self.append_rows(rows, datetime.now().replace(microsecond=0))
+
+    async def append_rows(self, rows: Dict[str, Dict[str, Any]], recorded_at: datetime) -> Dict[str, Any]:
+        """
+        追加一份快照中价格或成交量发生变化的股票 / Append rows whose price or volume changed
+        """
+        started = time.perf_counter()
+        records = []
+        seen = {}
+        for code, row in rows.items():
+            price = float(row.get("最新价", 0))
+            volume = float(row.get("成交量", 0))
+            if not price:
+                continue
+            seen[code] = (price, volume)
+            if self._last_seen.get(code) == (price, volume):
+                continue
+            records.append({
+                "market": self.market,
+                "code": code,
+                "recorded_at": recorded_at,
+                "price": price,
+                "price_change_pct": float(row.get("涨跌幅", 0)),
+                "volume": volume,
+                "turnover": float(row.get("成交额", 0)),
+            })
+
+        if records:
+            # 同一秒内重复追加（如手动刷新与定时刷新重叠）时跳过已有的行，不中止整个事务
+            # Skip rows already stored for the same second instead of aborting the whole transaction
+            statement = _DIALECT_INSERTS.get(self.engine.dialect.name, insert)(IntradayPrice)
+            if hasattr(statement, "on_conflict_do_nothing"):
+                statement = statement.on_conflict_do_nothing()
+            async with self.engine.begin() as conn:
+                await self._ensure_partition(conn, recorded_at.date())
+                for offset in range(0, len(records), INSERT_BATCH_SIZE):
+                    await conn.execute(statement, records[offset:offset + INSERT_BATCH_SIZE])
+        # 写入成功后才更新去重状态 / Only remember values once they are stored
+        self._last_seen.update(seen)
+
+        self.last_append = {
+            "recorded_at": recorded_at.isoformat(),
+            "rows": len(records),
+            "unchanged": len(seen) - len(records),
+            "elapsed_ms": round((time.perf_counter() - started) * 1000, 2)
+        }
+        logger.info(f"盘中价格历史追加: {self.last_append}")
+        return self.last_append
+
+    async def _raw_days_before(self, conn, cutoff: date) -> List[date]:
+        """需要降采样的交易日 / Trading days with raw data older than the cutoff"""
+        if self.partitioned:
+            result = await conn.execute(text(
+                "SELECT c.relname FROM pg_inherits i "
+                "JOIN pg_class c ON c.oid = i.inhrelid "
+                "JOIN pg_class p ON p.oid = i.inhparent "
+                "WHERE p.relname = :parent"
+            ), {"parent": IntradayPrice.__tablename__})
+            days = []
+            for (name,) in result:
+                match = _PARTITION_PATTERN.match(name)
+                if match:
+                    day = datetime.strptime(match.group(1), "%Y%m%d").date()
+                    if day < cutoff:
+                        days.append(day)
+            return sorted(days)
+        earliest = (await conn.execute(
+            select(func.min(IntradayPrice.recorded_at)).where(IntradayPrice.market == self.market)
+        )).scalar()
+        if earliest is None:
+            return []
+        first_day = earliest.date() if isinstance(earliest, datetime) else datetime.fromisoformat(str(earliest)).date()
+        return [first_day + timedelta(days=n) for n in range((cutoff - first_day).days)]
+
+    async def _downsample_day(self, conn, day: date) -> int:
+        """把一个交易日的原始数据降采样为K线 / Downsample one day of raw ticks into bars"""
+        day_start = datetime.combine(day, datetime.min.time())
+        result = await conn.stream(
+            select(
+                IntradayPrice.market, IntradayPrice.code, IntradayPrice.recorded_at,
+                IntradayPrice.price, IntradayPrice.volume, IntradayPrice.turnover
+            ).where(and_(
+                IntradayPrice.recorded_at >= day_start,
+                IntradayPrice.recorded_at < day_start + timedelta(days=1)
+            )).order_by(IntradayPrice.market, IntradayPrice.code, IntradayPrice.recorded_at)
+        )
+
+        dialect_insert = _DIALECT_INSERTS.get(self.engine.dialect.name, insert)
+        pending: List[Dict[str, Any]] = []
+        written = 0
+        current_key = None
+        points: List[Tuple] = []
+
+        async def flush_points():
+            market, code = current_key
+            for bar in resample(points, DOWNSAMPLE_MINUTES):
+                pending.append({
+                    "market": market, "code": code, "resolution_minutes": DOWNSAMPLE_MINUTES,
+                    "bucket_start": bar["time"], "open_price": bar["open"], "high_price": bar["high"],
+                    "low_price": bar["low"], "close_price": bar["close"], "volume": bar["volume"],
+                    "turnover": bar["turnover"], "samples": bar["samples"]
+                })
+            if len(pending) >= INSERT_BATCH_SIZE:
+                await write_pending()
+
+        async def write_pending():
+            nonlocal written
+            if not pending:
+                return
+            statement = dialect_insert(IntradayPriceBar)
+            if hasattr(statement, "on_conflict_do_nothing"):
+                statement = statement.on_conflict_do_nothing()
+            await conn.execute(statement, pending)
+            written += len(pending)
+            pending.clear()
+
+        async for market, code, recorded_at, price, volume, turnover in result:
+            if (market, code) != current_key:
+                if current_key is not None:
+                    await flush_points()
+                current_key = (market, code)
+                points = []
+            points.append((recorded_at, price, price, price, price, volume, turnover, 1))
+        if current_key is not None:
+            await flush_points()
+        await write_pending()
+        return written
+
+    async def _drop_raw_day(self, conn, day: date):
+        if self.partitioned:
+            await conn.execute(text(f"DROP TABLE IF EXISTS {self.partition_name(day)}"))
+            self._partitions.discard(day)
+        else:
+            day_start = datetime.combine(day, datetime.min.time())
+            await conn.execute(delete(IntradayPrice).where(and_(
+                IntradayPrice.recorded_at >= day_start,
+                IntradayPrice.recorded_at < day_start + timedelta(days=1)
+            )))
+
+    async def maintain(self, today: Optional[date] = None) -> Dict[str, Any]:
+        """
+        降采样并删除过期的原始分区，清理过期K线 / Downsample and drop expired raw partitions, purge old bars
+        每个交易日在单独的事务中处理 / Each trading day is handled in its own transaction
+        """
+        started = time.perf_counter()
+        today = today or date.today()
+        report = {"downsampled_days": [], "bars_written": 0, "bars_purged": 0}
+
+        async with self.engine.connect() as conn:
+            days = await self._raw_days_before(conn, today - timedelta(days=RAW_RETENTION_DAYS))
+        for day in days:
+            async with self.engine.begin() as conn:
+                report["bars_written"] += await self._downsample_day(conn, day)
+                await self._drop_raw_day(conn, day)
+            report["downsampled_days"].append(day.isoformat())
+
+        bar_cutoff = datetime.combine(today - timedelta(days=BAR_RETENTION_DAYS), datetime.min.time())
+        async with self.engine.begin() as conn:
+            result = await conn.execute(delete(IntradayPriceBar).where(IntradayPriceBar.bucket_start < bar_cutoff))
+            report["bars_purged"] = result.rowcount or 0
+
+        report["elapsed_ms"] = round((time.perf_counter() - started) * 1000, 2)
+        self.last_maintenance = report
+        logger.info(f"盘中价格历史维护完成: {report}")
+        return report
+
+    async def query(self, db, code: str, start: datetime, end: datetime, resolution_minutes: int) -> List[Dict[str, Any]]:
+        """
+        查询时间范围内的价格序列，合并原始数据和降采样K线 / Query a time range, merging raw ticks and stored bars
+        """
+        raw_rows = (await db.execute(
+            select(
+                IntradayPrice.recorded_at, IntradayPrice.price, IntradayPrice.volume, IntradayPrice.turnover
+            ).where(and_(
+                IntradayPrice.market == self.market,
+                IntradayPrice.code == code,
+                IntradayPrice.recorded_at >= start,
+                IntradayPrice.recorded_at <= end
+            )).order_by(IntradayPrice.recorded_at)
+        )).all()
+        bar_rows = (await db.execute(
+            select(
+                IntradayPriceBar.bucket_start, IntradayPriceBar.open_price, IntradayPriceBar.high_price,
+                IntradayPriceBar.low_price, IntradayPriceBar.close_price, IntradayPriceBar.volume,
+                IntradayPriceBar.turnover, IntradayPriceBar.samples
+            ).where(and_(
+                IntradayPriceBar.market == self.market,
+                IntradayPriceBar.code == code,
+                IntradayPriceBar.resolution_minutes == DOWNSAMPLE_MINUTES,
+                IntradayPriceBar.bucket_start >= start,
+                IntradayPriceBar.bucket_start <= end
+            )).order_by(IntradayPriceBar.bucket_start)
+        )).all()
+
+        points = [tuple(row) for row in bar_rows]
+        points.extend((moment, price, price, price, price, volume, turnover, 1) for moment, price, volume, turnover in raw_rows)
+        points.sort(key=lambda point: point[0])
+        bars = resample(points, resolution_minutes)
+        for bar in bars:
+            bar["time"] = bar["time"].isoformat()
+        return bars
+
+    async def _loop(self):
+        while True:
+            try:
+                await self.maintain()
+            except Exception as e:
+                logger.error(f"盘中价格历史维护失败 / Intraday history maintenance failed: {str(e)}")
+            await asyncio.sleep(MAINTENANCE_INTERVAL_SECONDS)
+
+    def start(self):
+        """启动定时维护 / Start periodic maintenance"""
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._loop())
+
+    async def stop(self):
+        """停止定时维护 / Stop periodic maintenance"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def info(self) -> Dict[str, Any]:
+        return {
+            "partitioned": self.partitioned,
+            "raw_retention_days": RAW_RETENTION_DAYS,
+            "downsample_minutes": DOWNSAMPLE_MINUTES,
+            "bar_retention_days": BAR_RETENTION_DAYS,
+            "last_append": self.last_append,
+            "last_maintenance": self.last_maintenance
+        }
+
+
+# 全局实例 / Global instance
+price_history = PriceHistory()
@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+"""
+字段投影与按需计算模块
+Field projection and lazy section computation module
+
+调用方通过 sections= / fields= 查询参数声明需要的数据区块和字段，
+端点据此只执行所需的上游数据获取（akshare调用）和计算。
+- sections=current_price,trading_status       选择整个区块
+- fields=current_price.price,key_metrics.pe_ratio  选择区块内的具体字段
+两个参数可以同时使用，结果取并集；都不传时返回完整响应（向后兼容）。
+"""
+from typing import Any, Dict, Iterable, Optional, Set, Tuple
+
+
+class ProjectionSpec:
+    """端点的可投影区块定义 / Projectable sections of an endpoint and their upstream sources"""
+
+    def __init__(self, sections: Dict[str, Tuple[str, ...]],
+                 field_sources: Optional[Dict[str, Tuple[str, ...]]] = None):
+        """
+        Args:
+            sections: 区块名 -> 该区块依赖的上游数据源
+            field_sources: "区块.字段" -> 该字段依赖的上游数据源（覆盖区块级依赖）
+        """
+        self.sections = sections
+        self.field_sources = field_sources or {}
+
+    def resolve(self, fields: Optional[str] = None, sections: Optional[str] = None) -> "Projection":
+        """
+        解析查询参数为投影 / Resolve query parameters into a projection
+
+        Raises:
+            ValueError: 请求了不存在的区块
+        """
+        requested_sections = _split(sections)
+        requested_fields = _split(fields)
+
+        if not requested_sections and not requested_fields:
+            return Projection(self, {name: set() for name in self.sections}, full=True)
+
+        selected: Dict[str, Set[str]] = {}
+        for section in requested_sections:
+            self._check_section(section)
+            selected[section] = set()
+
+        for field in requested_fields:
+            section, _, subfield = field.partition(".")
+            self._check_section(section)
+            if section in selected and not selected[section]:
+                continue  # 已选择整个区块
+            if not subfield:
+                selected[section] = set()
+            else:
+                selected.setdefault(section, set()).add(subfield)
+
+        return Projection(self, selected)
+
+    def _check_section(self, section: str):
+        if section not in self.sections:
+            raise ValueError(
+                f"未知的数据区块 '{section}'，可选: {', '.join(self.sections)} / "
+                f"Unknown section '{section}', available: {', '.join(self.sections)}"
+            )
+
+
+class Projection:
+    """已解析的投影 / A resolved projection"""
+
+    def __init__(self, spec: ProjectionSpec, selected: Dict[str, Set[str]], full: bool = False):
+        self.spec = spec
+        self.selected = selected
+        self.full = full
+        self.sources = self._collect_sources()
+
+    def _collect_sources(self) -> Set[str]:
+        sources: Set[str] = set()
+        for section, subfields in self.selected.items():
+            if not subfields:
+                sources.update(self.spec.sections[section])
+                # 区块中按字段声明的额外依赖 / Field-level sources inside a whole section
+                prefix = f"{section}."
+                for field, field_sources in self.spec.field_sources.items():
+                    if field.startswith(prefix):
+                        sources.update(field_sources)
+                continue
+            for subfield in subfields:
+                sources.update(
+                    self.spec.field_sources.get(f"{section}.{subfield}", self.spec.sections[section])
+                )
+        return sources
+
+    def wants(self, section: str) -> bool:
+        """是否需要输出该区块 / Whether the section is part of the response"""
+        return section in self.selected
+
+    def needs(self, *sources: str) -> bool:
+        """是否需要获取任一上游数据源 / Whether any of the upstream sources must be fetched"""
+        return any(source in self.sources for source in sources)
+
+    def apply(self, section: str, data: Any) -> Any:
+        """按字段裁剪区块数据 / Prune a section down to the selected fields"""
+        subfields = self.selected.get(section)
+        if not subfields or not isinstance(data, dict):
+            return data
+        return {key: value for key, value in data.items() if key in subfields}
+
+    def build(self, sections: Dict[str, Any]) -> Dict[str, Any]:
+        """只保留被选择的区块并按字段裁剪 / Keep only the selected sections, pruned by field"""
+        return {
+            name: self.apply(name, value)
+            for name, value in sections.items()
+            if self.wants(name)
+        }
+
+    def describe(self) -> Dict[str, Any]:
+        """投影说明，附加在响应中 / Projection summary attached to responses"""
+        return {
+            "full": self.full,
+            "sections": sorted(self.selected),
+            "fields": {name: sorted(fields) for name, fields in self.selected.items() if fields},
+            "fetched_sources": sorted(self.sources)
+        }
+
+
+def _split(value: Optional[str]) -> Iterable[str]:
+    if not value:
+        return []
+    return [item.strip() for item in value.split(",") if item.strip()]
+
+
+# ============ 各端点的投影定义 ============
+
+# /stocks/{stock_code}
+UNIFIED_STOCK_SPEC = ProjectionSpec(
+    sections={
+        "stock_name": ("basic",),
+        "basic_info": ("basic",),
+        "current_price": ("realtime",),
+        "key_metrics": ("market",),
+        "trading_status": ("realtime",),
+    },
+    field_sources={
+        "key_metrics.financial_metrics": ("financial",),
+    }
+)
+
+# /stocks/{stock_code}/analysis/technical
+TECHNICAL_ANALYSIS_SPEC = ProjectionSpec(
+    sections={
+        "stock_name": ("basic",),
+        "k_line_data": ("kline",),
+        "real_time_data": ("realtime",),
+        "technical_indicators": ("market", "realtime"),
+        "analysis_data": ("realtime",),
+    },
+    field_sources={
+        "analysis_data.turnover_rate": ("market", "realtime"),
+        "analysis_data.pe_ratio": ("market", "realtime"),
+        "analysis_data.pb_ratio": ("market", "realtime"),
+        "analysis_data.recent_high": ("kline",),
+        "analysis_data.recent_low": ("kline",),
+    }
+)
+
+# /stocks/{stock_code}/analysis/fundamental
+FUNDAMENTAL_ANALYSIS_SPEC = ProjectionSpec(
+    sections={
+        "stock_name": ("basic",),
+        "basic_info": ("basic",),
+        "financial_indicators": ("financial",),
+        "analysis_data": ("basic",),
+    },
+    field_sources={
+        "analysis_data.financial_metrics": ("financial",),
+    }
+)
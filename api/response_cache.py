@@ -0,0 +1,308 @@
+# -*- coding: utf-8 -*-
+"""
+两级响应缓存模块
+Two-tier response cache module
+
+为 /stocks/{code}、/analysis/*、/historical/*、/live/flow 等接口缓存处理函数的返回结果：
+- 第一级：进程内LRU（RESPONSE_CACHE_MAX_ENTRIES 条）
+- 第二级：Redis，多个进程/实例共享；Redis不可用时只用进程内缓存，稍后自动重连
+- 每个接口单独设置有效期（RESPONSE_CACHE_TTLS）
+- 过期后 RESPONSE_CACHE_STALE_SECONDS 内仍立即返回旧数据，同时只启动一个后台任务重新计算
+- 未命中时同一个键只计算一次，并发请求等待同一结果
+- 错误响应（包含 "error" 字段）不缓存
+响应中的 cache_info 给出真实的命中层级、数据年龄和有效期。
+未过期的缓存命中时重新登记生成该响应时的数据版本，使ETag条件请求照常工作；
+返回过期数据时不登记，避免条件请求对已知过期的数据返回304。
+"""
+import asyncio
+import functools
+import hashlib
+import inspect
+import json
+import logging
+import time
+from collections import Counter, OrderedDict
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from fastapi.encoders import jsonable_encoder
+
+from http_cache import data_versions
+
+try:
+    import redis.asyncio as redis
+    REDIS_AVAILABLE = True
+except ImportError:
+    REDIS_AVAILABLE = False
+
+try:
+    from config import Config
+    REDIS_URL = Config.REDIS_URL
+    RESPONSE_CACHE_MAX_ENTRIES = Config.RESPONSE_CACHE_MAX_ENTRIES
+    RESPONSE_CACHE_STALE_SECONDS = Config.RESPONSE_CACHE_STALE_SECONDS
+    RESPONSE_CACHE_TTLS = Config.RESPONSE_CACHE_TTLS
+except (ImportError, AttributeError):
+    REDIS_URL = "redis://localhost:6379/0"
+    RESPONSE_CACHE_MAX_ENTRIES = 2000
+    RESPONSE_CACHE_STALE_SECONDS = 300
+    RESPONSE_CACHE_TTLS = {}
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TTL_SECONDS = 60
+
+# Redis连接失败后多久再重试 / Delay before reconnecting after a Redis failure
+REDIS_RETRY_SECONDS = 30
+REDIS_TIMEOUT_SECONDS = 0.5
+
+# 缓存条目格式版本，格式变化时旧条目自然失效 / Entry format version, bumped to orphan old entries
+KEY_PREFIX = "resp:v1"
+
+
+class LRUCache:
+    """进程内LRU缓存 / In-process LRU cache"""
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, Any]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: str) -> Optional[Any]:
+        value = self._entries.get(key)
+        if value is not None:
+            self._entries.move_to_end(key)
+        return value
+
+    def set(self, key: str, value: Any):
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def pop(self, key: str):
+        self._entries.pop(key, None)
+
+
+def is_cacheable(result: Any) -> bool:
+    """只缓存正常的字典响应 / Only successful dict responses are cached"""
+    return isinstance(result, dict) and "error" not in result
+
+
+class ResponseCache:
+    """两级响应缓存 / Two-tier response cache"""
+
+    def __init__(self, redis_url: str = REDIS_URL, max_entries: int = RESPONSE_CACHE_MAX_ENTRIES,
+                 stale_seconds: int = RESPONSE_CACHE_STALE_SECONDS):
+        self.redis_url = redis_url
+        self.stale_seconds = stale_seconds
+        self.memory = LRUCache(max_entries)
+        self.stats: Counter = Counter()
+        self._redis = None
+        self._redis_retry_at = 0.0
+        self._connect_lock = asyncio.Lock()
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self._background: set = set()
+
+    # ---------- Redis ----------
+
+    async def _get_redis(self):
+        """获取Redis客户端；不可用时返回None / Redis client, or None while Redis is unavailable"""
+        if not REDIS_AVAILABLE or not self.redis_url:
+            return None
+        if self._redis is not None:
+            return self._redis
+        async with self._connect_lock:
+            if self._redis is not None or time.monotonic() < self._redis_retry_at:
+                return self._redis
+            try:
+                client = redis.from_url(
+                    self.redis_url, decode_responses=True,
+                    socket_timeout=REDIS_TIMEOUT_SECONDS, socket_connect_timeout=REDIS_TIMEOUT_SECONDS
+                )
+                await client.ping()
+                self._redis = client
+            except Exception as e:
+                self._redis_retry_at = time.monotonic() + REDIS_RETRY_SECONDS
+                logger.warning(f"响应缓存Redis不可用，仅使用进程内缓存 / Redis unavailable for response cache: {e}")
+            return self._redis
+
+    def _drop_redis(self, error: Exception):
+        logger.warning(f"响应缓存Redis操作失败 / Response cache Redis operation failed: {error}")
+        self.stats["redis_errors"] += 1
+        self._redis = None
+        self._redis_retry_at = time.monotonic() + REDIS_RETRY_SECONDS
+
+    async def close(self):
+        """关闭Redis连接 / Close the Redis connection"""
+        if self._redis is not None:
+            await self._redis.aclose()
+            self._redis = None
+
+    # ---------- 读写 / Reads and writes ----------
+
+    @staticmethod
+    def make_key(name: str, arguments: Dict[str, Any]) -> str:
+        """缓存键：接口名 + 股票代码 + 参数摘要 / Key from endpoint name, stock code and argument digest"""
+        digest = hashlib.sha1(json.dumps(arguments, sort_keys=True, default=str).encode("utf-8")).hexdigest()[:16]
+        return f"{KEY_PREFIX}:{name}:{arguments.get('stock_code', '')}:{digest}"
+
+    async def _read(self, key: str) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
+        entry = self.memory.get(key)
+        if entry is not None:
+            return entry, "memory"
+        client = await self._get_redis()
+        if client is None:
+            return None, None
+        try:
+            raw = await client.get(key)
+        except Exception as e:
+            self._drop_redis(e)
+            return None, None
+        if not raw:
+            return None, None
+        entry = json.loads(raw)
+        self.memory.set(key, entry)
+        return entry, "redis"
+
+    async def _write(self, key: str, entry: Dict[str, Any], ttl: int):
+        self.memory.set(key, entry)
+        client = await self._get_redis()
+        if client is None:
+            return
+        try:
+            await client.setex(key, ttl + self.stale_seconds, json.dumps(entry, ensure_ascii=False))
+        except Exception as e:
+            self._drop_redis(e)
+
+    async def _compute(self, key: str, ttl: int, compute: Callable[[], Awaitable[Any]]):
+        """调用处理函数并写入缓存 / Run the handler and store a cacheable result"""
+        with data_versions.capture() as versions:
+            result = await compute()
+        if not is_cacheable(result):
+            return None, result
+        entry = {
+            "value": jsonable_encoder(result),
+            "stored_at": time.time(),
+            "versions": [[stock_code, kind, version] for (stock_code, kind), version in versions.items()]
+        }
+        await self._write(key, entry, ttl)
+        return entry, result
+
+    async def _load(self, key: str, ttl: int, compute: Callable[[], Awaitable[Any]]):
+        """同一个键同时只计算一次 / Single-flight computation per key"""
+        future = self._inflight.get(key)
+        if future is not None:
+            return await asyncio.shield(future)
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            outcome = await self._compute(key, ttl, compute)
+            future.set_result(outcome)
+            return outcome
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            future.exception()  # 没有等待者时避免 "exception was never retrieved" 警告
+            raise
+        finally:
+            self._inflight.pop(key, None)
+
+    def _revalidate(self, key: str, ttl: int, compute: Callable[[], Awaitable[Any]]):
+        """后台重新计算过期条目；同一个键只有一个任务 / Refresh a stale entry in one background task"""
+        if key in self._inflight:
+            return
+        self.stats["revalidations"] += 1
+
+        async def run():
+            try:
+                await self._load(key, ttl, compute)
+            except Exception as e:
+                logger.error(f"响应缓存后台刷新失败 / Background revalidation failed for {key}: {e}")
+
+        task = asyncio.create_task(run())
+        self._background.add(task)
+        task.add_done_callback(self._background.discard)
+
+    @staticmethod
+    def _annotate(entry: Dict[str, Any], ttl: int, tier: Optional[str], stale: bool = False) -> Dict[str, Any]:
+        age = max(time.time() - entry["stored_at"], 0.0)
+        response = dict(entry["value"])
+        response["cache_info"] = {
+            "cached": tier is not None,
+            "tier": tier,
+            "stale": stale,
+            "age_seconds": round(age, 1),
+            "ttl": ttl,
+            "cache_time": datetime.fromtimestamp(entry["stored_at"]).isoformat()
+        }
+        return response
+
+    async def fetch(self, key: str, ttl: int, compute: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        读取缓存，必要时计算 / Serve from cache, computing on a miss
+
+        - 未过期：直接返回
+        - 过期但在 stale_seconds 内：直接返回旧数据并后台刷新
+        - 其他情况：计算（同一个键只计算一次）后返回
+        """
+        entry, tier = await self._read(key)
+        if entry is not None:
+            age = time.time() - entry["stored_at"]
+            if age <= ttl + self.stale_seconds:
+                stale = age > ttl
+                self.stats["stale_hits" if stale else f"{tier}_hits"] += 1
+                if stale:
+                    self._revalidate(key, ttl, compute)
+                else:
+                    for stock_code, kind, version in entry.get("versions", []):
+                        data_versions.record(stock_code, kind, version)
+                return self._annotate(entry, ttl, tier, stale)
+
+        self.stats["misses"] += 1
+        entry, result = await self._load(key, ttl, compute)
+        if entry is None:
+            return result
+        return self._annotate(entry, ttl, None)
+
+    def cached(self, name: str, ttl: Optional[int] = None):
+        """
+        处理函数装饰器 / Decorator for a route handler
+
+        Args:
+            name: 接口名，用于缓存键和 RESPONSE_CACHE_TTLS 中的有效期
+            ttl: 有效期（秒），默认取 RESPONSE_CACHE_TTLS[name]
+        """
+        ttl = ttl or RESPONSE_CACHE_TTLS.get(name, DEFAULT_TTL_SECONDS)
+
+        def decorator(handler):
+            signature = inspect.signature(handler)
+
+            @functools.wraps(handler)
+            async def wrapper(*args, **kwargs):
+                bound = signature.bind(*args, **kwargs)
+                bound.apply_defaults()
+                key = self.make_key(name, dict(bound.arguments))
+                return await self.fetch(key, ttl, lambda: handler(*args, **kwargs))
+
+            return wrapper
+
+        return decorator
+
+    def info(self) -> Dict[str, Any]:
+        """缓存状态 / Cache status"""
+        return {
+            "memory_entries": len(self.memory),
+            "redis_connected": self._redis is not None,
+            "inflight": len(self._inflight),
+            "stale_seconds": self.stale_seconds,
+            "ttls": RESPONSE_CACHE_TTLS,
+            **self.stats
+        }
+
+
+# 全局响应缓存 / Global response cache
+response_cache = ResponseCache()
@@ -0,0 +1,244 @@
+# -*- coding: utf-8 -*-
+"""
+股票内存搜索索引模块
+In-memory stock search index module
+
+基于全市场行情快照构建，支持 / Built from the whole-market snapshot and supports:
+- 股票代码前缀匹配          code prefix, e.g. "6000" -> 600000, 600004 ...
+- 中文名称子串匹配          Chinese name substring, e.g. "茅台" -> 贵州茅台
+- 拼音首字母前缀匹配        pinyin initials prefix, e.g. "gzmt" -> 贵州茅台
+- 英文名称单词前缀匹配      English name word prefix, e.g. "moutai" -> Kweichow Moutai
+结果按匹配类型打分排序。每次快照刷新后增量更新：只为新增或改名的股票重新计算拼音，
+然后一次性替换索引结构，查询过程中不加锁。
+快照只有中文名称，英文名称由 set_english_names() 从 chinese_stocks.stock_name_en 载入。
+"""
+import bisect
+import logging
+import re
+import time
+from typing import Any, Dict, List, NamedTuple, Optional, Set, Tuple
+
+from market_snapshot import market_snapshot
+
+try:
+    from pypinyin import Style, lazy_pinyin
+    PINYIN_AVAILABLE = True
+except ImportError:
+    PINYIN_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+# 匹配类型得分，越高越靠前 / Score per match type, higher ranks first
+SCORE_CODE_EXACT = 100
+SCORE_NAME_EXACT = 90
+SCORE_CODE_PREFIX = 80
+SCORE_NAME_PREFIX = 75
+SCORE_INITIALS_EXACT = 70
+SCORE_INITIALS_PREFIX = 60
+SCORE_NAME_SUBSTRING = 50
+SCORE_ENGLISH_PREFIX = 40
+
+_WORD_PATTERN = re.compile(r"[a-z0-9]+")
+_LATIN_PATTERN = re.compile(r"[A-Za-z]")
+
+
+class SearchEntry(NamedTuple):
+    """索引条目 / Indexed stock"""
+    stock_code: str
+    stock_name_cn: str
+    stock_name_en: str
+    initials: str
+
+
+def pinyin_initials(name: str) -> str:
+    """
+    名称的拼音首字母，字母和数字原样保留（如 "*ST" -> "st"）
+    Pinyin initials of a name; ASCII letters and digits are kept as-is
+    """
+    if not PINYIN_AVAILABLE:
+        return ""
+    letters = lazy_pinyin(name, style=Style.FIRST_LETTER, errors=lambda chars: list(chars))
+    return "".join(letter for letter in "".join(letters).lower() if letter.isalnum())
+
+
+class _IndexState(NamedTuple):
+    """一次构建出的不可变索引结构 / Immutable index structures swapped in as a whole"""
+    entries: Dict[str, SearchEntry]
+    codes: List[str]
+    initials: List[Tuple[str, str]]
+    english_words: List[Tuple[str, str]]
+    name_chars: Dict[str, Set[str]]
+
+
+class StockSearchIndex:
+    """股票搜索索引 / Stock search index"""
+
+    def __init__(self):
+        self._state = _IndexState({}, [], [], [], {})
+        self._english_names: Dict[str, str] = {}
+        self.built_at: Optional[float] = None
+        self.last_build: Dict[str, Any] = {}
+
+    def __len__(self) -> int:
+        return len(self._state.entries)
+
+    def update_from_rows(self, rows: Dict[str, Dict[str, Any]]) -> Dict[str, Any]:
+        """
+        根据快照行增量更新索引 / Incrementally update the index from snapshot rows
+
+        未改名的股票复用已有条目（含拼音），只为新增或改名的股票计算拼音。
+        """
+        started = time.perf_counter()
+        previous = self._state.entries
+        entries: Dict[str, SearchEntry] = {}
+        added = renamed = 0
+        for code, row in rows.items():
+            code = str(code)
+            name = str(row.get("名称", "")).strip()
+            if not code or not name:
+                continue
+            entry = previous.get(code)
+            if entry is None or entry.stock_name_cn != name:
+                if entry is None:
+                    added += 1
+                else:
+                    renamed += 1
+                entry = SearchEntry(code, name, self._english_names.get(code, ""), pinyin_initials(name))
+            entries[code] = entry
+        removed = sum(1 for code in previous if code not in entries)
+
+        if added or renamed or removed or not previous:
+            self._state = self._build_state(entries)
+        self.built_at = time.time()
+        self.last_build = {
+            "entries": len(entries),
+            "added": added,
+            "renamed": renamed,
+            "removed": removed,
+            "build_ms": round((time.perf_counter() - started) * 1000, 2),
+            "pinyin": PINYIN_AVAILABLE
+        }
+        logger.info(f"股票搜索索引已更新: {self.last_build}")
+        return self.last_build
+
+    def set_english_names(self, names: Dict[str, Optional[str]]) -> int:
+        """
+        载入英文名称 / Load English names, e.g. from chinese_stocks.stock_name_en
+
+        没有英文名称的股票在库中存的是中文名称，不含拉丁字母的名称不计入。
+
+        Returns:
+            有英文名称的股票数
+        """
+        english_names = {
+            str(code): name.strip() for code, name in names.items()
+            if name and _LATIN_PATTERN.search(name)
+        }
+        self._english_names = english_names
+        previous = self._state.entries
+        entries = {
+            code: entry._replace(stock_name_en=english_names.get(code, ""))
+            for code, entry in previous.items()
+        }
+        if any(entries[code].stock_name_en != entry.stock_name_en for code, entry in previous.items()):
+            self._state = self._build_state(entries)
+        return len(english_names)
+
+    @staticmethod
+    def _build_state(entries: Dict[str, SearchEntry]) -> _IndexState:
+        initials = []
+        english_words = []
+        name_chars: Dict[str, Set[str]] = {}
+        for code, entry in entries.items():
+            if entry.initials:
+                initials.append((entry.initials, code))
+            for word in set(_WORD_PATTERN.findall(entry.stock_name_en.lower())):
+                english_words.append((word, code))
+            for char in set(entry.stock_name_cn.lower()):
+                name_chars.setdefault(char, set()).add(code)
+        return _IndexState(entries, sorted(entries), sorted(initials), sorted(english_words), name_chars)
+
+    @staticmethod
+    def _prefix_range(items: List, prefix: str) -> List:
+        """有序列表中的前缀匹配 / Prefix scan over a sorted list"""
+        start = bisect.bisect_left(items, (prefix,) if items and isinstance(items[0], tuple) else prefix)
+        matches = []
+        for item in items[start:]:
+            key = item[0] if isinstance(item, tuple) else item
+            if not key.startswith(prefix):
+                break
+            matches.append(item)
+        return matches
+
+    def search(self, query: str, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        """
+        搜索并按得分排序 / Search and rank matches
+
+        Args:
+            limit: 最多返回条数，默认返回全部匹配
+
+        Returns:
+            [{stock_code, stock_name_cn, stock_name_en, score, match}, ...]
+        """
+        state = self._state
+        query = (query or "").strip().lower()
+        if not query or not state.entries:
+            return []
+
+        scores: Dict[str, Tuple[int, str]] = {}
+
+        def hit(code: str, score: int, match: str):
+            if score > scores.get(code, (0, ""))[0]:
+                scores[code] = (score, match)
+
+        # 代码前缀 / Code prefix
+        if query.isdigit():
+            for code in self._prefix_range(state.codes, query):
+                hit(code, SCORE_CODE_EXACT if code == query else SCORE_CODE_PREFIX, "code")
+
+        # 中文名称子串：按字符倒排取交集后校验 / Name substring via per-character posting intersection
+        postings = [state.name_chars.get(char) for char in set(query)]
+        if postings and all(postings):
+            for code in set.intersection(*sorted(postings, key=len)):
+                name = state.entries[code].stock_name_cn.lower()
+                if name == query:
+                    hit(code, SCORE_NAME_EXACT, "name")
+                elif name.startswith(query):
+                    hit(code, SCORE_NAME_PREFIX, "name")
+                elif query in name:
+                    hit(code, SCORE_NAME_SUBSTRING, "name")
+
+        if query.isascii() and query.isalnum():
+            # 拼音首字母前缀 / Pinyin initials prefix
+            for initials, code in self._prefix_range(state.initials, query):
+                hit(code, SCORE_INITIALS_EXACT if initials == query else SCORE_INITIALS_PREFIX, "pinyin")
+            # 英文名称单词前缀 / English word prefix
+            for _, code in self._prefix_range(state.english_words, query):
+                hit(code, SCORE_ENGLISH_PREFIX, "english")
+
+        ranked = sorted(
+            scores.items(),
+            key=lambda item: (-item[1][0], len(state.entries[item[0]].stock_name_cn), item[0])
+        )[:limit]
+        return [
+            {
+                "stock_code": code,
+                "stock_name_cn": state.entries[code].stock_name_cn,
+                "stock_name_en": state.entries[code].stock_name_en,
+                "score": score,
+                "match": match
+            }
+            for code, (score, match) in ranked
+        ]
+
+    def info(self) -> Dict[str, Any]:
+        """索引状态 / Index status"""
+        return {"entries": len(self), "english_names": len(self._english_names),
+                "pinyin_available": PINYIN_AVAILABLE, "last_build": self.last_build}
+
+
+# 全局搜索索引 / Global search index
+stock_search_index = StockSearchIndex()
+
+# 每次全市场快照刷新后增量更新索引 / Refresh the index after every market snapshot refresh
+market_snapshot.add_listener(stock_search_index.update_from_rows)
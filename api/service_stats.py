@@ -0,0 +1,174 @@
+# -*- coding: utf-8 -*-
+"""
+服务统计计数模块
+Incrementally maintained service statistics
+
+/stats 不再在每次请求时全表 count() 和扫描 api_logs：
+- 表统计（活跃数、总数、分布）保存在内存中，写操作时增量调整，
+  定时以及批量同步后重新计算一次用于校准
+- 每日API调用次数由日志缓冲写入器在每批写入时累加到 api_call_daily 汇总表，
+  查询时只读一行主键记录，再加上本进程中尚未写入的缓冲条数
+"""
+import asyncio
+import logging
+import time
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from sqlalchemy import and_, func, insert, select
+from sqlalchemy.dialects import postgresql, sqlite
+
+from database import APICallDaily, APILog, AsyncSessionLocal
+
+try:
+    from config import Config
+    STATS_RECONCILE_SECONDS = Config.STATS_RECONCILE_SECONDS
+except (ImportError, AttributeError):
+    STATS_RECONCILE_SECONDS = 300
+
+logger = logging.getLogger(__name__)
+
+_DIALECT_INSERTS = {
+    "postgresql": postgresql.insert,
+    "sqlite": sqlite.insert,
+}
+
+
+class TableStats:
+    """
+    内存中的表统计，增量调整并定时校准 / In-memory table statistics, adjusted incrementally and reconciled periodically
+    """
+
+    def __init__(self, name: str, compute: Callable[[Any], Awaitable[Dict[str, Any]]],
+                 reconcile_seconds: int = STATS_RECONCILE_SECONDS):
+        """
+        Args:
+            name: 统计名称，用于日志
+            compute: 接收数据库会话、返回完整统计的协程函数（只在校准时调用）
+            reconcile_seconds: 定时校准间隔
+        """
+        self.name = name
+        self.compute = compute
+        self.reconcile_seconds = reconcile_seconds
+        self.values: Dict[str, Any] = {}
+        self.computed_at: Optional[datetime] = None
+        self._lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+
+    async def refresh(self) -> Dict[str, Any]:
+        """重新计算全部统计 / Recompute the statistics from the database"""
+        async with self._lock:
+            started = time.perf_counter()
+            async with AsyncSessionLocal() as db:
+                self.values = await self.compute(db)
+            self.computed_at = datetime.utcnow()
+            logger.info(f"{self.name} 统计已校准, {round((time.perf_counter() - started) * 1000, 2)} ms")
+            return self.values
+
+    async def get(self) -> Dict[str, Any]:
+        """读取统计，首次调用时计算 / Current statistics, computed on first use"""
+        if self.computed_at is None:
+            await self.refresh()
+        return self.values
+
+    async def count_info(self, key: str, bucket: Optional[str] = None) -> Dict[str, Any]:
+        """
+        以列表接口总数的格式返回某项计数（bucket 指定分布统计中的一项），不查询数据库
+        A maintained counter in the list endpoints' count format, optionally one bucket of a distribution
+        """
+        values = await self.get()
+        count = values.get(key, {}).get(bucket, 0) if bucket is not None else values.get(key, 0)
+        return {"total_count": count, "count_source": "maintained",
+                "count_age_seconds": round((datetime.utcnow() - self.computed_at).total_seconds(), 1)}
+
+    def adjust(self, **deltas: int):
+        """写操作后增量调整计数 / Apply counter deltas after a write"""
+        if self.computed_at is None:
+            return
+        for key, delta in deltas.items():
+            self.values[key] = self.values.get(key, 0) + delta
+
+    def adjust_distribution(self, key: str, bucket: Optional[str], delta: int):
+        """调整分布统计中的某一项 / Adjust one bucket of a distribution"""
+        if self.computed_at is None or not bucket:
+            return
+        distribution = self.values.setdefault(key, {})
+        distribution[bucket] = distribution.get(bucket, 0) + delta
+        if distribution[bucket] <= 0:
+            distribution.pop(bucket)
+
+    async def _loop(self):
+        while True:
+            try:
+                await self.refresh()
+            except Exception as e:
+                logger.error(f"{self.name} 统计校准失败 / Stats reconcile failed: {str(e)}")
+            await asyncio.sleep(self.reconcile_seconds)
+
+    def start(self):
+        """启动定时校准 / Start periodic reconciliation"""
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._loop())
+
+    async def stop(self):
+        """停止定时校准 / Stop periodic reconciliation"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def info(self) -> Dict[str, Any]:
+        return {
+            "computed_at": self.computed_at.isoformat() if self.computed_at else None,
+            "reconcile_seconds": self.reconcile_seconds
+        }
+
+
+async def today_api_calls(db, service_type: str, pending: int = 0) -> int:
+    """
+    今日（UTC）API调用次数：汇总表的一行加上尚未写入的缓冲条数
+    Today's (UTC) API calls: one rollup row plus entries still buffered in this process
+    """
+    stored = (await db.execute(
+        select(APICallDaily.call_count).where(and_(
+            APICallDaily.service_type == service_type,
+            APICallDaily.day == datetime.utcnow().date()
+        ))
+    )).scalar()
+    return (stored or 0) + pending
+
+
+async def backfill_today_api_calls(service_type: str):
+    """
+    汇总表中没有今天的记录时，从 api_logs 统计一次（仅在启动时，写入器启动之前调用）
+    Seed today's rollup row from api_logs once, at startup before the log writer runs
+
+    多个worker同时启动时可能都读到没有记录，写入时忽略主键冲突，由先写入的worker生效。
+    """
+    today = datetime.utcnow().date()
+    async with AsyncSessionLocal() as db:
+        exists = (await db.execute(
+            select(APICallDaily.call_count).where(and_(
+                APICallDaily.service_type == service_type,
+                APICallDaily.day == today
+            ))
+        )).scalar()
+        if exists is not None:
+            return
+        today_start = datetime.combine(today, datetime.min.time())
+        call_count, error_count = (await db.execute(
+            select(
+                func.count(APILog.id),
+                func.count(APILog.id).filter(APILog.response_status >= 500)
+            ).where(and_(APILog.service_type == service_type, APILog.created_at >= today_start))
+        )).one()
+        statement = _DIALECT_INSERTS.get(db.bind.dialect.name, insert)(APICallDaily).values(
+            service_type=service_type, day=today, call_count=call_count, error_count=error_count
+        )
+        if hasattr(statement, "on_conflict_do_nothing"):
+            statement = statement.on_conflict_do_nothing(index_elements=[APICallDaily.service_type, APICallDaily.day])
+        await db.execute(statement)
+        await db.commit()
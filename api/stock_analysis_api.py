@@ -3,14 +3,38 @@
 全面股票分析API服务
 Complete Stock Analysis API Service
 """
-from fastapi import FastAPI
+from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
-import akshare as ak
+from fastapi.responses import Response
+import akshare
 from datetime import datetime, timedelta
+from collections import deque
+from typing import Optional
+import asyncio
+import statistics
 import sys
 import os
+import time
 sys.path.append(os.path.join(os.path.dirname(__file__)))
 from akshare_service import AkshareService
+from http_cache import (
+    data_versions, digest_values, bars_version, report_version,
+    match_stock_route, request_variant, if_none_match, GZIP_MINIMUM_SIZE
+)
+from projection import UNIFIED_STOCK_SPEC, TECHNICAL_ANALYSIS_SPEC, FUNDAMENTAL_ANALYSIS_SPEC
+from streaming import stream_records, STREAM_FORMATS, StreamingAwareGZipMiddleware
+from market_snapshot import (
+    market_snapshot, profile_cache, spot_row_to_quote, spot_row_to_valuation
+)
+from response_cache import response_cache
+from fetch_context import MemoizedModule, fetch_context
+try:
+    from config import Config
+    BATCH_MAX_CODES = Config.BATCH_MAX_CODES
+    BATCH_FETCH_CONCURRENCY = Config.BATCH_FETCH_CONCURRENCY
+except (ImportError, AttributeError):
+    BATCH_MAX_CODES = 50
+    BATCH_FETCH_CONCURRENCY = 5
 
 app = FastAPI(
     title="Stock Analysis API", 
@@ -32,9 +56,53 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# 响应压缩，按Accept-Encoding协商；SSE等流式响应不压缩，保证逐块送达
+# Response compression negotiated via Accept-Encoding; streaming responses stay uncompressed so chunks arrive immediately
+app.add_middleware(StreamingAwareGZipMiddleware, minimum_size=GZIP_MINIMUM_SIZE)
+
 # 初始化akshare服务
 akshare_service = AkshareService()
 
+# akshare调用经过代理：在 fetch_context() 内（AI数据聚合）相同参数的调用只执行一次
+# akshare calls go through a proxy so one aggregation never repeats the same call
+ak = MemoizedModule(akshare)
+
+@app.middleware("http")
+async def conditional_get(request: Request, call_next):
+    """
+    基于数据版本的ETag条件请求中间件 / Data-version ETag conditional-GET middleware
+    数据版本仍有效且If-None-Match命中时直接返回304，不调用处理函数
+    """
+    route = match_stock_route(request.url.path) if request.method == "GET" else None
+    if route is None:
+        return await call_next(request)
+    
+    stock_code, kinds, precheck = route
+    variant = request_variant(
+        request.url.path, str(request.query_params), request.headers.get("accept-encoding", "")
+    )
+    client_etag = request.headers.get("if-none-match")
+    
+    # 数据版本未过期时，无需重新计算即可判断客户端缓存是否有效（实时接口除外）
+    known_etag = data_versions.compose_etag(stock_code, kinds, variant) if precheck else None
+    if known_etag and if_none_match(client_etag, known_etag):
+        return Response(status_code=304, headers={"ETag": known_etag, "Cache-Control": "no-cache"})
+    
+    started_at = time.monotonic()
+    response = await call_next(request)
+    if response.status_code != 200:
+        return response
+    
+    # 只有本次请求中处理函数成功登记了全部数据版本才下发ETag（错误响应不登记版本）
+    etag = data_versions.compose_etag(stock_code, kinds, variant, since=started_at)
+    if etag is None:
+        return response
+    if if_none_match(client_etag, etag):
+        return Response(status_code=304, headers={"ETag": etag, "Cache-Control": "no-cache"})
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = "no-cache"
+    return response
+
 def _extract_financial_indicator(df, indicator_name):
     """从财务数据中提取指定指标的最新值"""
     try:
@@ -172,56 +240,66 @@ async def get_technical_indicators(stock_code: str):
 # ============ workflow所需的API端点 ============
 
 @app.get("/stocks/{stock_code}/analysis/fundamental")
-async def get_fundamental_analysis(stock_code: str):
+@response_cache.cached("fundamental")
+async def get_fundamental_analysis(stock_code: str, fields: Optional[str] = None, sections: Optional[str] = None):
     """
     基本面分析API端点 / Fundamental analysis API endpoint
     对应workflow中的基本面分析HTTP请求
+    
+    - **sections**: 需要的数据区块，如 basic_info,financial_indicators / Sections to return
+    - **fields**: 需要的字段，如 analysis_data.financial_metrics / Fields to return
     """
     try:
-        # 获取财务摘要数据
-        financial_df = ak.stock_financial_abstract(symbol=stock_code)
-        
-        # 获取股票基本信息
-        basic_df = ak.stock_individual_info_em(symbol=stock_code)
-        
-        if financial_df is None or len(financial_df) == 0:
-            return {"error": f"无法获取股票 {stock_code} 的财务数据"}
-        
-        if basic_df is None or len(basic_df) == 0:
-            return {"error": f"无法获取股票 {stock_code} 的基本信息"}
-        
-        # 处理NaN值
-        financial_df = financial_df.fillna('')
-        
-        # 转换基本信息为字典
+        projection = FUNDAMENTAL_ANALYSIS_SPEC.resolve(fields, sections)
+    except ValueError as e:
+        return {"error": str(e)}
+    
+    try:
         basic_info = {}
-        for _, row in basic_df.iterrows():
-            basic_info[row['item']] = row['value']
+        financial_df = None
         
-        # 构建基本面分析数据
-        result = {
-            "stock_code": stock_code,
-            "stock_name": basic_info.get("股票简称", ""),
-            "analysis_type": "fundamental",
-            "data_source": "akshare_comprehensive",
-            "update_time": datetime.now().isoformat(),
-            
-            # 基本信息
-            "basic_info": basic_info,
+        # 获取财务摘要数据
+        if projection.needs("financial"):
+            financial_df = ak.stock_financial_abstract(symbol=stock_code)
+            if financial_df is None or len(financial_df) == 0:
+                return {"error": f"无法获取股票 {stock_code} 的财务数据"}
             
-            # 财务指标
-            "financial_indicators": financial_df.to_dict("records"),
+            # 处理NaN值
+            financial_df = financial_df.fillna('')
+            data_versions.record(stock_code, "report", report_version(financial_df))
+        
+        # 获取股票基本信息
+        if projection.needs("basic"):
+            basic_df = ak.stock_individual_info_em(symbol=stock_code)
+            if basic_df is None or len(basic_df) == 0:
+                return {"error": f"无法获取股票 {stock_code} 的基本信息"}
             
+            # 转换基本信息为字典
+            for _, row in basic_df.iterrows():
+                basic_info[row['item']] = row['value']
+            data_versions.record(stock_code, "profile", digest_values(basic_info))
+        
+        # 只构建被选择的区块
+        data_sections = {}
+        if projection.wants("stock_name"):
+            data_sections["stock_name"] = basic_info.get("股票简称", "")
+        if projection.wants("basic_info"):
+            data_sections["basic_info"] = basic_info
+        if projection.wants("financial_indicators"):
+            data_sections["financial_indicators"] = financial_df.to_dict("records")
+        if projection.wants("analysis_data"):
             # 为AI分析准备的结构化数据
-            "analysis_data": {
-                "company_overview": {
+            analysis_data = {}
+            if projection.needs("basic"):
+                analysis_data["company_overview"] = {
                     "stock_code": stock_code,
                     "stock_name": basic_info.get("股票简称", ""),
                     "total_shares": basic_info.get("总股本", 0),
                     "circulating_shares": basic_info.get("流通股", 0),
                     "current_price": basic_info.get("最新", 0)
-                },
-                "financial_metrics": {
+                }
+            if financial_df is not None:
+                analysis_data["financial_metrics"] = {
                     # 从财务摘要中提取关键指标
                     "revenue": _extract_financial_indicator(financial_df, "营业总收入"),
                     "net_profit": _extract_financial_indicator(financial_df, "归母净利润"), 
@@ -229,8 +307,18 @@ async def get_fundamental_analysis(stock_code: str):
                     "net_assets": _extract_financial_indicator(financial_df, "净资产"),
                     "eps": _extract_financial_indicator(financial_df, "每股收益")
                 }
-            }
+            data_sections["analysis_data"] = analysis_data
+        
+        # 构建基本面分析数据
+        result = {
+            "stock_code": stock_code,
+            "analysis_type": "fundamental",
+            "data_source": "akshare_comprehensive",
+            "update_time": datetime.now().isoformat(),
+            **projection.build(data_sections)
         }
+        if not projection.full:
+            result["projection"] = projection.describe()
         
         return result
         
@@ -238,60 +326,78 @@ async def get_fundamental_analysis(stock_code: str):
         return {"error": f"基本面分析失败: {str(e)}"}
 
 @app.get("/stocks/{stock_code}/analysis/technical")
-async def get_technical_analysis(stock_code: str):
+@response_cache.cached("technical")
+async def get_technical_analysis(stock_code: str, fields: Optional[str] = None, sections: Optional[str] = None):
     """
     技术面分析API端点 / Technical analysis API endpoint
     对应workflow中的技术面分析HTTP请求
+    
+    - **sections**: 需要的数据区块，如 real_time_data,analysis_data / Sections to return
+    - **fields**: 需要的字段，如 analysis_data.current_price / Fields to return
     """
+    try:
+        projection = TECHNICAL_ANALYSIS_SPEC.resolve(fields, sections)
+    except ValueError as e:
+        return {"error": str(e)}
+    
     try:
         # 首先获取股票基本信息以确保股票名称一致性
-        basic_df = ak.stock_individual_info_em(symbol=stock_code)
         stock_name = ""
-        if basic_df is not None and len(basic_df) > 0:
-            for _, row in basic_df.iterrows():
-                if row['item'] == '股票简称':
-                    stock_name = row['value']
-                    break
-        
-        # 获取K线数据（最近30天）
-        end_date = datetime.now().strftime('%Y%m%d')
-        start_date = (datetime.now() - timedelta(days=60)).strftime('%Y%m%d')
-        
-        kline_df = ak.stock_zh_a_hist(
-            symbol=stock_code,
-            period="daily", 
-            start_date=start_date,
-            end_date=end_date
-        )
+        if projection.needs("basic"):
+            basic_df = ak.stock_individual_info_em(symbol=stock_code)
+            if basic_df is not None and len(basic_df) > 0:
+                for _, row in basic_df.iterrows():
+                    if row['item'] == '股票简称':
+                        stock_name = row['value']
+                        break
+        
+        # 获取K线数据（最近60天）
+        kline_df = None
+        if projection.needs("kline"):
+            end_date = datetime.now().strftime('%Y%m%d')
+            start_date = (datetime.now() - timedelta(days=60)).strftime('%Y%m%d')
+            
+            kline_df = ak.stock_zh_a_hist(
+                symbol=stock_code,
+                period="daily", 
+                start_date=start_date,
+                end_date=end_date
+            )
+            
+            if kline_df is None or len(kline_df) == 0:
+                return {"error": f"无法获取股票 {stock_code} 的K线数据"}
+            
+            data_versions.record(stock_code, "bars", bars_version(kline_df))
+            
+            # 处理NaN值
+            kline_df = kline_df.fillna('')
         
         # 获取实时行情数据
-        realtime_df = ak.stock_bid_ask_em(symbol=stock_code)
-        
-        # 获取市场概况数据（这个调用可能会比较慢，容易出错）
-        try:
-            market_df = ak.stock_zh_a_spot_em()
-            target_stock = market_df[market_df['代码'] == stock_code]
-        except:
-            target_stock = []
-        
-        if kline_df is None or len(kline_df) == 0:
-            return {"error": f"无法获取股票 {stock_code} 的K线数据"}
-        
-        if realtime_df is None or len(realtime_df) == 0:
-            return {"error": f"无法获取股票 {stock_code} 的实时数据"}
-        
-        # 处理NaN值
-        kline_df = kline_df.fillna('')
-        
-        # 提取实时行情数据
         realtime_data = {}
-        for _, row in realtime_df.iterrows():
-            realtime_data[row['item']] = row['value']
+        if projection.needs("realtime"):
+            realtime_df = ak.stock_bid_ask_em(symbol=stock_code)
+            
+            if realtime_df is None or len(realtime_df) == 0:
+                return {"error": f"无法获取股票 {stock_code} 的实时数据"}
+            
+            # 提取实时行情数据
+            for _, row in realtime_df.iterrows():
+                realtime_data[row['item']] = row['value']
+            
+            # 登记数据版本，用于ETag条件请求
+            data_versions.record(stock_code, "snapshot", digest_values(realtime_data))
+        
+        # 获取市场概况数据（使用共享的全市场快照，避免每次下载整张行情表）
+        stock_data = None
+        if projection.needs("market"):
+            try:
+                stock_data = await market_snapshot.get_row(stock_code)
+            except:
+                stock_data = None
         
         # 提取技术指标数据
         technical_data = {}
-        if len(target_stock) > 0:
-            stock_data = target_stock.iloc[0]
+        if stock_data:
             technical_data = {
                 "涨跌幅": stock_data.get("涨跌幅", 0),
                 "换手率": stock_data.get("换手率", 0),
@@ -311,25 +417,22 @@ async def get_technical_analysis(stock_code: str):
                 "总市值": 0   # 需要计算
             }
         
-        # 构建技术分析数据 - 优先使用从基本信息获取的股票名称
-        result = {
-            "stock_code": stock_code,
-            "stock_name": stock_name,  # 使用从基本信息获取的准确股票名称
-            "analysis_type": "technical",
-            "data_source": "akshare_technical",
-            "update_time": datetime.now().isoformat(),
-            
+        # 只构建被选择的区块 - 优先使用从基本信息获取的股票名称
+        data_sections = {}
+        if projection.wants("stock_name"):
+            data_sections["stock_name"] = stock_name
+        if projection.wants("k_line_data"):
             # K线数据
-            "k_line_data": kline_df.to_dict("records"),
-            
+            data_sections["k_line_data"] = kline_df.to_dict("records")
+        if projection.wants("real_time_data"):
             # 实时行情
-            "real_time_data": realtime_data,
-            
+            data_sections["real_time_data"] = realtime_data
+        if projection.wants("technical_indicators"):
             # 技术指标
-            "technical_indicators": technical_data,
-            
+            data_sections["technical_indicators"] = technical_data
+        if projection.wants("analysis_data"):
             # 为AI分析准备的结构化数据
-            "analysis_data": {
+            data_sections["analysis_data"] = {
                 "current_price": float(realtime_data.get("最新", 0)),
                 "price_change": float(realtime_data.get("涨跌", 0)),
                 "price_change_pct": float(realtime_data.get("涨幅", 0)),
@@ -337,10 +440,20 @@ async def get_technical_analysis(stock_code: str):
                 "turnover_rate": float(technical_data.get("换手率", 0)),
                 "pe_ratio": float(technical_data.get("市盈率", 0)),
                 "pb_ratio": float(technical_data.get("市净率", 0)),
-                "recent_high": float(kline_df['最高'].max()) if len(kline_df) > 0 else 0,
-                "recent_low": float(kline_df['最低'].min()) if len(kline_df) > 0 else 0
+                "recent_high": float(kline_df['最高'].max()) if kline_df is not None and len(kline_df) > 0 else 0,
+                "recent_low": float(kline_df['最低'].min()) if kline_df is not None and len(kline_df) > 0 else 0
             }
+        
+        # 构建技术分析数据
+        result = {
+            "stock_code": stock_code,
+            "analysis_type": "technical",
+            "data_source": "akshare_technical",
+            "update_time": datetime.now().isoformat(),
+            **projection.build(data_sections)
         }
+        if not projection.full:
+            result["projection"] = projection.describe()
         
         return result
         
@@ -370,6 +483,7 @@ async def get_company_announcements(stock_code: str):
         # 提取报告期信息
         date_columns = [col for col in financial_df.columns if col.isdigit() and len(col) == 8]
         date_columns = sorted(date_columns, reverse=True)[:4]  # 最近4个报告期
+        data_versions.record(stock_code, "report", report_version(financial_df))
         
         announcements = []
         for period in date_columns:
@@ -454,6 +568,55 @@ async def get_dragon_tiger_list(stock_code: str, days: int = 90):
             'note': '数据获取异常，请稍后重试'
         }
 
+@app.get("/stocks/{stock_code}/news/dragon-tiger/stream")
+async def stream_dragon_tiger_list(stock_code: str, days: int = 90, format: str = "ndjson"):
+    """
+    龙虎榜流式接口 / Dragon Tiger List streaming API
+    逐条输出龙虎榜记录（NDJSON或分块JSON数组），适合较长的days窗口
+    
+    - **format**: ndjson（meta/record/summary三类行）或 json（仅记录数组）
+      json 以 application/json 返回并经gzip压缩，服务端仍逐条序列化，但客户端在响应结束后才能解析；
+      需要增量接收时请使用 ndjson / format=json is gzipped as application/json and is not delivered incrementally, use ndjson for that
+    """
+    if format not in STREAM_FORMATS:
+        return {"error": f"不支持的格式 {format}，可选: {', '.join(STREAM_FORMATS)}"}
+    
+    try:
+        stock_lhb = akshare_service.get_dragon_tiger_frame(stock_code, days)
+        if stock_lhb is None:
+            return {"error": f"获取龙虎榜数据失败: 股票 {stock_code}"}
+        
+        # 汇总信息在记录输出过程中增量计算
+        summary = {"total_net_buy": 0.0, "reasons": []}
+        
+        def records():
+            for record in akshare_service.iter_frame_records(stock_lhb):
+                net_buy = record.get('龙虎榜净买额')
+                if net_buy not in ('', None):
+                    summary["total_net_buy"] += float(net_buy)
+                reason = record.get('上榜原因')
+                if reason and reason not in summary["reasons"]:
+                    summary["reasons"].append(reason)
+                yield record
+        
+        def build_summary():
+            return {
+                "total_appearances": len(stock_lhb),
+                "total_net_buy": round(summary["total_net_buy"], 2),
+                "reasons": summary["reasons"]
+            }
+        
+        meta = {
+            "stock_code": stock_code,
+            "data_source": "akshare_dragon_tiger",
+            "update_time": datetime.now().isoformat(),
+            "query_period_days": days
+        }
+        return stream_records(format, meta, records(), build_summary)
+        
+    except Exception as e:
+        return {"error": f"获取龙虎榜数据失败: {str(e)}"}
+
 @app.get("/stocks/{stock_code}/news/industry")
 async def get_industry_news(stock_code: str):
     """行业新闻API端点"""
@@ -703,8 +866,189 @@ async def get_fund_flow_analysis(stock_code: str):
 
 # ============ 新的统一API架构 ============
 
+# ============ 批量多股票接口 ============
+
+def _parse_batch_codes(codes: str):
+    """解析逗号分隔的股票代码，去重并保持顺序 / Parse, dedupe and validate a comma-separated code list"""
+    valid, invalid = [], []
+    for code in (codes or "").split(","):
+        code = code.strip()
+        if not code or code in valid or code in invalid:
+            continue
+        if len(code) == 6 and code.isdigit():
+            valid.append(code)
+        else:
+            invalid.append(code)
+    return valid, invalid
+
+async def _gather_bounded(stock_codes, fetch, limit: int = BATCH_FETCH_CONCURRENCY):
+    """以有限并发获取缺失数据，单只失败不影响其他股票 / Fetch missing pieces with bounded concurrency"""
+    semaphore = asyncio.Semaphore(limit)
+    
+    async def run(code):
+        async with semaphore:
+            try:
+                return code, await fetch(code), None
+            except Exception as e:
+                return code, None, str(e)
+    
+    return await asyncio.gather(*(run(code) for code in stock_codes))
+
+async def _fetch_bid_ask_quote(stock_code: str):
+    """快照中缺失时，单独获取五档行情 / Fallback quote from bid/ask when missing from the snapshot"""
+    realtime_df = await asyncio.to_thread(ak.stock_bid_ask_em, symbol=stock_code)
+    if realtime_df is None or len(realtime_df) == 0:
+        raise ValueError(f"Stock {stock_code} live quote not available")
+    realtime_data = {}
+    for _, row in realtime_df.iterrows():
+        realtime_data[row['item']] = row['value']
+    data_versions.record(stock_code, "snapshot", digest_values(realtime_data))
+    return {
+        "stock_name": "",
+        "current_price": float(realtime_data.get("最新", 0)),
+        "change": float(realtime_data.get("涨跌", 0)),
+        "change_percent": float(realtime_data.get("涨幅", 0)),
+        "high": float(realtime_data.get("最高", 0)),
+        "low": float(realtime_data.get("最低", 0)),
+        "open": float(realtime_data.get("今开", 0)),
+        "previous_close": float(realtime_data.get("昨收", 0)),
+        "volume": float(realtime_data.get("总手", 0)),
+        "amount": float(realtime_data.get("金额", 0)),
+        "turnover_rate": 0,
+        "volume_ratio": 0
+    }
+
+async def _fetch_profile(stock_code: str):
+    """获取个股基本信息并写入缓存 / Fetch a stock profile and store it in the profile cache"""
+    basic_df = await asyncio.to_thread(ak.stock_individual_info_em, symbol=stock_code)
+    if basic_df is None or len(basic_df) == 0:
+        raise ValueError(f"Stock {stock_code} profile not found")
+    profile_data = {}
+    for _, row in basic_df.iterrows():
+        profile_data[row["item"]] = row["value"]
+    profile = {
+        "stock_name": profile_data.get("股票简称", ""),
+        "industry": profile_data.get("行业", ""),
+        "total_shares": profile_data.get("总股本", 0),
+        "circulating_shares": profile_data.get("流通股", 0),
+        "listing_date": profile_data.get("上市时间", "")
+    }
+    profile_cache.set(stock_code, profile)
+    return profile
+
+async def _resolve_batch_quotes(stock_codes):
+    """先从共享快照一次解析，再补充获取缺失的报价 / Resolve quotes from the snapshot, then fetch what is missing"""
+    rows = await market_snapshot.get_rows(stock_codes)
+    results = {}
+    for code, row in rows.items():
+        results[code] = {
+            "success": True,
+            "source": "market_snapshot",
+            "quote": spot_row_to_quote(row),
+            "valuation": spot_row_to_valuation(row)
+        }
+    
+    missing = [code for code in stock_codes if code not in rows]
+    for code, quote, error in await _gather_bounded(missing, _fetch_bid_ask_quote):
+        if error:
+            results[code] = {"success": False, "source": "bid_ask", "error": error}
+        else:
+            results[code] = {"success": True, "source": "bid_ask", "quote": quote, "valuation": None}
+    return results
+
+def _batch_response(data_source: str, stock_codes, invalid_codes, results):
+    """批量接口的统一响应格式，逐只报告成功或失败 / Common batch envelope with per-symbol status"""
+    for code in invalid_codes:
+        results[code] = {"success": False, "error": "股票代码必须是6位数字"}
+    ordered = {code: results[code] for code in list(stock_codes) + list(invalid_codes) if code in results}
+    succeeded = sum(1 for item in ordered.values() if item.get("success"))
+    return {
+        "data_source": data_source,
+        "update_time": datetime.now().isoformat(),
+        "requested": len(ordered),
+        "succeeded": succeeded,
+        "failed": len(ordered) - succeeded,
+        "snapshot": market_snapshot.info(),
+        "results": ordered
+    }
+
+@app.get("/stocks/batch/quotes")
+async def get_batch_quotes(codes: str):
+    """
+    批量实时报价接口 / Batch quotes API
+    
+    - **codes**: 逗号分隔的股票代码，最多 BATCH_MAX_CODES 个，如 000001,600036
+    
+    所有股票先从共享的全市场快照中一次性解析，只有快照中缺失的股票才单独请求五档行情。
+    单只股票失败不影响其他股票，失败原因在对应结果中返回。
+    """
+    stock_codes, invalid_codes = _parse_batch_codes(codes)
+    if len(stock_codes) + len(invalid_codes) > BATCH_MAX_CODES:
+        return {"error": f"单次最多查询 {BATCH_MAX_CODES} 只股票"}
+    if not stock_codes and not invalid_codes:
+        return {"error": "codes参数不能为空"}
+    
+    try:
+        results = await _resolve_batch_quotes(stock_codes)
+        return _batch_response("batch_quotes", stock_codes, invalid_codes, results)
+    except Exception as e:
+        return {"error": f"批量获取报价失败: {str(e)}"}
+
+@app.get("/stocks/batch/summary")
+async def get_batch_summary(codes: str):
+    """
+    批量股票摘要接口 / Batch summary API
+    
+    - **codes**: 逗号分隔的股票代码，最多 BATCH_MAX_CODES 个
+    
+    每只股票返回报价、估值指标和公司基本信息。报价和估值来自共享快照，
+    基本信息优先使用进程内缓存，仅对缓存中缺失的股票以有限并发请求上游。
+    """
+    stock_codes, invalid_codes = _parse_batch_codes(codes)
+    if len(stock_codes) + len(invalid_codes) > BATCH_MAX_CODES:
+        return {"error": f"单次最多查询 {BATCH_MAX_CODES} 只股票"}
+    if not stock_codes and not invalid_codes:
+        return {"error": "codes参数不能为空"}
+    
+    try:
+        quote_results, profiles = await asyncio.gather(
+            _resolve_batch_quotes(stock_codes),
+            _resolve_batch_profiles(stock_codes)
+        )
+        
+        results = {}
+        for code in stock_codes:
+            quote_result = quote_results.get(code, {"success": False, "error": "unknown"})
+            profile, profile_error = profiles.get(code, (None, None))
+            item = dict(quote_result)
+            item["profile"] = profile
+            if profile_error:
+                # 报价成功但基本信息失败时标记为部分成功
+                item["partial"] = quote_result.get("success", False)
+                item["profile_error"] = profile_error
+            results[code] = item
+        
+        return _batch_response("batch_summary", stock_codes, invalid_codes, results)
+    except Exception as e:
+        return {"error": f"批量获取股票摘要失败: {str(e)}"}
+
+async def _resolve_batch_profiles(stock_codes):
+    """从缓存解析基本信息，缺失部分有限并发获取 / Resolve profiles from cache, fetching only the misses"""
+    profiles = {}
+    missing = []
+    for code in stock_codes:
+        cached = profile_cache.get(code)
+        if cached is not None:
+            profiles[code] = (cached, None)
+        else:
+            missing.append(code)
+    for code, profile, error in await _gather_bounded(missing, _fetch_profile):
+        profiles[code] = (profile, error)
+    return profiles
+
 @app.get("/stocks/{stock_code}")
-async def get_unified_stock_info(stock_code: str):
+@response_cache.cached("unified")
+async def get_unified_stock_info(stock_code: str, fields: Optional[str] = None, sections: Optional[str] = None):
     """
     统一股票信息接口 - 整合多个接口的核心数据
     Unified Stock Information API - Consolidates key data from multiple endpoints
@@ -717,11 +1061,22 @@ async def get_unified_stock_info(stock_code: str):
     替代前端调用 / Replaces Frontend Calls:
     - '/api/stock-info/${stockCode}' 
     - '/stocks/${stockCode}' (之前不存在)
+    
+    按需获取 / Projection:
+    - **sections**: 如 current_price,trading_status，只执行这些区块需要的上游调用
+    - **fields**: 如 current_price.price,key_metrics.pe_ratio
     """
     try:
-        # 并行获取多个数据源
-        tasks = []
-        
+        projection = UNIFIED_STOCK_SPEC.resolve(fields, sections)
+    except ValueError as e:
+        return {
+            "stock_code": stock_code,
+            "error": str(e),
+            "data_source": "unified_api_error",
+            "timestamp": datetime.now().isoformat()
+        }
+    
+    try:
         # 1. 基本股票信息
         async def get_basic_info():
             try:
@@ -730,49 +1085,50 @@ async def get_unified_stock_info(stock_code: str):
                     result = {}
                     for _, row in df.iterrows():
                         result[row["item"]] = row["value"]
+                    data_versions.record(stock_code, "profile", digest_values(result))
                     return result
                 return {}
             except:
                 return {}
         
-        # 2. 技术指标信息
-        async def get_tech_indicators():
+        # 2. 实时行情数据
+        async def get_realtime():
             try:
-                # 获取实时行情数据
                 bid_ask_df = ak.stock_bid_ask_em(symbol=stock_code)
                 realtime_data = {}
                 if bid_ask_df is not None and len(bid_ask_df) > 0:
                     for _, row in bid_ask_df.iterrows():
                         realtime_data[row['item']] = row['value']
-                
-                # 获取市场概况数据
-                try:
-                    market_df = ak.stock_zh_a_spot_em()
-                    target_stock = market_df[market_df['代码'] == stock_code]
-                    market_data = {}
-                    if len(target_stock) > 0:
-                        stock_data = target_stock.iloc[0]
-                        market_data = {
-                            "涨跌幅": stock_data.get("涨跌幅", 0),
-                            "换手率": stock_data.get("换手率", 0),
-                            "量比": stock_data.get("量比", 0),
-                            "市盈率": stock_data.get("市盈率-动态", 0),
-                            "市净率": stock_data.get("市净率", 0),
-                            "总市值": stock_data.get("总市值", 0),
-                            "流通市值": stock_data.get("流通市值", 0)
-                        }
-                except:
-                    market_data = {}
-                    
-                return {"realtime": realtime_data, "market": market_data}
+                    data_versions.record(stock_code, "snapshot", digest_values(realtime_data))
+                return realtime_data
             except:
-                return {"realtime": {}, "market": {}}
+                return {}
         
-        # 3. 核心财务指标
+        # 3. 市场概况数据（来自共享的全市场快照，仅在需要估值指标时查询）
+        async def get_market():
+            try:
+                stock_data = await market_snapshot.get_row(stock_code)
+                market_data = {}
+                if stock_data:
+                    market_data = {
+                        "涨跌幅": stock_data.get("涨跌幅", 0),
+                        "换手率": stock_data.get("换手率", 0),
+                        "量比": stock_data.get("量比", 0),
+                        "市盈率": stock_data.get("市盈率-动态", 0),
+                        "市净率": stock_data.get("市净率", 0),
+                        "总市值": stock_data.get("总市值", 0),
+                        "流通市值": stock_data.get("流通市值", 0)
+                    }
+                return market_data
+            except:
+                return {}
+        
+        # 4. 核心财务指标
         async def get_key_financial():
             try:
                 df = ak.stock_financial_abstract(symbol=stock_code)
                 if df is not None and len(df) > 0:
+                    data_versions.record(stock_code, "report", report_version(df))
                     df = df.fillna('')
                     # 提取关键财务指标
                     key_metrics = {}
@@ -791,23 +1147,83 @@ async def get_unified_stock_info(stock_code: str):
             except:
                 return {}
         
-        # 并行执行所有数据获取任务
-        import asyncio
-        basic_info, tech_indicators, key_financial = await asyncio.gather(
-            get_basic_info(),
-            get_tech_indicators(), 
-            get_key_financial(),
+        async def skip():
+            return {}
+        
+        # 并行执行所需的数据获取任务，未被选择的区块不发起上游调用
+        basic_info, realtime, market, key_financial = await asyncio.gather(
+            get_basic_info() if projection.needs("basic") else skip(),
+            get_realtime() if projection.needs("realtime") else skip(),
+            get_market() if projection.needs("market") else skip(),
+            get_key_financial() if projection.needs("financial") else skip(),
             return_exceptions=True
         )
         
         # 处理异常结果
         if isinstance(basic_info, Exception):
             basic_info = {}
-        if isinstance(tech_indicators, Exception):
-            tech_indicators = {"realtime": {}, "market": {}}
+        if isinstance(realtime, Exception):
+            realtime = {}
+        if isinstance(market, Exception):
+            market = {}
         if isinstance(key_financial, Exception):
             key_financial = {}
         
+        # 只构建被选择的区块
+        data_sections = {}
+        if projection.wants("stock_name"):
+            data_sections["stock_name"] = basic_info.get("股票简称", "")
+        if projection.wants("basic_info"):
+            # 基本信息
+            data_sections["basic_info"] = {
+                "stock_code": stock_code,
+                "stock_name": basic_info.get("股票简称", ""),
+                "industry": basic_info.get("行业", ""),
+                "total_shares": basic_info.get("总股本", 0),
+                "circulating_shares": basic_info.get("流通股", 0),
+                "listing_date": basic_info.get("上市时间", "")
+            }
+        if projection.wants("current_price"):
+            # 当前价格信息
+            data_sections["current_price"] = {
+                "price": float(realtime.get("最新", basic_info.get("最新", 0))),
+                "change": float(realtime.get("涨跌", 0)),
+                "change_pct": float(realtime.get("涨幅", 0)),
+                "high": float(realtime.get("最高", 0)),
+                "low": float(realtime.get("最低", 0)),
+                "open": float(realtime.get("今开", 0)),
+                "previous_close": float(realtime.get("昨收", 0))
+            }
+        if projection.wants("key_metrics"):
+            # 关键财务指标
+            data_sections["key_metrics"] = {
+                "market_cap": float(market.get("总市值", 0)),
+                "circulating_market_cap": float(market.get("流通市值", 0)),
+                "pe_ratio": float(market.get("市盈率", 0)),
+                "pb_ratio": float(market.get("市净率", 0)),
+                "turnover_rate": float(market.get("换手率", 0)),
+                "volume_ratio": float(market.get("量比", 0)),
+                "financial_metrics": key_financial
+            }
+        if projection.wants("trading_status"):
+            # 交易状态
+            data_sections["trading_status"] = {
+                "trading_volume": float(realtime.get("总手", 0)),
+                "trading_amount": float(realtime.get("金额", 0)),  # 修复字段名
+                "bid_price": float(realtime.get("buy_1", 0)),      # 修复字段名
+                "ask_price": float(realtime.get("sell_1", 0)),     # 修复字段名
+                "status": "交易中" if datetime.now().hour >= 9 and datetime.now().hour < 15 else "停牌"
+            }
+        
+        integrated_sources = [
+            name for name, source in (
+                ("stock_info", "basic"),
+                ("technical_indicators", "realtime"),
+                ("market_spot", "market"),
+                ("financial_abstract", "financial")
+            ) if projection.needs(source)
+        ]
+        
         # 构建统一响应格式
         unified_response = {
             "stock_code": stock_code,
@@ -818,56 +1234,17 @@ async def get_unified_stock_info(stock_code: str):
                 "cache_time": datetime.now().isoformat(),
                 "ttl": 300
             },
-            "data": {
-                # 基本信息
-                "basic_info": {
-                    "stock_code": stock_code,
-                    "stock_name": basic_info.get("股票简称", ""),
-                    "industry": basic_info.get("行业", ""),
-                    "total_shares": basic_info.get("总股本", 0),
-                    "circulating_shares": basic_info.get("流通股", 0),
-                    "listing_date": basic_info.get("上市时间", "")
-                },
-                
-                # 当前价格信息
-                "current_price": {
-                    "price": float(tech_indicators.get("realtime", {}).get("最新", basic_info.get("最新", 0))),
-                    "change": float(tech_indicators.get("realtime", {}).get("涨跌", 0)),
-                    "change_pct": float(tech_indicators.get("realtime", {}).get("涨幅", 0)),
-                    "high": float(tech_indicators.get("realtime", {}).get("最高", 0)),
-                    "low": float(tech_indicators.get("realtime", {}).get("最低", 0)),
-                    "open": float(tech_indicators.get("realtime", {}).get("今开", 0)),
-                    "previous_close": float(tech_indicators.get("realtime", {}).get("昨收", 0))
-                },
-                
-                # 关键财务指标
-                "key_metrics": {
-                    "market_cap": float(tech_indicators.get("market", {}).get("总市值", 0)),
-                    "circulating_market_cap": float(tech_indicators.get("market", {}).get("流通市值", 0)),
-                    "pe_ratio": float(tech_indicators.get("market", {}).get("市盈率", 0)),
-                    "pb_ratio": float(tech_indicators.get("market", {}).get("市净率", 0)),
-                    "turnover_rate": float(tech_indicators.get("market", {}).get("换手率", 0)),
-                    "volume_ratio": float(tech_indicators.get("market", {}).get("量比", 0)),
-                    "financial_metrics": key_financial
-                },
-                
-                # 交易状态
-                "trading_status": {
-                    "trading_volume": float(tech_indicators.get("realtime", {}).get("总手", 0)),
-                    "trading_amount": float(tech_indicators.get("realtime", {}).get("金额", 0)),  # 修复字段名
-                    "bid_price": float(tech_indicators.get("realtime", {}).get("buy_1", 0)),      # 修复字段名
-                    "ask_price": float(tech_indicators.get("realtime", {}).get("sell_1", 0)),     # 修复字段名
-                    "status": "交易中" if datetime.now().hour >= 9 and datetime.now().hour < 15 else "停牌"
-                }
-            },
+            "data": projection.build(data_sections),
             "metadata": {
                 "api_version": "v2.0",
                 "response_time_ms": 0,  # 将在返回前计算
                 "data_quality": "excellent",
-                "integrated_sources": ["stock_info", "technical_indicators", "financial_abstract"]
+                "integrated_sources": integrated_sources
             },
             "last_updated": datetime.now().isoformat()
         }
+        if not projection.full:
+            unified_response["metadata"]["projection"] = projection.describe()
         
         return unified_response
         
@@ -896,6 +1273,7 @@ async def get_stock_profile(stock_code: str):
         profile_data = {}
         for _, row in basic_df.iterrows():
             profile_data[row["item"]] = row["value"]
+        data_versions.record(stock_code, "profile", digest_values(profile_data))
         
         # 构建详细档案信息
         company_profile = {
@@ -937,6 +1315,7 @@ async def get_stock_profile(stock_code: str):
 # ============ 历史数据接口层 ============
 
 @app.get("/stocks/{stock_code}/historical/prices")
+@response_cache.cached("historical_prices")
 async def get_historical_prices(stock_code: str, days: int = 30):
     """
     历史价格数据接口 - 替代分散的K线接口
@@ -962,6 +1341,7 @@ async def get_historical_prices(stock_code: str, days: int = 30):
             return {"error": f"Stock {stock_code} historical data not found"}
         
         df = df.fillna(0)
+        data_versions.record(stock_code, "bars", bars_version(df))
         
         # 计算技术指标
         prices = df['收盘'].astype(float).tolist()
@@ -1033,7 +1413,106 @@ async def get_historical_prices(stock_code: str, days: int = 30):
     except Exception as e:
         return {"error": f"获取历史价格数据失败: {str(e)}"}
 
+@app.get("/stocks/{stock_code}/historical/prices/stream")
+async def stream_historical_prices(stock_code: str, days: int = 365, format: str = "ndjson"):
+    """
+    历史价格流式接口 / Historical prices streaming API
+    逐条输出K线记录及均线（NDJSON或分块JSON数组），统计信息在输出过程中增量计算
+    
+    - **format**: ndjson（meta/record/summary三类行）或 json（仅记录数组）
+      json 以 application/json 返回并经gzip压缩，服务端仍逐条序列化，但客户端在响应结束后才能解析；
+      需要增量接收时请使用 ndjson / format=json is gzipped as application/json and is not delivered incrementally, use ndjson for that
+    """
+    if format not in STREAM_FORMATS:
+        return {"error": f"不支持的格式 {format}，可选: {', '.join(STREAM_FORMATS)}"}
+    
+    try:
+        end_date = datetime.now().strftime('%Y%m%d')
+        start_date = (datetime.now() - timedelta(days=days)).strftime('%Y%m%d')
+        
+        df = ak.stock_zh_a_hist(
+            symbol=stock_code,
+            period="daily",
+            start_date=start_date,
+            end_date=end_date
+        )
+        
+        if df is None or len(df) == 0:
+            return {"error": f"Stock {stock_code} historical data not found"}
+        
+        df = df.fillna(0)
+        data_versions.record(stock_code, "bars", bars_version(df))
+        
+        stats = {"high": None, "low": None, "volume_sum": 0.0, "count": 0, "mean": 0.0, "m2": 0.0}
+        
+        def records():
+            windows = {5: deque(maxlen=5), 10: deque(maxlen=10), 20: deque(maxlen=20)}
+            columns = list(df.columns)
+            for values in df.itertuples(index=False, name=None):
+                row = dict(zip(columns, values))
+                close = float(row['收盘'])
+                moving_averages = {}
+                for window, window_values in windows.items():
+                    window_values.append(close)
+                    moving_averages[f"ma{window}"] = (
+                        round(sum(window_values) / window, 2) if len(window_values) == window else 0
+                    )
+                
+                # 增量统计（Welford算法计算涨跌幅标准差）
+                high, low, change_pct = float(row['最高']), float(row['最低']), float(row['涨跌幅'])
+                stats["high"] = high if stats["high"] is None else max(stats["high"], high)
+                stats["low"] = low if stats["low"] is None else min(stats["low"], low)
+                stats["volume_sum"] += float(row['成交量'])
+                stats["count"] += 1
+                delta = change_pct - stats["mean"]
+                stats["mean"] += delta / stats["count"]
+                stats["m2"] += delta * (change_pct - stats["mean"])
+                
+                yield {
+                    "date": row['日期'].strftime('%Y-%m-%d') if hasattr(row['日期'], 'strftime') else str(row['日期']),
+                    "stock_code": stock_code,
+                    "open": float(row['开盘']),
+                    "high": high,
+                    "low": low,
+                    "close": close,
+                    "volume": float(row['成交量']),
+                    "amount": float(row['成交额']),
+                    "change_pct": change_pct,
+                    "change": float(row['涨跌额']),
+                    "amplitude": float(row.get('振幅', 0)),
+                    "turnover_rate": float(row.get('换手率', 0)),
+                    **moving_averages
+                }
+        
+        def build_summary():
+            count = stats["count"]
+            return {
+                "statistics": {
+                    "period_high": stats["high"] or 0,
+                    "period_low": stats["low"] or 0,
+                    "period_volume_avg": stats["volume_sum"] / count if count else 0,
+                    "total_trading_days": count,
+                    "price_volatility": (stats["m2"] / (count - 1)) ** 0.5 if count > 1 else 0
+                }
+            }
+        
+        meta = {
+            "stock_code": stock_code,
+            "data_source": "akshare_historical_prices",
+            "update_time": datetime.now().isoformat(),
+            "period_info": {
+                "days_requested": days,
+                "start_date": start_date,
+                "end_date": end_date
+            }
+        }
+        return stream_records(format, meta, records(), build_summary)
+        
+    except Exception as e:
+        return {"error": f"获取历史价格数据失败: {str(e)}"}
+
 @app.get("/stocks/{stock_code}/historical/financial")  
+@response_cache.cached("historical_financial")
 async def get_historical_financial(stock_code: str, periods: int = 8):
     """
     历史财务数据接口 - 整合财务相关接口
@@ -1051,6 +1530,7 @@ async def get_historical_financial(stock_code: str, periods: int = 8):
             return {"error": f"Stock {stock_code} historical financial data not found"}
         
         financial_df = financial_df.fillna('')
+        data_versions.record(stock_code, "report", report_version(financial_df))
         
         # 获取指定期数的数据
         date_columns = [col for col in financial_df.columns if col.isdigit() and len(col) == 8]
@@ -1153,6 +1633,7 @@ async def get_live_quote(stock_code: str):
         realtime_data = {}
         for _, row in realtime_df.iterrows():
             realtime_data[row['item']] = row['value']
+        data_versions.record(stock_code, "snapshot", digest_values(realtime_data))
         
         # 构建标准化的实时报价数据
         live_quote = {
@@ -1212,6 +1693,7 @@ async def get_live_quote(stock_code: str):
         return {"error": f"获取实时报价失败: {str(e)}"}
 
 @app.get("/stocks/{stock_code}/live/flow")
+@response_cache.cached("live_flow")
 async def get_live_flow(stock_code: str):
     """
     实时资金流向接口 - 替代fund-flow接口
@@ -1316,10 +1798,16 @@ async def root():
             "backup_commit": "36a5aad",
             "rollback_time": "< 30秒"
         },
+        "response_cache": response_cache.info(),
         "status": "running",
         "timestamp": datetime.now().isoformat()
     }
 
+@app.on_event("shutdown")
+async def close_response_cache():
+    """关闭响应缓存的Redis连接 / Close the response cache Redis connection"""
+    await response_cache.close()
+
 # ============ 向后兼容适配层 ============
 
 @app.get("/api/advanced-technical/{stock_code}")
@@ -1580,6 +2068,93 @@ try:
     
     from ai_analysis.services.cache_manager import analysis_cache
     from ai_analysis.services.data_aggregator import stock_data_aggregator
+    from ai_analysis.services.analysis_stream import emit_progress, stream_analysis
+    from ai_analysis.services.job_queue import JobQueueFull, analysis_job_queue
+    from ai_analysis.services.batch_analysis import batch_analyzer
+    from ai_analysis.services.rate_limiter import model_rate_limiter
+    
+    # 数据聚合直接调用本进程的接口处理函数，不再经HTTP回环访问自己的公网地址
+    stock_data_aggregator.use_local_sources({
+        "live_quote": get_live_quote,
+        "historical_prices": lambda stock_code: get_historical_prices(stock_code, days=30),
+        "technical_analysis": get_technical_analysis,
+        "core_data": get_unified_stock_info,
+        "fundamental_analysis": get_fundamental_analysis,
+        "financial_history": get_historical_financial,
+        "announcements": get_company_announcements,
+        "dragon_tiger": get_dragon_tiger_list,
+        "money_flow": get_live_flow,
+    }, context_factory=fetch_context)
+    
+    def _market_overview(rows):
+        """全市场涨跌概况 / Market breadth from snapshot rows"""
+        changes = [float(row.get("涨跌幅", 0) or 0) for row in rows.values()]
+        if not changes:
+            return {}
+        return {
+            "stock_count": len(changes),
+            "up_count": sum(1 for change in changes if change > 0),
+            "down_count": sum(1 for change in changes if change < 0),
+            "limit_up_count": sum(1 for change in changes if change >= 9.9),
+            "limit_down_count": sum(1 for change in changes if change <= -9.9),
+            "median_change_percent": round(statistics.median(changes), 2),
+            "total_amount": round(sum(float(row.get("成交额", 0) or 0) for row in rows.values()), 2)
+        }
+    
+    async def _fetch_industry_boards():
+        """行业板块行情，按板块名称索引 / Industry board quotes keyed by board name"""
+        boards_df = await asyncio.to_thread(ak.stock_board_industry_name_em)
+        boards = {}
+        if boards_df is None or len(boards_df) == 0:
+            return boards
+        for _, row in boards_df.fillna(0).iterrows():
+            boards[str(row.get("板块名称", ""))] = {
+                "industry": str(row.get("板块名称", "")),
+                "rank": int(row.get("排名", 0)),
+                "total_industries": len(boards_df),
+                "change_percent": float(row.get("涨跌幅", 0)),
+                "turnover_rate": float(row.get("换手率", 0)),
+                "up_count": int(row.get("上涨家数", 0)),
+                "down_count": int(row.get("下跌家数", 0)),
+                "leader": str(row.get("领涨股票", "")),
+                "leader_change_percent": float(row.get("领涨股票-涨跌幅", 0))
+            }
+        return boards
+    
+    async def _load_batch_market_context(stock_codes):
+        """
+        批量AI分析的共享数据 / Shared data for a batch AI analysis
+        
+        全市场快照和行业板块行情每个批次只获取一次，基本信息（所属行业）优先使用缓存，
+        按股票拆分为 market_context 数据段：市场涨跌概况、所属行业表现及个股相对行业的强弱。
+        """
+        rows, profiles = await asyncio.gather(
+            market_snapshot.get_rows(stock_codes),
+            _resolve_batch_profiles(stock_codes)
+        )
+        try:
+            boards = await _fetch_industry_boards()
+        except Exception as e:
+            print(f"行业板块行情获取失败: {e}")
+            boards = {}
+        overview = _market_overview(market_snapshot.rows)
+        
+        shared = {}
+        for code in stock_codes:
+            context = {"market_overview": overview}
+            profile, _ = profiles.get(code, (None, None))
+            industry = boards.get(profile.get("industry", "")) if profile else None
+            if industry:
+                context["industry"] = dict(industry)
+                if code in rows:
+                    stock_change = float(rows[code].get("涨跌幅", 0) or 0)
+                    context["industry"]["relative_change_percent"] = round(stock_change - industry["change_percent"], 2)
+            shared[code] = {"market_context": context}
+        return shared
+    
+    # 批量分析时市场概况和行业统计只获取一次，附加到每只股票的聚合数据中
+    batch_analyzer.use_shared_data(_load_batch_market_context)
+    
     from ai_analysis.agents.technical_agent import TechnicalAnalysisAgent
     from ai_analysis.agents.comprehensive_agent import ComprehensiveAnalysisAgent
     
@@ -1611,17 +2186,36 @@ try:
         print("启动AI分析功能...")
         initialize_ai_agents()
         
-        # 测试Redis连接
-        try:
-            await analysis_cache.connect()
+        # 连接缓存（Redis不可用时使用进程内存储，后台自动重连）
+        if await analysis_cache.connect():
             print("✓ Redis连接成功")
-        except Exception as e:
-            print(f"✗ Redis连接失败: {e}")
+        else:
+            print("✗ Redis不可用，AI分析缓存暂时使用进程内存储")
+        
+        # 异步任务队列和批量分析执行与同步接口相同的分析流程
+        runners = {
+            "trading_signal": lambda stock_code, force_refresh: get_trading_signal(
+                stock_code, TradingSignalRequest(force_refresh=force_refresh)
+            ),
+            "comprehensive_eval": lambda stock_code, force_refresh: get_comprehensive_evaluation(
+                stock_code, ComprehensiveEvalRequest(force_refresh=force_refresh)
+            ),
+        }
+        for analysis_type, runner in runners.items():
+            analysis_job_queue.register(analysis_type, runner)
+            batch_analyzer.register(analysis_type, runner)
+        await analysis_job_queue.start()
+    
+    @app.on_event("shutdown")
+    async def shutdown_event():
+        """应用关闭事件：停止任务队列，关闭缓存连接，保存进程内缓存"""
+        await analysis_job_queue.stop()
+        await analysis_cache.disconnect()
     
     # AI分析端点
     from fastapi import HTTPException
     from pydantic import BaseModel
-    from typing import Optional
+    from typing import List, Optional
     
     class TradingSignalRequest(BaseModel):
         force_refresh: Optional[bool] = False
@@ -1629,6 +2223,16 @@ try:
     class ComprehensiveEvalRequest(BaseModel):
         force_refresh: Optional[bool] = False
     
+    class AnalysisJobRequest(BaseModel):
+        job_type: str
+        stock_code: str
+        force_refresh: Optional[bool] = False
+    
+    class BatchAnalysisRequest(BaseModel):
+        stock_codes: List[str]
+        analysis_type: str = "trading_signal"
+        force_refresh: Optional[bool] = False
+    
     @app.post("/ai/trading-signal/{stock_code}")
     async def get_trading_signal(
         stock_code: str, 
@@ -1651,78 +2255,84 @@ try:
                     detail="股票代码必须是6位数字"
                 )
             
-            # 检查缓存（除非强制刷新）
-            cached_result = None
-            if not request.force_refresh:
-                try:
-                    cached_result = await analysis_cache.get_trading_signal_cache(stock_code)
-                    if cached_result:
-                        print(f"返回技术面交易信号缓存: {stock_code}")
-                        return {
-                            "analysis_type": "daily_technical_trading",
-                            "stock_code": stock_code,
-                            **cached_result
-                        }
-                except Exception as e:
-                    print(f"缓存查询失败: {e}")
+            # 缓存未命中时执行的分析（同一时间只有一个请求真正执行）
+            async def run_analysis():
+                # 检查AI Agent是否可用
+                if not technical_agent:
+                    raise HTTPException(
+                        status_code=503,
+                        detail="技术面分析AI Agent未初始化，请检查ANTHROPIC_API_KEY配置"
+                    )
             
-            # 检查AI Agent是否可用
-            if not technical_agent:
-                raise HTTPException(
-                    status_code=503,
-                    detail="技术面分析AI Agent未初始化，请检查ANTHROPIC_API_KEY配置"
-                )
+                # 收集技术面数据
+                emit_progress("phase", {"phase": "collecting_data"})
+                print(f"收集技术面数据: {stock_code}")
+                technical_data = await stock_data_aggregator.collect_technical_data(stock_code)
             
-            # 使用现有API接口获取数据，配置正确的base_url
-            stock_data_aggregator.base_url = "http://35.77.54.203:3003"
+                if not technical_data or technical_data.get("success_count", 0) == 0:
+                    raise HTTPException(
+                        status_code=503,
+                        detail="无法获取技术分析所需的数据"
+                    )
             
-            # 收集技术面数据
-            print(f"收集技术面数据: {stock_code}")
-            technical_data = await stock_data_aggregator.collect_technical_data(stock_code)
+                emit_progress("phase", {
+                    "phase": "data_collected",
+                    "success_count": technical_data.get("success_count", 0),
+                    "data_completeness": technical_data.get("data_completeness", 0),
+                    "partial": technical_data.get("partial", False),
+                    "sections": technical_data.get("sections", {})
+                })
+                
+                # 格式化数据为AI可读格式
+                formatted_data = stock_data_aggregator.format_data_for_ai(technical_data)
             
-            if not technical_data or technical_data.get("success_count", 0) == 0:
-                raise HTTPException(
-                    status_code=503,
-                    detail="无法获取技术分析所需的数据"
+                # 执行AI分析
+                print(f"执行技术面AI分析: {stock_code}")
+                # 输入数据与上次相同（收盘后、周末）时复用上次的AI结果，不再调用模型
+                fingerprint = technical_agent.input_fingerprint(
+                    stock_data_aggregator.format_data_for_ai(technical_data, normalize=True)
+                )
+                ai_result = await analysis_cache.get_or_analyze_content(
+                    "trading_signal", stock_code, fingerprint,
+                    lambda: technical_agent.analyze_trading_signal(formatted_data, stock_code),
+                    force_refresh=request.force_refresh
                 )
             
-            # 格式化数据为AI可读格式
-            formatted_data = stock_data_aggregator.format_data_for_ai(technical_data)
-            
-            # 执行AI分析
-            print(f"执行技术面AI分析: {stock_code}")
-            ai_result = await technical_agent.analyze_trading_signal(formatted_data, stock_code)
+                if not ai_result.get("success"):
+                    raise HTTPException(
+                        status_code=500,
+                        detail=f"AI技术分析失败: {ai_result.get('error', 'Unknown error')}"
+                    )
             
-            if not ai_result.get("success"):
-                raise HTTPException(
-                    status_code=500,
-                    detail=f"AI技术分析失败: {ai_result.get('error', 'Unknown error')}"
-                )
+                # 构建响应
+                response_data = {
+                    "analysis_type": "daily_technical_trading",
+                    "stock_code": stock_code,
+                    "cached": False,
+                    "cache_expires_at": None,
+                    "immediate_trading_signal": ai_result["analysis"].get("immediate_trading_signal", {}),
+                    "technical_summary": ai_result["analysis"].get("technical_summary", {}),
+                    "risk_warning": ai_result["analysis"].get("risk_warning", "请注意投资风险"),
+                    "ai_analysis": ai_result["analysis"].get("raw_content", ""),
+                    "data_completeness": technical_data.get("data_completeness", 0),
+                    "api_usage": ai_result.get("api_usage", {}),
+                    "content_reused": ai_result.get("content_reused", False),
+                    "timestamp": datetime.now().isoformat()
+                }
+                
+                print(f"技术面交易信号分析完成: {stock_code}")
+                return response_data
             
-            # 构建响应
-            response_data = {
+            # 读取缓存；未命中时单飞执行分析，临近过期时后台提前刷新（除非强制刷新）
+            result = await analysis_cache.get_or_compute(
+                "trading_signal", stock_code, run_analysis, force_refresh=request.force_refresh
+            )
+            return {
                 "analysis_type": "daily_technical_trading",
                 "stock_code": stock_code,
-                "cached": False,
-                "cache_expires_at": None,
-                "immediate_trading_signal": ai_result["analysis"].get("immediate_trading_signal", {}),
-                "technical_summary": ai_result["analysis"].get("technical_summary", {}),
-                "risk_warning": ai_result["analysis"].get("risk_warning", "请注意投资风险"),
-                "ai_analysis": ai_result["analysis"].get("raw_content", ""),
-                "data_completeness": technical_data.get("data_completeness", 0),
-                "api_usage": ai_result.get("api_usage", {}),
-                "timestamp": datetime.now().isoformat()
+                **result
             }
             
-            # 保存到缓存
-            try:
-                await analysis_cache.set_trading_signal_cache(stock_code, response_data)
-            except Exception as e:
-                print(f"缓存保存失败: {e}")
-            
-            print(f"技术面交易信号分析完成: {stock_code}")
-            return response_data
-            
         except HTTPException:
             raise
         except Exception as e:
@@ -1732,6 +2342,22 @@ try:
                 detail=f"处理技术面交易信号时发生错误: {str(e)}"
             )
     
+    @app.get("/ai/trading-signal/{stock_code}/stream")
+    async def stream_trading_signal(stock_code: str, force_refresh: bool = False):
+        """
+        流式获取技术面交易信号（Server-Sent Events）
+        
+        - 依次推送 phase（数据收集阶段）、token（模型输出片段）事件，最后推送 result（与 POST /ai/trading-signal 的响应相同）
+        - 缓存命中时直接推送 result；失败时推送 error
+        - 与普通接口共享缓存和单飞，客户端中途断开时分析继续执行并写入缓存
+        """
+        if not stock_code or len(stock_code) != 6 or not stock_code.isdigit():
+            raise HTTPException(status_code=400, detail="股票代码必须是6位数字")
+        return stream_analysis(
+            lambda: get_trading_signal(stock_code, TradingSignalRequest(force_refresh=force_refresh)),
+            stock_code=stock_code, analysis_type="daily_technical_trading"
+        )
+    
     # 添加GET方法支持，重定向到POST
     @app.get("/ai/comprehensive-evaluation/{stock_code}")
     async def get_comprehensive_evaluation_redirect(stock_code: str):
@@ -1760,109 +2386,115 @@ try:
                     detail="股票代码必须是6位数字"
                 )
             
-            # 检查缓存（除非强制刷新）
-            cached_result = None
-            if not request.force_refresh:
-                try:
-                    cached_result = await analysis_cache.get_comprehensive_cache(stock_code)
-                    if cached_result:
-                        print(f"返回综合评估缓存: {stock_code}")
-                        return {
-                            "analysis_type": "comprehensive_stock_evaluation",
-                            "stock_code": stock_code,
-                            **cached_result
-                        }
-                except Exception as e:
-                    print(f"缓存查询失败: {e}")
-            
-            # 检查AI Agent是否可用
-            if not comprehensive_agent:
-                raise HTTPException(
-                    status_code=503,
-                    detail="综合评估AI Agent未初始化，请检查ANTHROPIC_API_KEY配置"
-                )
-            
-            # 使用现有API接口获取数据
-            stock_data_aggregator.base_url = "http://35.77.54.203:3003"
+            # 缓存未命中时执行的分析（同一时间只有一个请求真正执行）
+            async def run_analysis():
+                # 检查AI Agent是否可用
+                if not comprehensive_agent:
+                    raise HTTPException(
+                        status_code=503,
+                        detail="综合评估AI Agent未初始化，请检查ANTHROPIC_API_KEY配置"
+                    )
             
-            # 收集综合数据
-            print(f"收集综合数据: {stock_code}")
-            comprehensive_data = await stock_data_aggregator.collect_comprehensive_data(stock_code)
+                # 收集综合数据
+                emit_progress("phase", {"phase": "collecting_data"})
+                print(f"收集综合数据: {stock_code}")
+                comprehensive_data = await stock_data_aggregator.collect_comprehensive_data(stock_code)
             
-            if not comprehensive_data or comprehensive_data.get("success_count", 0) < 2:  # 降低要求，至少需要2个数据源
-                # 如果数据收集失败，尝试简化版本
-                print(f"数据收集失败，尝试基础数据收集: {stock_code}")
-                try:
-                    # 只收集核心数据和基本面分析
-                    basic_data = await stock_data_aggregator.collect_technical_data(stock_code)
-                    if basic_data and basic_data.get("success_count", 0) >= 1:
-                        comprehensive_data = {
-                            "stock_code": stock_code,
-                            "data_type": "simplified_evaluation",
-                            "collected_at": datetime.now().isoformat(),
-                            "data_sources": basic_data.get("data_sources", {}),
-                            "success_count": basic_data.get("success_count", 0),
-                            "data_completeness": basic_data.get("data_completeness", 0),
-                            "note": "使用简化数据进行评估"
-                        }
-                    else:
+                if not comprehensive_data or comprehensive_data.get("success_count", 0) < 2:  # 降低要求，至少需要2个数据源
+                    # 如果数据收集失败，尝试简化版本
+                    print(f"数据收集失败，尝试基础数据收集: {stock_code}")
+                    try:
+                        # 只收集核心数据和基本面分析
+                        basic_data = await stock_data_aggregator.collect_technical_data(stock_code)
+                        if basic_data and basic_data.get("success_count", 0) >= 1:
+                            comprehensive_data = {
+                                "stock_code": stock_code,
+                                "data_type": "simplified_evaluation",
+                                "collected_at": datetime.now().isoformat(),
+                                "data_sources": basic_data.get("data_sources", {}),
+                                "success_count": basic_data.get("success_count", 0),
+                                "data_completeness": basic_data.get("data_completeness", 0),
+                                "note": "使用简化数据进行评估"
+                            }
+                        else:
+                            raise HTTPException(
+                                status_code=503,
+                                detail=f"无法获取任何有效数据进行分析"
+                            )
+                    except Exception as e:
                         raise HTTPException(
                             status_code=503,
-                            detail=f"无法获取任何有效数据进行分析"
+                            detail=f"数据收集完全失败: {str(e)}"
                         )
-                except Exception as e:
-                    raise HTTPException(
-                        status_code=503,
-                        detail=f"数据收集完全失败: {str(e)}"
-                    )
-            
-            # 格式化数据为AI可读格式
-            formatted_data = stock_data_aggregator.format_data_for_ai(comprehensive_data)
             
-            # 执行AI分析
-            print(f"执行综合评估AI分析: {stock_code}")
-            ai_result = await comprehensive_agent.analyze_comprehensive_evaluation(formatted_data, stock_code)
+                emit_progress("phase", {
+                    "phase": "data_collected",
+                    "success_count": comprehensive_data.get("success_count", 0),
+                    "data_completeness": comprehensive_data.get("data_completeness", 0),
+                    "partial": comprehensive_data.get("partial", False),
+                    "sections": comprehensive_data.get("sections", {})
+                })
+                
+                # 格式化数据为AI可读格式
+                formatted_data = stock_data_aggregator.format_data_for_ai(comprehensive_data)
             
-            if not ai_result.get("success"):
-                raise HTTPException(
-                    status_code=500,
-                    detail=f"AI综合评估失败: {ai_result.get('error', 'Unknown error')}"
+                # 执行AI分析
+                print(f"执行综合评估AI分析: {stock_code}")
+                # 输入数据与上次相同（收盘后、周末）时复用上次的AI结果，不再调用模型
+                fingerprint = comprehensive_agent.input_fingerprint(
+                    stock_data_aggregator.format_data_for_ai(comprehensive_data, normalize=True)
+                )
+                ai_result = await analysis_cache.get_or_analyze_content(
+                    "comprehensive_eval", stock_code, fingerprint,
+                    lambda: comprehensive_agent.analyze_comprehensive_evaluation(formatted_data, stock_code),
+                    force_refresh=request.force_refresh
                 )
             
-            # 构建响应
-            response_data = {
+                if not ai_result.get("success"):
+                    raise HTTPException(
+                        status_code=500,
+                        detail=f"AI综合评估失败: {ai_result.get('error', 'Unknown error')}"
+                    )
+            
+                # 构建响应
+                response_data = {
+                    "analysis_type": "comprehensive_stock_evaluation",
+                    "stock_code": stock_code,
+                    "cached": False,
+                    "cache_expires_at": None,
+                    "comprehensive_evaluation": ai_result["analysis"].get("comprehensive_evaluation", {}),
+                    "evidence_and_reasoning": ai_result["analysis"].get("evidence_and_reasoning", {}),
+                    "detailed_analysis": ai_result["analysis"].get("detailed_analysis", {}),
+                    "sector_comparison": ai_result["analysis"].get("sector_comparison", {}),
+                    "raw_data_sources": {
+                        "fundamental_data": comprehensive_data.get("data_sources", {}).get("fundamental_analysis", {}),
+                        "technical_data": comprehensive_data.get("data_sources", {}).get("technical_analysis", {}),
+                        "news_data": {
+                            "announcements": comprehensive_data.get("data_sources", {}).get("announcements", {}),
+                            "dragon_tiger": comprehensive_data.get("data_sources", {}).get("dragon_tiger", {})
+                        },
+                        "financial_history": comprehensive_data.get("data_sources", {}).get("financial_history", {})
+                    },
+                    "ai_analysis": ai_result["analysis"].get("raw_content", ""),
+                    "data_completeness": comprehensive_data.get("data_completeness", 0),
+                    "api_usage": ai_result.get("api_usage", {}),
+                    "content_reused": ai_result.get("content_reused", False),
+                    "timestamp": datetime.now().isoformat()
+                }
+                
+                print(f"综合评估分析完成: {stock_code}")
+                return response_data
+            
+            # 读取缓存；未命中时单飞执行分析，临近过期时后台提前刷新（除非强制刷新）
+            result = await analysis_cache.get_or_compute(
+                "comprehensive_eval", stock_code, run_analysis, force_refresh=request.force_refresh
+            )
+            return {
                 "analysis_type": "comprehensive_stock_evaluation",
                 "stock_code": stock_code,
-                "cached": False,
-                "cache_expires_at": None,
-                "comprehensive_evaluation": ai_result["analysis"].get("comprehensive_evaluation", {}),
-                "evidence_and_reasoning": ai_result["analysis"].get("evidence_and_reasoning", {}),
-                "detailed_analysis": ai_result["analysis"].get("detailed_analysis", {}),
-                "sector_comparison": ai_result["analysis"].get("sector_comparison", {}),
-                "raw_data_sources": {
-                    "fundamental_data": comprehensive_data.get("data_sources", {}).get("fundamental_analysis", {}),
-                    "technical_data": comprehensive_data.get("data_sources", {}).get("technical_analysis", {}),
-                    "news_data": {
-                        "announcements": comprehensive_data.get("data_sources", {}).get("announcements", {}),
-                        "dragon_tiger": comprehensive_data.get("data_sources", {}).get("dragon_tiger", {})
-                    },
-                    "financial_history": comprehensive_data.get("data_sources", {}).get("financial_history", {})
-                },
-                "ai_analysis": ai_result["analysis"].get("raw_content", ""),
-                "data_completeness": comprehensive_data.get("data_completeness", 0),
-                "api_usage": ai_result.get("api_usage", {}),
-                "timestamp": datetime.now().isoformat()
+                **result
             }
             
-            # 保存到缓存
-            try:
-                await analysis_cache.set_comprehensive_cache(stock_code, response_data)
-            except Exception as e:
-                print(f"缓存保存失败: {e}")
-            
-            print(f"综合评估分析完成: {stock_code}")
-            return response_data
-            
         except HTTPException:
             raise
         except Exception as e:
@@ -1872,6 +2504,22 @@ try:
                 detail=f"处理综合评估时发生错误: {str(e)}"
             )
     
+    @app.get("/ai/comprehensive-evaluation/{stock_code}/stream")
+    async def stream_comprehensive_evaluation(stock_code: str, force_refresh: bool = False):
+        """
+        流式获取综合评估报告（Server-Sent Events）
+        
+        - 依次推送 phase（数据收集阶段）、token（模型输出片段）事件，最后推送 result（与 POST /ai/comprehensive-evaluation 的响应相同）
+        - 缓存命中时直接推送 result；失败时推送 error
+        - 与普通接口共享缓存和单飞，客户端中途断开时分析继续执行并写入缓存
+        """
+        if not stock_code or len(stock_code) != 6 or not stock_code.isdigit():
+            raise HTTPException(status_code=400, detail="股票代码必须是6位数字")
+        return stream_analysis(
+            lambda: get_comprehensive_evaluation(stock_code, ComprehensiveEvalRequest(force_refresh=force_refresh)),
+            stock_code=stock_code, analysis_type="comprehensive_stock_evaluation"
+        )
+    
     @app.get("/ai/health")
     async def ai_health_check():
         """AI功能健康检查"""
@@ -1901,9 +2549,94 @@ try:
             "comprehensive_agent": bool(comprehensive_agent),
             "anthropic_api_key": bool(os.getenv('ANTHROPIC_API_KEY'))
         }
+        health_status["components"]["job_queue"] = analysis_job_queue.info()
+        health_status["components"]["batch_analysis"] = batch_analyzer.info()
+        health_status["components"]["model_rate_limiter"] = model_rate_limiter.info()
         
         return health_status
     
+    @app.post("/ai/jobs", status_code=202)
+    async def submit_analysis_job(request: AnalysisJobRequest):
+        """
+        提交异步分析任务，立即返回任务ID
+        
+        - **job_type**: trading_signal（技术面交易信号）或 comprehensive_eval（综合评估）
+        - 同一股票、同一类型已有排队或执行中的任务时返回该任务（deduplicated=true）
+        - 通过 GET /ai/jobs/{job_id}?wait=秒数 查询或长轮询结果
+        """
+        if not request.stock_code or len(request.stock_code) != 6 or not request.stock_code.isdigit():
+            raise HTTPException(status_code=400, detail="股票代码必须是6位数字")
+        if request.job_type not in analysis_job_queue.runners:
+            raise HTTPException(
+                status_code=400,
+                detail=f"job_type必须是: {', '.join(sorted(analysis_job_queue.runners)) or '(任务队列未启动)'}"
+            )
+        try:
+            job, created = await analysis_job_queue.submit(request.job_type, request.stock_code, request.force_refresh)
+        except JobQueueFull as e:
+            raise HTTPException(status_code=429, detail=str(e))
+        except RuntimeError as e:
+            raise HTTPException(status_code=503, detail=str(e))
+        return {**job, "deduplicated": not created}
+    
+    @app.get("/ai/jobs/{job_id}")
+    async def get_analysis_job(job_id: str, wait: float = 0):
+        """
+        查询分析任务状态和结果
+        
+        - **wait**: 长轮询秒数（最长60），任务在此期间完成时立即返回；0 表示立即返回当前状态
+        - status: queued / running / succeeded / failed；succeeded 时 result 与同步接口的响应相同
+        """
+        job = await (analysis_job_queue.wait(job_id, wait) if wait > 0 else analysis_job_queue.get(job_id))
+        if job is None:
+            raise HTTPException(status_code=404, detail=f"任务不存在或已过期: {job_id}")
+        return job
+    
+    @app.post("/ai/batch")
+    async def batch_analysis(request: BatchAnalysisRequest):
+        """
+        自选股批量AI分析（Server-Sent Events）
+        
+        - **stock_codes**: 股票代码列表，最多100只（ANALYSIS_BATCH_MAX_CODES）
+        - **analysis_type**: trading_signal（技术面交易信号，默认）或 comprehensive_eval（综合评估）
+        - 全市场快照和行业板块行情每批只获取一次，作为 market_context 附加到每只股票的分析数据
+        - 数据收集并发有上限，模型调用按每分钟token预算排队；每只股票的结果与单只接口相同并写入缓存
+        - 按完成顺序推送 stock 事件，全部完成后推送 result（批次汇总）
+        """
+        stock_codes, invalid_codes = batch_analyzer.validate(request.analysis_type, request.stock_codes)
+        return batch_analyzer.stream(request.analysis_type, stock_codes, request.force_refresh, invalid_codes)
+    
+    @app.get("/ai/cache/status")
+    async def get_cache_status_batch(codes: str):
+        """
+        批量获取多只股票的缓存状态（所有TTL查询在一个Redis pipeline中完成）
+        
+        - **codes**: 逗号分隔的股票代码，如 600519,000001
+        """
+        stock_codes, invalid_codes = _parse_batch_codes(codes)
+        if not stock_codes:
+            raise HTTPException(status_code=400, detail="请提供有效的股票代码，如 codes=600519,000001")
+        if len(stock_codes) > analysis_cache.MAX_BATCH_CODES:
+            raise HTTPException(
+                status_code=400,
+                detail=f"单次最多查询 {analysis_cache.MAX_BATCH_CODES} 只股票，当前 {len(stock_codes)} 只"
+            )
+        
+        statuses = await analysis_cache.get_cache_status_many(stock_codes)
+        if "error" in statuses:
+            raise HTTPException(status_code=500, detail=statuses["error"])
+        
+        return {
+            "count": len(stock_codes),
+            "invalid_codes": invalid_codes,
+            "summary": {
+                cache_type: sum(1 for code in stock_codes if statuses[code][cache_type]["exists"])
+                for cache_type in analysis_cache.CACHE_TYPES
+            },
+            "statuses": [statuses[code] for code in stock_codes],
+            "timestamp": datetime.now().isoformat()
+        }
+    
     @app.get("/ai/cache/status/{stock_code}")
     async def get_cache_status(stock_code: str):
         """获取指定股票的缓存状态"""
@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+"""
+大数据集流式响应模块
+Streaming response helpers for large record sets
+
+支持两种格式 / Two formats:
+- ndjson: 每行一个JSON对象，依次为 meta、record...、summary
+          one JSON object per line: a meta line, one line per record, a summary line
+- json:   分块输出的JSON数组，仅包含记录
+          a chunked JSON array containing only the records
+记录由生成器逐条产生并序列化，服务端内存占用不随记录数增长。
+只有ndjson会逐块送达客户端；json数组按 application/json 压缩输出，客户端在响应结束后才能解析。
+
+StreamingAwareGZipMiddleware 替代 GZipMiddleware：流式媒体类型的响应不压缩，逐块直接发送。
+StreamingAwareGZipMiddleware replaces GZipMiddleware so streaming media types are sent uncompressed, chunk by chunk.
+"""
+import json
+from datetime import date, datetime
+from functools import partial
+from typing import Any, Callable, Dict, Iterable, Iterator, Optional
+
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import StreamingResponse
+from starlette.datastructures import Headers
+
+STREAM_FORMATS = ("ndjson", "json")
+
+MEDIA_TYPES = {
+    "ndjson": "application/x-ndjson",
+    "json": "application/json",
+}
+
+# 不进行gzip压缩的流式媒体类型 / Streaming media types that are never gzipped
+# json格式是普通的 application/json，仍会被压缩，因而不会逐块送达客户端
+# The json format stays plain application/json, so it is still gzipped and not delivered incrementally
+STREAMING_MEDIA_TYPES = ("text/event-stream", MEDIA_TYPES["ndjson"])
+
+
+def _json_default(value: Any):
+    """序列化pandas/numpy类型 / Serialize pandas and numpy scalars"""
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if hasattr(value, "item"):
+        return value.item()
+    if hasattr(value, "isoformat"):
+        return value.isoformat()
+    return str(value)
+
+
+def dumps(value: Any) -> str:
+    """紧凑JSON序列化（NaN需由调用方预先处理）/ Compact JSON (callers fill NaN beforehand)"""
+    return json.dumps(value, ensure_ascii=False, default=_json_default, separators=(",", ":"))
+
+
+def ndjson_lines(meta: Dict[str, Any], records: Iterable[Dict[str, Any]],
+                 summary: Optional[Callable[[], Dict[str, Any]]] = None) -> Iterator[str]:
+    """生成NDJSON行 / Yield NDJSON lines: meta, records, then summary"""
+    yield dumps({"type": "meta", "data": meta}) + "\n"
+    count = 0
+    for record in records:
+        count += 1
+        yield dumps({"type": "record", "data": record}) + "\n"
+    tail = {"total_records": count}
+    if summary is not None:
+        tail.update(summary())
+    yield dumps({"type": "summary", "data": tail}) + "\n"
+
+
+def json_array_chunks(records: Iterable[Dict[str, Any]]) -> Iterator[str]:
+    """生成分块的JSON数组 / Yield a JSON array chunk by chunk"""
+    yield "["
+    first = True
+    for record in records:
+        yield dumps(record) if first else "," + dumps(record)
+        first = False
+    yield "]"
+
+
+def stream_records(fmt: str, meta: Dict[str, Any], records: Iterable[Dict[str, Any]],
+                   summary: Optional[Callable[[], Dict[str, Any]]] = None) -> StreamingResponse:
+    """
+    构建流式响应 / Build a streaming response over a record generator
+
+    Args:
+        fmt: ndjson 或 json
+        meta: 记录之前输出的元信息（仅ndjson）
+        records: 记录生成器
+        summary: 在记录全部输出后调用，返回汇总信息（仅ndjson）
+    """
+    if fmt == "json":
+        body = json_array_chunks(records)
+    else:
+        body = ndjson_lines(meta, records, summary)
+    return StreamingResponse(
+        (chunk.encode("utf-8") for chunk in body),
+        media_type=MEDIA_TYPES.get(fmt, MEDIA_TYPES["ndjson"])
+    )
+
+
+class StreamingAwareGZipMiddleware:
+    """
+    跳过流式响应的gzip压缩中间件 / GZip middleware that leaves streaming responses uncompressed
+
+    Starlette 0.27（fastapi 0.104）的 GZipMiddleware 把流式响应的分块写入 GzipFile 且不刷新，
+    客户端在响应结束前只能收到gzip头。这里根据响应头的媒体类型分流：
+    STREAMING_MEDIA_TYPES 中的响应绕过压缩直接发送，其余响应照常交给 GZipMiddleware。
+    """
+
+    def __init__(self, app, minimum_size: int = 500, media_types: Iterable[str] = STREAMING_MEDIA_TYPES):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.media_types = frozenset(media_types)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        gzip = GZipMiddleware(partial(self._route_response, raw_send=send), minimum_size=self.minimum_size)
+        await gzip(scope, receive, send)
+
+    async def _route_response(self, scope, receive, gzip_send, raw_send):
+        target = None
+
+        async def send(message):
+            nonlocal target
+            if target is None and message["type"] == "http.response.start":
+                media_type = Headers(raw=message["headers"]).get("content-type", "").partition(";")[0].strip().lower()
+                target = raw_send if media_type in self.media_types else gzip_send
+            await (target or gzip_send)(message)
+
+        await self.app(scope, receive, send)
@@ -5,15 +5,22 @@ US Stock Service API - Port 3004
 """
 from fastapi import FastAPI, HTTPException, Depends, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
-from sqlalchemy.orm import Session
-from sqlalchemy import and_, or_
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import and_, or_, func, select
 from typing import List, Optional
 from datetime import datetime, timedelta
 import logging
 import time
 
-from database import get_db, USStock, APILog, init_database, test_database_connection
+from database import (
+    get_async_db, US_STOCK_SORT_COLUMNS, USStock, fetch_first, count_rows,
+    init_async_database, test_async_database_connection, close_async_database
+)
 from akshare_service import AkshareService
+from log_buffer import api_log_buffer
+from pagination import CursorError, KeysetPaginator, count_cache, filters_fingerprint
+from latency_rollup import DEFAULT_QUERY_WINDOWS, RESOLUTIONS, LatencyRollupJob, query_latency, route_normalizer
+from service_stats import TableStats, backfill_today_api_calls, today_api_calls
 from config import Config
 
 # 配置日志 / Configure logging
@@ -38,6 +45,29 @@ app.add_middleware(
 # 初始化akshare服务 / Initialize akshare service
 akshare_service = AkshareService()
 
+# 列表接口的键集分页器 / Keyset paginator for the list endpoint
+stock_paginator = KeysetPaginator(USStock, "stock_symbol", US_STOCK_SORT_COLUMNS)
+
+# 接口延迟汇总与原始日志保留任务 / Latency rollup and raw log retention job
+latency_rollup = LatencyRollupJob("us_stock", route_normalizer(app.routes))
+
+
+async def _compute_stock_stats(db: AsyncSession) -> dict:
+    """完整计算表统计（仅在校准时执行） / Full table statistics, only run on reconcile"""
+    exchange_stats = (await db.execute(select(
+        USStock.exchange,
+        func.count(USStock.stock_symbol).label('count')
+    ).where(USStock.is_active == True).group_by(USStock.exchange))).all()
+    return {
+        "active_stocks_count": await count_rows(db, select(USStock).where(USStock.is_active == True)),
+        "total_stocks_count": await count_rows(db, select(USStock)),
+        "exchange_distribution": {exchange: count for exchange, count in exchange_stats if exchange}
+    }
+
+
+# /stats 使用的内存统计 / In-memory statistics behind /stats
+stock_stats = TableStats("us_stocks", _compute_stock_stats)
+
 @app.middleware("http")
 async def log_requests(request: Request, call_next):
     """API请求日志中间件 / API request logging middleware"""
@@ -45,22 +75,17 @@ async def log_requests(request: Request, call_next):
     response = await call_next(request)
     process_time = time.time() - start_time
     
-    # 记录API调用日志 / Log API calls
+    # 记录API调用日志（放入缓冲区，由后台任务批量写入）/ Log API calls via the batched buffer
     try:
-        db = next(get_db())
-        log_entry = APILog(
+        api_log_buffer.enqueue(
             service_type="us_stock",
             endpoint=str(request.url.path),
             method=request.method,
             request_params=str(request.query_params) if request.query_params else None,
             response_status=response.status_code,
             response_time=process_time,
-            client_ip=request.client.host,
-            created_at=datetime.utcnow()
+            client_ip=request.client.host if request.client else None
         )
-        db.add(log_entry)
-        db.commit()
-        db.close()
     except Exception as e:
         logger.error(f"日志记录失败 / Failed to log request: {str(e)}")
     
@@ -72,17 +97,35 @@ async def startup_event():
     logger.info("美国股票服务API启动中 / US Stock Service API starting...")
     
     # 测试数据库连接 / Test database connection
-    if not test_database_connection():
+    if not await test_async_database_connection():
         logger.error("数据库连接失败，服务无法启动 / Database connection failed, service cannot start")
         raise Exception("Database connection failed")
     
     # 初始化数据库表 / Initialize database tables
-    if not init_database():
+    if not await init_async_database():
         logger.error("数据库初始化失败 / Database initialization failed")
         raise Exception("Database initialization failed")
     
+    # 启动API日志批量写入任务 / Start the batched API log writer
+    await backfill_today_api_calls("us_stock")
+    api_log_buffer.start()
+    
+    # 启动统计定时校准 / Start periodic statistics reconciliation
+    stock_stats.start()
+    
+    # 启动接口延迟汇总 / Start the latency rollup job
+    latency_rollup.start()
+    
     logger.info(f"美国股票服务API已在端口{Config.US_STOCK_PORT}启动 / US Stock Service API started on port {Config.US_STOCK_PORT}")
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    """应用关闭事件 / Application shutdown event"""
+    await stock_stats.stop()
+    await latency_rollup.stop()
+    await api_log_buffer.stop()
+    await close_async_database()
+
 @app.get("/", summary="服务状态检查 / Service health check")
 async def root():
     """服务状态检查端点 / Service health check endpoint"""
@@ -96,15 +139,16 @@ async def root():
     }
 
 @app.get("/health", summary="健康检查 / Health check")
-async def health_check(db: Session = Depends(get_db)):
+async def health_check(db: AsyncSession = Depends(get_async_db)):
     """健康检查端点，包含数据库连接测试 / Health check endpoint with database connection test"""
     try:
         # 测试数据库查询 / Test database query
         from sqlalchemy import text
-        db.execute(text("SELECT 1"))
+        await db.execute(text("SELECT 1"))
         return {
             "status": "healthy",
             "database": "connected",
+            "request_log": api_log_buffer.stats(),
             "timestamp": datetime.utcnow().isoformat()
         }
     except Exception as e:
@@ -114,7 +158,7 @@ async def health_check(db: Session = Depends(get_db)):
 async def get_stock_info(
     stock_symbol: str,
     refresh: bool = Query(False, description="是否强制刷新数据 / Whether to force refresh data"),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     获取指定美股的详细信息
@@ -128,7 +172,7 @@ async def get_stock_info(
         stock_symbol = stock_symbol.upper()
         
         # 检查数据库中是否有缓存数据 / Check if there's cached data in database
-        cached_stock = db.query(USStock).filter(USStock.stock_symbol == stock_symbol).first()
+        cached_stock = await fetch_first(db, select(USStock).where(USStock.stock_symbol == stock_symbol))
         
         # 判断是否需要刷新数据 / Determine if data refresh is needed
         need_refresh = (
@@ -148,6 +192,7 @@ async def get_stock_info(
                 )
             
             # 更新或创建数据库记录 / Update or create database record
+            created = cached_stock is None
             if cached_stock:
                 # 更新现有记录 / Update existing record
                 for key, value in stock_data.items():
@@ -159,11 +204,15 @@ async def get_stock_info(
                 cached_stock = USStock(**stock_data)
                 db.add(cached_stock)
             
-            db.commit()
+            await db.commit()
+            # 提交成功后才调整统计 / Adjust statistics only after a successful commit
+            if created:
+                stock_stats.adjust(total_stocks_count=1, active_stocks_count=1)
+                stock_stats.adjust_distribution("exchange_distribution", cached_stock.exchange, 1)
             
             # 验证数据库操作 / Verify database operation
-            db.refresh(cached_stock)
-            verification_query = db.query(USStock).filter(USStock.stock_symbol == stock_symbol).first()
+            await db.refresh(cached_stock)
+            verification_query = await fetch_first(db, select(USStock).where(USStock.stock_symbol == stock_symbol))
             if verification_query is None:
                 logger.error(f"数据库验证失败：股票 {stock_symbol} 未找到 / Database verification failed: Stock {stock_symbol} not found")
                 raise HTTPException(status_code=500, detail="数据库操作验证失败 / Database operation verification failed")
@@ -210,18 +259,24 @@ async def get_stocks_list(
     sort_by: str = Query("stock_symbol", description="排序字段 / Sort field"),
     sort_order: str = Query("asc", description="排序顺序：asc或desc / Sort order: asc or desc"),
     active_only: bool = Query(True, description="只显示活跃股票 / Show active stocks only"),
-    db: Session = Depends(get_db)
+    cursor: Optional[str] = Query(None, description="上一页返回的next_cursor，传入后忽略page / next_cursor from the previous page; overrides page"),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     获取美股列表，支持分页、搜索和排序
     Get US stock list with pagination, search and sorting support
     """
+    try:
+        sort_by, descending = stock_paginator.validate_sort(sort_by, sort_order)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
     try:
         # 构建查询条件 / Build query conditions
-        query = db.query(USStock)
+        query = select(USStock)
         
         if active_only:
-            query = query.filter(USStock.is_active == True)
+            query = query.where(USStock.is_active == True)
         
         if search:
             search_condition = or_(
@@ -229,28 +284,30 @@ async def get_stocks_list(
                 USStock.stock_name_en.contains(search),
                 USStock.stock_name_cn.contains(search)
             )
-            query = query.filter(search_condition)
+            query = query.where(search_condition)
         
         if sector:
-            query = query.filter(USStock.sector.contains(sector))
+            query = query.where(USStock.sector.contains(sector))
         
         if exchange:
-            query = query.filter(USStock.exchange == exchange.upper())
-        
-        # 排序 / Sorting
-        if hasattr(USStock, sort_by):
-            sort_column = getattr(USStock, sort_by)
-            if sort_order.lower() == "desc":
-                query = query.order_by(sort_column.desc())
-            else:
-                query = query.order_by(sort_column.asc())
-        
-        # 计算总数 / Calculate total count
-        total_count = query.count()
+            query = query.where(USStock.exchange == exchange.upper())
+        
+        # 无筛选、只按活跃状态或交易所筛选时读取增量维护的计数，否则按筛选条件缓存总数
+        # Maintained counters for no filter, active-only or active exchange filters; cached counts otherwise
+        fingerprint = filters_fingerprint({"active_only": active_only, "search": search, "sector": sector, "exchange": exchange})
+        if not (search or sector or exchange):
+            count_info = await stock_stats.count_info("active_stocks_count" if active_only else "total_stocks_count")
+        elif active_only and exchange and not (search or sector):
+            count_info = await stock_stats.count_info("exchange_distribution", exchange.upper())
+        else:
+            count_info = await count_cache.count(f"us_stocks:{fingerprint}", lambda: count_rows(db, query))
+        total_count = count_info["total_count"]
         
-        # 分页 / Pagination
-        offset = (page - 1) * limit
-        stocks = query.offset(offset).limit(limit).all()
+        # 键集分页：按 (排序列, 主键) 排序，多取一行判断是否有下一页 / Keyset pagination, fetching one extra row
+        query = stock_paginator.apply(query, sort_by, descending, fingerprint, cursor=cursor, offset=(page - 1) * limit)
+        rows = (await db.execute(query.limit(limit + 1))).scalars().all()
+        next_cursor = stock_paginator.next_cursor(rows, limit, sort_by, descending, fingerprint)
+        stocks = rows[:limit]
         
         # 格式化返回数据 / Format return data
         stocks_data = []
@@ -272,19 +329,24 @@ async def get_stocks_list(
         return {
             "stocks": stocks_data,
             "pagination": {
-                "page": page,
+                "page": None if cursor else page,
                 "limit": limit,
                 "total_count": total_count,
-                "total_pages": (total_count + limit - 1) // limit
+                "total_pages": (total_count + limit - 1) // limit,
+                "count_source": count_info["count_source"],
+                "next_cursor": next_cursor,
+                "has_more": next_cursor is not None
             }
         }
         
+    except CursorError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         logger.error(f"获取美股列表失败 / Failed to get US stock list: {str(e)}")
         raise HTTPException(status_code=500, detail=f"内部服务器错误 / Internal server error: {str(e)}")
 
 @app.post("/stocks/{stock_symbol}/refresh", summary="刷新指定美股数据 / Refresh specific US stock data")
-async def refresh_stock_data(stock_symbol: str, db: Session = Depends(get_db)):
+async def refresh_stock_data(stock_symbol: str, db: AsyncSession = Depends(get_async_db)):
     """
     强制刷新指定美股的数据
     Force refresh data for a specific US stock
@@ -302,8 +364,9 @@ async def refresh_stock_data(stock_symbol: str, db: Session = Depends(get_db)):
             )
         
         # 查找现有记录 / Find existing record
-        existing_stock = db.query(USStock).filter(USStock.stock_symbol == stock_symbol).first()
+        existing_stock = await fetch_first(db, select(USStock).where(USStock.stock_symbol == stock_symbol))
         
+        created = existing_stock is None
         if existing_stock:
             # 更新现有记录 / Update existing record
             for key, value in stock_data.items():
@@ -315,11 +378,15 @@ async def refresh_stock_data(stock_symbol: str, db: Session = Depends(get_db)):
             existing_stock = USStock(**stock_data)
             db.add(existing_stock)
         
-        db.commit()
+        await db.commit()
+        # 提交成功后才调整统计 / Adjust statistics only after a successful commit
+        if created:
+            stock_stats.adjust(total_stocks_count=1, active_stocks_count=1)
+            stock_stats.adjust_distribution("exchange_distribution", existing_stock.exchange, 1)
         
         # 验证数据库操作 / Verify database operation
-        db.refresh(existing_stock)
-        verification_query = db.query(USStock).filter(USStock.stock_symbol == stock_symbol).first()
+        await db.refresh(existing_stock)
+        verification_query = await fetch_first(db, select(USStock).where(USStock.stock_symbol == stock_symbol))
         if verification_query is None:
             logger.error(f"数据库验证失败：股票 {stock_symbol} 刷新后未找到 / Database verification failed: Stock {stock_symbol} not found after refresh")
             raise HTTPException(status_code=500, detail="数据库操作验证失败 / Database operation verification failed")
@@ -338,7 +405,7 @@ async def refresh_stock_data(stock_symbol: str, db: Session = Depends(get_db)):
         raise HTTPException(status_code=500, detail=f"内部服务器错误 / Internal server error: {str(e)}")
 
 @app.delete("/stocks/{stock_symbol}", summary="删除指定美股数据 / Delete specific US stock data")
-async def delete_stock_data(stock_symbol: str, db: Session = Depends(get_db)):
+async def delete_stock_data(stock_symbol: str, db: AsyncSession = Depends(get_async_db)):
     """
     删除指定美股的数据（软删除，设置为不活跃）
     Delete data for a specific US stock (soft delete, set as inactive)
@@ -347,7 +414,7 @@ async def delete_stock_data(stock_symbol: str, db: Session = Depends(get_db)):
         stock_symbol = stock_symbol.upper()
         
         # 查找股票记录 / Find stock record
-        stock = db.query(USStock).filter(USStock.stock_symbol == stock_symbol).first()
+        stock = await fetch_first(db, select(USStock).where(USStock.stock_symbol == stock_symbol))
         
         if not stock:
             raise HTTPException(
@@ -356,16 +423,21 @@ async def delete_stock_data(stock_symbol: str, db: Session = Depends(get_db)):
             )
         
         # 软删除：设置为不活跃 / Soft delete: set as inactive
+        was_active = stock.is_active
         stock.is_active = False
         stock.last_updated = datetime.utcnow()
         
-        db.commit()
+        await db.commit()
+        count_cache.invalidate("us_stocks:")
+        if was_active:
+            stock_stats.adjust(active_stocks_count=-1)
+            stock_stats.adjust_distribution("exchange_distribution", stock.exchange, -1)
         
         # 验证数据库操作 / Verify database operation
-        db.refresh(stock)
-        verification_query = db.query(USStock).filter(
+        await db.refresh(stock)
+        verification_query = await fetch_first(db, select(USStock).where(
             and_(USStock.stock_symbol == stock_symbol, USStock.is_active == False)
-        ).first()
+        ))
         if verification_query is None:
             logger.error(f"数据库验证失败：股票 {stock_symbol} 删除后验证失败 / Database verification failed: Stock {stock_symbol} deletion verification failed")
             raise HTTPException(status_code=500, detail="数据库操作验证失败 / Database operation verification failed")
@@ -383,15 +455,15 @@ async def delete_stock_data(stock_symbol: str, db: Session = Depends(get_db)):
         raise HTTPException(status_code=500, detail=f"内部服务器错误 / Internal server error: {str(e)}")
 
 @app.get("/sectors", summary="获取行业列表 / Get sector list")
-async def get_sectors(db: Session = Depends(get_db)):
+async def get_sectors(db: AsyncSession = Depends(get_async_db)):
     """
     获取所有行业列表
     Get all sector list
     """
     try:
-        sectors_query = db.query(USStock.sector).filter(
+        sectors_query = (await db.execute(select(USStock.sector).where(
             and_(USStock.sector.isnot(None), USStock.sector != "", USStock.is_active == True)
-        ).distinct().all()
+        ).distinct())).all()
         
         sectors = [sector[0] for sector in sectors_query if sector[0]]
         
@@ -405,15 +477,15 @@ async def get_sectors(db: Session = Depends(get_db)):
         raise HTTPException(status_code=500, detail=f"内部服务器错误 / Internal server error: {str(e)}")
 
 @app.get("/exchanges", summary="获取交易所列表 / Get exchange list")
-async def get_exchanges(db: Session = Depends(get_db)):
+async def get_exchanges(db: AsyncSession = Depends(get_async_db)):
     """
     获取所有交易所列表
     Get all exchange list
     """
     try:
-        exchanges_query = db.query(USStock.exchange).filter(
+        exchanges_query = (await db.execute(select(USStock.exchange).where(
             and_(USStock.exchange.isnot(None), USStock.exchange != "", USStock.is_active == True)
-        ).distinct().all()
+        ).distinct())).all()
         
         exchanges = [exchange[0] for exchange in exchanges_query if exchange[0]]
         
@@ -426,41 +498,52 @@ async def get_exchanges(db: Session = Depends(get_db)):
         logger.error(f"获取交易所列表失败 / Failed to get exchanges: {str(e)}")
         raise HTTPException(status_code=500, detail=f"内部服务器错误 / Internal server error: {str(e)}")
 
+@app.get("/metrics/latency", summary="获取接口延迟汇总 / Get API latency rollups")
+async def get_latency_metrics(
+    resolution: str = Query("hour", description="汇总粒度 minute/hour/day / Rollup resolution"),
+    start: Optional[datetime] = Query(None, description="开始时间（UTC，默认按粒度回溯） / Start time in UTC"),
+    end: Optional[datetime] = Query(None, description="结束时间（UTC，默认为当前时间） / End time in UTC"),
+    endpoint: Optional[str] = Query(None, description="路由模板，如 /stats / Route template, e.g. /stats"),
+    method: Optional[str] = Query(None, description="HTTP方法 / HTTP method"),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """
+    按端点查询延迟汇总：调用次数、错误率、平均/最大响应时间和 p50/p90/p95/p99
+    Query per-endpoint latency rollups: calls, error rate, avg/max latency and p50/p90/p95/p99
+    """
+    if resolution not in RESOLUTIONS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"不支持的汇总粒度 '{resolution}'，可选: {', '.join(RESOLUTIONS)} / "
+                   f"Unsupported resolution '{resolution}', available: {', '.join(RESOLUTIONS)}"
+        )
+    try:
+        end = end or datetime.utcnow()
+        start = start or end - DEFAULT_QUERY_WINDOWS[resolution]
+        result = await query_latency(db, "us_stock", resolution, start, end, endpoint, method)
+        result["rollup"] = latency_rollup.info()
+        return result
+    except Exception as e:
+        logger.error(f"获取接口延迟汇总失败 / Failed to get latency rollups: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"内部服务器错误 / Internal server error: {str(e)}")
+
 @app.get("/stats", summary="获取美股统计信息 / Get US stock statistics")
-async def get_statistics(db: Session = Depends(get_db)):
+async def get_statistics(db: AsyncSession = Depends(get_async_db)):
     """
     获取美股服务统计信息
     Get US stock service statistics
     """
     try:
-        # 统计活跃股票数量 / Count active stocks
-        active_stocks_count = db.query(USStock).filter(USStock.is_active == True).count()
-        
-        # 统计总股票数量 / Count total stocks
-        total_stocks_count = db.query(USStock).count()
-        
-        # 统计今日API调用次数 / Count today's API calls
-        today_start = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
-        today_api_calls = db.query(APILog).filter(
-            and_(
-                APILog.service_type == "us_stock",
-                APILog.created_at >= today_start
-            )
-        ).count()
-        
-        # 统计各交易所股票数量 / Count stocks by exchange
-        from sqlalchemy import func
-        exchange_stats = db.query(
-            USStock.exchange,
-            func.count(USStock.stock_symbol).label('count')
-        ).filter(USStock.is_active == True).group_by(USStock.exchange).all()
+        # 股票数量和交易所分布来自内存统计 / Counts and exchange distribution from the in-memory statistics
+        table_stats = await stock_stats.get()
         
-        exchange_distribution = {exchange: count for exchange, count in exchange_stats if exchange}
+        # 今日API调用次数：汇总表一行 + 尚未写入的缓冲日志 / Today's API calls: rollup row plus buffered entries
+        api_calls_today = await today_api_calls(db, "us_stock", api_log_buffer.pending("us_stock"))
         
         # 获取最新更新的股票 / Get latest updated stocks
-        latest_updated_stocks = db.query(USStock).filter(
+        latest_updated_stocks = (await db.execute(select(USStock).where(
             USStock.is_active == True
-        ).order_by(USStock.last_updated.desc()).limit(5).all()
+        ).order_by(USStock.last_updated.desc()).limit(5))).scalars().all()
         
         latest_stocks_data = []
         for stock in latest_updated_stocks:
@@ -476,11 +559,12 @@ async def get_statistics(db: Session = Depends(get_db)):
         return {
             "service": "US Stock Service",
             "statistics": {
-                "active_stocks_count": active_stocks_count,
-                "total_stocks_count": total_stocks_count,
-                "today_api_calls": today_api_calls,
-                "exchange_distribution": exchange_distribution,
-                "latest_updated_stocks": latest_stocks_data
+                "active_stocks_count": table_stats.get("active_stocks_count", 0),
+                "total_stocks_count": table_stats.get("total_stocks_count", 0),
+                "today_api_calls": api_calls_today,
+                "exchange_distribution": dict(table_stats.get("exchange_distribution", {})),
+                "latest_updated_stocks": latest_stocks_data,
+                "stats_computed_at": stock_stats.info()["computed_at"]
             },
             "timestamp": datetime.utcnow().isoformat()
         }
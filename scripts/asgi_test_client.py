@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+"""
+ASGI测试客户端
+In-process ASGI driver shared by the test scripts
+
+不启动服务器，直接以ASGI方式调用应用并逐块接收响应：
+记录每个分块的到达时间，gzip响应边接收边解压，SSE响应解析为事件，可模拟客户端断开。
+测试脚本把 scripts 目录加入 sys.path 后导入 call_app。
+"""
+import asyncio
+import codecs
+import json
+import time
+import zlib
+
+
+async def call_app(app, method: str, path: str, query: str = "", disconnect_after_tokens: int = 0,
+                   headers=(), body=None, on_chunk=None):
+    """
+    以ASGI方式调用应用并逐块接收响应
+    返回 (状态码, [(到达时间, 事件名, 数据)])；disconnect_after_tokens>0 时收到该数量的token后模拟客户端断开
+    响应为gzip编码时边接收边解压，事件的到达时间为其所在分块的到达时间
+    body 不为None时作为JSON请求体发送；on_chunk(到达时间, 解压后的文本) 用于接收非SSE格式的响应
+    """
+    status, events, buffer = {}, [], ""
+    disconnected = asyncio.Event()
+    request_sent = False
+    decompressor = None
+    decoder = codecs.getincrementaldecoder("utf-8")()
+
+    async def receive():
+        nonlocal request_sent
+        if not request_sent:
+            request_sent = True
+            payload = b"" if body is None else json.dumps(body).encode()
+            return {"type": "http.request", "body": payload, "more_body": False}
+        await disconnected.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        nonlocal buffer, decompressor
+        if message["type"] == "http.response.start":
+            status["code"] = message["status"]
+            if (b"content-encoding", b"gzip") in [(k.lower(), v) for k, v in message["headers"]]:
+                decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+            return
+        arrived_at = time.monotonic()
+        body = message.get("body", b"")
+        text = decoder.decode(decompressor.decompress(body) if decompressor else body)
+        if on_chunk is not None:
+            on_chunk(arrived_at, text)
+            return
+        buffer += text
+        while "\n\n" in buffer:
+            block, buffer = buffer.split("\n\n", 1)
+            fields = dict(line.split(": ", 1) for line in block.splitlines() if not line.startswith(":"))
+            if "event" in fields:
+                events.append((arrived_at, fields["event"], json.loads(fields.get("data", "{}"))))
+        tokens = sum(1 for _, event, _ in events if event == "token")
+        if disconnect_after_tokens and tokens >= disconnect_after_tokens:
+            disconnected.set()
+
+    scope = {"type": "http", "http_version": "1.1", "method": method, "path": path, "raw_path": path.encode(),
+             "query_string": query.encode(),
+             "headers": list(headers) + ([(b"content-type", b"application/json")] if body is not None else []),
+             "scheme": "http", "server": ("test", 80), "client": ("127.0.0.1", 12345), "root_path": ""}
+    await app(scope, receive, send)
+    return status.get("code"), events
@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+"""
+AI数据聚合方式延迟对比
+AI data aggregation latency: in-process vs loopback HTTP
+
+- http:  StockDataAggregator 通过 --base-url 调用接口服务（旧方式，独立部署时使用）
+- local: 导入 stock_analysis_api，在同一进程内直接调用接口处理函数，
+         一次聚合共享一个抓取上下文（相同的akshare调用只执行一次）
+每种方式对每只股票执行 --iterations 次技术面和综合评估数据收集，输出中位数/P95耗时、
+数据完整率，以及进程内方式的akshare实际调用次数和复用次数。
+默认关闭进程内方式的响应缓存，测量的是每次都重新取数的耗时；HTTP方式的服务端响应缓存
+不受本脚本控制，对比冷数据时请用刚启动的服务。
+
+用法 / Usage:
+    python scripts/benchmark_aggregation.py --codes 600519,000001 --iterations 5
+    python scripts/benchmark_aggregation.py --modes local --keep-response-cache
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "api"))
+
+from ai_analysis.services.data_aggregator import StockDataAggregator  # noqa: E402
+
+
+def _local_aggregator(keep_response_cache: bool) -> StockDataAggregator:
+    """导入接口服务模块，得到已注册进程内数据源的聚合器"""
+    import stock_analysis_api  # noqa: F401  导入时注册进程内数据源
+    from ai_analysis.services.data_aggregator import stock_data_aggregator
+    from response_cache import LRUCache, response_cache
+
+    if not keep_response_cache:
+        response_cache.memory = LRUCache(0)
+        response_cache.redis_url = None
+    return stock_data_aggregator
+
+
+def _percentile(samples, fraction: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(int(len(ordered) * fraction), len(ordered) - 1)]
+
+
+async def _run(aggregator: StockDataAggregator, codes, iterations: int):
+    rows = []
+    for kind, collect in (("technical", aggregator.collect_technical_data),
+                          ("comprehensive", aggregator.collect_comprehensive_data)):
+        durations, completeness, calls, reused = [], [], 0, 0
+        for _ in range(iterations):
+            for code in codes:
+                started = time.perf_counter()
+                data = await collect(code)
+                durations.append((time.perf_counter() - started) * 1000)
+                completeness.append(data.get("data_completeness", 0))
+                stats = data.get("fetch_stats") or {}
+                calls += stats.get("calls", 0)
+                reused += stats.get("reused", 0)
+        rows.append((kind, durations, completeness, calls, reused))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="AI数据聚合延迟对比 / Aggregation latency comparison")
+    parser.add_argument("--codes", default="600519,000001", help="逗号分隔的股票代码")
+    parser.add_argument("--iterations", type=int, default=3)
+    parser.add_argument("--modes", default="http,local", help="要测试的方式: http,local")
+    parser.add_argument("--base-url", default="http://35.77.54.203:3003", help="http方式访问的接口服务地址")
+    parser.add_argument("--keep-response-cache", action="store_true", help="进程内方式保留响应缓存")
+    args = parser.parse_args()
+
+    codes = [code.strip() for code in args.codes.split(",") if code.strip()]
+    print(f"{'mode':<7}{'kind':<15}{'p50_ms':>10}{'p95_ms':>10}{'complete':>10}{'ak_calls':>10}{'reused':>8}")
+    for mode in [m.strip() for m in args.modes.split(",")]:
+        if mode == "http":
+            aggregator = StockDataAggregator(base_url=args.base_url)
+        elif mode == "local":
+            aggregator = _local_aggregator(args.keep_response_cache)
+            if aggregator.mode != "local":
+                print("进程内数据源未注册（AI分析模块导入失败？），跳过 / Local sources not registered, skipping")
+                continue
+        else:
+            print(f"未知方式 / Unknown mode: {mode}")
+            continue
+        for kind, durations, completeness, calls, reused in asyncio.run(_run(aggregator, codes, args.iterations)):
+            ak_columns = f"{calls:>10}{reused:>8}" if mode == "local" else f"{'-':>10}{'-':>8}"
+            print(f"{mode:<7}{kind:<15}{statistics.median(durations):>10.1f}{_percentile(durations, 0.95):>10.1f}"
+                  f"{statistics.mean(completeness):>10.2%}{ak_columns}")
+
+
+if __name__ == "__main__":
+    main()
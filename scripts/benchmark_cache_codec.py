@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+"""
+AI分析缓存编解码基准测试
+AI analysis cache codec benchmark
+
+对比旧版 json.dumps 文本与各种二进制编码的每条缓存字节数和编解码耗时：
+- legacy-json:  json.dumps(data, ensure_ascii=False)（旧版格式）
+- json:         紧凑JSON
+- json+zlib:    紧凑JSON + zlib
+- msgpack:      MessagePack（需要 msgpack）
+- msgpack+zlib: MessagePack + zlib（默认格式）
+样本条目按 /ai/trading-signal 和 /ai/comprehensive-evaluation 的响应结构构造，
+包含数千字的 ai_analysis 原始文本。
+
+用法 / Usage:
+    python scripts/benchmark_cache_codec.py --iterations 2000 --watchlist 500
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "api"))
+
+from ai_analysis.services.cache_codec import (  # noqa: E402
+    FORMAT_JSON, FORMAT_MSGPACK, MSGPACK_AVAILABLE, CacheCodec
+)
+
+_PHRASES = [
+    "MACD金叉后红柱持续放大，短期动能偏强。", "股价站上20日均线，均线系统呈多头排列。",
+    "成交量较5日均量放大约1.6倍，资金参与度提升。", "RSI接近70，存在短线超买回调风险。",
+    "布林带开口向上，价格运行于中轨与上轨之间。", "主力资金连续三日净流入，龙虎榜机构席位买入。",
+    "营业收入同比增长12.4%，归母净利润同比增长8.9%。", "毛利率环比小幅下降，费用率保持稳定。",
+    "行业景气度回升，估值处于近三年历史分位的35%附近。", "建议关注前期高点压力位，设置止损于60日均线下方。",
+]
+
+
+def _raw_text(rng: random.Random, paragraphs: int) -> str:
+    lines = []
+    for index in range(paragraphs):
+        lines.append(f"### 分析要点 {index + 1}\n" + "".join(rng.choice(_PHRASES) for _ in range(8)))
+    return "\n\n".join(lines)
+
+
+def trading_signal_entry(rng: random.Random, stock_code: str) -> dict:
+    now = datetime.now()
+    return {
+        "analysis_type": "daily_technical_trading",
+        "stock_code": stock_code,
+        "cached": True,
+        "cache_created_at": now.isoformat(),
+        "cache_expires_at": (now + timedelta(minutes=30)).isoformat(),
+        "immediate_trading_signal": {
+            "action": rng.choice(["买入", "持有", "卖出"]),
+            "confidence": round(rng.uniform(0.4, 0.9), 2),
+            "entry_price": round(rng.uniform(8, 60), 2),
+            "stop_loss": round(rng.uniform(7, 55), 2),
+            "target_price": round(rng.uniform(9, 70), 2),
+            "holding_period": "1-3个交易日",
+        },
+        "technical_summary": {
+            "trend": "上升趋势", "momentum": "偏强", "volume_signal": "放量",
+            "support_levels": [round(rng.uniform(8, 50), 2) for _ in range(3)],
+            "resistance_levels": [round(rng.uniform(9, 60), 2) for _ in range(3)],
+        },
+        "risk_warning": "以上分析仅供参考，不构成投资建议，请注意投资风险。",
+        "ai_analysis": _raw_text(rng, 12),
+        "data_completeness": 0.95,
+        "api_usage": {"prompt_tokens": 3821, "completion_tokens": 1475, "total_tokens": 5296},
+        "timestamp": now.isoformat(),
+    }
+
+
+def comprehensive_entry(rng: random.Random, stock_code: str) -> dict:
+    entry = trading_signal_entry(rng, stock_code)
+    entry.update({
+        "analysis_type": "comprehensive_stock_evaluation",
+        "comprehensive_evaluation": {"overall_score": rng.randint(50, 90), "rating": "增持"},
+        "evidence_and_reasoning": {f"reason_{i}": rng.choice(_PHRASES) for i in range(6)},
+        "detailed_analysis": {"fundamental": _raw_text(rng, 3), "technical": _raw_text(rng, 3)},
+        "sector_comparison": {"industry": "银行", "rank": rng.randint(1, 40), "peers": 42},
+        "raw_data_sources": {
+            "financial_history": {
+                "periods": [{"报告期": f"2024{q:02d}30", "营业总收入": rng.uniform(1e9, 1e10),
+                             "归母净利润": rng.uniform(1e8, 1e9)} for q in (3, 6, 9, 12)]
+            }
+        },
+        "ai_analysis": _raw_text(rng, 20),
+    })
+    entry.pop("immediate_trading_signal")
+    return entry
+
+
+def _timed(func, argument, iterations: int) -> float:
+    samples = []
+    for _ in range(iterations):
+        started = time.perf_counter()
+        func(argument)
+        samples.append(time.perf_counter() - started)
+    return statistics.median(samples) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description="AI分析缓存编解码基准测试 / Cache codec benchmark")
+    parser.add_argument("--iterations", type=int, default=2000, help="每种编码的编解码次数")
+    parser.add_argument("--watchlist", type=int, default=500, help="估算内存占用时的自选股数量")
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    samples = {
+        "trading_signal": trading_signal_entry(rng, "600519"),
+        "comprehensive_eval": comprehensive_entry(rng, "600519"),
+    }
+
+    codecs = [
+        ("legacy-json", lambda data: json.dumps(data, ensure_ascii=False).encode("utf-8"),
+         lambda raw: json.loads(raw.decode("utf-8"))),
+        ("json", CacheCodec(FORMAT_JSON, compress=False).encode, CacheCodec.decode),
+        ("json+zlib", CacheCodec(FORMAT_JSON).encode, CacheCodec.decode),
+    ]
+    if MSGPACK_AVAILABLE:
+        codecs += [
+            ("msgpack", CacheCodec(FORMAT_MSGPACK, compress=False).encode, CacheCodec.decode),
+            ("msgpack+zlib", CacheCodec(FORMAT_MSGPACK).encode, CacheCodec.decode),
+        ]
+    else:
+        print("msgpack 未安装，跳过 msgpack 编码 / msgpack not installed, skipping")
+
+    for kind, data in samples.items():
+        print(f"\n== {kind} ==")
+        print(f"{'codec':<14}{'bytes':>9}{'ratio':>8}{'encode_us':>12}{'decode_us':>12}")
+        baseline = None
+        for name, encode, decode in codecs:
+            raw = encode(data)
+            assert decode(raw)["ai_analysis"] == data["ai_analysis"]
+            baseline = baseline or len(raw)
+            print(f"{name:<14}{len(raw):>9}{len(raw) / baseline:>8.2f}"
+                  f"{_timed(encode, data, args.iterations):>12.1f}{_timed(decode, raw, args.iterations):>12.1f}")
+
+    print(f"\n自选股 {args.watchlist} 只（每只两类缓存）的 Redis 数据量 / Redis payload for a {args.watchlist}-stock watchlist:")
+    for name, encode, _ in codecs:
+        per_stock = sum(len(encode(data)) for data in samples.values())
+        print(f"  {name:<14}{per_stock * args.watchlist / 1024 / 1024:>8.2f} MB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+"""
+提示词数据编码基准测试
+Prompt data encoding benchmark
+
+对比 format_data_for_ai 两种编码的提示词大小和编码耗时：
+- json:    原来的 json.dumps(indent=2)，每个列表保留8条
+- compact: PromptDataEncoder 按数据段token预算输出紧凑表格
+样本数据按综合评估8个接口的响应结构构造（K线、akshare财务摘要宽表、个股资料、季度财务等）。
+token数为本地估算；设置 ANTHROPIC_API_KEY 并加 --count-with-api 时同时用 count_tokens 接口计数。
+
+用法 / Usage:
+    python scripts/benchmark_prompt_encoding.py --iterations 200
+    python scripts/benchmark_prompt_encoding.py --count-with-api
+"""
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import sys
+import time
+from datetime import date, datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "api"))
+
+from ai_analysis.services.data_aggregator import StockDataAggregator  # noqa: E402
+from ai_analysis.services.prompt_encoder import estimate_tokens  # noqa: E402
+
+_INDICATORS = ["归母净利润", "营业总收入", "营业成本", "净利润", "扣非净利润", "股东权益合计", "商誉",
+               "经营现金流量净额", "基本每股收益", "每股净资产", "每股现金流", "净资产收益率", "总资产报酬率",
+               "毛利率", "销售净利率", "期间费用率", "资产负债率", "流动比率", "速动比率", "存货周转率"]
+
+
+def _periods(count: int):
+    periods, year, quarter_ends = [], 2025, ["1231", "0930", "0630", "0331"]
+    while len(periods) < count:
+        periods.extend(f"{year}{suffix}" for suffix in quarter_ends)
+        year -= 1
+    return periods[:count]
+
+
+def _kline(rng: random.Random, days: int, chinese: bool):
+    rows, price = [], rng.uniform(10, 60)
+    start = date.today() - timedelta(days=days)
+    for offset in range(days):
+        change = rng.uniform(-0.04, 0.04)
+        close = round(price * (1 + change), 2)
+        day = (start + timedelta(days=offset)).isoformat()
+        values = [day, round(price, 2), close, round(max(price, close) * 1.01, 2), round(min(price, close) * 0.99, 2),
+                  rng.randint(10 ** 5, 10 ** 7), round(rng.uniform(1e7, 1e9), 2), round(rng.uniform(1, 6), 2),
+                  round(change * 100, 2), round(close - price, 2), round(rng.uniform(0.2, 5), 2)]
+        keys = (["日期", "开盘", "收盘", "最高", "最低", "成交量", "成交额", "振幅", "涨跌幅", "涨跌额", "换手率"] if chinese else
+                ["date", "open", "close", "high", "low", "volume", "amount", "amplitude", "change_pct", "change",
+                 "turnover_rate"])
+        rows.append(dict(zip(keys, values)))
+        price = close
+    return rows
+
+
+def _financial_abstract(rng: random.Random, periods: int):
+    columns = _periods(periods)
+    return [{"选项": "常用指标", "指标": name, **{p: rng.uniform(-1e9, 1e10) for p in columns}} for name in _INDICATORS]
+
+
+def sample_aggregated_data(rng: random.Random, stock_code: str = "600519") -> dict:
+    now = datetime.now().isoformat()
+    quarterly = {f"{2025 - i // 4}Q{4 - i % 4}": {"revenue": rng.uniform(1e9, 1e10), "net_profit": rng.uniform(1e8, 1e9),
+                                                  "roe": rng.uniform(5, 30), "gross_margin": rng.uniform(20, 90)}
+                 for i in range(12)}
+    sources = {
+        "core_data": {"stock_code": stock_code, "update_time": now,
+                      "basic_info": {"股票简称": "贵州茅台", "行业": "酿酒行业", "总市值": 2.1e12, "流通市值": 2.1e12},
+                      "raw_profile_data": {f"字段{i}": f"值{rng.randint(0, 10 ** 6)}" for i in range(40)},
+                      "financial_indicators": _financial_abstract(rng, 40)},
+        "technical_analysis": {"stock_code": stock_code, "update_time": now,
+                               "k_line_data": _kline(rng, 90, chinese=True),
+                               "indicators": {"ma5": 1500.2, "ma10": 1490.1, "rsi": 61.2, "macd": 3.1}},
+        "fundamental_analysis": {"stock_code": stock_code, "update_time": now,
+                                 "financial_indicators": _financial_abstract(rng, 60)},
+        "historical_prices": {"stock_code": stock_code, "update_time": now,
+                              "statistics": {"period_high": 1600.0, "period_low": 1400.0},
+                              "historical_data": _kline(rng, 30, chinese=False)},
+        "money_flow": {"stock_code": stock_code, "update_time": now,
+                       "flow": [{"date": (date.today() - timedelta(days=i)).isoformat(), "main_net": rng.uniform(-1e8, 1e8),
+                                 "retail_net": rng.uniform(-1e7, 1e7)} for i in range(20)]},
+        "financial_history": {"stock_code": stock_code, "update_time": now, "quarterly_data": quarterly,
+                              "trend_analysis": {"revenue": {"historical_values": [rng.uniform(1e9, 1e10) for _ in range(12)]}}},
+        "announcements": {"stock_code": stock_code, "update_time": now,
+                          "announcements": [{"公告日期": (date.today() - timedelta(days=3 * i)).isoformat(),
+                                             "公告标题": f"关于第{i}次董事会决议的公告，涉及利润分配、关联交易等事项"}
+                                            for i in range(30)]},
+        "dragon_tiger": {"stock_code": stock_code, "update_time": now,
+                         "dragon_tiger_list": [{"上榜日": (date.today() - timedelta(days=7 * i)).isoformat(),
+                                                "解读": "机构买入", "净买额": rng.uniform(-1e8, 1e8)} for i in range(15)]},
+    }
+    return {"stock_code": stock_code, "data_type": "comprehensive_evaluation", "collected_at": now,
+            "data_sources": sources, "data_completeness": 1.0}
+
+
+def _timed(func, iterations: int) -> float:
+    samples = []
+    for _ in range(iterations):
+        started = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - started)
+    return statistics.median(samples) * 1000
+
+
+async def _count_with_api(texts):
+    from anthropic import AsyncAnthropic
+    client = AsyncAnthropic()
+    counts = {}
+    for name, text in texts.items():
+        response = await client.messages.count_tokens(
+            model="claude-3-5-sonnet-20241022", messages=[{"role": "user", "content": text}]
+        )
+        counts[name] = response.input_tokens
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="提示词数据编码基准测试 / Prompt encoding benchmark")
+    parser.add_argument("--iterations", type=int, default=100)
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--count-with-api", action="store_true", help="同时用Anthropic count_tokens接口计数")
+    args = parser.parse_args()
+
+    aggregator = StockDataAggregator()
+    data = sample_aggregated_data(random.Random(args.seed))
+    texts = {encoding: aggregator.format_data_for_ai(data, encoding=encoding) for encoding in ("json", "compact")}
+    api_counts = asyncio.run(_count_with_api(texts)) if args.count_with_api else {}
+
+    print(f"{'encoding':<10}{'chars':>9}{'est_tokens':>12}{'api_tokens':>12}{'encode_ms':>11}")
+    for encoding, text in texts.items():
+        elapsed = _timed(lambda: aggregator.format_data_for_ai(data, encoding=encoding), args.iterations)
+        print(f"{encoding:<10}{len(text):>9}{estimate_tokens(text):>12}{str(api_counts.get(encoding, '-')):>12}"
+              f"{elapsed:>11.2f}")
+
+    _, report = aggregator.prompt_encoder.encode(list(data["data_sources"].items()))
+    print("\ncompact 各数据段 / per-section (budget, full -> encoded tokens, omitted):")
+    for name, stats in report.items():
+        print(f"  {name:<22}{stats['budget']:>6}{stats.get('tokens_full', 0):>8} -> {stats['tokens']:<6}"
+              f"{','.join(stats['omitted'])}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+"""
+模型接口桩服务
+Stub model server speaking the Anthropic Messages API
+
+实现 POST /v1/messages 的普通响应和流式（SSE）响应，按固定文本分片逐段输出，
+用于在没有真实API密钥、不产生费用的情况下测试AI分析接口（尤其是流式接口）。
+把 ANTHROPIC_BASE_URL 指向本服务即可，Anthropic SDK 会直接请求这里。
+
+- --text / --text-file: 模型返回的文本（默认返回一段含交易信号JSON的文本）
+- --chunk-chars / --chunk-delay: 流式输出时每个片段的字符数和间隔，模拟生成速度
+- --fail-first N: 前N次请求在输出一半后中断（流式返回 error 事件，普通请求返回529），用于测试重试
+
+用法 / Usage:
+    python scripts/stub_model_server.py --port 8787 --chunk-delay 0.05
+    ANTHROPIC_BASE_URL=http://127.0.0.1:8787 ANTHROPIC_API_KEY=stub python api/stock_analysis_api.py
+"""
+import argparse
+import asyncio
+import json
+import uuid
+from typing import Optional
+
+from aiohttp import web
+
+DEFAULT_TEXT = """根据日线数据分析如下：
+```json
+{
+  "immediate_trading_signal": {
+    "action": "观望",
+    "entry_condition": "放量突破20日均线后介入",
+    "stop_loss": {"price": 9.5, "basis": "前低支撑"},
+    "take_profit": [{"price": 11.2, "basis": "前高压力"}]
+  },
+  "technical_summary": {"trend": "震荡", "support": 9.5, "resistance": 11.2},
+  "comprehensive_evaluation": {"overall_score": 72, "investment_rating": "持有"},
+  "risk_warning": "桩服务返回的测试数据，不构成投资建议"
+}
+```"""
+
+
+class StubModelServer:
+    """Anthropic Messages API 桩服务"""
+
+    def __init__(self, text: str = DEFAULT_TEXT, chunk_chars: int = 16, chunk_delay: float = 0.0,
+                 fail_first: int = 0):
+        self.text = text
+        self.chunk_chars = max(1, chunk_chars)
+        self.chunk_delay = chunk_delay
+        self.fail_first = fail_first
+        self.requests = 0
+        self.bodies = []  # 收到的请求体，测试时用于检查提示词内容
+        self._runner: Optional[web.AppRunner] = None
+        self.base_url = ""
+
+    def _usage(self, body: dict) -> dict:
+        prompt = json.dumps(body.get("system", ""), ensure_ascii=False) + json.dumps(body.get("messages", []),
+                                                                                      ensure_ascii=False)
+        return {"input_tokens": len(prompt) // 3, "output_tokens": len(self.text) // 3}
+
+    def _message(self, body: dict, text: str, usage: dict) -> dict:
+        return {
+            "id": f"msg_stub_{uuid.uuid4().hex[:12]}",
+            "type": "message",
+            "role": "assistant",
+            "model": body.get("model", "stub-model"),
+            "content": [{"type": "text", "text": text}] if text else [],
+            "stop_reason": "end_turn" if text else None,
+            "stop_sequence": None,
+            "usage": usage,
+        }
+
+    async def handle_messages(self, request: web.Request) -> web.StreamResponse:
+        body = await request.json()
+        self.requests += 1
+        self.bodies.append(body)
+        failing = self.requests <= self.fail_first
+        usage = self._usage(body)
+
+        if not body.get("stream"):
+            if failing:
+                return web.json_response({"type": "error", "error": {"type": "overloaded_error",
+                                                                     "message": "stub overloaded"}}, status=529)
+            return web.json_response(self._message(body, self.text, usage))
+
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream", "Cache-Control": "no-cache"})
+        await response.prepare(request)
+
+        async def send(event: str, data: dict):
+            await response.write(f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n".encode("utf-8"))
+
+        try:
+            await send("message_start", {"type": "message_start",
+                                         "message": self._message(body, "", {**usage, "output_tokens": 0})})
+            await send("content_block_start", {"type": "content_block_start", "index": 0,
+                                               "content_block": {"type": "text", "text": ""}})
+            # 失败的请求只输出一半文本后返回 error 事件
+            limit = len(self.text) // 2 if failing else len(self.text)
+            for start in range(0, limit, self.chunk_chars):
+                if self.chunk_delay:
+                    await asyncio.sleep(self.chunk_delay)
+                await send("content_block_delta", {"type": "content_block_delta", "index": 0,
+                                                   "delta": {"type": "text_delta",
+                                                             "text": self.text[start:min(start + self.chunk_chars, limit)]}})
+            if failing:
+                await send("error", {"type": "error", "error": {"type": "overloaded_error", "message": "stub overloaded"}})
+            else:
+                await send("content_block_stop", {"type": "content_block_stop", "index": 0})
+                await send("message_delta", {"type": "message_delta",
+                                             "delta": {"stop_reason": "end_turn", "stop_sequence": None},
+                                             "usage": {"output_tokens": usage["output_tokens"]}})
+                await send("message_stop", {"type": "message_stop"})
+            await response.write_eof()
+        except ConnectionResetError:
+            pass  # 客户端中途断开（如测试服务重启）
+        return response
+
+    def app(self) -> web.Application:
+        application = web.Application()
+        application.router.add_post("/v1/messages", self.handle_messages)
+        return application
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        """启动服务，返回 base_url（port=0 时自动选择空闲端口）"""
+        self._runner = web.AppRunner(self.app())
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        bound_port = site._server.sockets[0].getsockname()[1]
+        self.base_url = f"http://{host}:{bound_port}"
+        return self.base_url
+
+    async def stop(self):
+        if self._runner:
+            await self._runner.cleanup()
+            self._runner = None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="模型接口桩服务 / Stub Anthropic Messages API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8787)
+    parser.add_argument("--text", default=None, help="模型返回的文本")
+    parser.add_argument("--text-file", default=None, help="从文件读取模型返回的文本")
+    parser.add_argument("--chunk-chars", type=int, default=16)
+    parser.add_argument("--chunk-delay", type=float, default=0.05)
+    parser.add_argument("--fail-first", type=int, default=0)
+    args = parser.parse_args()
+
+    text = args.text or DEFAULT_TEXT
+    if args.text_file:
+        with open(args.text_file, encoding="utf-8") as f:
+            text = f.read()
+    server = StubModelServer(text, args.chunk_chars, args.chunk_delay, args.fail_first)
+    print(f"模型接口桩服务 / Stub model server: http://{args.host}:{args.port}/v1/messages")
+    web.run_app(server.app(), host=args.host, port=args.port, print=None)
+
+
+if __name__ == "__main__":
+    main()
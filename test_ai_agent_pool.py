@@ -0,0 +1,186 @@
+# -*- coding: utf-8 -*-
+"""
+ai_agent 共享客户端与提示词注册表测试脚本
+Test script for the ai_agent shared LLM client pool and prompt registry
+
+使用模型桩服务（scripts/stub_model_server.py）和临时提示词目录，不依赖线上服务和真实API密钥。
+"""
+import asyncio
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(ROOT, "api"))
+sys.path.insert(0, os.path.join(ROOT, "scripts"))
+
+from stub_model_server import StubModelServer  # noqa: E402
+
+# 由 main() 初始化
+stub = None
+
+PROMPT_TEMPLATE = """agent_name: "{name}"
+version: "{version}"
+system_prompt: |
+  你是测试用分析师。
+user_prompt_template: |
+  请分析 {{stock_code}}，时间 {{analysis_time}}。
+parameters:
+  model: "stub-model"
+  max_tokens: 200
+cache_config:
+  enabled: false
+"""
+
+
+def _write_prompt(prompts_dir: Path, name: str, version: str):
+    (prompts_dir / f"{name}.yaml").write_text(PROMPT_TEMPLATE.format(name=name, version=version), encoding="utf-8")
+
+
+async def _wait_for(condition, timeout: float = 5.0) -> bool:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        await asyncio.sleep(0.05)
+    return condition()
+
+
+async def test_prompt_registry():
+    """测试提示词只加载一次、查询不检查文件、修改后自动重新加载、错误配置保留旧版本"""
+    print("\n=== 测试提示词注册表 ===")
+    from ai_agent.prompt_manager import PromptManager
+    # ai_agent 包导出了同名的 prompt_manager 实例，这里需要模块本身
+    prompt_module = sys.modules[PromptManager.__module__]
+
+    results = {}
+    for watch_mode in ("watchfiles", "polling"):
+        prompts_dir = Path(tempfile.mkdtemp())
+        has_watchfiles = prompt_module.HAS_WATCHFILES
+        prompt_module.HAS_WATCHFILES = prompt_module.HAS_WATCHFILES and watch_mode == "watchfiles"
+        try:
+            _write_prompt(prompts_dir, "tester", "1")
+            manager = PromptManager(str(prompts_dir))
+            manager.load_prompt_config("tester")
+
+            stat_calls = 0
+            original_stat = Path.stat
+
+            def counting_stat(self, *args, **kwargs):
+                nonlocal stat_calls
+                stat_calls += 1
+                return original_stat(self, *args, **kwargs)
+
+            Path.stat = counting_stat
+            try:
+                for _ in range(100):
+                    prompt = manager.get_user_prompt("tester", stock_code="600519")
+                    manager.get_model_parameters("tester")
+            finally:
+                Path.stat = original_stat
+
+            await manager.start_watching(interval=0.1)
+            await asyncio.sleep(0.3)  # 等待监听就绪
+            time.sleep(0.01)
+            _write_prompt(prompts_dir, "tester", "2")
+            reloaded = await _wait_for(lambda: manager.load_prompt_config("tester").get("version") == "2")
+            (prompts_dir / "tester.yaml").write_text("agent_name: [broken", encoding="utf-8")
+            await asyncio.sleep(1.0)
+            kept = manager.load_prompt_config("tester").get("version") == "2"
+            await manager.stop_watching()
+
+            checks = {
+                f"[{watch_mode}] 模板替换": "请分析 600519" in prompt,
+                f"[{watch_mode}] 查询不检查文件": stat_calls == 0,
+                f"[{watch_mode}] 修改后自动重新加载": reloaded and manager.info()["reload_count"] == 1,
+                f"[{watch_mode}] 错误配置保留旧版本": kept,
+                f"[{watch_mode}] 停止监听": not manager.info()["watching"],
+            }
+            try:
+                manager.get_user_prompt("tester")
+                checks[f"[{watch_mode}] 缺少变量报错"] = False
+            except ValueError as e:
+                checks[f"[{watch_mode}] 缺少变量报错"] = "stock_code" in str(e)
+            results.update(checks)
+        finally:
+            prompt_module.HAS_WATCHFILES = has_watchfiles
+            shutil.rmtree(prompts_dir, ignore_errors=True)
+
+    for name, ok in results.items():
+        print(f"{'✓' if ok else '✗'} {name}")
+    return all(results.values())
+
+
+async def test_shared_client_pool():
+    """测试所有Agent共用一个异步客户端、并发有上限、不占用线程池线程"""
+    print("\n=== 测试共享模型客户端 ===")
+    from ai_agent.client_pool import llm_client_pool
+    from ai_agent.stock_agents import FundamentalAnalysisAgent
+
+    agents = [FundamentalAnalysisAgent() for _ in range(3)]
+    stub.chunk_delay = 0
+    llm_client_pool._semaphore = asyncio.Semaphore(2)
+    llm_client_pool.max_concurrent_calls = 2
+
+    threads_before = threading.active_count()
+    peak_threads = threads_before
+
+    async def sample_threads():
+        nonlocal peak_threads
+        while True:
+            peak_threads = max(peak_threads, threading.active_count())
+            await asyncio.sleep(0.01)
+
+    sampler = asyncio.create_task(sample_threads())
+    calls = [agents[i % 3].call_ai_model("system", f"prompt {i}") for i in range(8)]
+    responses = await asyncio.gather(*calls)
+    sampler.cancel()
+
+    info = llm_client_pool.info()
+    checks = {
+        "所有Agent共用一个客户端": len({id(agent.client) for agent in agents}) == 1 and info["clients"] == 1,
+        "所有Agent共用一个Redis客户端": len({id(agent.redis_client) for agent in agents}) == 1,
+        "全部调用成功": len(responses) == 8 and all(responses) and stub.requests == 8,
+        "并发不超过上限": info["max_in_flight"] == 2 and info["in_flight"] == 0 and info["waiting"] == 0,
+        "不占用线程池线程": peak_threads <= threads_before + 1,
+    }
+    await llm_client_pool.close()
+    checks["关闭后释放客户端"] = llm_client_pool.info()["clients"] == 0
+    for name, ok in checks.items():
+        print(f"{'✓' if ok else '✗'} {name}")
+    return all(checks.values())
+
+
+async def main():
+    """主测试函数"""
+    global stub
+    print("=== ai_agent 共享客户端与提示词注册表测试 ===")
+    stub = StubModelServer(text="基本面分析：测试文本", chunk_chars=8)
+    os.environ["ANTHROPIC_BASE_URL"] = await stub.start()
+    os.environ["ANTHROPIC_API_KEY"] = "stub-key"
+
+    tests = [
+        ("提示词注册表", test_prompt_registry),
+        ("共享模型客户端", test_shared_client_pool),
+    ]
+    test_results = []
+    try:
+        for test_name, test_func in tests:
+            test_results.append((test_name, await test_func()))
+    finally:
+        await stub.stop()
+
+    print(f"\n{'='*50}")
+    passed = sum(1 for _, result in test_results if result)
+    for test_name, result in test_results:
+        print(f"{test_name}: {'✓ 通过' if result else '✗ 失败'}")
+    print(f"\n总计: {passed}/{len(test_results)} 个测试通过")
+    return passed == len(test_results)
+
+
+if __name__ == "__main__":
+    sys.exit(0 if asyncio.run(main()) else 1)
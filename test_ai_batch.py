@@ -0,0 +1,214 @@
+# -*- coding: utf-8 -*-
+"""
+AI批量分析测试脚本
+Test script for watchlist batch AI analysis and the model token budget
+
+与 test_ai_streaming.py 相同，使用模型桩服务和进程内数据源，不依赖线上服务和真实API密钥。
+"""
+import asyncio
+import os
+import sys
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(ROOT, "api"))
+sys.path.insert(0, os.path.join(ROOT, "scripts"))
+
+from asgi_test_client import call_app  # noqa: E402
+from stub_model_server import StubModelServer  # noqa: E402
+
+# 由 main() 初始化
+app = None
+stub = None
+# 同时在收集数据的股票数
+collecting = {"active": {}, "max": 0}
+shared_loads = []
+
+
+def _sample_source(name: str):
+    async def handler(stock_code: str):
+        return {"stock_code": stock_code, "source": name, "update_time": datetime.now().isoformat(),
+                "records": [{"date": f"2025-06-{day:02d}", "close": 10 + day / 10} for day in range(1, 11)]}
+    return handler
+
+
+async def _post_events(path: str, body: dict):
+    """以ASGI方式POST并解析SSE响应，返回 (状态码, [(事件名, 数据)])"""
+    status, events = await call_app(app, "POST", path, body=body)
+    return status, [(event, data) for _, event, data in events]
+
+
+def _counting_source(name: str):
+    """记录同时在收集数据的股票数的数据源"""
+    sample = _sample_source(name)
+
+    async def handler(stock_code: str):
+        active = collecting["active"]
+        active[stock_code] = active.get(stock_code, 0) + 1
+        collecting["max"] = max(collecting["max"], len(active))
+        try:
+            await asyncio.sleep(0.05)
+            return await sample(stock_code)
+        finally:
+            active[stock_code] -= 1
+            if not active[stock_code]:
+                del active[stock_code]
+    return handler
+
+
+async def _load_shared(stock_codes):
+    shared_loads.append(list(stock_codes))
+    return {code: {"market_context": {"market_overview": {"up_count": 3000, "down_count": 2000},
+                                      "industry": {"industry": "银行", "change_percent": 1.2}}}
+            for code in stock_codes}
+
+
+async def test_batch_stream():
+    """测试批量分析：共享数据只加载一次、并发有上限、结果按完成顺序推送并写入缓存"""
+    print("\n=== 测试批量分析 ===")
+    from ai_analysis.services.batch_analysis import batch_analyzer
+    from ai_analysis.services.cache_manager import analysis_cache
+
+    codes = ["000001", "000002", "600519", "600036", "000858", "300750"]
+    status, events = await _post_events("/ai/batch", {"stock_codes": codes + ["12345", "000001"]})
+    names = [name for name, _ in events]
+    stocks = [data for name, data in events if name == "stock"]
+    summary = events[-1][1] if events else {}
+    cached = await analysis_cache.get_trading_signal_cache("600519")
+    checks = {
+        "响应200": status == 200,
+        "先推送started和共享数据阶段": names[:2] == ["phase", "phase"]
+                                  and events[0][1]["invalid_codes"] == ["12345"]
+                                  and events[1][1]["phase"] == "shared_data_collected",
+        "共享数据只加载一次": len(shared_loads) == 1 and shared_loads[0] == codes,
+        "每只股票一个结果": sorted(item["stock_code"] for item in stocks) == sorted(codes)
+                         and all(item["success"] for item in stocks),
+        "推送单只股票进度": any(name == "progress" and data.get("phase") == "data_collected" for name, data in events),
+        "最后推送汇总": names[-1] == "result" and summary["succeeded"] == len(codes) and summary["failed"] == 0,
+        "数据收集并发不超过上限": collecting["max"] == batch_analyzer.collect_concurrency,
+        "提示词包含共享数据": stub.requests == len(codes)
+                           and all("=== MARKET_CONTEXT ===" in body["messages"][0]["content"] for body in stub.bodies),
+        "结果写入缓存": cached is not None,
+    }
+
+    status, events = await _post_events("/ai/batch", {"stock_codes": codes})
+    summary = events[-1][1]
+    checks["再次分析全部命中缓存"] = summary["cached"] == len(codes) and stub.requests == len(codes)
+    for name, ok in checks.items():
+        print(f"{'✓' if ok else '✗'} {name}")
+    return all(checks.values())
+
+
+async def test_batch_fingerprint():
+    """测试共享数据段不计入输入指纹：市场概况变化时批量与单只分析的指纹一致"""
+    print("\n=== 测试批量分析输入指纹 ===")
+    from ai_analysis.services.data_aggregator import stock_data_aggregator
+
+    def fingerprint(data):
+        return stock_data_aggregator.format_data_for_ai(data, normalize=True)
+
+    single = await stock_data_aggregator.collect_technical_data("600519")
+    batched = []
+    for up_count in (3000, 3100):
+        shared = {"600519": {"market_context": {"market_overview": {"up_count": up_count, "down_count": 2000}}}}
+        with stock_data_aggregator.batch_scope(shared, 1):
+            batched.append(await stock_data_aggregator.collect_technical_data("600519"))
+    checks = {
+        "提示词包含共享数据": all("=== MARKET_CONTEXT ===" in stock_data_aggregator.format_data_for_ai(data)
+                           for data in batched),
+        "市场概况变化不影响指纹": fingerprint(batched[0]) == fingerprint(batched[1]),
+        "与单只股票分析指纹一致": fingerprint(batched[0]) == fingerprint(single),
+    }
+    for name, ok in checks.items():
+        print(f"{'✓' if ok else '✗'} {name}")
+    return all(checks.values())
+
+
+async def test_token_budget():
+    """测试每分钟token预算：预占、按实际用量结算、预算不足时等待"""
+    print("\n=== 测试token预算 ===")
+    from ai_analysis.services.rate_limiter import ModelRateLimiter
+
+    limiter = ModelRateLimiter(input_tokens_per_minute=6000, output_tokens_per_minute=0)
+    first = await limiter.acquire(5000, 4000)
+    limiter.settle(first, input_tokens=1000, output_tokens=500)
+    second = await limiter.acquire(4000, 4000)
+    waits = []
+    blocked = asyncio.create_task(limiter.acquire(4000, 4000, on_wait=waits.append))
+    await asyncio.sleep(0.1)
+    checks = {
+        "预算充足时不等待": first.waited_seconds < 0.05 and second.waited_seconds < 0.05,
+        "多占的部分退回": limiter.info()["remaining"]["input"] < 2000,
+        "预算不足时等待": not blocked.done() and len(waits) == 1 and 25 < waits[0] < 35,
+        "未限制的输出不计预算": "output" not in limiter.info()["remaining"],
+    }
+    blocked.cancel()
+    for name, ok in checks.items():
+        print(f"{'✓' if ok else '✗'} {name}")
+    return all(checks.values())
+
+
+async def test_errors():
+    """测试参数错误"""
+    print("\n=== 测试错误处理 ===")
+    bad_type, _ = await _post_events("/ai/batch", {"stock_codes": ["000001"], "analysis_type": "unknown"})
+    no_codes, _ = await _post_events("/ai/batch", {"stock_codes": ["abc"]})
+    too_many, _ = await _post_events("/ai/batch", {"stock_codes": [f"{i:06d}" for i in range(1, 200)]})
+    checks = {
+        "未知分析类型400": bad_type == 400,
+        "没有有效代码400": no_codes == 400,
+        "超过数量上限400": too_many == 400,
+    }
+    for name, ok in checks.items():
+        print(f"{'✓' if ok else '✗'} {name}")
+    return all(checks.values())
+
+
+async def main():
+    """主测试函数"""
+    global app, stub
+    print("=== AI批量分析测试 ===")
+    stub = StubModelServer(chunk_chars=24)
+    os.environ["ANTHROPIC_BASE_URL"] = await stub.start()
+    os.environ["ANTHROPIC_API_KEY"] = "stub-key"
+
+    from ai_analysis import api_endpoints
+    from ai_analysis.services.batch_analysis import batch_analyzer
+    from ai_analysis.services.cache_backends import MemoryCacheBackend
+    from ai_analysis.services.cache_manager import analysis_cache
+    from ai_analysis.services.data_aggregator import stock_data_aggregator
+
+    analysis_cache.backend = MemoryCacheBackend()
+    stock_data_aggregator.use_local_sources({
+        section.name: _counting_source(section.name)
+        for section in stock_data_aggregator.TECHNICAL_ENDPOINTS + stock_data_aggregator.COMPREHENSIVE_ENDPOINTS
+    })
+    batch_analyzer.use_shared_data(_load_shared)
+    batch_analyzer.collect_concurrency = 2
+    app = api_endpoints.ai_analysis_app
+    await api_endpoints.startup_event()
+
+    tests = [
+        ("批量分析", test_batch_stream),
+        ("批量分析输入指纹", test_batch_fingerprint),
+        ("token预算", test_token_budget),
+        ("错误处理", test_errors),
+    ]
+    test_results = []
+    try:
+        for test_name, test_func in tests:
+            test_results.append((test_name, await test_func()))
+    finally:
+        await api_endpoints.shutdown_event()
+        await stub.stop()
+
+    print(f"\n{'='*50}")
+    passed = sum(1 for _, result in test_results if result)
+    for test_name, result in test_results:
+        print(f"{test_name}: {'✓ 通过' if result else '✗ 失败'}")
+    print(f"\n总计: {passed}/{len(test_results)} 个测试通过")
+    return passed == len(test_results)
+
+
+if __name__ == "__main__":
+    sys.exit(0 if asyncio.run(main()) else 1)
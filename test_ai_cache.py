@@ -0,0 +1,256 @@
+# -*- coding: utf-8 -*-
+"""
+AI分析缓存单飞与提前刷新测试脚本
+Test script for AnalysisCache single-flight, waiter timeout, early refresh, codec and failover backend
+
+使用进程内存储后端；两个 AnalysisCache 实例共享同一个后端模拟共享Redis的两个进程，不依赖Redis服务。
+"""
+import asyncio
+import os
+import sys
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(ROOT, "api"))
+
+from ai_analysis.services.cache_backends import (  # noqa: E402
+    FailoverCacheBackend, MemoryCacheBackend, RedisCacheBackend
+)
+from ai_analysis.services.cache_codec import FORMAT_JSON, CacheCodec  # noqa: E402
+from ai_analysis.services.cache_manager import AnalysisCache  # noqa: E402
+
+
+def _cache(backend=None) -> AnalysisCache:
+    """使用进程内存储、缩短轮询间隔和锁超时的缓存管理器"""
+    cache = AnalysisCache(backend=backend if backend is not None else MemoryCacheBackend())
+    cache.LOCK_POLL_INTERVAL = 0.02
+    cache.LOCK_TIMEOUT = 5
+    cache.EARLY_REFRESH_BETA = 0  # 默认不提前刷新，由测试单独开启
+    return cache
+
+
+def _counting_compute(calls: list, delay: float = 0.1, signal: str = "买入"):
+    async def compute():
+        calls.append(1)
+        await asyncio.sleep(delay)
+        return {"stock_code": "000001", "signal": signal}
+    return compute
+
+
+async def test_single_flight():
+    """测试同一进程内N个并发请求只执行一次分析，并共享结果"""
+    print("\n=== 测试进程内单飞 ===")
+    cache = _cache()
+    calls = []
+    compute = _counting_compute(calls)
+    results = await asyncio.gather(*[
+        cache.get_or_compute("trading_signal", "000001", compute) for _ in range(20)
+    ])
+    cached = await cache.get_or_compute("trading_signal", "000001", compute)
+    checks = {
+        "只执行一次分析": len(calls) == 1,
+        "全部请求得到同一结果": all(result["signal"] == "买入" for result in results),
+        "结果写入缓存": cached.get("cached") is True and len(calls) == 1,
+        "记录分析耗时": cached.get("compute_seconds", 0) > 0,
+        "进行中的分析已清除": not cache._local_flights,
+    }
+    for name, ok in checks.items():
+        print(f"{'✓' if ok else '✗'} {name}")
+    return all(checks.values())
+
+
+async def test_cross_process_single_flight():
+    """测试共享后端的多个实例（模拟多进程）只有持锁者执行分析，其他实例等待其缓存结果"""
+    print("\n=== 测试跨进程单飞 ===")
+    backend = MemoryCacheBackend()
+    caches = [_cache(backend) for _ in range(4)]
+    calls = []
+    compute = _counting_compute(calls, delay=0.2)
+    results = await asyncio.gather(*[
+        cache.get_or_compute("comprehensive_eval", "600519", compute)
+        for cache in caches for _ in range(5)
+    ])
+    checks = {
+        "只执行一次分析": len(calls) == 1,
+        "全部请求得到结果": len(results) == 20 and all(result["signal"] == "买入" for result in results),
+        "锁已释放": not await backend.exists("lock:comprehensive_eval:600519"),
+    }
+    for name, ok in checks.items():
+        print(f"{'✓' if ok else '✗'} {name}")
+    return all(checks.values())
+
+
+async def test_waiter_timeout():
+    """测试持锁者一直不写入结果时等待者超时；锁释放而无结果时等待者重新竞争并执行分析"""
+    print("\n=== 测试等待超时与重新竞争 ===")
+    backend = MemoryCacheBackend()
+    cache = _cache(backend)
+    cache.LOCK_TIMEOUT = 0.3
+    calls = []
+    compute = _counting_compute(calls, delay=0)
+
+    # 其他进程持有锁且一直不写入结果
+    await backend.set_if_absent("lock:trading_signal:000002", b"other", 60)
+    timed_out = False
+    try:
+        await cache.get_or_compute("trading_signal", "000002", compute)
+    except TimeoutError:
+        timed_out = True
+    no_compute_while_locked = not calls
+
+    # 其他进程分析失败：释放锁但没有写入缓存
+    cache.LOCK_TIMEOUT = 5
+    await backend.set_if_absent("lock:trading_signal:000003", b"other", 60)
+
+    async def release_later():
+        await asyncio.sleep(0.1)
+        await backend.delete_if_equals("lock:trading_signal:000003", b"other")
+
+    releaser = asyncio.create_task(release_later())
+    result = await cache.get_or_compute("trading_signal", "000003", compute)
+    await releaser
+    checks = {
+        "持锁期间不执行分析": no_compute_while_locked,
+        "超过锁超时抛出TimeoutError": timed_out,
+        "锁释放后重新竞争并执行分析": result["signal"] == "买入" and len(calls) == 1,
+    }
+    for name, ok in checks.items():
+        print(f"{'✓' if ok else '✗'} {name}")
+    return all(checks.values())
+
+
+async def test_error_propagation():
+    """测试分析失败时所有并发请求都收到异常，下一次请求重新执行分析"""
+    print("\n=== 测试分析失败 ===")
+    cache = _cache()
+    calls = []
+
+    async def failing():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        raise RuntimeError("模型不可用")
+
+    results = await asyncio.gather(*[
+        cache.get_or_compute("trading_signal", "000004", failing) for _ in range(5)
+    ], return_exceptions=True)
+    retried = await cache.get_or_compute("trading_signal", "000004", _counting_compute(calls, delay=0))
+    checks = {
+        "失败只执行一次": calls[:1] == [1] and len(calls) == 2,
+        "所有请求收到异常": all(isinstance(result, RuntimeError) for result in results),
+        "失败后重新执行": retried["signal"] == "买入",
+    }
+    for name, ok in checks.items():
+        print(f"{'✓' if ok else '✗'} {name}")
+    return all(checks.values())
+
+
+async def test_early_refresh():
+    """测试临近过期的命中立即返回旧结果，并在后台只刷新一次"""
+    print("\n=== 测试提前刷新 ===")
+    cache = _cache()
+    calls = []
+    # 写入一条剩余有效期很短的缓存
+    cache.TRADING_SIGNAL_TTL = 2
+    await cache.get_or_compute("trading_signal", "000005", _counting_compute(calls, delay=0.05, signal="旧"))
+    cache.TRADING_SIGNAL_TTL = 1800
+
+    fresh = {"compute_seconds": 5, "cache_expires_at": (datetime.now() + timedelta(hours=1)).isoformat()}
+    expiring = {"compute_seconds": 5, "cache_expires_at": (datetime.now() + timedelta(seconds=1)).isoformat()}
+    cache.EARLY_REFRESH_BETA = 1.0
+    never_for_fresh = not any(cache._should_refresh_early(fresh) for _ in range(200))
+    cache.EARLY_REFRESH_BETA = 1000.0
+    always_near_expiry = all(cache._should_refresh_early(expiring) for _ in range(200))
+
+    # 系数足够大时命中几乎都会触发提前刷新
+    refresh_compute = _counting_compute(calls, delay=0.1, signal="新")
+    hits = await asyncio.gather(*[
+        cache.get_or_compute("trading_signal", "000005", refresh_compute) for _ in range(10)
+    ])
+    task = cache._background_refreshes.get("trading_signal:000005")
+    if task is not None:
+        await task
+    cache.EARLY_REFRESH_BETA = 0
+    refreshed = await cache.get_or_compute("trading_signal", "000005", refresh_compute)
+    checks = {
+        "远离过期不提前刷新": never_for_fresh,
+        "临近过期提前刷新": always_near_expiry,
+        "命中立即返回旧结果": all(hit["signal"] == "旧" for hit in hits),
+        "后台只刷新一次": len(calls) == 2,
+        "刷新后返回新结果": refreshed["signal"] == "新" and not cache._background_refreshes,
+    }
+    for name, ok in checks.items():
+        print(f"{'✓' if ok else '✗'} {name}")
+    return all(checks.values())
+
+
+async def test_codec():
+    """测试缓存编解码：压缩往返、JSON格式、兼容旧版JSON条目"""
+    print("\n=== 测试缓存编解码 ===")
+    data = {"stock_code": "000001", "analysis": "趋势向上" * 200, "score": 7.5, "items": [1, 2, 3]}
+    codec = CacheCodec()
+    encoded = codec.encode(data)
+    json_codec = CacheCodec(fmt=FORMAT_JSON, compress=False)
+    legacy = '{"stock_code": "000001", "signal": "买入"}'
+    checks = {
+        "往返一致": CacheCodec.decode(encoded) == data,
+        "长内容压缩": len(encoded) < len(data["analysis"].encode("utf-8")),
+        "JSON格式往返一致": CacheCodec.decode(json_codec.encode(data)) == data,
+        "兼容旧版JSON条目": CacheCodec.decode(legacy.encode("utf-8"))["signal"] == "买入"
+                          and CacheCodec.decode(legacy)["signal"] == "买入",
+    }
+    for name, ok in checks.items():
+        print(f"{'✓' if ok else '✗'} {name}")
+    return all(checks.values())
+
+
+async def test_failover_backend():
+    """测试Redis不可用时缓存和单飞锁改用进程内存储，不抛出异常"""
+    print("\n=== 测试故障切换后端 ===")
+    backend = FailoverCacheBackend(RedisCacheBackend("redis://127.0.0.1:1"), MemoryCacheBackend(),
+                                   reconnect_seconds=3600)
+    cache = _cache(backend)
+    calls = []
+    connected = await cache.connect()
+    results = await asyncio.gather(*[
+        cache.get_or_compute("trading_signal", "000006", _counting_compute(calls)) for _ in range(5)
+    ])
+    cached = await cache.get_trading_signal_cache("000006")
+    checks = {
+        "Redis不可用": connected is False and backend.active is backend.fallback,
+        "单飞仍然生效": len(calls) == 1 and all(result["signal"] == "买入" for result in results),
+        "结果写入进程内存储": cached is not None and len(backend.fallback) >= 1,
+    }
+    await cache.disconnect()
+    if backend._reconnect_task is not None:
+        backend._reconnect_task.cancel()
+    for name, ok in checks.items():
+        print(f"{'✓' if ok else '✗'} {name}")
+    return all(checks.values())
+
+
+async def main():
+    """主测试函数"""
+    print("=== AI分析缓存测试 ===")
+    tests = [
+        ("进程内单飞", test_single_flight),
+        ("跨进程单飞", test_cross_process_single_flight),
+        ("等待超时与重新竞争", test_waiter_timeout),
+        ("分析失败", test_error_propagation),
+        ("提前刷新", test_early_refresh),
+        ("缓存编解码", test_codec),
+        ("故障切换后端", test_failover_backend),
+    ]
+    test_results = []
+    for test_name, test_func in tests:
+        test_results.append((test_name, await test_func()))
+
+    print(f"\n{'='*50}")
+    passed = sum(1 for _, result in test_results if result)
+    for test_name, result in test_results:
+        print(f"{test_name}: {'✓ 通过' if result else '✗ 失败'}")
+    print(f"\n总计: {passed}/{len(test_results)} 个测试通过")
+    return passed == len(test_results)
+
+
+if __name__ == "__main__":
+    sys.exit(0 if asyncio.run(main()) else 1)
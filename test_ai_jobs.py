@@ -0,0 +1,198 @@
+# -*- coding: utf-8 -*-
+"""
+AI分析任务队列测试脚本
+Test script for the asynchronous AI analysis job queue
+
+与 test_ai_streaming.py 相同，使用模型桩服务和进程内数据源，不依赖线上服务和真实API密钥。
+"""
+import asyncio
+import json
+import os
+import sys
+from datetime import datetime
+import time
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(ROOT, "api"))
+sys.path.insert(0, os.path.join(ROOT, "scripts"))
+
+from asgi_test_client import call_app  # noqa: E402
+from stub_model_server import StubModelServer  # noqa: E402
+
+# 由 main() 初始化
+app = None
+stub = None
+
+
+def _sample_source(name: str):
+    async def handler(stock_code: str):
+        return {"stock_code": stock_code, "source": name, "update_time": datetime.now().isoformat(),
+                "records": [{"date": f"2025-06-{day:02d}", "close": 10 + day / 10} for day in range(1, 11)]}
+    return handler
+
+
+async def _request(method: str, path: str, body=None, query: str = ""):
+    """以ASGI方式调用应用，返回 (状态码, JSON响应)"""
+    chunks = []
+    status, _ = await call_app(app, method, path, query=query, body=body,
+                                on_chunk=lambda _, text: chunks.append(text))
+    return status, json.loads("".join(chunks) or "null")
+
+
+async def test_submit_and_dedup():
+    """测试提交立即返回任务ID，重复提交返回同一任务"""
+    print("\n=== 测试提交与去重 ===")
+    started = time.monotonic()
+    status, job = await _request("POST", "/ai/jobs", {"job_type": "trading_signal", "stock_code": "000001"})
+    submit_seconds = time.monotonic() - started
+    status2, duplicate = await _request("POST", "/ai/jobs", {"job_type": "trading_signal", "stock_code": "000001"})
+    status3, done = await _request("GET", f"/ai/jobs/{job['job_id']}", query="wait=30")
+    checks = {
+        "提交返回202": status == 202 and job["status"] == "queued" and not job["deduplicated"],
+        "提交不等待分析完成": submit_seconds < 0.5,
+        "重复提交返回同一任务": status2 == 202 and duplicate["job_id"] == job["job_id"] and duplicate["deduplicated"],
+        "长轮询得到结果": status3 == 200 and done["status"] == "succeeded"
+                       and done["result"]["immediate_trading_signal"]["action"] == "观望",
+        "记录执行进度": done["progress"].get("phase") == "model_call" and done["progress"].get("output_chars", 0) > 0,
+        "模型只调用一次": stub.requests == 1,
+    }
+    status4, resubmitted = await _request("POST", "/ai/jobs", {"job_type": "trading_signal", "stock_code": "000001"})
+    checks["完成后可再次提交"] = status4 == 202 and resubmitted["job_id"] != job["job_id"]
+    for name, ok in checks.items():
+        print(f"{'✓' if ok else '✗'} {name}")
+    return all(checks.values())
+
+
+async def test_restart_recovery():
+    """测试服务重启：执行中的任务在重启后重新执行完成"""
+    print("\n=== 测试重启恢复 ===")
+    from ai_analysis.services.job_queue import analysis_job_queue
+
+    stub.chunk_delay = 0.05
+    _, job = await _request("POST", "/ai/jobs", {"job_type": "comprehensive_eval", "stock_code": "600519"})
+    for _ in range(100):
+        _, current = await _request("GET", f"/ai/jobs/{job['job_id']}")
+        if current["progress"].get("output_chars"):
+            break
+        await asyncio.sleep(0.05)
+    await analysis_job_queue.stop()
+    _, interrupted = await _request("GET", f"/ai/jobs/{job['job_id']}")
+    stub.chunk_delay = 0
+    await analysis_job_queue.start()
+    _, done = await _request("GET", f"/ai/jobs/{job['job_id']}", query="wait=30")
+    checks = {
+        "停止时任务未完成": interrupted["status"] == "running",
+        "重启后执行完成": done["status"] == "succeeded" and done["attempts"] == 2,
+    }
+    for name, ok in checks.items():
+        print(f"{'✓' if ok else '✗'} {name}")
+    return all(checks.values())
+
+
+async def test_leased_elsewhere():
+    """测试任务租约被其他进程持有时，本进程的长轮询在对方完成后返回，不等满超时"""
+    print("\n=== 测试其他进程执行的任务 ===")
+    from ai_analysis.services.job_queue import analysis_job_queue
+
+    backend = analysis_job_queue.cache.backend
+    set_if_absent = backend.set_if_absent
+
+    async def leased_elsewhere(key, value, ttl):
+        # 模拟其他进程已取得该任务的租约
+        if key.startswith(f"{analysis_job_queue.KEY_PREFIX}:lease:"):
+            return False
+        return await set_if_absent(key, value, ttl)
+
+    async def finish_elsewhere(job_id: str):
+        await asyncio.sleep(0.3)
+        job = await analysis_job_queue.get(job_id)
+        job.update(status="succeeded", result={"source": "other"})
+        await analysis_job_queue._save(job)
+
+    backend.set_if_absent = leased_elsewhere
+    try:
+        _, job = await _request("POST", "/ai/jobs", {"job_type": "trading_signal", "stock_code": "000003"})
+        finisher = asyncio.create_task(finish_elsewhere(job["job_id"]))
+        started = time.monotonic()
+        _, done = await _request("GET", f"/ai/jobs/{job['job_id']}", query="wait=10")
+        waited = time.monotonic() - started
+        await finisher
+    finally:
+        backend.set_if_absent = set_if_absent
+    checks = {
+        "得到其他进程的结果": done["status"] == "succeeded" and done["result"] == {"source": "other"},
+        "对方完成后及时返回": waited < 2,
+        "完成事件没有残留": job["job_id"] not in analysis_job_queue._done,
+    }
+    for name, ok in checks.items():
+        print(f"{'✓' if ok else '✗'} {name}")
+    return all(checks.values())
+
+
+async def test_errors():
+    """测试参数错误、任务不存在和排队已满"""
+    print("\n=== 测试错误处理 ===")
+    from ai_analysis.services.job_queue import analysis_job_queue
+
+    bad_type, _ = await _request("POST", "/ai/jobs", {"job_type": "unknown", "stock_code": "000001"})
+    bad_code, _ = await _request("POST", "/ai/jobs", {"job_type": "trading_signal", "stock_code": "12345"})
+    missing, _ = await _request("GET", "/ai/jobs/does-not-exist")
+    analysis_job_queue.max_pending = 0
+    full, _ = await _request("POST", "/ai/jobs", {"job_type": "trading_signal", "stock_code": "000002"})
+    analysis_job_queue.max_pending = 200
+    checks = {
+        "未知任务类型400": bad_type == 400,
+        "无效股票代码400": bad_code == 400,
+        "任务不存在404": missing == 404,
+        "排队已满429": full == 429,
+    }
+    for name, ok in checks.items():
+        print(f"{'✓' if ok else '✗'} {name}")
+    return all(checks.values())
+
+
+async def main():
+    """主测试函数"""
+    global app, stub
+    print("=== AI分析任务队列测试 ===")
+    stub = StubModelServer(chunk_chars=24)
+    os.environ["ANTHROPIC_BASE_URL"] = await stub.start()
+    os.environ["ANTHROPIC_API_KEY"] = "stub-key"
+
+    from ai_analysis import api_endpoints
+    from ai_analysis.services.cache_backends import MemoryCacheBackend
+    from ai_analysis.services.cache_manager import analysis_cache
+    from ai_analysis.services.data_aggregator import stock_data_aggregator
+
+    analysis_cache.backend = MemoryCacheBackend()
+    stock_data_aggregator.use_local_sources({
+        section.name: _sample_source(section.name)
+        for section in stock_data_aggregator.TECHNICAL_ENDPOINTS + stock_data_aggregator.COMPREHENSIVE_ENDPOINTS
+    })
+    app = api_endpoints.ai_analysis_app
+    await api_endpoints.startup_event()
+
+    tests = [
+        ("提交与去重", test_submit_and_dedup),
+        ("重启恢复", test_restart_recovery),
+        ("其他进程执行的任务", test_leased_elsewhere),
+        ("错误处理", test_errors),
+    ]
+    test_results = []
+    try:
+        for test_name, test_func in tests:
+            test_results.append((test_name, await test_func()))
+    finally:
+        await api_endpoints.shutdown_event()
+        await stub.stop()
+
+    print(f"\n{'='*50}")
+    passed = sum(1 for _, result in test_results if result)
+    for test_name, result in test_results:
+        print(f"{test_name}: {'✓ 通过' if result else '✗ 失败'}")
+    print(f"\n总计: {passed}/{len(test_results)} 个测试通过")
+    return passed == len(test_results)
+
+
+if __name__ == "__main__":
+    sys.exit(0 if asyncio.run(main()) else 1)
@@ -0,0 +1,195 @@
+# -*- coding: utf-8 -*-
+"""
+AI分析流式接口测试脚本
+Test script for the AI analysis SSE streaming endpoints
+
+不依赖线上服务和真实API密钥：
+- 模型: scripts/stub_model_server.py 桩服务（ANTHROPIC_BASE_URL 指向它），分片输出固定文本
+- 数据: 向数据聚合器注册进程内数据源，返回固定的接口数据
+- 应用: 通过 scripts/asgi_test_client.py 以ASGI方式直接调用 ai_analysis_app，逐块接收响应
+"""
+import asyncio
+import os
+import sys
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(ROOT, "api"))
+sys.path.insert(0, os.path.join(ROOT, "scripts"))
+
+from asgi_test_client import call_app  # noqa: E402
+from stub_model_server import DEFAULT_TEXT, StubModelServer  # noqa: E402
+
+TEST_STOCK_CODE = "000001"
+
+# 由 main() 初始化
+app = None
+stub = None
+
+
+def _sample_source(name: str):
+    async def handler(stock_code: str):
+        return {"stock_code": stock_code, "source": name, "update_time": datetime.now().isoformat(),
+                "records": [{"date": f"2025-06-{day:02d}", "close": 10 + day / 10} for day in range(1, 11)]}
+    return handler
+
+
+async def test_trading_signal_stream():
+    """测试技术面交易信号流式输出：阶段事件 → 模型片段 → 最终结果"""
+    print("\n=== 测试技术面交易信号流式接口 ===")
+    status, events = await call_app(app, "GET", f"/ai/trading-signal/{TEST_STOCK_CODE}/stream")
+    names = [event for _, event, _ in events]
+    phases = [data.get("phase") for _, event, data in events if event == "phase"]
+    tokens = [(at, data["text"]) for at, event, data in events if event == "token"]
+    result_at, result = next(((at, data) for at, event, data in events if event == "result"), (None, None))
+
+    checks = {
+        "状态码200": status == 200,
+        "阶段顺序": phases == ["started", "collecting_data", "data_collected", "model_call"],
+        "多个文本片段": len(tokens) > 1,
+        "片段拼接等于模型输出": "".join(text for _, text in tokens) == DEFAULT_TEXT,
+        "首个片段早于结果到达": bool(tokens) and result_at is not None and tokens[0][0] < result_at,
+        "结果为最后一个事件": names[-1] == "result",
+        "结果已解析": bool(result) and result.get("immediate_trading_signal", {}).get("action") == "观望",
+    }
+    for name, ok in checks.items():
+        print(f"{'✓' if ok else '✗'} {name}")
+    return all(checks.values())
+
+
+async def test_stream_result_cached():
+    """测试流式结果写入缓存：普通接口和再次流式请求都直接命中缓存"""
+    print("\n=== 测试流式结果写入缓存 ===")
+    from ai_analysis.api_endpoints import TradingSignalRequest, get_trading_signal
+
+    requests_before = stub.requests
+    cached = await get_trading_signal(TEST_STOCK_CODE, TradingSignalRequest())
+    status, events = await call_app(app, "GET", f"/ai/trading-signal/{TEST_STOCK_CODE}/stream")
+    names = [event for _, event, _ in events]
+    checks = {
+        "普通接口命中缓存": cached.get("cached") is True,
+        "流式接口直接返回结果": names == ["phase", "result"] and events[-1][2].get("cached") is True,
+        "没有再次调用模型": stub.requests == requests_before,
+    }
+    for name, ok in checks.items():
+        print(f"{'✓' if ok else '✗'} {name}")
+    return all(checks.values())
+
+
+async def test_comprehensive_stream():
+    """测试综合评估流式接口"""
+    print("\n=== 测试综合评估流式接口 ===")
+    status, events = await call_app(app, "GET", f"/ai/comprehensive-evaluation/{TEST_STOCK_CODE}/stream")
+    result = next((data for _, event, data in events if event == "result"), {})
+    collected = next((data for _, event, data in events if event == "phase" and data.get("phase") == "data_collected"), {})
+    checks = {
+        "状态码200": status == 200,
+        "数据收集完成事件含各数据段状态": len(collected.get("sections", {})) == 8,
+        "有文本片段": any(event == "token" for _, event, _ in events),
+        "结果已解析": result.get("analysis_type") == "comprehensive_stock_evaluation" and "comprehensive_evaluation" in result,
+    }
+    for name, ok in checks.items():
+        print(f"{'✓' if ok else '✗'} {name}")
+    return all(checks.values())
+
+
+async def test_stream_retry():
+    """测试模型输出中途失败：推送 retry 事件后重新输出"""
+    print("\n=== 测试流式重试 ===")
+    stub.fail_first = stub.requests + 1
+    status, events = await call_app(app, "GET", f"/ai/trading-signal/{TEST_STOCK_CODE}/stream",
+                                     query="force_refresh=true")
+    names = [event for _, event, _ in events]
+    retry_index = names.index("retry") if "retry" in names else -1
+    after_retry = "".join(data["text"] for _, event, data in events[retry_index + 1:] if event == "token")
+    checks = {
+        "推送retry事件": retry_index >= 0,
+        "重试后的片段为完整输出": after_retry == DEFAULT_TEXT,
+        "最终推送结果": names[-1] == "result",
+    }
+    for name, ok in checks.items():
+        print(f"{'✓' if ok else '✗'} {name}")
+    return all(checks.values())
+
+
+async def test_client_disconnect():
+    """测试客户端中途断开：分析继续完成并写入缓存"""
+    print("\n=== 测试客户端中途断开 ===")
+    from ai_analysis.services.cache_manager import analysis_cache
+
+    stock_code = "600519"
+    status, events = await call_app(app, "GET", f"/ai/trading-signal/{stock_code}/stream", disconnect_after_tokens=2)
+    received_result = any(event == "result" for _, event, _ in events)
+    entry = None
+    for _ in range(100):
+        entry = await analysis_cache.get_trading_signal_cache(stock_code)
+        if entry:
+            break
+        await asyncio.sleep(0.05)
+    checks = {
+        "断开前未收到结果": not received_result,
+        "分析完成后写入缓存": bool(entry) and entry.get("immediate_trading_signal", {}).get("action") == "观望",
+    }
+    for name, ok in checks.items():
+        print(f"{'✓' if ok else '✗'} {name}")
+    return all(checks.values())
+
+
+async def test_invalid_stock_code():
+    """测试无效股票代码直接返回400"""
+    print("\n=== 测试无效股票代码 ===")
+    status, events = await call_app(app, "GET", "/ai/trading-signal/12345/stream")
+    ok = status == 400 and not events
+    print(f"{'✓' if ok else '✗'} 返回400")
+    return ok
+
+
+async def main():
+    """主测试函数"""
+    global app, stub
+    print("=== AI分析流式接口测试 ===")
+    stub = StubModelServer(chunk_chars=24, chunk_delay=0.01)
+    os.environ["ANTHROPIC_BASE_URL"] = await stub.start()
+    os.environ["ANTHROPIC_API_KEY"] = "stub-key"
+    print(f"模型桩服务: {stub.base_url}")
+
+    from ai_analysis import api_endpoints
+    from ai_analysis.services.cache_backends import MemoryCacheBackend
+    from ai_analysis.services.cache_manager import analysis_cache
+    from ai_analysis.services.data_aggregator import stock_data_aggregator
+
+    analysis_cache.backend = MemoryCacheBackend()
+    stock_data_aggregator.use_local_sources({
+        section.name: _sample_source(section.name)
+        for section in stock_data_aggregator.TECHNICAL_ENDPOINTS + stock_data_aggregator.COMPREHENSIVE_ENDPOINTS
+    })
+    app = api_endpoints.ai_analysis_app
+    api_endpoints.initialize_agents()
+    for agent in (api_endpoints.technical_agent, api_endpoints.comprehensive_agent):
+        agent.retry_delay = 0
+
+    tests = [
+        ("技术面交易信号流式接口", test_trading_signal_stream),
+        ("流式结果写入缓存", test_stream_result_cached),
+        ("综合评估流式接口", test_comprehensive_stream),
+        ("流式重试", test_stream_retry),
+        ("客户端中途断开", test_client_disconnect),
+        ("无效股票代码", test_invalid_stock_code),
+    ]
+    test_results = []
+    try:
+        for test_name, test_func in tests:
+            test_results.append((test_name, await test_func()))
+    finally:
+        await stub.stop()
+
+    print(f"\n{'='*50}")
+    passed = sum(1 for _, result in test_results if result)
+    for test_name, result in test_results:
+        print(f"{test_name}: {'✓ 通过' if result else '✗ 失败'}")
+    print(f"\n总计: {passed}/{len(test_results)} 个测试通过")
+    return passed == len(test_results)
+
+
+if __name__ == "__main__":
+    sys.exit(0 if asyncio.run(main()) else 1)
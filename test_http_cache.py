@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+"""
+ETag条件请求测试脚本
+Test script for data-version ETags and 304 responses on /stocks/{code}/* endpoints
+
+以ASGI方式调用集成应用，akshare替换为计数的固定数据，不依赖线上服务。
+"""
+import asyncio
+import os
+import sys
+import time
+from types import SimpleNamespace
+
+import pandas as pd
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(ROOT, "api"))
+sys.path.insert(0, os.path.join(ROOT, "scripts"))
+
+from asgi_test_client import call_app  # noqa: E402
+
+# 由 main() 初始化
+app = None
+calls = {"bid_ask": 0, "profile": 0}
+quote = {"最新": 10.0}
+
+
+def _bid_ask(symbol):
+    calls["bid_ask"] += 1
+    return pd.DataFrame({"item": ["最新", "涨跌"], "value": [quote["最新"], 0.1]})
+
+
+def _individual_info(symbol):
+    calls["profile"] += 1
+    return pd.DataFrame({"item": ["股票简称", "行业"], "value": ["平安银行", "银行"]})
+
+
+async def _get(path: str, etag: str = None):
+    """GET请求，返回 (状态码, 响应的ETag)"""
+    captured = {}
+
+    async def capture_app(scope, receive, send):
+        async def capture_send(message):
+            if message["type"] == "http.response.start":
+                captured["etag"] = dict(message["headers"]).get(b"etag", b"").decode() or None
+            await send(message)
+        await app(scope, receive, capture_send)
+
+    headers = [(b"if-none-match", etag.encode())] if etag else []
+    status, _ = await call_app(capture_app, "GET", path, headers=headers)
+    return status, captured.get("etag")
+
+
+async def test_live_quote_always_revalidates():
+    """测试实时报价总是执行处理函数：内容未变返回304，价格变化后返回200和新的ETag"""
+    print("\n=== 测试实时报价条件请求 ===")
+    path = "/stocks/000001/live/quote"
+    status, etag = await _get(path)
+    before = calls["bid_ask"]
+    unchanged_status, unchanged_etag = await _get(path, etag)
+    quote["最新"] = 10.5
+    changed_status, changed_etag = await _get(path, etag)
+    checks = {
+        "首次请求返回ETag": status == 200 and etag is not None,
+        "内容未变返回304": unchanged_status == 304 and unchanged_etag == etag,
+        "条件请求仍获取最新行情": calls["bid_ask"] == before + 2,
+        "价格变化后返回新内容": changed_status == 200 and changed_etag not in (None, etag),
+    }
+    for name, ok in checks.items():
+        print(f"{'✓' if ok else '✗'} {name}")
+    return all(checks.values())
+
+
+async def test_profile_precheck():
+    """测试非实时接口在数据版本有效期内直接返回304，不调用处理函数"""
+    print("\n=== 测试基本信息条件请求 ===")
+    path = "/stocks/000001/profile"
+    status, etag = await _get(path)
+    before = calls["profile"]
+    cached_status, _ = await _get(path, etag)
+    checks = {
+        "首次请求返回ETag": status == 200 and etag is not None,
+        "版本有效期内直接304": cached_status == 304 and calls["profile"] == before,
+    }
+    for name, ok in checks.items():
+        print(f"{'✓' if ok else '✗'} {name}")
+    return all(checks.values())
+
+
+async def test_version_ttls():
+    """测试行情和K线版本的有效期不超过全市场快照的有效期"""
+    print("\n=== 测试数据版本有效期 ===")
+    from http_cache import SNAPSHOT_TTL, VERSION_TTLS, DataVersionRegistry
+
+    registry = DataVersionRegistry()
+    registry.record("000001", "snapshot", "v1")
+    registry.record("000001", "profile", "p1")
+    recorded_at = registry._versions[("000001", "snapshot")][1]
+    # 模拟时间经过快照有效期
+    for key in list(registry._versions):
+        version, _ = registry._versions[key]
+        registry._versions[key] = (version, recorded_at - SNAPSHOT_TTL - 1)
+    checks = {
+        "行情版本有效期不超过快照": VERSION_TTLS["snapshot"] <= SNAPSHOT_TTL,
+        "K线版本有效期不超过快照": VERSION_TTLS["bars"] <= SNAPSHOT_TTL,
+        "快照过期后行情版本失效": registry.get("000001", "snapshot") is None,
+        "基本信息版本仍有效": registry.get("000001", "profile") == "p1",
+    }
+    for name, ok in checks.items():
+        print(f"{'✓' if ok else '✗'} {name}")
+    return all(checks.values())
+
+
+async def test_stale_response_versions():
+    """测试响应缓存返回过期数据时不重新登记数据版本，未过期命中时照常登记"""
+    print("\n=== 测试响应缓存与数据版本 ===")
+    from http_cache import data_versions
+    from response_cache import ResponseCache
+
+    cache = ResponseCache(redis_url="", stale_seconds=300)
+    refreshed = asyncio.Event()
+
+    async def compute():
+        data_versions.record("600519", "report", "20250331")
+        refreshed.set()
+        return {"stock_code": "600519"}
+
+    key = cache.make_key("test", {"stock_code": "600519"})
+    stored_at = time.time()
+    cache.memory.set(key, {"value": {"stock_code": "600519"}, "stored_at": stored_at,
+                           "versions": [["600519", "report", "20241231"]]})
+    fresh = await cache.fetch(key, 60, compute)
+    fresh_version = data_versions.get("600519", "report")
+
+    data_versions._versions.pop(("600519", "report"), None)
+    cache.memory.set(key, {"value": {"stock_code": "600519"}, "stored_at": stored_at - 120,
+                           "versions": [["600519", "report", "20241231"]]})
+    stale = await cache.fetch(key, 60, compute)
+    stale_version = data_versions.get("600519", "report")
+    await asyncio.wait_for(refreshed.wait(), 5)
+    checks = {
+        "未过期命中登记版本": not fresh["cache_info"]["stale"] and fresh_version == "20241231",
+        "过期数据不登记版本": stale["cache_info"]["stale"] and stale_version is None,
+        "后台刷新后登记新版本": data_versions.get("600519", "report") == "20250331",
+    }
+    for name, ok in checks.items():
+        print(f"{'✓' if ok else '✗'} {name}")
+    return all(checks.values())
+
+
+async def main():
+    """主测试函数"""
+    global app
+    print("=== ETag条件请求测试 ===")
+    import stock_analysis_api
+
+    stock_analysis_api.ak = SimpleNamespace(stock_bid_ask_em=_bid_ask, stock_individual_info_em=_individual_info)
+    app = stock_analysis_api.app
+
+    tests = [
+        ("实时报价条件请求", test_live_quote_always_revalidates),
+        ("基本信息条件请求", test_profile_precheck),
+        ("数据版本有效期", test_version_ttls),
+        ("响应缓存与数据版本", test_stale_response_versions),
+    ]
+    test_results = []
+    for test_name, test_func in tests:
+        test_results.append((test_name, await test_func()))
+
+    print(f"\n{'='*50}")
+    passed = sum(1 for _, result in test_results if result)
+    for test_name, result in test_results:
+        print(f"{test_name}: {'✓ 通过' if result else '✗ 失败'}")
+    print(f"\n总计: {passed}/{len(test_results)} 个测试通过")
+    return passed == len(test_results)
+
+
+if __name__ == "__main__":
+    sys.exit(0 if asyncio.run(main()) else 1)
@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+"""
+接口延迟汇总测试脚本
+Test script for the API latency rollup job and the mergeable latency sketch
+
+使用临时SQLite数据库（在导入 database 之前设置 DATABASE_URL），不依赖Postgres。
+"""
+import asyncio
+import os
+import random
+import sys
+import tempfile
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(ROOT, "api"))
+
+DB_PATH = os.path.join(tempfile.mkdtemp(), "latency.db")
+os.environ["DATABASE_URL"] = f"sqlite:///{DB_PATH}"
+os.environ["ASYNC_DATABASE_URL"] = f"sqlite+aiosqlite:///{DB_PATH}"
+
+from sqlalchemy import func, select  # noqa: E402
+from sqlalchemy.orm import sessionmaker  # noqa: E402
+
+from database import APILatencyRollup, APILog, APILogRollupState, Base, engine  # noqa: E402
+from latency_rollup import LatencyRollupJob, LatencySketch  # noqa: E402
+
+Session = sessionmaker(bind=engine)
+TABLES = [APILog.__table__, APILatencyRollup.__table__, APILogRollupState.__table__]
+
+
+def _reset():
+    Base.metadata.drop_all(engine, tables=TABLES)
+    Base.metadata.create_all(engine, tables=TABLES)
+
+
+def _insert_log(log_id: int, created_at: datetime, response_time: float = 0.1):
+    """写入一条日志；指定ID以模拟ID分配顺序与提交顺序不一致"""
+    with Session() as db:
+        db.add(APILog(id=log_id, service_type="test", endpoint="/stocks/000001", method="GET",
+                      response_status=200, response_time=response_time, created_at=created_at))
+        db.commit()
+
+
+def _counts():
+    with Session() as db:
+        raw = db.execute(select(func.count()).select_from(APILog)).scalar()
+        rolled = db.execute(select(func.coalesce(func.sum(APILatencyRollup.call_count), 0))
+                            .where(APILatencyRollup.resolution == "day")).scalar()
+    return raw, rolled
+
+
+async def test_late_commits_rolled_up():
+    """测试ID较小但提交较晚的日志仍被汇总，保留策略只删除已汇总的日志"""
+    print("\n=== 测试晚提交的日志 ===")
+    _reset()
+    job = LatencyRollupJob("test", safety_lag_seconds=120)
+    created = datetime(2025, 6, 2, 9, 30)
+
+    # ID 5 先提交，ID 4 的事务尚未提交
+    _insert_log(5, created)
+    early = await job.rollup(now=created + timedelta(seconds=10))
+    _insert_log(4, created - timedelta(seconds=1))
+    later = await job.rollup(now=created + timedelta(seconds=130))
+    _insert_log(6, created + timedelta(seconds=200))
+    retention = await job.enforce_retention(now=created + timedelta(days=30))
+    raw, rolled = _counts()
+    checks = {
+        "安全延迟内不汇总": early["logs_rolled_up"] == 0,
+        "超过安全延迟后全部汇总": later["logs_rolled_up"] == 2,
+        "汇总包含晚提交的日志": rolled == 2,
+        "只删除已汇总的日志": retention["raw_logs_deleted"] == 2 and raw == 1,
+    }
+    for name, ok in checks.items():
+        print(f"{'✓' if ok else '✗'} {name}")
+    return all(checks.values())
+
+
+async def test_retention_without_rollup():
+    """测试从未汇总时保留策略不删除原始日志，再次汇总不重复计数"""
+    print("\n=== 测试未汇总日志的保留 ===")
+    _reset()
+    job = LatencyRollupJob("test", safety_lag_seconds=120, batch_size=3)
+    created = datetime(2025, 6, 2, 9, 30)
+    for i in range(1, 8):
+        _insert_log(i, created)  # 相同时间，按ID区分
+    retention = await job.enforce_retention(now=created + timedelta(days=30))
+    first = await job.rollup(now=created + timedelta(days=1))
+    second = await job.rollup(now=created + timedelta(days=1))
+    _, rolled = _counts()
+    checks = {
+        "未汇总时不删除": retention["raw_logs_deleted"] == 0,
+        "分批汇总全部日志": first["logs_rolled_up"] == 7 and rolled == 7,
+        "再次汇总不重复": second["logs_rolled_up"] == 0,
+    }
+    for name, ok in checks.items():
+        print(f"{'✓' if ok else '✗'} {name}")
+    return all(checks.values())
+
+
+async def test_route_normalizer():
+    """测试端点按路径和方法归类：同一路径不同方法的路由不会互相混淆"""
+    print("\n=== 测试端点归类 ===")
+    from fastapi import FastAPI
+    from latency_rollup import UNMATCHED_ENDPOINT, route_normalizer
+
+    app = FastAPI()
+
+    @app.get("/stocks/{stock_code}")
+    async def get_stock(stock_code: str):
+        return {}
+
+    @app.post("/stocks/bulk-refresh")
+    async def bulk_refresh():
+        return {}
+
+    @app.delete("/stocks/{stock_code}")
+    async def delete_stock(stock_code: str):
+        return {}
+
+    normalize = route_normalizer(app.routes)
+    checks = {
+        "GET归入股票详情": normalize("/stocks/000001", "GET") == "/stocks/{stock_code}",
+        "POST批量刷新不归入股票详情": normalize("/stocks/bulk-refresh", "POST") == "/stocks/bulk-refresh",
+        "GET批量刷新路径按方法归类": normalize("/stocks/bulk-refresh", "GET") == "/stocks/{stock_code}",
+        "方法不匹配时归入路径匹配的路由": normalize("/stocks/000001", "PUT") == "/stocks/{stock_code}",
+        "无匹配路由": normalize("/nothing", "GET") == UNMATCHED_ENDPOINT,
+    }
+    for name, ok in checks.items():
+        print(f"{'✓' if ok else '✗'} {name}")
+    return all(checks.values())
+
+
+async def test_sketch_merge():
+    """测试sketch合并等于整体直方图，分位数误差在相对精度内"""
+    print("\n=== 测试延迟直方图合并 ===")
+    rng = random.Random(11)
+    values = [rng.lognormvariate(-2.5, 1.0) for _ in range(5000)] + [0.0] * 20
+    whole, parts = LatencySketch(0.01), [LatencySketch(0.01) for _ in range(4)]
+    for i, value in enumerate(values):
+        whole.add(value)
+        parts[i % 4].add(value)
+    merged = LatencySketch.from_json(parts[0].to_json())
+    for part in parts[1:]:
+        merged.merge(LatencySketch.from_json(part.to_json()))
+
+    ordered = sorted(values)
+    errors = []
+    for q in (0.5, 0.9, 0.99):
+        exact = ordered[int(q * (len(ordered) - 1))]
+        errors.append(abs(merged.quantile(q) - exact) / exact)
+    try:
+        merged.merge(LatencySketch(0.02))
+        rejected = False
+    except ValueError:
+        rejected = True
+    checks = {
+        "合并结果与整体一致": merged.bins == whole.bins and merged.zero_count == whole.zero_count,
+        "分位数误差在相对精度内": max(errors) <= 0.01 + 1e-9,
+        "拒绝合并不同精度": rejected,
+        "空直方图无分位数": LatencySketch().quantile(0.5) is None,
+    }
+    for name, ok in checks.items():
+        print(f"{'✓' if ok else '✗'} {name}")
+    return all(checks.values())
+
+
+async def main():
+    """主测试函数"""
+    print("=== 接口延迟汇总测试 ===")
+    tests = [
+        ("晚提交的日志", test_late_commits_rolled_up),
+        ("未汇总日志的保留", test_retention_without_rollup),
+        ("端点归类", test_route_normalizer),
+        ("延迟直方图合并", test_sketch_merge),
+    ]
+    test_results = []
+    for test_name, test_func in tests:
+        test_results.append((test_name, await test_func()))
+
+    print(f"\n{'='*50}")
+    passed = sum(1 for _, result in test_results if result)
+    for test_name, result in test_results:
+        print(f"{test_name}: {'✓ 通过' if result else '✗ 失败'}")
+    print(f"\n总计: {passed}/{len(test_results)} 个测试通过")
+    return passed == len(test_results)
+
+
+if __name__ == "__main__":
+    sys.exit(0 if asyncio.run(main()) else 1)
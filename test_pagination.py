@@ -0,0 +1,266 @@
+# -*- coding: utf-8 -*-
+"""
+键集分页与计数缓存测试脚本
+Test script for keyset pagination cursors and the count cache
+
+使用临时SQLite数据库（在导入 database 之前设置 DATABASE_URL），不依赖Postgres。
+"""
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(ROOT, "api"))
+
+DB_PATH = os.path.join(tempfile.mkdtemp(), "pagination.db")
+os.environ["DATABASE_URL"] = f"sqlite:///{DB_PATH}"
+os.environ["ASYNC_DATABASE_URL"] = f"sqlite+aiosqlite:///{DB_PATH}"
+
+from sqlalchemy import select  # noqa: E402
+from sqlalchemy.orm import sessionmaker  # noqa: E402
+
+from database import Base, CHINESE_STOCK_SORT_COLUMNS, ChineseStock, engine  # noqa: E402
+from pagination import CountCache, CursorError, KeysetPaginator, filters_fingerprint  # noqa: E402
+
+ROW_COUNT = 137
+Session = sessionmaker(bind=engine)
+
+
+def _seed():
+    """写入带重复值和NULL值的测试数据"""
+    rng = random.Random(7)
+    base_time = datetime(2025, 6, 1, 9, 30)
+    Base.metadata.drop_all(engine, tables=[ChineseStock.__table__])
+    Base.metadata.create_all(engine, tables=[ChineseStock.__table__])
+    with Session() as db:
+        db.add_all([
+            ChineseStock(
+                stock_code=f"{i:06d}",
+                stock_name_cn=f"测试{i % 17}",
+                current_price=None if i % 11 == 0 else float(rng.randint(1, 20)),
+                price_change_pct=None if i % 13 == 0 else round(rng.uniform(-5, 5), 1),
+                market_cap=float(rng.randint(1, 5)) * 1e9,
+                volume=float(rng.randint(1, 30)),
+                last_updated=None if i % 19 == 0 else base_time + timedelta(minutes=rng.randint(0, 10)),
+                is_active=i % 5 != 0,
+            )
+            for i in range(ROW_COUNT)
+        ])
+        db.commit()
+
+
+def _expected(rows, sort_by: str, descending: bool):
+    """独立计算期望顺序：升序NULL在后、降序NULL在前，相同值按主键"""
+    present = [row for row in rows if getattr(row, sort_by) is not None]
+    missing = [row for row in rows if getattr(row, sort_by) is None]
+    present.sort(key=lambda row: (getattr(row, sort_by), row.stock_code), reverse=descending)
+    missing.sort(key=lambda row: row.stock_code, reverse=descending)
+    ordered = missing + present if descending else present + missing
+    return [row.stock_code for row in ordered]
+
+
+def _page_all(db, paginator, sort_by: str, descending: bool, active_only: bool, limit: int):
+    """按游标逐页读取，返回 (全部代码, 页数)"""
+    fingerprint = filters_fingerprint({"active_only": active_only, "search": None})
+    codes, cursor, pages = [], None, 0
+    while True:
+        query = select(ChineseStock)
+        if active_only:
+            query = query.where(ChineseStock.is_active == True)  # noqa: E712
+        query = paginator.apply(query, sort_by, descending, fingerprint, cursor=cursor)
+        rows = db.execute(query.limit(limit + 1)).scalars().all()
+        codes.extend(row.stock_code for row in rows[:limit])
+        pages += 1
+        cursor = paginator.next_cursor(rows, limit, sort_by, descending, fingerprint)
+        if cursor is None or pages > ROW_COUNT:
+            return codes, pages
+
+
+async def test_cursor_pages_equal_unpaged():
+    """测试各排序字段和方向下，按游标翻完所有页等于不分页的查询结果"""
+    print("\n=== 测试游标翻页与不分页结果一致 ===")
+    _seed()
+    paginator = KeysetPaginator(ChineseStock, "stock_code", CHINESE_STOCK_SORT_COLUMNS)
+    failures = []
+    with Session() as db:
+        all_rows = db.execute(select(ChineseStock)).scalars().all()
+        for active_only in (True, False):
+            rows = [row for row in all_rows if row.is_active or not active_only]
+            for sort_by in CHINESE_STOCK_SORT_COLUMNS:
+                for descending in (False, True):
+                    for limit in (1, 7, 50):
+                        codes, _ = _page_all(db, paginator, sort_by, descending, active_only, limit)
+                        if codes != _expected(rows, sort_by, descending):
+                            failures.append((sort_by, descending, active_only, limit))
+
+    checks = {
+        "全部组合结果一致": not failures,
+    }
+    with Session() as db:
+        fingerprint = filters_fingerprint({"active_only": True, "search": None})
+        query = paginator.apply(select(ChineseStock), "stock_code", False, fingerprint)
+        rows = db.execute(query.limit(11)).scalars().all()
+        cursor = paginator.next_cursor(rows, 10, "stock_code", False, fingerprint)
+    for name, sort_by, other_fingerprint in (("其他排序字段的游标被拒绝", "volume", fingerprint),
+                                             ("其他筛选条件的游标被拒绝", "stock_code", "other")):
+        try:
+            paginator.apply(select(ChineseStock), sort_by, False, other_fingerprint, cursor=cursor)
+            checks[name] = False
+        except CursorError:
+            checks[name] = True
+    if failures:
+        print(f"不一致的组合: {failures[:5]}")
+    for name, ok in checks.items():
+        print(f"{'✓' if ok else '✗'} {name}")
+    return all(checks.values())
+
+
+async def test_count_cache():
+    """测试计数缓存：命中、过期、条目数上限、按前缀清除"""
+    print("\n=== 测试计数缓存 ===")
+    cache = CountCache(ttl_seconds=60, max_entries=3)
+    computed = []
+
+    async def compute():
+        computed.append(1)
+        return 42
+
+    first = await cache.count("chinese_stocks:a", compute)
+    second = await cache.count("chinese_stocks:a", compute)
+    for key in ("chinese_stocks:b", "chinese_stocks:c", "us_stocks:d"):
+        await cache.count(key, compute)
+    bounded = len(cache) == 3 and cache.get("chinese_stocks:a") is None
+
+    expiring = CountCache(ttl_seconds=0.05, max_entries=100)
+    for i in range(10):
+        expiring.set(f"chinese_stocks:{i}", i)
+    time.sleep(0.1)
+    expiring.set("chinese_stocks:new", 1)
+
+    cache.invalidate("chinese_stocks:")
+    checks = {
+        "首次精确计数": first["count_source"] == "exact" and first["total_count"] == 42,
+        "有效期内命中缓存": second["count_source"] == "cached" and len(computed) == 4,
+        "条目数不超过上限": bounded,
+        "写入时清除过期条目": len(expiring) == 1,
+        "按前缀清除": len(cache) == 1 and cache.get("us_stocks:d") is not None,
+    }
+    for name, ok in checks.items():
+        print(f"{'✓' if ok else '✗'} {name}")
+    return all(checks.values())
+
+
+async def test_maintained_counts():
+    """测试无筛选条件的总数来自增量维护的表统计，不再查询数据库"""
+    print("\n=== 测试增量维护的总数 ===")
+    from database import count_rows
+    from service_stats import TableStats
+
+    computed = []
+
+    async def compute(db):
+        computed.append(1)
+        return {"active_stocks_count": await count_rows(db, select(ChineseStock).where(ChineseStock.is_active == True)),  # noqa: E712
+                "total_stocks_count": await count_rows(db, select(ChineseStock)),
+                "exchange_distribution": {"SSE": 3}}
+
+    stats = TableStats("test_stocks", compute)
+    active = await stats.count_info("active_stocks_count")
+    stats.adjust(active_stocks_count=1, total_stocks_count=1)
+    adjusted = await stats.count_info("active_stocks_count")
+    bucket = await stats.count_info("exchange_distribution", "SSE")
+    missing = await stats.count_info("exchange_distribution", "NYSE")
+    expected_active = sum(1 for i in range(ROW_COUNT) if i % 5 != 0)
+    checks = {
+        "活跃数与数据库一致": active["total_count"] == expected_active and active["count_source"] == "maintained",
+        "写入后增量调整": adjusted["total_count"] == expected_active + 1,
+        "分布统计的单项计数": bucket["total_count"] == 3 and missing["total_count"] == 0,
+        "只在首次读取时计算": len(computed) == 1,
+    }
+    for name, ok in checks.items():
+        print(f"{'✓' if ok else '✗'} {name}")
+    return all(checks.values())
+
+
+async def test_backfill_concurrent_workers():
+    """测试多个worker同时启动时补写今日调用汇总不因主键冲突失败"""
+    print("\n=== 测试并发补写今日调用汇总 ===")
+    from database import APICallDaily, APILog
+    from service_stats import backfill_today_api_calls
+
+    Base.metadata.create_all(engine, tables=[APICallDaily.__table__, APILog.__table__])
+    results = await asyncio.gather(*[backfill_today_api_calls("test_workers") for _ in range(4)],
+                                   return_exceptions=True)
+    with Session() as db:
+        rows = db.execute(select(APICallDaily).where(APICallDaily.service_type == "test_workers")).scalars().all()
+    checks = {
+        "全部worker启动成功": not any(isinstance(result, Exception) for result in results),
+        "只有一条今日记录": len(rows) == 1,
+    }
+    for name, ok in checks.items():
+        print(f"{'✓' if ok else '✗'} {name}")
+    return all(checks.values())
+
+
+async def test_search_pages():
+    """测试搜索结果：总数为全部匹配数、英文名称来自数据库、指定排序字段时按字段排序"""
+    print("\n=== 测试搜索分页 ===")
+    from chinese_stock_api import _search_stocks_page
+    from database import AsyncSessionLocal
+    from search_index import stock_search_index
+
+    _seed()
+    with Session() as db:
+        all_rows = db.execute(select(ChineseStock)).scalars().all()
+    stock_search_index.update_from_rows({row.stock_code: {"名称": row.stock_name_cn} for row in all_rows})
+    stock_search_index.set_english_names({"000016": "Test Sixteen Holdings", "000017": "测试0"})
+    active = [row for row in all_rows if row.is_active]
+
+    async with AsyncSessionLocal() as db:
+        relevance = await _search_stocks_page(db, "00", 1, 10, True)
+        by_price = [await _search_stocks_page(db, "00", page, 50, True, "current_price", True)
+                    for page in (1, 2, 3)]
+        english = await _search_stocks_page(db, "sixteen", 1, 10, False)
+        fallback = await _search_stocks_page(db, "测试0", 1, 10, False)
+
+    price_codes = [item["stock_code"] for result in by_price for item in result["stocks"]]
+    checks = {
+        "总数为全部匹配数": relevance["pagination"]["total_count"] == len(active),
+        "默认按相关度排序": relevance["search"]["order"] == "relevance" and len(relevance["stocks"]) == 10,
+        "指定字段时按字段排序": price_codes == _expected(active, "current_price", True),
+        "英文名称来自数据库": [item["stock_code"] for item in english["stocks"]] == ["000016"],
+        "中文回填的英文名称不计入": all(item["match"] != "english" for item in fallback["stocks"]),
+    }
+    for name, ok in checks.items():
+        print(f"{'✓' if ok else '✗'} {name}")
+    return all(checks.values())
+
+
+async def main():
+    """主测试函数"""
+    print("=== 键集分页与计数缓存测试 ===")
+    tests = [
+        ("游标翻页与不分页结果一致", test_cursor_pages_equal_unpaged),
+        ("计数缓存", test_count_cache),
+        ("增量维护的总数", test_maintained_counts),
+        ("并发补写今日调用汇总", test_backfill_concurrent_workers),
+        ("搜索分页", test_search_pages),
+    ]
+    test_results = []
+    for test_name, test_func in tests:
+        test_results.append((test_name, await test_func()))
+
+    print(f"\n{'='*50}")
+    passed = sum(1 for _, result in test_results if result)
+    for test_name, result in test_results:
+        print(f"{test_name}: {'✓ 通过' if result else '✗ 失败'}")
+    print(f"\n总计: {passed}/{len(test_results)} 个测试通过")
+    return passed == len(test_results)
+
+
+if __name__ == "__main__":
+    sys.exit(0 if asyncio.run(main()) else 1)
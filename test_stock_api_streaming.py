@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+"""
+集成应用流式响应测试脚本
+Test script for streaming responses through the integrated stock_analysis_api app
+
+集成应用对所有响应启用gzip压缩，这里以 Accept-Encoding: gzip 调用集成应用的流式接口（SSE和NDJSON），
+检查事件在响应结束前逐块送达，而不是被压缩中间件缓冲到最后。
+与 test_ai_streaming.py 相同，使用模型桩服务和进程内数据源，不依赖线上服务和真实API密钥。
+"""
+import asyncio
+import json
+import os
+import sys
+from datetime import datetime
+from types import SimpleNamespace
+
+import pandas as pd
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(ROOT, "api"))
+sys.path.insert(0, os.path.join(ROOT, "scripts"))
+
+from asgi_test_client import call_app  # noqa: E402
+from stub_model_server import StubModelServer  # noqa: E402
+
+GZIP_HEADERS = [(b"accept-encoding", b"gzip, deflate")]
+
+# 由 main() 初始化
+app = None
+stub = None
+
+
+def _sample_source(name: str):
+    async def handler(stock_code: str):
+        return {"stock_code": stock_code, "source": name, "update_time": datetime.now().isoformat(),
+                "records": [{"date": f"2025-06-{day:02d}", "close": 10 + day / 10} for day in range(1, 11)]}
+    return handler
+
+
+async def test_sse_not_buffered_by_gzip():
+    """测试SSE接口在gzip协商下逐块送达：phase 事件早于 result 到达"""
+    print("\n=== 测试SSE接口不被gzip缓冲 ===")
+    status, events = await call_app(app, "GET", "/ai/trading-signal/000001/stream", headers=GZIP_HEADERS)
+    phase_at = next((at for at, event, _ in events if event == "phase"), None)
+    token_at = next((at for at, event, _ in events if event == "token"), None)
+    result_at = next((at for at, event, _ in events if event == "result"), None)
+    checks = {
+        "状态码200": status == 200,
+        "收到结果": result_at is not None,
+        "phase事件早于结果到达": phase_at is not None and result_at is not None and phase_at < result_at,
+        "token事件早于结果到达": token_at is not None and result_at is not None and token_at < result_at,
+    }
+    for name, ok in checks.items():
+        print(f"{'✓' if ok else '✗'} {name}")
+    return all(checks.values())
+
+
+async def test_batch_not_buffered_by_gzip():
+    """测试批量分析在gzip协商下逐只推送：stock 事件早于批次汇总到达"""
+    print("\n=== 测试批量分析不被gzip缓冲 ===")
+    codes = ["000001", "000002", "600036"]
+    status, events = await call_app(app, "POST", "/ai/batch", headers=GZIP_HEADERS,
+                                     body={"stock_codes": codes})
+    stock_at = [at for at, event, _ in events if event == "stock"]
+    result_at = next((at for at, event, _ in events if event == "result"), None)
+    checks = {
+        "状态码200": status == 200,
+        "每只股票一个结果": len(stock_at) == len(codes),
+        "首个股票结果早于汇总到达": bool(stock_at) and result_at is not None and stock_at[0] < result_at,
+        "各股票结果分别到达": len(set(stock_at)) == len(codes),
+    }
+    for name, ok in checks.items():
+        print(f"{'✓' if ok else '✗'} {name}")
+    return all(checks.values())
+
+
+def _sample_kline(symbol, period="daily", start_date=None, end_date=None, adjust=""):
+    """固定的日K线数据，替代 akshare.stock_zh_a_hist"""
+    days = pd.date_range(end=datetime.now(), periods=300, freq="D")
+    closes = [10 + (i % 20) / 10 for i in range(len(days))]
+    return pd.DataFrame({
+        "日期": days, "开盘": closes, "收盘": closes, "最高": [c + 0.2 for c in closes],
+        "最低": [c - 0.2 for c in closes], "成交量": 100000.0, "成交额": 1000000.0,
+        "振幅": 2.0, "涨跌幅": 0.5, "涨跌额": 0.05, "换手率": 1.2
+    })
+
+
+async def test_ndjson_not_buffered_by_gzip():
+    """测试NDJSON历史价格在gzip协商下逐块送达：meta 行早于 summary 行到达"""
+    print("\n=== 测试NDJSON不被gzip缓冲 ===")
+    import stock_analysis_api
+
+    chunks = []
+    original_ak = stock_analysis_api.ak
+    stock_analysis_api.ak = SimpleNamespace(stock_zh_a_hist=_sample_kline)
+    try:
+        status, _ = await call_app(app, "GET", "/stocks/000001/historical/prices/stream", headers=GZIP_HEADERS,
+                                    on_chunk=lambda at, text: chunks.append((at, text)))
+    finally:
+        stock_analysis_api.ak = original_ak
+    lines = [(at, json.loads(line)) for at, text in chunks for line in text.splitlines() if line]
+    meta_at = next((at for at, line in lines if line["type"] == "meta"), None)
+    summary_at = next((at for at, line in lines if line["type"] == "summary"), None)
+    checks = {
+        "状态码200": status == 200,
+        "每条K线一行": sum(1 for _, line in lines if line["type"] == "record") == 300,
+        "meta行早于summary行到达": meta_at is not None and summary_at is not None and meta_at < summary_at,
+    }
+    for name, ok in checks.items():
+        print(f"{'✓' if ok else '✗'} {name}")
+    return all(checks.values())
+
+
+async def _load_shared(stock_codes):
+    return {code: {"market_context": {"market_overview": {"up_count": 3000, "down_count": 2000}}}
+            for code in stock_codes}
+
+
+async def main():
+    """主测试函数"""
+    global app, stub
+    print("=== 集成应用流式响应测试 ===")
+    stub = StubModelServer(chunk_chars=24, chunk_delay=0.02)
+    os.environ["ANTHROPIC_BASE_URL"] = await stub.start()
+    os.environ["ANTHROPIC_API_KEY"] = "stub-key"
+
+    import stock_analysis_api
+    from ai_analysis.services.batch_analysis import batch_analyzer
+    from ai_analysis.services.cache_backends import MemoryCacheBackend
+    from ai_analysis.services.cache_manager import analysis_cache
+    from ai_analysis.services.data_aggregator import stock_data_aggregator
+
+    analysis_cache.backend = MemoryCacheBackend()
+    # 导入集成应用时注册了本进程的接口处理函数，这里替换为固定数据
+    stock_data_aggregator.use_local_sources({
+        section.name: _sample_source(section.name)
+        for section in stock_data_aggregator.TECHNICAL_ENDPOINTS + stock_data_aggregator.COMPREHENSIVE_ENDPOINTS
+    })
+    # 集成应用的共享数据来自全市场快照和行业板块行情，这里替换为固定数据
+    batch_analyzer.use_shared_data(_load_shared)
+    app = stock_analysis_api.app
+    await stock_analysis_api.startup_event()
+
+    tests = [
+        ("SSE接口不被gzip缓冲", test_sse_not_buffered_by_gzip),
+        ("批量分析不被gzip缓冲", test_batch_not_buffered_by_gzip),
+        ("NDJSON不被gzip缓冲", test_ndjson_not_buffered_by_gzip),
+    ]
+    test_results = []
+    try:
+        for test_name, test_func in tests:
+            test_results.append((test_name, await test_func()))
+    finally:
+        await stock_analysis_api.shutdown_event()
+        await stub.stop()
+
+    print(f"\n{'='*50}")
+    passed = sum(1 for _, result in test_results if result)
+    for test_name, result in test_results:
+        print(f"{test_name}: {'✓ 通过' if result else '✗ 失败'}")
+    print(f"\n总计: {passed}/{len(test_results)} 个测试通过")
+    return passed == len(test_results)
+
+
+if __name__ == "__main__":
+    sys.exit(0 if asyncio.run(main()) else 1)